@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import BACKENDS, create_backend
+from app.services.memory import MemoryBudget, MemoryTracer
+from app.services.metrics import COUNTERS, RunReport, continuation_rate, dedup_ratio, output_tokens_per_page, use_metrics
+from app.services.pdf_session import PdfSession
+
+
+OUTPUT_SUFFIX = "讲解版.pdf"
+DEFAULT_PROMPT = "请用中文讲解本页pdf，关键词给出英文，讲解详尽，语言简洁易懂。讲解让人一看就懂，便于快速学习。请避免不必要的换行，使页面保持紧凑。"
+
+
+def output_paths(pdf_path: str) -> Tuple[str, str]:
+	"""输出与输入同目录，命名与界面打包下载一致：<名>讲解版.pdf / <名>.json"""
+	base = os.path.splitext(pdf_path)[0]
+	return f"{base}{OUTPUT_SUFFIX}", f"{base}.json"
+
+
+def collect_inputs(patterns: List[str]) -> List[str]:
+	"""展开目录（递归查找 *.pdf）与通配符，排除本工具生成的讲解版 PDF"""
+	found: List[str] = []
+	for pattern in patterns:
+		if os.path.isdir(pattern):
+			matches = glob.glob(os.path.join(pattern, "**", "*.pdf"), recursive=True)
+		else:
+			matches = glob.glob(pattern, recursive=True)
+		found.extend(m for m in matches if m.lower().endswith(".pdf") and not m.endswith(OUTPUT_SUFFIX))
+	return sorted(set(os.path.abspath(p) for p in found))
+
+
+def load_existing_explanations(json_path: str, src_path: str) -> Dict[int, str]:
+	"""读取已有讲解 JSON；源 PDF 比 JSON 新时视为过期"""
+	if not os.path.exists(json_path) or os.path.getmtime(json_path) < os.path.getmtime(src_path):
+		return {}
+	try:
+		with open(json_path, "r", encoding="utf-8") as f:
+			return {int(k): str(v) for k, v in json.load(f).items()}
+	except (ValueError, OSError):
+		return {}
+
+
+class BatchRunner:
+	"""
+	批量处理多个 PDF：所有文件共享一个客户端（限流器与用量统计）和一组并发槽位，
+	在同一事件循环中跨文件并发生成讲解并流式合成。
+	"""
+
+	def __init__(self, args: argparse.Namespace, options: pdf_processor.ExplainOptions) -> None:
+		self.args = args
+		logger = (lambda msg: tqdm.write(msg)) if args.verbose else None
+		self.client = create_client(args, logger=logger)
+		self.fast_client = create_client(args, logger=logger, fast=True) if args.fast_model else None
+		# 逐页处理选项（--trivial-pages、--route-pages 等）对所有文件相同，由 main 校验后构建一次
+		self.options = options
+		self.compose_kwargs = dict(
+			font_path=(args.font_path or None),
+			render_mode=args.render_mode,
+			line_spacing=args.line_spacing,
+			column_padding=args.column_padding,
+			engine=args.engine,
+		)
+		self.stats = {"files": 0, "skipped": 0, "composed": 0, "generated": 0, "failed_files": 0,
+					"pages": 0, "failed_pages": 0}
+		self.bar: Optional[tqdm] = None
+		self.tracer = MemoryTracer() if args.memory_trace else None
+		self.budget = MemoryBudget.from_mb(args.memory_budget)
+		self.report = RunReport(tracer=self.tracer, budget=self.budget)
+
+	async def run(self, paths: List[str]) -> Dict:
+		loop = asyncio.get_running_loop()
+		# LLM 同步调用经 to_thread 执行，默认线程池上限可能小于并发页数
+		loop.set_default_executor(ThreadPoolExecutor(max_workers=max(4, self.args.concurrency)))
+		page_sem = asyncio.Semaphore(self.args.concurrency)
+		file_sem = asyncio.Semaphore(self.args.files)
+		self.bar = tqdm(total=0, unit="页", desc="生成讲解", disable=self.args.quiet)
+		if self.tracer:
+			self.tracer.start()
+		start = time.perf_counter()
+
+		async def guarded(path: str):
+			async with file_sem:
+				try:
+					await self.process_file(path, page_sem)
+				except Exception as e:
+					self.stats["failed_files"] += 1
+					tqdm.write(f"❌ {path}: {e}")
+
+		try:
+			await asyncio.gather(*(guarded(p) for p in paths))
+		finally:
+			if self.tracer:
+				self.tracer.stop()
+			if self.budget:
+				# 命令行不使用预览，落盘的预览随之删除
+				self.budget.cleanup()
+		self.bar.close()
+		self.stats["files"] = len(paths)
+		self.stats["elapsed"] = time.perf_counter() - start
+		self.report.finish()
+		return self.stats
+
+	async def process_file(self, path: str, page_sem: asyncio.Semaphore) -> None:
+		# 源文件从路径打开一次，校验、渲染与合成共用同一个文档；阶段耗时记入该文件的统计
+		with PdfSession(path) as session, use_metrics(self.report.file(path)):
+			is_valid, error = session.validation
+			if not is_valid:
+				raise ValueError(f"PDF文件验证失败: {error}")
+			await self._process_session(path, session, page_sem)
+
+	async def _process_session(self, path: str, session: PdfSession, page_sem: asyncio.Semaphore) -> None:
+		args = self.args
+		out_pdf, out_json = output_paths(path)
+		existing = {} if args.force else load_existing_explanations(out_json, path)
+		missing = [pno for pno in range(session.page_count) if pno not in existing]
+
+		if not missing:
+			if pdf_processor.output_is_current(out_pdf, session, args.font_size, explanations=existing, **self.compose_kwargs):
+				self.stats["skipped"] += 1
+				tqdm.write(f"⏭️  {os.path.basename(path)}: 已是最新")
+				return
+			# 讲解齐全，仅重新合成（已有输出时只重建变化页）
+			if os.path.exists(out_pdf):
+				pdf_processor.recompose_pdf(out_pdf, session, existing, args.right_ratio, args.font_size, **self.compose_kwargs)
+			else:
+				pdf_processor.compose_pdf(session, existing, args.right_ratio, args.font_size, output=out_pdf, **self.compose_kwargs)
+			self.stats["composed"] += 1
+			tqdm.write(f"🔄 {os.path.basename(path)}: 已按现有讲解重新合成")
+			return
+
+		# 生成缺失页的讲解（首次处理为全部页），已有讲解直接送入流式合成
+		composer = pdf_processor.StreamingComposer(session, args.right_ratio, args.font_size, **self.compose_kwargs)
+		for pno, text in existing.items():
+			composer.add_page(pno, text)
+		self.bar.total += len(missing)
+		self.bar.refresh()
+		try:
+			generated, _previews, failed_pages = await pdf_processor.generate_explanations_async(
+				session, self.client, args.prompt, args.dpi, args.concurrency,
+				pages=missing,
+				on_progress=lambda done, total: self.bar.update(1),
+				on_page_done=composer.add_page,
+				semaphore=page_sem,
+				memory_budget=self.budget,
+				options=self.options,
+				fast_client=self.fast_client,
+				on_log=(lambda msg: tqdm.write(f"{os.path.basename(path)}: {msg}")) if args.verbose else None,
+			)
+		except Exception:
+			composer.close()
+			raise
+		explanations = {**existing, **generated}
+		tmp_json = f"{out_json}.tmp"
+		with open(tmp_json, "w", encoding="utf-8") as f:
+			json.dump(dict(sorted(explanations.items())), f, ensure_ascii=False, indent=2)
+		os.replace(tmp_json, out_json)
+		composer.finish(explanations, output=out_pdf)
+
+		self.stats["generated"] += 1
+		self.stats["pages"] += len(missing) - len(failed_pages)
+		self.stats["failed_pages"] += len(failed_pages)
+		note = f"，{len(failed_pages)} 页失败（重新运行将只补全失败页）" if failed_pages else ""
+		ratio = dedup_ratio(self.report.file(path).counters())
+		if ratio is not None:
+			note += f"，去重率 {ratio:.0%}"
+		tqdm.write(f"✅ {os.path.basename(path)}: 生成 {len(missing) - len(failed_pages)}/{len(missing)} 页{note}")
+
+
+def format_summary(stats: Dict, usage: Dict, fast_usage: Optional[Dict] = None) -> str:
+	minutes = max(stats["elapsed"], 1e-9) / 60
+	lines = [
+		f"文件：共 {stats['files']}，生成 {stats['generated']}，仅合成 {stats['composed']}，"
+		f"跳过 {stats['skipped']}，失败 {stats['failed_files']}",
+		f"页面：生成 {stats['pages']} 页，失败 {stats['failed_pages']} 页，"
+		f"耗时 {stats['elapsed']:.1f}s，吞吐 {stats['pages'] / minutes:.1f} 页/分钟",
+		f"请求：成功 {usage['requests']}，重试/失败 {usage['errors']}；"
+		f"tokens：输入 {usage['input_tokens']}，输出 {usage['output_tokens']}",
+	]
+	if fast_usage is not None:
+		lines.append(f"快速模型请求：成功 {fast_usage['requests']}，重试/失败 {fast_usage['errors']}；"
+					f"tokens：输入 {fast_usage['input_tokens']}，输出 {fast_usage['output_tokens']}")
+	return "\n".join(lines)
+
+
+def format_stages(report: RunReport) -> str:
+	lines = ["阶段耗时（p50 / p95 / p99，总计）："]
+	for stage, stats in report.batch.summary().items():
+		lines.append(f"  {stage:<14} {stats['count']:>6} 次  {stats['p50'] * 1000:8.1f} / {stats['p95'] * 1000:8.1f} / "
+					f"{stats['p99'] * 1000:8.1f} ms  {stats['total']:8.1f}s")
+	return "\n".join(lines)
+
+
+def format_counters(report: RunReport) -> str:
+	counters = report.batch.counters()
+	lines = [f"{COUNTERS.get(name, name)}：{value:g}" for name, value in counters.items()]
+	if counters.get("explained_pages"):
+		lines.append(f"续页率：{continuation_rate(counters):.2f} 页/页，每页输出 token：{output_tokens_per_page(counters):g}")
+	return "\n".join(lines)
+
+
+def format_memory(report: RunReport) -> str:
+	def mb(n: int) -> str:
+		return f"{n / 1024 / 1024:.1f} MB"
+
+	memory = report.memory()
+	lines = []
+	if "peak_rss" in memory:
+		lines.append(f"内存峰值：RSS {mb(memory['peak_rss'])}，Python 分配 {mb(memory['peak_traced'])}")
+		for stage, stats in report.batch.summary().items():
+			if "peak_rss" in stats:
+				lines.append(f"  {stage:<14} RSS {mb(stats['peak_rss']):>10}  Python {mb(stats['peak_traced']):>10}")
+	budget = memory.get("budget")
+	if budget:
+		lines.append(f"内存预算 {mb(budget['limit_bytes'])}：接近预算 {budget['pressure_events']} 次，"
+					f"限制渲染 {budget['throttled']} 次（{budget['throttle_seconds']:.1f}s），"
+					f"落盘 {budget['spilled']} 个文件（{mb(budget['spilled_bytes'])}）")
+	return "\n".join(lines)
+
+
+def add_client_arguments(parser: argparse.ArgumentParser) -> None:
+	"""LLM 客户端相关选项（命令行与 HTTP 服务共用）"""
+	parser.add_argument("--api-key", default=None, help="默认读取环境变量 GEMINI_API_KEY")
+	parser.add_argument("--model", default="gemini-2.5-pro")
+	parser.add_argument("--temperature", type=float, default=0.4)
+	parser.add_argument("--max-tokens", type=int, default=4096)
+	parser.add_argument("--rpm", type=int, default=150, help="RPM 上限（同一进程内所有文件/任务共享）")
+	parser.add_argument("--tpm", type=int, default=2000000, help="TPM 预算（同一进程内所有文件/任务共享）")
+	parser.add_argument("--rpd", type=int, default=10000, help="RPD 上限（同一进程内所有文件/任务共享）")
+	parser.add_argument("--backend", choices=BACKENDS, default="gemini",
+						help="LLM 后端：fake 为离线模拟；record 录制真实响应，replay 只回放录制")
+	parser.add_argument("--record-dir", default=None, help="record/replay 后端的录制目录")
+	parser.add_argument("--fake-latency", type=float, default=0.5, help="fake 后端延迟中位数（秒）")
+	parser.add_argument("--fake-latency-sigma", type=float, default=0.5, help="fake 后端延迟的对数正态 sigma")
+	parser.add_argument("--fake-429-rate", type=float, default=0.0, help="fake 后端返回 429 的概率")
+	parser.add_argument("--fake-seed", type=int, default=0)
+	parser.add_argument("--fast-model", default=None,
+						help="快速模型（如 gemini-2.5-flash），用于模型路由；有独立的 RPM/TPM/RPD 限流")
+	parser.add_argument("--fast-rpm", type=int, default=1000, help="快速模型的 RPM 上限")
+	parser.add_argument("--fast-tpm", type=int, default=4000000, help="快速模型的 TPM 预算")
+	parser.add_argument("--fast-rpd", type=int, default=10000, help="快速模型的 RPD 上限")
+	parser.add_argument("--fake-fast-latency", type=float, default=0.15, help="fake 后端中快速模型的延迟中位数（秒）")
+	parser.add_argument("--request-timeout", type=float, default=300.0,
+						help="单次 LLM 调用的期限（秒），超过后放弃并重试；0 为不限")
+	parser.add_argument("--hedge", action="store_true",
+						help="对冲慢请求：调用超过最近耗时的 p90 仍未返回时，在限流额度允许时再发一个相同请求，先返回的为准")
+
+
+def check_client_arguments(args: argparse.Namespace) -> Optional[str]:
+	"""补全 API Key；缺少必需参数时返回错误信息"""
+	args.api_key = args.api_key or os.getenv("GEMINI_API_KEY")
+	if args.backend in ("gemini", "record") and not args.api_key:
+		return "请通过 --api-key 或环境变量 GEMINI_API_KEY 提供 API Key"
+	if args.backend in ("record", "replay") and not args.record_dir:
+		return f"--backend {args.backend} 需要指定 --record-dir"
+	if (getattr(args, "routing", "off") != "off" or getattr(args, "route_pages", None)) and not args.fast_model:
+		return "模型路由需要通过 --fast-model 指定快速模型"
+	return None
+
+
+def create_client(args: argparse.Namespace, logger=None, fast: bool = False) -> GeminiClient:
+	"""创建强模型（--model）客户端；fast 为 True 时创建快速模型（--fast-model）客户端，使用独立的限额"""
+	model = args.fast_model if fast else args.model
+	backend = create_backend(
+		args.backend, api_key=args.api_key, model_name=model, temperature=args.temperature,
+		max_output_tokens=args.max_tokens, record_dir=args.record_dir,
+		latency=args.fake_fast_latency if fast else args.fake_latency, latency_sigma=args.fake_latency_sigma,
+		rate_limit_rate=args.fake_429_rate, seed=args.fake_seed,
+	)
+	return GeminiClient(
+		api_key=args.api_key,
+		model_name=model,
+		temperature=args.temperature,
+		max_output_tokens=args.max_tokens,
+		rpm_limit=args.fast_rpm if fast else args.rpm,
+		tpm_budget=args.fast_tpm if fast else args.tpm,
+		rpd_limit=args.fast_rpd if fast else args.rpd,
+		logger=logger,
+		backend=backend,
+		label=("fast" if fast else "strong") if args.fast_model else None,
+		request_timeout=args.request_timeout or None,
+		hedge=args.hedge,
+	)
+
+
+def build_parser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(
+		prog="python -m app.cli",
+		description="批量为目录/通配符中的 PDF 生成讲解并合成讲解版 PDF（输出与 JSON 写在输入文件旁）",
+	)
+	parser.add_argument("inputs", nargs="+", help="PDF 文件、目录（递归）或通配符")
+	add_client_arguments(parser)
+	parser.add_argument("--dpi", type=int, default=180, help="渲染 DPI（仅供 LLM）")
+	parser.add_argument("--image-mode", choices=["full", "adaptive"], default="full",
+						help="发给 LLM 的图片：full 按 --dpi 渲染整页；adaptive 裁去空白边距，按最小字号与小图逐页选择 DPI")
+	parser.add_argument("--min-dpi", type=int, default=96, help="adaptive 模式的最低 DPI")
+	parser.add_argument("--max-dpi", type=int, default=220, help="adaptive 模式的最高 DPI")
+	parser.add_argument("--input-mode", choices=["image", "hybrid"], default="image",
+						help="LLM 输入：image 只发图片；hybrid 对文字主导的页附上文本层并改发低分辨率图片")
+	parser.add_argument("--hybrid-dpi", type=int, default=72, help="hybrid 模式下文字主导页的图片 DPI")
+	parser.add_argument("--right-ratio", type=float, default=0.48)
+	parser.add_argument("--font-size", type=int, default=20)
+	parser.add_argument("--line-spacing", type=float, default=1.2)
+	parser.add_argument("--column-padding", type=int, default=10)
+	parser.add_argument("--font-path", default="assets/fonts/SIMHEI.TTF")
+	parser.add_argument("--render-mode", choices=["text", "markdown"], default="markdown")
+	parser.add_argument("--engine", choices=["vector", "widen"], default="vector")
+	parser.add_argument("--trivial-pages", choices=["off", "skip", "batch"], default="off",
+						help="空白/过渡页：skip 不请求 LLM，使用本地讲解；batch 把过渡页拼图后合并为一次请求")
+	parser.add_argument("--duplicate-pages", choices=["off", "share", "diff"], default="off",
+						help="重复页：share 相同的页只讲解一次并共用讲解；diff 另外对逐步展开的页只讲解新增内容")
+	parser.add_argument("--length-budget", choices=["off", "prompt", "condense"], default="off",
+						help="篇幅控制：prompt 按排版参数估算每页右栏容量，写入提示词并限制输出 token；condense 另外压缩超长讲解")
+	parser.add_argument("--routing", choices=["off", "auto"], default="off",
+						help="模型路由：auto 按页面复杂度把简单的页交给 --fast-model，复杂的页交给 --model")
+	parser.add_argument("--route-threshold", type=float, default=1.0, help="复杂度低于该值的页使用快速模型")
+	parser.add_argument("--route-pages", default=None, help="逐页指定路由，如 \"1-3=fast,7=strong\"（页码从 1 起，优先于自动判定）")
+	parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+	parser.add_argument("--concurrency", type=int, default=20, help="所有文件合计的并发页数")
+	parser.add_argument("--files", type=int, default=4, help="同时处理的文件数")
+	parser.add_argument("--force", action="store_true", help="忽略已有输出，全部重新生成")
+	parser.add_argument("--quiet", action="store_true", help="不显示进度条")
+	parser.add_argument("--verbose", action="store_true", help="输出 LLM 重试日志与逐页日志（含 adaptive 模式每页的 DPI 与图片大小）")
+	parser.add_argument("--report", default=None, help="把各阶段耗时（逐文件与整批）写入 JSON 运行报告")
+	parser.add_argument("--metrics", default=None, help="把各阶段耗时以 Prometheus 文本格式写入文件（可供 node_exporter textfile 采集）")
+	parser.add_argument("--memory-trace", action="store_true", help="跟踪内存（tracemalloc 与 RSS 采样），各阶段与各文件的峰值写入报告")
+	parser.add_argument("--memory-budget", type=float, default=None,
+						help="内存预算（MB）：接近预算时减少同时渲染的页数、预览落盘并释放缓存")
+	return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	load_dotenv()
+	args = build_parser().parse_args(argv)
+	error = check_client_arguments(args)
+	if error:
+		print(error, file=sys.stderr)
+		return 2
+	try:
+		options = pdf_processor.ExplainOptions.from_params(vars(args))
+	except ValueError as e:
+		print(e, file=sys.stderr)
+		return 2
+	paths = collect_inputs(args.inputs)
+	if not paths:
+		print("未找到 PDF 文件", file=sys.stderr)
+		return 2
+
+	runner = BatchRunner(args, options)
+	stats = asyncio.run(runner.run(paths))
+	print(format_summary(stats, runner.client.usage, runner.fast_client.usage if runner.fast_client else None))
+	if runner.report.batch.summary():
+		print(format_stages(runner.report))
+	if runner.report.batch.counters():
+		print(format_counters(runner.report))
+	if runner.tracer or runner.budget:
+		print(format_memory(runner.report))
+	if args.report:
+		with open(args.report, "w", encoding="utf-8") as f:
+			f.write(runner.report.to_json())
+	if args.metrics:
+		with open(args.metrics, "w", encoding="utf-8") as f:
+			f.write(runner.report.to_prometheus())
+	return 1 if stats["failed_files"] or stats["failed_pages"] else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,467 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlparse
+
+from dotenv import load_dotenv
+
+from app.cli import DEFAULT_PROMPT, OUTPUT_SUFFIX, add_client_arguments, check_client_arguments, create_client
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.job_queue import COMPLETED, FAILED, QUEUED, RUNNING
+from app.services.metrics import RunReport, use_metrics
+from app.services.pdf_session import PdfSession
+
+
+DEFAULT_OUTPUT_DIR = os.path.join(tempfile.gettempdir(), "pdf_processor_cache", "api")
+
+# 每个请求可通过查询参数覆盖的处理参数：名称 -> (类型, 默认值)
+JOB_OPTIONS: Dict[str, Tuple[Callable[[str], Any], Any]] = {
+	"prompt": (str, DEFAULT_PROMPT),
+	"dpi": (int, 180),
+	"right_ratio": (float, 0.48),
+	"font_size": (int, 20),
+	"line_spacing": (float, 1.2),
+	"column_padding": (int, 10),
+	"render_mode": (str, "markdown"),
+	"engine": (str, "vector"),
+	"trivial_pages": (str, "off"),
+	"duplicate_pages": (str, "off"),
+	"image_mode": (str, "full"),
+	"min_dpi": (int, 96),
+	"max_dpi": (int, 220),
+	"input_mode": (str, "image"),
+	"hybrid_dpi": (int, 72),
+	"routing": (str, "off"),
+	"route_threshold": (float, 1.0),
+	"route_pages": (str, ""),
+	"length_budget": (str, "off"),
+}
+_OPTION_CHOICES = {"render_mode": ("text", "markdown"), "engine": ("vector", "widen"),
+				"trivial_pages": ("off", "skip", "batch"), "duplicate_pages": ("off", "share", "diff"),
+				"image_mode": ("full", "adaptive"), "input_mode": ("image", "hybrid"),
+				"routing": ("off", "auto"), "length_budget": ("off", "prompt", "condense")}
+
+# SSE 空闲时发送注释行的间隔，防止代理断开连接
+KEEPALIVE_SECONDS = 15.0
+
+
+def parse_options(query: Dict[str, List[str]]) -> Dict[str, Any]:
+	"""从查询参数解析处理参数，未给出的取默认值；类型或取值不合法（含 DPI 范围等组合检查）时抛出 ValueError"""
+	options: Dict[str, Any] = {}
+	for name, (cast, default) in JOB_OPTIONS.items():
+		if name not in query:
+			options[name] = default
+			continue
+		try:
+			options[name] = cast(query[name][-1])
+		except ValueError:
+			raise ValueError(f"参数 {name} 不合法: {query[name][-1]}")
+		if name in _OPTION_CHOICES and options[name] not in _OPTION_CHOICES[name]:
+			raise ValueError(f"参数 {name} 只能是 {'/'.join(_OPTION_CHOICES[name])}")
+	# 提交前构建一次 ExplainOptions，组合检查失败时返回 400，而不是任务开始后才失败
+	pdf_processor.ExplainOptions.from_params(options)
+	return options
+
+
+class Job:
+	"""
+	单个处理任务的状态与事件日志。
+
+	事件只在事件循环线程中追加，HTTP 线程通过 wait_events 按序号读取，
+	SSE 断线重连时可凭 Last-Event-ID 从中断处继续。
+	"""
+
+	def __init__(self, job_id: str, filename: str, options: Dict[str, Any], total: int, pdf_path: str) -> None:
+		self.id = job_id
+		self.filename = filename
+		self.options = options
+		self.total = total
+		self.pdf_path = pdf_path
+		self.status = QUEUED
+		self.done = 0
+		self.failed_pages: List[int] = []
+		self.error: Optional[str] = None
+		self.explanations: Optional[Dict[int, str]] = None
+		self.created_at = time.time()
+		self.finished_at: Optional[float] = None
+		self._events: List[Tuple[str, Dict]] = []
+		self._cond = threading.Condition()
+
+	@property
+	def finished(self) -> bool:
+		return self.status in (COMPLETED, FAILED)
+
+	def publish(self, event: str, data: Dict) -> None:
+		with self._cond:
+			self._events.append((event, data))
+			self._cond.notify_all()
+
+	def wait_events(self, start: int, timeout: float) -> Tuple[List[Tuple[str, Dict]], bool]:
+		"""返回序号 start 起的事件与任务是否已结束；暂无新事件时最多等待 timeout 秒"""
+		with self._cond:
+			if len(self._events) <= start and not self.finished:
+				self._cond.wait(timeout)
+			return self._events[start:], self.finished
+
+	def set_status(self, status: str) -> None:
+		self.status = status
+		self.publish("status", {"status": status, "done": self.done, "total": self.total})
+
+	def page_done(self, pno: int, ok: bool) -> None:
+		self.done += 1
+		self.publish("page", {"page": pno, "ok": ok, "done": self.done, "total": self.total})
+
+	def complete(self, explanations: Dict[int, str], failed_pages: List[int]) -> None:
+		self.explanations = explanations
+		self.failed_pages = failed_pages
+		self.finished_at = time.time()
+		with self._cond:
+			self.status = COMPLETED
+			self._events.append(("done", {"status": COMPLETED, "failed_pages": failed_pages,
+										"explanations": f"/jobs/{self.id}/explanations", "pdf": f"/jobs/{self.id}/pdf"}))
+			self._cond.notify_all()
+
+	def fail(self, error: str) -> None:
+		self.error = error
+		self.finished_at = time.time()
+		with self._cond:
+			self.status = FAILED
+			self._events.append(("error", {"status": FAILED, "error": error}))
+			self._cond.notify_all()
+
+	def to_dict(self) -> Dict:
+		return {
+			"id": self.id,
+			"filename": self.filename,
+			"status": self.status,
+			"done": self.done,
+			"total": self.total,
+			"failed_pages": self.failed_pages,
+			"error": self.error,
+			"options": self.options,
+			"created_at": self.created_at,
+			"finished_at": self.finished_at,
+			"events": f"/jobs/{self.id}/events",
+		}
+
+
+class ApiService:
+	"""
+	进程内共享的处理服务：所有请求共用一个 LLM 客户端（同一组 RPM/TPM/RPD 限流）和一组页级并发槽位。
+	配置了快速模型时另有一个 fast_client（独立限流），供请求参数 routing/route_pages 启用模型路由。
+
+	PyMuPDF 非线程安全，渲染、校验与合成都在同一个后台事件循环线程中执行；
+	HTTP 处理线程只提交任务、读取任务状态与输出文件。
+	"""
+
+	def __init__(self, client: GeminiClient, concurrency: int = 20, max_jobs: int = 4,
+				font_path: Optional[str] = None, output_dir: Optional[str] = None,
+				fast_client: Optional[GeminiClient] = None) -> None:
+		self.client = client
+		self.fast_client = fast_client
+		self.concurrency = concurrency
+		self.font_path = font_path
+		self.output_dir = output_dir or DEFAULT_OUTPUT_DIR
+		os.makedirs(self.output_dir, exist_ok=True)
+		self.jobs: Dict[str, Job] = {}
+		# 服务启动以来所有任务的阶段耗时（GET /metrics）
+		self.report = RunReport(max_samples=10000)
+		self._lock = threading.Lock()
+		self._page_sem = asyncio.Semaphore(concurrency)
+		# 同时合成的任务数：每个运行中的任务在内存中持有一份源文档与输出文档
+		self._job_sem = asyncio.Semaphore(max_jobs)
+		self.loop = asyncio.new_event_loop()
+		# LLM 同步调用经 to_thread 执行，默认线程池上限可能小于并发页数
+		self.loop.set_default_executor(ThreadPoolExecutor(max_workers=max(4, concurrency)))
+		self._thread = threading.Thread(target=self.loop.run_forever, name="pipeline-loop", daemon=True)
+		self._thread.start()
+
+	def _call_in_loop(self, fn: Callable, *args):
+		"""在事件循环线程中执行同步函数并等待结果"""
+		async def call():
+			return fn(*args)
+		return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+	def submit(self, src_bytes: bytes, filename: str, options: Dict[str, Any]) -> Job:
+		"""校验 PDF 并创建任务，立即返回；不合法的 PDF 抛出 ValueError"""
+		if (options.get("routing", "off") != "off" or options.get("route_pages")) and self.fast_client is None:
+			raise ValueError("服务未配置快速模型（--fast-model），不能使用模型路由")
+		# 源 PDF 只解析一次：校验、页数、渲染与合成共用同一个会话，任务结束时在事件循环线程中关闭
+		session = self._call_in_loop(PdfSession, src_bytes)
+		is_valid, error = session.validation
+		if not is_valid:
+			self._call_in_loop(session.close)
+			raise ValueError(f"PDF文件验证失败: {error}")
+		total = session.page_count
+		job_id = uuid.uuid4().hex
+		job = Job(job_id, filename, options, total, os.path.join(self.output_dir, f"{job_id}.pdf"))
+		with self._lock:
+			self.jobs[job_id] = job
+		asyncio.run_coroutine_threadsafe(self._run_job(job, session), self.loop)
+		return job
+
+	def get(self, job_id: str) -> Optional[Job]:
+		with self._lock:
+			return self.jobs.get(job_id)
+
+	def list_jobs(self) -> List[Job]:
+		with self._lock:
+			return sorted(self.jobs.values(), key=lambda j: j.created_at)
+
+	def delete(self, job_id: str) -> bool:
+		"""删除已结束的任务及其输出文件；运行中的任务不可删除"""
+		with self._lock:
+			job = self.jobs.get(job_id)
+			if job is None or not job.finished:
+				return False
+			del self.jobs[job_id]
+		if os.path.exists(job.pdf_path):
+			os.remove(job.pdf_path)
+		return True
+
+	async def _run_job(self, job: Job, session: PdfSession) -> None:
+		# 阶段耗时记入服务的汇总统计（contextvar 只作用于本任务）
+		with use_metrics(self.report.batch):
+			async with self._job_sem:
+				opts = job.options
+				composer = None
+				try:
+					job.set_status(RUNNING)
+					composer = pdf_processor.StreamingComposer(
+						session, opts["right_ratio"], opts["font_size"], font_path=self.font_path,
+						render_mode=opts["render_mode"], line_spacing=opts["line_spacing"],
+						column_padding=opts["column_padding"], engine=opts["engine"],
+					)
+
+					def on_page_done(pno: int, text: Optional[str]) -> None:
+						composer.add_page(pno, text)
+						job.page_done(pno, text is not None)
+
+					explanations, _previews, failed_pages = await pdf_processor.generate_explanations_async(
+						session, self.client, opts["prompt"], opts["dpi"], self.concurrency,
+						on_page_done=on_page_done,
+						semaphore=self._page_sem,
+						options=pdf_processor.ExplainOptions.from_params(opts),
+						fast_client=self.fast_client,
+					)
+					composer.finish(explanations, output=job.pdf_path)
+					composer = None
+					job.complete(explanations, failed_pages)
+				except Exception as e:
+					if composer is not None:
+						composer.close()
+					job.fail(str(e))
+				finally:
+					session.close()
+
+	def close(self) -> None:
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self._thread.join()
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+	"""
+	路由：
+		POST   /jobs?filename=&<处理参数>     请求体为 PDF，返回 202 与任务信息
+		GET    /jobs                          任务列表
+		GET    /jobs/<id>                     任务状态
+		GET    /jobs/<id>/events              逐页进度（text/event-stream）
+		GET    /jobs/<id>/explanations        讲解 JSON
+		GET    /jobs/<id>/pdf                 讲解版 PDF（分块流式发送）
+		DELETE /jobs/<id>                     删除已结束的任务
+		GET    /health                        服务状态与累计 LLM 用量
+		GET    /metrics                       各阶段耗时（Prometheus 文本格式）
+	"""
+
+	server_version = "SmartLecturer"
+
+	@property
+	def service(self) -> ApiService:
+		return self.server.service
+
+	def log_message(self, format: str, *args) -> None:
+		if getattr(self.server, "verbose", False):
+			super().log_message(format, *args)
+
+	def _send_json(self, status: int, payload: Any) -> None:
+		body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def _send_error(self, status: int, message: str) -> None:
+		self._send_json(status, {"error": message})
+
+	def _route(self) -> Tuple[List[str], Dict[str, List[str]]]:
+		url = urlparse(self.path)
+		return [p for p in url.path.split("/") if p], parse_qs(url.query)
+
+	def do_POST(self) -> None:
+		parts, query = self._route()
+		if parts != ["jobs"]:
+			return self._send_error(404, "not found")
+		length = int(self.headers.get("Content-Length") or 0)
+		if length <= 0:
+			return self._send_error(411, "请求体需为 PDF 文件内容并带 Content-Length")
+		if length > self.server.max_upload_bytes:
+			return self._send_error(413, f"文件超过上限 {self.server.max_upload_bytes // (1024 * 1024)} MB")
+		src_bytes = self.rfile.read(length)
+		try:
+			options = parse_options(query)
+			job = self.service.submit(src_bytes, query.get("filename", ["upload.pdf"])[-1], options)
+		except ValueError as e:
+			return self._send_error(400, str(e))
+		self._send_json(202, job.to_dict())
+
+	def do_GET(self) -> None:
+		parts, _query = self._route()
+		if parts == ["health"]:
+			jobs = self.service.list_jobs()
+			return self._send_json(200, {
+				"status": "ok",
+				"jobs": {s: sum(1 for j in jobs if j.status == s) for s in (QUEUED, RUNNING, COMPLETED, FAILED)},
+				"usage": getattr(self.service.client, "usage", {}),
+			})
+		if parts == ["metrics"]:
+			body = self.service.report.to_prometheus().encode("utf-8")
+			self.send_response(200)
+			self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+			return
+		if parts == ["jobs"]:
+			return self._send_json(200, [job.to_dict() for job in self.service.list_jobs()])
+		if len(parts) not in (2, 3) or parts[0] != "jobs":
+			return self._send_error(404, "not found")
+		job = self.service.get(parts[1])
+		if job is None:
+			return self._send_error(404, "任务不存在")
+		if len(parts) == 2:
+			return self._send_json(200, job.to_dict())
+		if parts[2] == "events":
+			return self._stream_events(job)
+		if parts[2] not in ("explanations", "pdf"):
+			return self._send_error(404, "not found")
+		if job.status == FAILED:
+			return self._send_error(409, f"任务失败: {job.error}")
+		if job.status != COMPLETED:
+			return self._send_error(409, "任务尚未完成")
+		if parts[2] == "explanations":
+			return self._send_json(200, {str(k): v for k, v in sorted(job.explanations.items())})
+		self._send_file(job.pdf_path, f"{os.path.splitext(job.filename)[0]}{OUTPUT_SUFFIX}")
+
+	def do_DELETE(self) -> None:
+		parts, _query = self._route()
+		if len(parts) != 2 or parts[0] != "jobs":
+			return self._send_error(404, "not found")
+		if self.service.get(parts[1]) is None:
+			return self._send_error(404, "任务不存在")
+		if not self.service.delete(parts[1]):
+			return self._send_error(409, "任务尚未结束")
+		self._send_json(200, {"deleted": parts[1]})
+
+	def _stream_events(self, job: Job) -> None:
+		"""以 SSE 推送任务事件：先补发历史事件，再实时推送，任务结束后关闭连接"""
+		try:
+			index = int(self.headers.get("Last-Event-ID", "-1")) + 1
+		except ValueError:
+			index = 0
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+		self.send_header("Cache-Control", "no-cache")
+		self.send_header("X-Accel-Buffering", "no")
+		self.end_headers()
+		try:
+			while True:
+				events, finished = job.wait_events(index, KEEPALIVE_SECONDS)
+				for event, data in events:
+					self.wfile.write(f"id: {index}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+					index += 1
+				if not events:
+					if finished:
+						break
+					self.wfile.write(b": keep-alive\n\n")
+				self.wfile.flush()
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+
+	def _send_file(self, path: str, download_name: str) -> None:
+		"""分块发送文件，不把整份 PDF 读入内存"""
+		self.send_response(200)
+		self.send_header("Content-Type", "application/pdf")
+		self.send_header("Content-Length", str(os.path.getsize(path)))
+		self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(download_name)}")
+		self.end_headers()
+		with open(path, "rb") as f:
+			shutil.copyfileobj(f, self.wfile, 64 * 1024)
+
+
+def create_server(service: ApiService, host: str = "127.0.0.1", port: int = 8765,
+				max_upload_mb: int = 200, verbose: bool = False) -> ThreadingHTTPServer:
+	"""创建 HTTP 服务（port=0 时由系统分配端口，见 server.server_address）"""
+	server = ThreadingHTTPServer((host, port), ApiHandler)
+	server.daemon_threads = True
+	server.service = service
+	server.max_upload_bytes = max_upload_mb * 1024 * 1024
+	server.verbose = verbose
+	return server
+
+
+def build_parser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(
+		prog="python -m app.server",
+		description="SmartLecturer 本地 HTTP 服务：提交 PDF、以 SSE 订阅逐页进度、下载讲解 JSON 与讲解版 PDF",
+	)
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	add_client_arguments(parser)
+	parser.add_argument("--font-path", default="assets/fonts/SIMHEI.TTF")
+	parser.add_argument("--concurrency", type=int, default=20, help="所有任务合计的并发页数")
+	parser.add_argument("--jobs", type=int, default=4, help="同时处理的任务数")
+	parser.add_argument("--output-dir", default=None, help=f"输出目录（默认 {DEFAULT_OUTPUT_DIR}）")
+	parser.add_argument("--max-upload-mb", type=int, default=200)
+	parser.add_argument("--verbose", action="store_true", help="输出访问日志与 LLM 重试日志")
+	return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	load_dotenv()
+	args = build_parser().parse_args(argv)
+	error = check_client_arguments(args)
+	if error:
+		print(error, file=sys.stderr)
+		return 2
+	client = create_client(args, logger=print if args.verbose else None)
+	fast_client = create_client(args, logger=print if args.verbose else None, fast=True) if args.fast_model else None
+	service = ApiService(client, concurrency=args.concurrency, max_jobs=args.jobs,
+						font_path=(args.font_path or None), output_dir=args.output_dir, fast_client=fast_client)
+	server = create_server(service, args.host, args.port, args.max_upload_mb, args.verbose)
+	print(f"服务已启动：http://{args.host}:{server.server_address[1]}")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.close()
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
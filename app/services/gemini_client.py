@@ -1,14 +1,20 @@
 from __future__ import annotations
 
 import asyncio
+import math
 import random
+import re
 import time
+from collections import deque
 from dataclasses import dataclass
 from typing import Optional, Tuple
-import base64
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
+from .llm_backends import GeminiBackend, LLMBackend, LLMResponse
+from .metrics import count, percentile, timed
+
+
+# 会把思考过程计入输出 token 的模型
+_THINKING_MODEL_RE = re.compile(r"gemini-(?:2\.5|[3-9])|thinking")
 
 
 @dataclass
@@ -22,30 +28,45 @@ class RateLimiter:
 		self._req_timestamps: list[float] = []
 		self._used_tokens: list[Tuple[float, int]] = []
 		self._daily_requests: list[float] = []
+		# 因 RPM/TPM/RPD 额度不足而等待的累计时间（秒）
+		self.wait_seconds = 0.0
 
 	async def wait_for_slot(self, est_tokens: int) -> None:
-		# 清理窗口
-		now = time.time()
-		self._req_timestamps = [t for t in self._req_timestamps if now - t < self.window_seconds]
-		self._used_tokens = [(t, n) for (t, n) in self._used_tokens if now - t < self.window_seconds]
-		# 清理每日请求（24小时窗口）
-		self._daily_requests = [t for t in self._daily_requests if now - t < 86400]
+		with timed("wait_for_slot"):
+			await self._wait_for_slot(est_tokens)
 
+	async def _wait_for_slot(self, est_tokens: int) -> None:
 		while True:
 			now = time.time()
-			self._req_timestamps = [t for t in self._req_timestamps if now - t < self.window_seconds]
-			self._used_tokens = [(t, n) for (t, n) in self._used_tokens if now - t < self.window_seconds]
-			self._daily_requests = [t for t in self._daily_requests if now - t < 86400]
-
-			req_ok = len(self._req_timestamps) < self.max_rpm
-			tokens_used = sum(n for _, n in self._used_tokens)
-			tpm_ok = (tokens_used + est_tokens) <= self.max_tpm
-			rpd_ok = len(self._daily_requests) < self.max_rpd
-
-			if req_ok and tpm_ok and rpd_ok:
+			if self._has_room(now, est_tokens):
 				break
 			await asyncio.sleep(0.25)
+			self.wait_seconds += time.time() - now
+		self._take(est_tokens)
 
+	def try_acquire(self, est_tokens: int, rpd_reserve: int = 0) -> bool:
+		"""
+		不等待地占用一次请求额度（对冲请求使用）：RPM/TPM 有余量，且当日请求数距 RPD 上限
+		还多于 rpd_reserve 次时占用并返回 True，否则返回 False。
+		"""
+		if not self._has_room(time.time(), est_tokens, rpd_reserve):
+			return False
+		self._take(est_tokens)
+		return True
+
+	def _has_room(self, now: float, est_tokens: int, rpd_reserve: int = 0) -> bool:
+		# 清理窗口（每日请求为 24 小时窗口）
+		self._req_timestamps = [t for t in self._req_timestamps if now - t < self.window_seconds]
+		self._used_tokens = [(t, n) for (t, n) in self._used_tokens if now - t < self.window_seconds]
+		self._daily_requests = [t for t in self._daily_requests if now - t < 86400]
+
+		req_ok = len(self._req_timestamps) < self.max_rpm
+		tokens_used = sum(n for _, n in self._used_tokens)
+		tpm_ok = (tokens_used + est_tokens) <= self.max_tpm
+		rpd_ok = len(self._daily_requests) + rpd_reserve < self.max_rpd
+		return req_ok and tpm_ok and rpd_ok
+
+	def _take(self, est_tokens: int) -> None:
 		self._req_timestamps.append(time.time())
 		self._used_tokens.append((time.time(), est_tokens))
 		self._daily_requests.append(time.time())
@@ -56,42 +77,181 @@ def estimate_tokens(chinese_chars: int) -> int:
 	return max(256, chinese_chars // 2 + 200)
 
 
+def estimate_image_tokens(width: int, height: int) -> int:
+	# Gemini 图片计费：两边都不超过 384 像素为 258 token，否则按 768×768 分块，每块 258 token
+	if width <= 384 and height <= 384:
+		return 258
+	return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def estimate_text_tokens(text: str) -> int:
+	# 粗估：中日韩字符约 1 字 ≈ 1 token，其余约 4 字符 ≈ 1 token
+	cjk = sum(1 for c in text if "\u3000" <= c <= "\u9fff" or "\uac00" <= c <= "\ud7af" or "\uff00" <= c <= "\uffef")
+	return cjk + (len(text) - cjk) // 4
+
+
 class GeminiClient:
-	def __init__(self, api_key: str, model_name: str, temperature: float, max_output_tokens: int,
-				rpm_limit: int, tpm_budget: int, rpd_limit: int, logger=None) -> None:
-		self.llm = ChatGoogleGenerativeAI(
-			model=model_name,
-			api_key=api_key,
-			temperature=temperature,
-			max_output_tokens=max_output_tokens,
-		)
+	"""
+	讲解生成客户端：RPM/TPM/RPD 限流、失败重试与用量统计，实际调用交给可替换的后端。
+
+	Args:
+		backend: LLM 后端（见 llm_backends）；为 None 时按 api_key/model_name 等参数创建 GeminiBackend
+		label: 模型路由中的名称（"fast" / "strong"）；设置后每次调用的耗时另记入 "explain_page:<label>" 阶段
+		request_timeout: 单次调用的期限（秒），超过后放弃该次调用并按失败重试；None 为不限
+		hedge: 对冲慢请求。调用超过动态阈值（最近调用耗时的 hedge_quantile 分位数）仍未返回时，
+			在限流额度允许时再发一个相同的请求，先成功返回的为准，另一个取消；对冲次数记入计数器
+	"""
+
+	# 重试策略：最多尝试次数、首次重试等待（秒）与指数回退倍数
+	max_attempts = 5
+	retry_delay = 1.0
+	retry_backoff = 1.5
+
+	# 对冲策略：阈值分位数、计算阈值所需的最少样本数、阈值下限（秒）、为首次请求保留的 RPD 比例，
+	# 以及计算阈值使用的最近调用耗时样本数
+	hedge_quantile = 0.9
+	hedge_min_samples = 20
+	hedge_min_delay = 1.0
+	hedge_rpd_reserve = 0.1
+	latency_window = 200
+
+	def __init__(self, api_key: Optional[str], model_name: str, temperature: float, max_output_tokens: int,
+				rpm_limit: int, tpm_budget: int, rpd_limit: int, logger=None,
+				backend: Optional[LLMBackend] = None, label: Optional[str] = None,
+				request_timeout: Optional[float] = None, hedge: bool = False,
+				output_token_reserve: Optional[int] = None) -> None:
+		self.backend = backend or GeminiBackend(api_key, model_name, temperature, max_output_tokens)
+		self.label = label
+		self.request_timeout = request_timeout
+		self.hedge = hedge
+		if output_token_reserve is None and _THINKING_MODEL_RE.search(model_name or ""):
+			output_token_reserve = self.thinking_token_reserve
+		if output_token_reserve is not None:
+			self.output_token_reserve = output_token_reserve
 		self.ratelimiter = RateLimiter(max_rpm=rpm_limit, max_tpm=tpm_budget, max_rpd=rpd_limit)
 		self.logger = logger
+		# 累计用量：成功请求数、失败尝试数与响应中的 token 统计
+		self.usage = {"requests": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0}
+		# 正在等待后端响应的请求数，与失败后回退等待的累计时间（秒），供进度显示
+		self.in_flight = 0
+		self.retry_wait_seconds = 0.0
+		# 最近调用的耗时（秒），用于计算对冲阈值
+		self._latencies: deque = deque(maxlen=self.latency_window)
 
-	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
-		# 估算输出 tokens（目标 800~1200字）
-		est = estimate_tokens(1200)
+	# 按字数上限设置 max_output_tokens 时额外预留的 token；思考模型（2.5 及以后）的思考过程也计入输出，
+	# 预留更多，避免思考用尽上限后讲解为空或被截断。创建客户端时可用 output_token_reserve 覆盖
+	output_token_reserve = 1024
+	thinking_token_reserve = 8192
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str, max_chars: Optional[int] = None,
+						temperature: Optional[float] = None) -> str:
+		"""
+		生成单页讲解。
+
+		Args:
+			max_chars: 讲解字数上限；给出时按它估算限流 token，并把本次调用的 max_output_tokens
+				设为 max_chars + output_token_reserve（按 1 字 ≈ 1 token 的上界）
+			temperature: 本次调用的采样温度；None 时使用创建客户端时的设置
+		"""
+		with timed("explain_page"):
+			if self.label is None:
+				return await self._explain_page(image_bytes, system_prompt, max_chars, temperature)
+			with timed(f"explain_page:{self.label}"):
+				return await self._explain_page(image_bytes, system_prompt, max_chars, temperature)
+
+	async def _explain_page(self, image_bytes: bytes, system_prompt: str, max_chars: Optional[int] = None,
+							temperature: Optional[float] = None) -> str:
+		# 估算输出 tokens（未给出字数上限时按目标 800~1200字）
+		est = estimate_tokens(max_chars or 1200)
 		await self.ratelimiter.wait_for_slot(est)
+		# 自定义后端可能不支持 max_output_tokens / temperature，只在需要时传入
+		kwargs = {"max_output_tokens": max_chars + self.output_token_reserve} if max_chars else {}
+		if temperature is not None:
+			kwargs["temperature"] = temperature
 
-		# 将图片字节转为 data URL 以适配 image_url 格式
-		b64 = base64.b64encode(image_bytes).decode("utf-8")
-		data_url = f"data:image/png;base64,{b64}"
-		content = [
-			{"type": "text", "text": system_prompt},
-			{"type": "image_url", "image_url": data_url},
-		]
-
-		backoff = 1.5
-		delay = 1.0
-		for attempt in range(5):
+		delay = self.retry_delay
+		for attempt in range(self.max_attempts):
 			try:
-				resp = await asyncio.to_thread(self.llm.invoke, [HumanMessage(content=content)])
-				text = resp.content if isinstance(resp.content, str) else resp.content[0].text
-				return text.strip()
-			except Exception as e:  # 捕获 429/5xx 等
-				if attempt >= 4:
+				resp = await self._call(image_bytes, system_prompt, kwargs, est)
+				self._record_usage(resp)
+				return resp.text.strip()
+			except Exception as e:  # 捕获 429/5xx、超时等
+				self.usage["errors"] += 1
+				if attempt >= self.max_attempts - 1:
 					raise
 				if self.logger:
 					self.logger(f"LLM 调用失败(第 {attempt+1} 次)：{e}")
-				await asyncio.sleep(delay + random.uniform(0, 0.5))
-				delay *= backoff
+			wait = delay + random.uniform(0, 0.5 * self.retry_delay)
+			self.retry_wait_seconds += wait
+			await asyncio.sleep(wait)
+			delay *= self.retry_backoff
+
+	def hedge_threshold(self) -> Optional[float]:
+		"""对冲阈值（秒）：最近调用耗时的 hedge_quantile 分位数，不低于 hedge_min_delay；样本不足时为 None（不对冲）"""
+		if len(self._latencies) < self.hedge_min_samples:
+			return None
+		return max(percentile(sorted(self._latencies), self.hedge_quantile), self.hedge_min_delay)
+
+	async def _call(self, image_bytes: bytes, system_prompt: str, kwargs: dict, est: int) -> LLMResponse:
+		"""
+		一次后端调用，超过 request_timeout 仍没有结果时抛出 TimeoutError。
+		启用对冲时，超过 hedge_threshold 仍未返回且限流额度允许（当日请求数距 RPD 上限保留 hedge_rpd_reserve），
+		再发一个相同的请求，先成功返回的为准，另一个取消。GeminiBackend 在线程中调用，
+		取消只是不再等待，已发出的请求仍计入服务端配额。
+		"""
+		start = time.perf_counter()
+		tasks = [asyncio.ensure_future(self._generate(image_bytes, system_prompt, kwargs))]
+		hedge_task = None
+		try:
+			threshold = self.hedge_threshold() if self.hedge else None
+			if threshold is not None and (self.request_timeout is None or threshold < self.request_timeout):
+				done, _ = await asyncio.wait(tasks, timeout=threshold)
+				if not done:
+					reserve = int(self.ratelimiter.max_rpd * self.hedge_rpd_reserve)
+					if self.ratelimiter.try_acquire(est, rpd_reserve=reserve):
+						count("hedged_requests")
+						hedge_task = asyncio.ensure_future(self._generate(image_bytes, system_prompt, kwargs))
+						tasks.append(hedge_task)
+					else:
+						count("hedges_skipped")
+			error: Optional[BaseException] = None
+			while tasks:
+				timeout = None
+				if self.request_timeout is not None:
+					timeout = max(0.0, start + self.request_timeout - time.perf_counter())
+				done, pending = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+				if not done:
+					count("request_timeouts")
+					raise asyncio.TimeoutError(f"LLM 调用超过 {self.request_timeout:g}s 未返回")
+				for task in done:
+					if task.exception() is None:
+						if task is hedge_task:
+							count("hedge_wins")
+						return task.result()
+					error = task.exception()
+				tasks = list(pending)
+			raise error
+		finally:
+			for task in tasks:
+				task.cancel()
+
+	async def _generate(self, image_bytes: bytes, system_prompt: str, kwargs: dict) -> LLMResponse:
+		self.in_flight += 1
+		start = time.perf_counter()
+		try:
+			resp = await self.backend.generate(image_bytes, system_prompt, **kwargs)
+		except asyncio.CancelledError:
+			# 被对冲或超时取消：已等待的时间是该调用耗时的下界，同样计入样本，避免阈值随对冲逐步降低
+			self._latencies.append(time.perf_counter() - start)
+			raise
+		finally:
+			self.in_flight -= 1
+		self._latencies.append(time.perf_counter() - start)
+		return resp
+
+	def _record_usage(self, resp: LLMResponse) -> None:
+		self.usage["requests"] += 1
+		count("input_tokens", resp.input_tokens)
+		count("output_tokens", resp.output_tokens)
+		self.usage["input_tokens"] += resp.input_tokens
+		self.usage["output_tokens"] += resp.output_tokens
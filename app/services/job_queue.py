@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+DEFAULT_ROOT = os.path.join(tempfile.gettempdir(), "pdf_processor_cache", "jobs")
+
+# 不写入数据库的参数：API Key 由 worker 从自己的环境变量（或 .env）读取，不落盘
+SECRET_PARAMS = ("api_key",)
+
+
+def key_fingerprint(api_key: Optional[str]) -> Optional[str]:
+	"""API Key 的指纹（SHA-256 前 16 位），用于比较 worker 与 UI 的 Key 是否相同而不保存 Key 本身"""
+	return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	id TEXT PRIMARY KEY,
+	kind TEXT NOT NULL,
+	filename TEXT NOT NULL,
+	params TEXT NOT NULL,
+	status TEXT NOT NULL,
+	created_at REAL NOT NULL,
+	started_at REAL,
+	finished_at REAL,
+	heartbeat REAL,
+	worker_pid INTEGER,
+	done INTEGER NOT NULL DEFAULT 0,
+	total INTEGER NOT NULL DEFAULT 0,
+	message TEXT,
+	failed_pages TEXT,
+	error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+	pid INTEGER PRIMARY KEY,
+	max_jobs INTEGER NOT NULL,
+	heartbeat REAL NOT NULL,
+	key_fingerprint TEXT
+);
+"""
+
+
+class JobQueue:
+	"""
+	基于 SQLite 的本地任务队列。
+
+	每个任务一个目录：source.pdf（输入）、explanations.json / output.pdf（结果），
+	数据库只保存状态、进度与参数（不含 SECRET_PARAMS）。UI 提交任务后仅持有任务 ID，浏览器刷新或会话结束不影响执行；
+	任务由 job_worker 进程消费。目录只允许当前用户访问（共享的临时目录中其他用户不可读取上传的 PDF）。
+	"""
+
+	def __init__(self, root: Optional[str] = None) -> None:
+		self.root = root or os.getenv("JOB_QUEUE_DIR") or DEFAULT_ROOT
+		os.makedirs(self.root, mode=0o700, exist_ok=True)
+		self.db_path = os.path.join(self.root, "jobs.sqlite3")
+		with self._connect() as conn:
+			conn.executescript(_SCHEMA)
+			# 旧版本创建的 workers 表没有 key_fingerprint 列
+			if "key_fingerprint" not in {row["name"] for row in conn.execute("PRAGMA table_info(workers)")}:
+				conn.execute("ALTER TABLE workers ADD COLUMN key_fingerprint TEXT")
+
+	@contextlib.contextmanager
+	def _connect(self) -> Iterator[sqlite3.Connection]:
+		# 自动提交模式；多语句事务显式 BEGIN IMMEDIATE，连接关闭时未提交的事务回滚
+		conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+		try:
+			conn.row_factory = sqlite3.Row
+			conn.execute("PRAGMA journal_mode=WAL")
+			yield conn
+		finally:
+			conn.close()
+
+	def job_dir(self, job_id: str) -> str:
+		return os.path.join(self.root, job_id)
+
+	def source_path(self, job_id: str) -> str:
+		return os.path.join(self.job_dir(job_id), "source.pdf")
+
+	def output_path(self, job_id: str) -> str:
+		return os.path.join(self.job_dir(job_id), "output.pdf")
+
+	def explanations_path(self, job_id: str) -> str:
+		return os.path.join(self.job_dir(job_id), "explanations.json")
+
+	# ---- 提交与查询 ----
+
+	def submit(self, src_bytes: bytes, filename: str, params: Dict, kind: str = "generate",
+			explanations: Optional[Dict[int, str]] = None) -> str:
+		"""
+		提交任务，返回任务 ID。
+
+		Args:
+			kind: "generate"（生成讲解并合成）或 "compose"（使用给定讲解仅合成）
+			explanations: kind="compose" 时使用的讲解
+		"""
+		if kind not in ("generate", "compose"):
+			raise ValueError(f"未知的任务类型: {kind}")
+		if kind == "compose" and explanations is None:
+			raise ValueError("compose 任务需要提供讲解")
+		job_id = uuid.uuid4().hex
+		os.makedirs(self.job_dir(job_id), mode=0o700, exist_ok=True)
+		with open(self.source_path(job_id), "wb") as f:
+			f.write(src_bytes)
+		if explanations is not None:
+			with open(self.explanations_path(job_id), "w", encoding="utf-8") as f:
+				json.dump({str(k): v for k, v in explanations.items()}, f, ensure_ascii=False, indent=2)
+		with self._connect() as conn:
+			conn.execute(
+				"INSERT INTO jobs (id, kind, filename, params, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+				(job_id, kind, filename, json.dumps({k: v for k, v in params.items() if k not in SECRET_PARAMS},
+													ensure_ascii=False), QUEUED, time.time()),
+			)
+		return job_id
+
+	def get(self, job_id: str) -> Optional[Dict]:
+		with self._connect() as conn:
+			row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+		return self._to_dict(row) if row else None
+
+	def list_jobs(self, job_ids: Optional[List[str]] = None, limit: int = 100) -> List[Dict]:
+		"""按提交顺序返回任务；job_ids 为 None 时返回最近的 limit 个"""
+		with self._connect() as conn:
+			if job_ids is None:
+				rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+				rows = rows[::-1]
+			elif job_ids:
+				marks = ",".join("?" * len(job_ids))
+				rows = conn.execute(f"SELECT * FROM jobs WHERE id IN ({marks}) ORDER BY created_at", list(job_ids)).fetchall()
+			else:
+				rows = []
+		return [self._to_dict(row) for row in rows]
+
+	def cancel(self, job_id: str) -> bool:
+		"""取消排队中的任务；已开始的任务不受影响。返回是否取消成功"""
+		with self._connect() as conn:
+			cur = conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+							(CANCELLED, time.time(), job_id, QUEUED))
+		return cur.rowcount == 1
+
+	def _to_dict(self, row: sqlite3.Row) -> Dict:
+		job = dict(row)
+		job["params"] = json.loads(job["params"])
+		job["failed_pages"] = json.loads(job["failed_pages"]) if job["failed_pages"] else []
+		job["pdf_path"] = self.output_path(job["id"]) if job["status"] == COMPLETED else None
+		job["json_path"] = self.explanations_path(job["id"]) if job["status"] == COMPLETED else None
+		return job
+
+	# ---- worker 侧 ----
+
+	def claim_next(self, worker_pid: int) -> Optional[Dict]:
+		"""原子地领取最早排队的任务并标记为 running；无任务时返回 None"""
+		now = time.time()
+		with self._connect() as conn:
+			conn.execute("BEGIN IMMEDIATE")
+			row = conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+			if row is None:
+				conn.execute("COMMIT")
+				return None
+			conn.execute(
+				"UPDATE jobs SET status = ?, started_at = ?, heartbeat = ?, worker_pid = ?, message = NULL WHERE id = ?",
+				(RUNNING, now, now, worker_pid, row["id"]),
+			)
+			conn.execute("COMMIT")
+		return self.get(row["id"])
+
+	def update_progress(self, job_id: str, done: int, total: int, message: Optional[str] = None) -> None:
+		with self._connect() as conn:
+			conn.execute("UPDATE jobs SET done = ?, total = ?, message = COALESCE(?, message), heartbeat = ? WHERE id = ?",
+						(done, total, message, time.time(), job_id))
+
+	def set_message(self, job_id: str, message: str) -> None:
+		with self._connect() as conn:
+			conn.execute("UPDATE jobs SET message = ?, heartbeat = ? WHERE id = ?", (message, time.time(), job_id))
+
+	def complete(self, job_id: str, failed_pages: Optional[List[int]] = None, message: Optional[str] = None) -> None:
+		with self._connect() as conn:
+			conn.execute("UPDATE jobs SET status = ?, finished_at = ?, failed_pages = ?, message = COALESCE(?, message) WHERE id = ?",
+						(COMPLETED, time.time(), json.dumps(failed_pages or []), message, job_id))
+
+	def fail(self, job_id: str, error: str) -> None:
+		with self._connect() as conn:
+			conn.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ? AND status = ?",
+						(FAILED, time.time(), error, job_id, RUNNING))
+
+	def touch(self, job_ids: List[str]) -> None:
+		"""刷新运行中任务的心跳（由 worker 主进程定期调用）"""
+		if not job_ids:
+			return
+		marks = ",".join("?" * len(job_ids))
+		with self._connect() as conn:
+			conn.execute(f"UPDATE jobs SET heartbeat = ? WHERE id IN ({marks}) AND status = ?", [time.time(), *job_ids, RUNNING])
+
+	def requeue(self, job_id: str) -> None:
+		"""将运行中的任务放回队列（worker 停止时调用）"""
+		with self._connect() as conn:
+			conn.execute("UPDATE jobs SET status = ?, worker_pid = NULL, done = 0 WHERE id = ? AND status = ?", (QUEUED, job_id, RUNNING))
+
+	def requeue_stale(self, stale_seconds: float = 60) -> int:
+		"""将心跳超时的 running 任务（worker 异常退出）重新放回队列，返回数量"""
+		with self._connect() as conn:
+			cur = conn.execute("UPDATE jobs SET status = ?, worker_pid = NULL WHERE status = ? AND heartbeat < ?",
+							(QUEUED, RUNNING, time.time() - stale_seconds))
+		return cur.rowcount
+
+	def worker_heartbeat(self, pid: int, max_jobs: int, key_fingerprint: Optional[str] = None) -> None:
+		"""刷新 worker 心跳；key_fingerprint 为该 worker 所用 API Key 的指纹（见 key_fingerprint），没有 Key 时为 None"""
+		with self._connect() as conn:
+			conn.execute("INSERT OR REPLACE INTO workers (pid, max_jobs, heartbeat, key_fingerprint) VALUES (?, ?, ?, ?)",
+						(pid, max_jobs, time.time(), key_fingerprint))
+
+	def remove_worker(self, pid: int) -> None:
+		with self._connect() as conn:
+			conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+
+	def live_workers(self, timeout: float = 15) -> List[Dict]:
+		with self._connect() as conn:
+			rows = conn.execute("SELECT * FROM workers WHERE heartbeat >= ?", (time.time() - timeout,)).fetchall()
+		return [dict(row) for row in rows]
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from .job_queue import JobQueue, key_fingerprint
+
+
+# 同一 API Key 同时进行的 LLM 请求数上限（与界面逐个处理文件时相同），由并行任务均分
+MAX_CONCURRENCY = 10
+
+
+def _split_limits(params: Dict, max_jobs: int) -> Dict:
+	"""
+	同一 API Key 的限额在并行任务间均分，保证 worker 整体不超过配置的 RPM/TPM/RPD，
+	同时进行的请求数合计不超过 min(concurrency, MAX_CONCURRENCY)
+	"""
+	params = dict(params)
+	# 快速模型（模型路由）有独立的限额，同样均分；未设置时沿用已均分的强模型限额
+	for key in ("rpm_limit", "tpm_budget", "rpd_limit", "fast_rpm_limit", "fast_tpm_budget", "fast_rpd_limit"):
+		if params.get(key) is not None:
+			params[key] = max(1, int(params[key]) // max_jobs)
+	if "concurrency" in params:
+		params["concurrency"] = max(1, min(int(params["concurrency"]), MAX_CONCURRENCY) // max_jobs)
+	return params
+
+
+def run_job(queue: JobQueue, job: Dict, max_jobs: int = 1) -> None:
+	"""在当前进程中执行单个任务，结果写入任务目录"""
+	from .pdf_session import PdfSession
+
+	job_id = job["id"]
+	params = _split_limits(job["params"], max_jobs)
+	# 源 PDF 从任务目录按路径打开一次，生成与合成共用
+	with PdfSession(queue.source_path(job_id)) as session:
+		is_valid, error = session.validation
+		if not is_valid:
+			raise ValueError(f"PDF文件验证失败: {error}")
+		_run_session(queue, job, params, session)
+
+
+def _run_session(queue: JobQueue, job: Dict, params: Dict, session: "PdfSession") -> None:
+	from . import pdf_processor
+
+	job_id = job["id"]
+	compose_kwargs = dict(
+		font_path=(params.get("cjk_font_path") or None),
+		render_mode=params.get("render_mode", "markdown"),
+		line_spacing=params.get("line_spacing", 1.4),
+		column_padding=params.get("column_padding", 10),
+		engine=params.get("compose_engine", "vector"),
+	)
+	options = pdf_processor.ExplainOptions.from_params(params)
+
+	if job["kind"] == "compose":
+		with open(queue.explanations_path(job_id), "r", encoding="utf-8") as f:
+			explanations = {int(k): str(v) for k, v in json.load(f).items()}
+		queue.update_progress(job_id, 0, 1, "合成中")
+		pdf_processor.compose_pdf(session, explanations, params["right_ratio"], params["font_size"],
+								output=queue.output_path(job_id), **compose_kwargs)
+		queue.update_progress(job_id, 1, 1)
+		queue.complete(job_id, message="合成完成")
+		return
+
+	composer = pdf_processor.StreamingComposer(session, params["right_ratio"], params["font_size"], **compose_kwargs)
+	try:
+		explanations, _previews, failed_pages = pdf_processor.generate_explanations(
+			src_bytes=session,
+			# 任务参数不保存 API Key，由 worker 进程的环境变量提供（见 ensure_worker）
+			api_key=params.get("api_key") or os.getenv("GEMINI_API_KEY"),
+			model_name=params["model_name"],
+			user_prompt=params["user_prompt"],
+			temperature=params["temperature"],
+			max_tokens=params["max_tokens"],
+			dpi=params["dpi"],
+			concurrency=params["concurrency"],
+			rpm_limit=params["rpm_limit"],
+			tpm_budget=params["tpm_budget"],
+			rpd_limit=params["rpd_limit"],
+			on_progress=lambda done, total: queue.update_progress(job_id, done, total),
+			on_log=lambda msg: queue.set_message(job_id, msg),
+			on_page_done=composer.add_page,
+			options=options,
+		)
+	except Exception:
+		composer.close()
+		raise
+	with open(queue.explanations_path(job_id), "w", encoding="utf-8") as f:
+		json.dump({str(k): v for k, v in explanations.items()}, f, ensure_ascii=False, indent=2)
+	composer.finish(explanations, output=queue.output_path(job_id))
+	queue.complete(job_id, failed_pages=failed_pages, message="处理完成")
+
+
+def _job_process(root: str, job_id: str, max_jobs: int) -> None:
+	"""任务子进程入口：每个任务一个进程（PyMuPDF 非线程安全，进程间互不影响）"""
+	queue = JobQueue(root)
+	job = queue.get(job_id)
+	if job is None:
+		return
+	try:
+		run_job(queue, job, max_jobs=max_jobs)
+	except Exception as e:
+		queue.fail(job_id, str(e))
+
+
+def run_worker(root: Optional[str] = None, max_jobs: int = 2, poll_interval: float = 1.0,
+			exit_when_idle: bool = False, split_limits: bool = True) -> None:
+	"""
+	任务 worker 主循环：最多同时运行 max_jobs 个任务子进程，定期刷新心跳。
+
+	Args:
+		exit_when_idle: 队列为空且无运行中任务时退出（用于脚本/测试）
+		split_limits: 并行任务间均分每个任务的 RPM/TPM/RPD 限额
+	"""
+	queue = JobQueue(root)
+	pid = os.getpid()
+	queue.requeue_stale()
+	running: Dict[str, multiprocessing.Process] = {}
+	share = max_jobs if split_limits else 1
+	# 任务子进程从环境变量读取 API Key，心跳中只记录其指纹，供 ensure_worker 比较
+	fingerprint = key_fingerprint(os.getenv("GEMINI_API_KEY"))
+	try:
+		while True:
+			queue.worker_heartbeat(pid, max_jobs, fingerprint)
+			for job_id, proc in list(running.items()):
+				if not proc.is_alive():
+					proc.join()
+					del running[job_id]
+					# 子进程未正常写入结果即退出（崩溃/被杀），标记失败；已完成的任务不受影响
+					queue.fail(job_id, f"任务进程异常退出 (exit code {proc.exitcode})")
+			queue.touch(list(running))
+
+			while len(running) < max_jobs:
+				job = queue.claim_next(pid)
+				if job is None:
+					break
+				proc = multiprocessing.Process(target=_job_process, args=(queue.root, job["id"], share))
+				proc.start()
+				running[job["id"]] = proc
+
+			if exit_when_idle and not running:
+				break
+			time.sleep(poll_interval)
+	finally:
+		for job_id, proc in running.items():
+			proc.terminate()
+			proc.join()
+			queue.requeue(job_id)
+		queue.remove_worker(pid)
+
+
+def ensure_worker(queue: JobQueue, max_jobs: int = 2, api_key: Optional[str] = None) -> bool:
+	"""
+	若没有存活的 worker，则在后台启动一个。返回是否新启动了 worker
+
+	Args:
+		api_key: 通过环境变量 GEMINI_API_KEY 只传给新启动的 worker 进程。已有 worker 时按心跳中的指纹比较，
+			没有一个 worker 使用该 Key 时抛出 ValueError（任务会以 worker 自己的 Key 运行），调用方应拒绝提交
+	"""
+	workers = queue.live_workers()
+	if workers:
+		fingerprint = key_fingerprint(api_key)
+		if fingerprint and all(w["key_fingerprint"] != fingerprint for w in workers):
+			raise ValueError("运行中的后台 worker 使用的 API Key 与当前填写的不同（或没有 Key），"
+							"请停止该 worker（python -m app.services.job_worker）后重新提交")
+		return False
+	cmd = [sys.executable, "-m", "app.services.job_worker", "--root", queue.root, "--jobs", str(max_jobs)]
+	kwargs = {}
+	if api_key:
+		kwargs["env"] = {**os.environ, "GEMINI_API_KEY": api_key}
+	if os.name == "nt":
+		kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+	else:
+		kwargs["start_new_session"] = True
+	project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	subprocess.Popen(cmd, cwd=project_root, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+					stderr=subprocess.DEVNULL, **kwargs)
+	# 等待 worker 注册心跳，避免 UI 重复启动
+	deadline = time.time() + 10
+	while time.time() < deadline and not queue.live_workers():
+		time.sleep(0.2)
+	return True
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="SmartLecturer 后台任务 worker")
+	parser.add_argument("--root", default=None, help="任务目录（默认系统临时目录下 pdf_processor_cache/jobs，或环境变量 JOB_QUEUE_DIR）")
+	parser.add_argument("--jobs", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "2")), help="同时运行的任务数")
+	parser.add_argument("--poll", type=float, default=1.0, help="轮询间隔（秒）")
+	parser.add_argument("--exit-when-idle", action="store_true", help="队列清空后退出")
+	parser.add_argument("--no-split-limits", action="store_true", help="不在并行任务间均分 RPM/TPM/RPD")
+	args = parser.parse_args()
+	# 任务参数中没有 API Key，从环境变量或 .env 读取
+	load_dotenv()
+	# SIGTERM 时走 finally：终止子进程并把运行中的任务放回队列
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+	run_worker(args.root, max_jobs=max(1, args.jobs), poll_interval=args.poll,
+			exit_when_idle=args.exit_when_idle, split_limits=not args.no_split_limits)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Protocol
+
+
+@dataclass
+class LLMResponse:
+	text: str
+	input_tokens: int = 0
+	output_tokens: int = 0
+
+
+class RateLimitError(Exception):
+	"""后端返回 429 / RESOURCE_EXHAUSTED"""
+
+
+class LLMBackend(Protocol):
+	"""
+	单页讲解的模型调用接口。
+
+	后端只负责一次调用；限流、重试与用量统计由 GeminiClient 统一处理，
+	因此替换后端（模拟、录制回放）时调度与限流逻辑保持不变。
+	max_output_tokens 为本次调用的输出上限，temperature 为本次调用的采样温度，None 时使用后端创建时的设置。
+	"""
+
+	name: str
+
+	async def generate(self, image_bytes: bytes, prompt: str, max_output_tokens: Optional[int] = None,
+					temperature: Optional[float] = None) -> LLMResponse:
+		...
+
+
+class GeminiBackend:
+	"""通过 langchain-google-genai 调用 Gemini"""
+
+	def __init__(self, api_key: str, model_name: str, temperature: float, max_output_tokens: int) -> None:
+		# 延迟导入：使用模拟/回放后端时无需安装 langchain 也不需要网络
+		from langchain_google_genai import ChatGoogleGenerativeAI
+
+		self.name = f"gemini:{model_name}"
+		self.max_output_tokens = max_output_tokens
+		self.temperature = temperature
+		self.llm = ChatGoogleGenerativeAI(
+			model=model_name,
+			api_key=api_key,
+			temperature=temperature,
+			max_output_tokens=max_output_tokens,
+		)
+		self._limited: Dict[tuple, object] = {}
+
+	def _llm_for(self, max_output_tokens: Optional[int], temperature: Optional[float] = None):
+		"""
+		按输出上限与温度复制模型实例（共用底层客户端）；上限不低于创建时的设置、温度未改变时直接使用原实例
+		"""
+		update = {}
+		if max_output_tokens and not (self.max_output_tokens and max_output_tokens >= self.max_output_tokens):
+			update["max_output_tokens"] = max_output_tokens
+		if temperature is not None and temperature != self.temperature:
+			update["temperature"] = temperature
+		if not update:
+			return self.llm
+		key = tuple(sorted(update.items()))
+		llm = self._limited.get(key)
+		if llm is None:
+			llm = self._limited[key] = self.llm.model_copy(update=update)
+		return llm
+
+	async def generate(self, image_bytes: bytes, prompt: str, max_output_tokens: Optional[int] = None,
+					temperature: Optional[float] = None) -> LLMResponse:
+		from langchain_core.messages import HumanMessage
+
+		# 将图片字节转为 data URL 以适配 image_url 格式
+		b64 = base64.b64encode(image_bytes).decode("utf-8")
+		content = [
+			{"type": "text", "text": prompt},
+			{"type": "image_url", "image_url": f"data:image/png;base64,{b64}"},
+		]
+		resp = await asyncio.to_thread(self._llm_for(max_output_tokens, temperature).invoke, [HumanMessage(content=content)])
+		text = resp.content if isinstance(resp.content, str) else resp.content[0].text
+		usage = getattr(resp, "usage_metadata", None) or {}
+		return LLMResponse(
+			text=text.strip(),
+			input_tokens=int(usage.get("input_tokens", 0) or 0),
+			output_tokens=int(usage.get("output_tokens", 0) or 0),
+		)
+
+
+class FakeBackend:
+	"""
+	确定性的模拟后端，用于离线压测调度、限流与合成。
+
+	每次调用的延迟、是否返回 429 只由 (seed, 请求内容, 该请求第几次调用) 决定，
+	与并发下的调用先后无关，同样的输入多次运行得到相同的结果。
+
+	Args:
+		latency: 延迟中位数（秒）
+		latency_sigma: 对数正态分布的 sigma，0 为固定延迟；约 1.3 时 p99 接近中位数的 20 倍
+		rate_limit_rate: 返回 429 的概率
+		output_chars: 讲解字数（不受 temperature 影响）
+		image_tokens: 每张图片计入的输入 token
+	"""
+
+	def __init__(self, latency: float = 0.5, latency_sigma: float = 0.5, rate_limit_rate: float = 0.0,
+				output_chars: int = 800, image_tokens: int = 258, seed: int = 0) -> None:
+		self.name = "fake"
+		self.latency = latency
+		self.latency_sigma = latency_sigma
+		self.rate_limit_rate = rate_limit_rate
+		self.output_chars = output_chars
+		self.image_tokens = image_tokens
+		self.seed = seed
+		self.calls = 0
+		self.rate_limited = 0
+		self._attempts: Dict[str, int] = {}
+
+	def _rng(self, image_bytes: bytes, prompt: str) -> random.Random:
+		key = hashlib.md5(image_bytes + prompt.encode("utf-8")).hexdigest()
+		attempt = self._attempts.get(key, 0)
+		self._attempts[key] = attempt + 1
+		return random.Random(f"{self.seed}:{key}:{attempt}")
+
+	async def generate(self, image_bytes: bytes, prompt: str, max_output_tokens: Optional[int] = None,
+					temperature: Optional[float] = None) -> LLMResponse:
+		rng = self._rng(image_bytes, prompt)
+		self.calls += 1
+		delay = self.latency * rng.lognormvariate(0, self.latency_sigma) if self.latency_sigma > 0 else self.latency
+		if rng.random() < self.rate_limit_rate:
+			# 429 通常很快返回
+			await asyncio.sleep(min(delay, self.latency) * 0.1)
+			self.rate_limited += 1
+			raise RateLimitError("429 RESOURCE_EXHAUSTED (simulated)")
+		await asyncio.sleep(delay)
+		sentence = f"第 {rng.randint(1, 999)} 条模拟讲解：Key term 与要点说明。"
+		# 输出上限按 1 字 ≈ 1 token 截断
+		chars = min(self.output_chars, max_output_tokens) if max_output_tokens else self.output_chars
+		text = (sentence * (chars // len(sentence) + 1))[:chars]
+		return LLMResponse(
+			text=text,
+			input_tokens=self.image_tokens + len(prompt) // 2,
+			output_tokens=max(1, chars // 2),
+		)
+
+
+class RecordReplayBackend:
+	"""
+	录制/回放后端：以 (后端名称, 提示词, 图片) 的哈希为键，把真实响应与耗时保存为目录下的 JSON 文件。
+
+	Args:
+		directory: 录制目录
+		backend: 被录制的后端；mode="replay" 时可为 None
+		mode: "record" 总是调用 backend 并保存；"replay" 只读录制，未录制的请求抛出 LookupError；
+			"auto" 有录制则回放，否则调用并保存
+		replay_latency: 回放时按录制的耗时等待，使压测时序接近真实
+		backend_name: 只回放时录制所用后端的名称（如 "gemini:gemini-2.5-pro"），用于区分不同模型的录制；
+			提供 backend 时取 backend.name
+	"""
+
+	def __init__(self, directory: str, backend: Optional[LLMBackend] = None, mode: str = "auto",
+				replay_latency: bool = True, backend_name: Optional[str] = None) -> None:
+		if mode not in ("record", "replay", "auto"):
+			raise ValueError(f"未知的录制模式: {mode}")
+		if mode != "replay" and backend is None:
+			raise ValueError("录制模式需要提供被录制的后端")
+		self.backend_name = backend.name if backend is not None else backend_name
+		self.name = f"replay:{self.backend_name}" if self.backend_name else "replay"
+		self.directory = directory
+		self.backend = backend
+		self.mode = mode
+		self.replay_latency = replay_latency
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(directory, exist_ok=True)
+
+	def _path(self, image_bytes: bytes, prompt: str, max_output_tokens: Optional[int] = None,
+			temperature: Optional[float] = None) -> str:
+		# 只在设置时计入键，未设置时与旧录制兼容
+		limit = f"\0{max_output_tokens}".encode() if max_output_tokens else b""
+		if temperature is not None:
+			limit += f"\0t{temperature:g}".encode()
+		# 不同后端/模型对同一请求的响应不同，按后端名称分开录制
+		name = f"\0b{self.backend_name}".encode("utf-8") if self.backend_name else b""
+		key = hashlib.sha256(name + prompt.encode("utf-8") + limit + b"\0" + image_bytes).hexdigest()[:32]
+		return os.path.join(self.directory, f"{key}.json")
+
+	async def generate(self, image_bytes: bytes, prompt: str, max_output_tokens: Optional[int] = None,
+					temperature: Optional[float] = None) -> LLMResponse:
+		path = self._path(image_bytes, prompt, max_output_tokens, temperature)
+		if self.mode != "record" and os.path.exists(path):
+			with open(path, "r", encoding="utf-8") as f:
+				record = json.load(f)
+			if self.backend_name and record.get("backend", self.backend_name) != self.backend_name:
+				raise LookupError(f"录制来自其他后端 {record['backend']}，当前为 {self.backend_name}: {os.path.basename(path)}")
+			self.hits += 1
+			if self.replay_latency:
+				await asyncio.sleep(record.get("latency", 0.0))
+			return LLMResponse(record["text"], record.get("input_tokens", 0), record.get("output_tokens", 0))
+		if self.mode == "replay":
+			raise LookupError(f"未录制的请求: {os.path.basename(path)}")
+
+		self.misses += 1
+		start = time.perf_counter()
+		# 被录制的后端可能不支持这些参数，只在设置时传入
+		kwargs = {"max_output_tokens": max_output_tokens} if max_output_tokens else {}
+		if temperature is not None:
+			kwargs["temperature"] = temperature
+		resp = await self.backend.generate(image_bytes, prompt, **kwargs)
+		record = {
+			"text": resp.text,
+			"input_tokens": resp.input_tokens,
+			"output_tokens": resp.output_tokens,
+			"latency": round(time.perf_counter() - start, 3),
+			"backend": self.backend.name,
+		}
+		# 同一进程的多个会话线程可能同时录制同一请求，临时文件名需各自唯一
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+		try:
+			with os.fdopen(fd, "w", encoding="utf-8") as f:
+				json.dump(record, f, ensure_ascii=False)
+			os.replace(tmp_path, path)
+		finally:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+		return resp
+
+
+BACKENDS = ("gemini", "fake", "record", "replay")
+
+
+def create_backend(kind: str, api_key: Optional[str] = None, model_name: str = "gemini-2.5-pro",
+				temperature: float = 0.4, max_output_tokens: int = 4096,
+				record_dir: Optional[str] = None, **fake_kwargs) -> LLMBackend:
+	"""
+	按名称创建后端（供命令行与 HTTP 服务的 --backend 选项使用）。
+
+	Args:
+		kind: "gemini" / "fake" / "record"（已录制的请求回放，其余调用 Gemini 并录制）/ "replay"（只回放录制）
+		record_dir: record/replay 使用的录制目录
+		fake_kwargs: 传给 FakeBackend 的参数
+	"""
+	if kind == "fake":
+		return FakeBackend(**fake_kwargs)
+	if kind in ("record", "replay") and not record_dir:
+		raise ValueError(f"{kind} 后端需要指定录制目录")
+	if kind == "replay":
+		# 与录制时 GeminiBackend.name 相同，不同模型的录制互不混用
+		return RecordReplayBackend(record_dir, mode="replay", backend_name=f"gemini:{model_name}")
+	if kind not in ("gemini", "record"):
+		raise ValueError(f"未知的 LLM 后端: {kind}")
+	gemini = GeminiBackend(api_key, model_name, temperature, max_output_tokens)
+	return RecordReplayBackend(record_dir, gemini, mode="auto") if kind == "record" else gemini
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from markdown import Markdown
+
+
+# LaTeX 保护：$$...$$ 转为代码块，$...$ 转为行内代码，避免被 Markdown 解析破坏
+_BLOCK_MATH_RE = re.compile(r"\$\$(.+?)\$\$", flags=re.S)
+_INLINE_MATH_RE = re.compile(r"\$(.+?)\$", flags=re.S)
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables", "toc", "codehilite"]
+
+
+def protect_latex(s: str) -> str:
+	s = _BLOCK_MATH_RE.sub(r"\n```\n\1\n```\n", s)
+	s = _INLINE_MATH_RE.sub(r"`\1`", s)
+	return s
+
+
+@functools.lru_cache(maxsize=64)
+def build_css(font_size: int, line_spacing: float) -> str:
+	"""右栏 HTML 的 CSS，按 (font_size, line_spacing) 只构建一次。"""
+	return f"""
+                /* base reset */
+                body {{ font-size: {font_size}pt; line-height: {line_spacing}; font-family: 'SimHei','Noto Sans SC','Microsoft YaHei',sans-serif; color: #000000; word-wrap: break-word; overflow-wrap: break-word; word-break: break-word; white-space: normal; }}
+                pre, code {{ font-family: 'Consolas','Fira Code',monospace; font-size: {max(8, font_size-1)}pt; color: #000000; }}
+                table {{ border-collapse: collapse; width: 100%; }}
+                th, td {{ border: 1px solid #ccc; padding: 2pt 4pt; color: #000000; }}
+                body, p, h1, h2, h3, h4, h5, h6, ul, ol, pre, table {{ margin: 0; padding: 0; color: #000000; }}
+                ul, ol {{ padding-left: 18pt; list-style-position: inside; }}
+                p {{ margin-bottom: 1pt; }}
+                """
+
+
+class MarkdownRenderer:
+	"""
+	复用单个 Markdown 实例的渲染器，并按讲解文本哈希缓存 HTML。
+
+	相同文本重复合成（重新合成、增量合成、参数调优）时直接命中缓存，跳过 Markdown/Pygments 转换。
+	"""
+
+	def __init__(self, max_entries: int = 4096) -> None:
+		self._md = Markdown(extensions=MARKDOWN_EXTENSIONS)
+		self._cache: "OrderedDict[str, str]" = OrderedDict()
+		self._max_entries = max_entries
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def to_html(self, text: str) -> str:
+		key = hashlib.md5(text.encode("utf-8")).hexdigest()
+		with self._lock:
+			html = self._cache.get(key)
+			if html is not None:
+				self._cache.move_to_end(key)
+				self.hits += 1
+				return html
+			self.misses += 1
+			self._md.reset()
+			html = self._md.convert(protect_latex(text))
+			self._cache[key] = html
+			if len(self._cache) > self._max_entries:
+				self._cache.popitem(last=False)
+			return html
+
+	def clear(self) -> None:
+		with self._lock:
+			self._cache.clear()
+			self.hits = 0
+			self.misses = 0
+
+
+_default_renderer: Optional[MarkdownRenderer] = None
+_default_lock = threading.Lock()
+
+
+def get_renderer() -> MarkdownRenderer:
+	"""进程内共享的渲染器实例。"""
+	global _default_renderer
+	if _default_renderer is None:
+		with _default_lock:
+			if _default_renderer is None:
+				_default_renderer = MarkdownRenderer()
+	return _default_renderer
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+	from .metrics import StageMetrics
+
+
+def rss_bytes() -> Optional[int]:
+	"""
+	当前进程的常驻内存（字节）。
+
+	安装了 psutil 时使用它（跨平台）；否则在 Linux 上读取 /proc/self/statm；都不可用时返回 None。
+	"""
+	try:
+		import psutil
+	except ImportError:
+		psutil = None
+	if psutil is not None:
+		return psutil.Process().memory_info().rss
+	try:
+		with open("/proc/self/statm", "r") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, AttributeError, IndexError):
+		return None
+
+
+class MemoryTracer:
+	"""
+	内存跟踪：tracemalloc（Python 侧分配）加 RSS 采样，记录各阶段与各文件的内存峰值。
+
+	启用后 metrics.timed 在阶段开始与结束时各采样一次，后台线程每 interval 秒再采样一次，
+	样本记入当时所有进行中阶段所属的 StageMetrics（逐文件统计同时记入整批）。
+	停止时保存 tracemalloc 快照中分配最多的代码位置，写入运行报告。
+
+	Args:
+		interval: 后台采样间隔（秒）
+		trace_python: 是否启用 tracemalloc（会拖慢分配密集的代码，只看 RSS 时可关闭）
+		top: 报告中保留的分配最多的代码位置数
+	"""
+
+	def __init__(self, interval: float = 0.05, trace_python: bool = True, top: int = 10,
+				rss: Callable[[], Optional[int]] = rss_bytes) -> None:
+		self.interval = interval
+		self.trace_python = trace_python
+		self.top = top
+		self.rss = rss
+		self.peak_rss = 0
+		self.peak_traced = 0
+		self.top_allocations: List[Dict] = []
+		self._active: Dict[Tuple["StageMetrics", str], int] = {}
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		self._owns_tracemalloc = False
+
+	def start(self) -> MemoryTracer:
+		if self.trace_python and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._owns_tracemalloc = True
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name="memory-tracer", daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		if self._thread is not None:
+			self._stop.set()
+			self._thread.join()
+			self._thread = None
+		self.sample()
+		if tracemalloc.is_tracing():
+			stats = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+			self.top_allocations = [{"location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+									"bytes": s.size, "count": s.count} for s in stats]
+		if self._owns_tracemalloc:
+			tracemalloc.stop()
+			self._owns_tracemalloc = False
+
+	def __enter__(self) -> MemoryTracer:
+		return self.start()
+
+	def __exit__(self, *exc) -> None:
+		self.stop()
+
+	def sample(self) -> Tuple[int, int]:
+		"""采样一次 (RSS, tracemalloc 当前分配)，并记入所有进行中的阶段"""
+		rss = self.rss() or 0
+		traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+		with self._lock:
+			self.peak_rss = max(self.peak_rss, rss)
+			self.peak_traced = max(self.peak_traced, traced)
+			active = list(self._active)
+		for metrics, stage in active:
+			metrics.record_memory(stage, rss, traced)
+		return rss, traced
+
+	def enter(self, metrics: "StageMetrics", stage: str) -> None:
+		with self._lock:
+			self._active[(metrics, stage)] = self._active.get((metrics, stage), 0) + 1
+		self.sample()
+
+	def exit(self, metrics: "StageMetrics", stage: str) -> None:
+		self.sample()
+		with self._lock:
+			count = self._active.pop((metrics, stage), 1) - 1
+			if count > 0:
+				self._active[(metrics, stage)] = count
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self.sample()
+
+	def to_dict(self) -> Dict:
+		return {"peak_rss": self.peak_rss, "peak_traced": self.peak_traced, "top_allocations": self.top_allocations}
+
+
+class MemoryBudget:
+	"""
+	每次运行的内存预算。RSS 达到 limit_bytes × soft_ratio 时视为“接近预算”，流水线据此降级而不是被 OOM 杀掉：
+
+	- 生成讲解时同时持有渲染图片的页数降到 min_render_ahead（render_slot）；
+	- 预览缩略图不再留在内存中，写入 spill_dir 后只返回文件路径（spill）；
+	- 清空 Markdown HTML 缓存并触发一次垃圾回收（relieve）。
+
+	只在生成讲解的事件循环线程中使用。
+
+	Args:
+		limit_bytes: 预算（字节）
+		soft_ratio: 达到预算的该比例即开始降级
+		min_render_ahead: 降级时同时渲染/等待响应的页数上限
+		spill_dir: 落盘目录；为 None 时首次落盘时在系统临时目录下创建，cleanup() 删除
+	"""
+
+	# 两次读取 RSS 的最小间隔（秒）
+	check_interval = 0.1
+	# 降级时等待渲染槽位的轮询间隔（秒）
+	poll_interval = 0.05
+
+	def __init__(self, limit_bytes: int, soft_ratio: float = 0.85, min_render_ahead: int = 2,
+				spill_dir: Optional[str] = None, rss: Callable[[], Optional[int]] = rss_bytes) -> None:
+		self.limit_bytes = int(limit_bytes)
+		self.soft_ratio = soft_ratio
+		self.min_render_ahead = max(1, min_render_ahead)
+		self.spill_dir = spill_dir
+		self.rss = rss
+		self._owns_spill_dir = False
+		self._rendering = 0
+		self._last_check: Optional[float] = None
+		self._pressure = False
+		self._relieved = False
+		# 降级统计：进入紧张状态次数、因预算等待渲染槽位的次数与时间、落盘文件数与字节数
+		self.stats = {"pressure_events": 0, "throttled": 0, "throttle_seconds": 0.0, "spilled": 0, "spilled_bytes": 0,
+					"peak_rss": 0}
+
+	@classmethod
+	def from_mb(cls, megabytes: Optional[float], **kwargs) -> Optional[MemoryBudget]:
+		"""按 MB 创建；megabytes 为空或 0 时不设预算"""
+		return cls(int(megabytes * 1024 * 1024), **kwargs) if megabytes else None
+
+	def under_pressure(self) -> bool:
+		"""RSS 是否已接近预算（结果缓存 check_interval 秒）；无法读取 RSS 时始终为 False"""
+		now = time.monotonic()
+		if self._last_check is not None and now - self._last_check < self.check_interval:
+			return self._pressure
+		self._last_check = now
+		rss = self.rss()
+		if rss is not None:
+			self.stats["peak_rss"] = max(self.stats["peak_rss"], rss)
+		pressure = rss is not None and rss >= self.limit_bytes * self.soft_ratio
+		if pressure and not self._pressure:
+			self.stats["pressure_events"] += 1
+			self._relieved = False
+		self._pressure = pressure
+		if pressure and not self._relieved:
+			self.relieve()
+		return pressure
+
+	@contextlib.asynccontextmanager
+	async def render_slot(self) -> AsyncIterator[None]:
+		"""占用一个渲染槽位：接近预算时最多 min_render_ahead 页同时持有渲染图片，其余页在此等待"""
+		if self._rendering >= self.min_render_ahead and self.under_pressure():
+			self.stats["throttled"] += 1
+			start = time.monotonic()
+			while self._rendering >= self.min_render_ahead and self.under_pressure():
+				await asyncio.sleep(self.poll_interval)
+			self.stats["throttle_seconds"] += time.monotonic() - start
+		self._rendering += 1
+		try:
+			yield
+		finally:
+			self._rendering -= 1
+
+	def spill(self, name: str, data: bytes) -> str:
+		"""把数据写入落盘目录并返回文件路径（文件名加序号前缀，多个文件的同名产物不会互相覆盖）"""
+		if self.spill_dir is None:
+			self.spill_dir = tempfile.mkdtemp(prefix="smartlecturer_spill_")
+			self._owns_spill_dir = True
+		os.makedirs(self.spill_dir, exist_ok=True)
+		path = os.path.join(self.spill_dir, f"{self.stats['spilled']:06d}_{name}")
+		with open(path, "wb") as f:
+			f.write(data)
+		self.stats["spilled"] += 1
+		self.stats["spilled_bytes"] += len(data)
+		return path
+
+	def relieve(self) -> None:
+		"""释放可重建的缓存：Markdown HTML 缓存与循环引用垃圾"""
+		from .markdown_renderer import get_renderer
+
+		self._relieved = True
+		get_renderer().clear()
+		gc.collect()
+
+	def cleanup(self) -> None:
+		"""删除自动创建的落盘目录（其中的预览文件随之失效）"""
+		if self._owns_spill_dir and self.spill_dir:
+			shutil.rmtree(self.spill_dir, ignore_errors=True)
+			self.spill_dir = None
+			self._owns_spill_dir = False
+
+	def to_dict(self) -> Dict:
+		return {"limit_bytes": self.limit_bytes, "soft_ratio": self.soft_ratio,
+				"min_render_ahead": self.min_render_ahead, **self.stats}
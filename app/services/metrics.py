@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+	from .memory import MemoryBudget, MemoryTracer
+
+
+# 各阶段名称与含义（报告与界面按此顺序展示）
+STAGES = {
+	"classify": "本地判定空白/过渡页（classify_page）",
+	"dedup": "查找重复页与逐步展开页（find_duplicates）",
+	"text_layer": "提取文本层并判定文字主导页（text_layer）",
+	"route": "估计页面复杂度并选择模型（page_complexity）",
+	"render_plan": "选择发给 LLM 的图片裁剪区域与 DPI（render_plan）",
+	"render": "渲染页面 PNG（_page_png_bytes）",
+	"wait_for_slot": "等待限流额度（RateLimiter.wait_for_slot）",
+	"explain_page": "生成单页讲解，含限流与重试（explain_page）",
+	"explain_page:fast": "快速模型生成单页讲解（模型路由）",
+	"explain_page:strong": "强模型生成单页讲解（模型路由）",
+	"compose_page": "合成单页（_compose_vector / 加宽引擎）",
+	"save": "保存输出 PDF",
+}
+
+# 计数器名称与含义（跳过/合并的页、节省的请求与 token 等，报告按此顺序展示）
+COUNTERS = {
+	"trivial_pages": "空白/过渡页（本地判定，未单独请求 LLM）",
+	"trivial_batched": "合并为一次请求讲解的过渡页",
+	"dedup_checked_pages": "参与去重检查的页",
+	"duplicate_pages": "与代表页共用讲解的重复页",
+	"buildup_pages": "只讲解新增内容的逐步展开页",
+	"saved_requests": "节省的 LLM 请求数",
+	"saved_tokens": "节省的 token（按限流估算值）",
+	"image_pages": "发给 LLM 的页面图片数",
+	"image_bytes": "发给 LLM 的页面图片总字节数",
+	"image_pixels": "发给 LLM 的页面图片总像素数",
+	"hybrid_pages": "附文本层、发送低分辨率图片的文字主导页",
+	"image_input_pages": "只发送图片的页（文本层辅助模式下图表较多的页）",
+	"hybrid_saved_tokens": "文本层辅助估算节省的输入 token（可为负）",
+	"routed_fast": "路由到快速模型的页",
+	"routed_strong": "路由到强模型的页",
+	"route_overrides": "逐页指定路由的页",
+	"input_tokens": "LLM 输入 token（响应中的用量）",
+	"output_tokens": "LLM 输出 token（响应中的用量）",
+	"budget_chars": "篇幅上限合计（字，按合成排版估算）",
+	"explanation_chars": "设有篇幅上限的页的讲解字数合计",
+	"over_budget_pages": "讲解超出篇幅上限的页",
+	"condense_requests": "请求压缩超长讲解的次数",
+	"condensed_pages": "压缩后采用的讲解",
+	"blank_retries": "空白/过短讲解的即时重试次数",
+	"blank_recovered": "重试后得到有效讲解的页",
+	"request_timeouts": "超过单次调用期限而放弃的 LLM 调用",
+	"hedged_requests": "对冲请求数（慢调用超过阈值后再发的相同请求）",
+	"hedge_wins": "对冲请求先于原请求返回的次数",
+	"hedges_skipped": "因限流额度或 RPD 保留而未发出的对冲",
+	"explained_pages": "合成时绘制讲解的页",
+	"continuation_pages": "合成时生成的续页",
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current: contextvars.ContextVar[Optional["StageMetrics"]] = contextvars.ContextVar("stage_metrics", default=None)
+
+
+def percentile(values: List[float], q: float) -> float:
+	"""最近秩分位数；values 须已排序"""
+	if not values:
+		return 0.0
+	return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class StageMetrics:
+	"""
+	按阶段累计耗时（秒），线程安全。
+
+	Args:
+		parent: 同时记入的上级统计（如单个文件记入整批）
+		max_samples: 每阶段保留用于计算分位数的最近样本数；None 为全部保留。
+			次数、总耗时与最大值始终精确，长期运行的服务用它限制内存
+		tracer: 内存跟踪（MemoryTracer）；为 None 时沿用 parent 的设置
+	"""
+
+	def __init__(self, parent: Optional[StageMetrics] = None, max_samples: Optional[int] = None,
+				tracer: Optional[MemoryTracer] = None) -> None:
+		self.parent = parent
+		self.max_samples = max_samples
+		self.tracer = tracer if tracer is not None else (parent.tracer if parent is not None else None)
+		self._samples: Dict[str, Deque[float]] = {}
+		self._totals: Dict[str, List[float]] = {}  # stage -> [次数, 总耗时, 最大值]
+		self._memory: Dict[str, List[int]] = {}  # stage -> [RSS 峰值, tracemalloc 峰值]
+		self._counters: Dict[str, float] = {}
+		self._lock = threading.Lock()
+
+	def record(self, stage: str, seconds: float) -> None:
+		with self._lock:
+			samples = self._samples.get(stage)
+			if samples is None:
+				samples = self._samples[stage] = deque(maxlen=self.max_samples)
+				self._totals[stage] = [0, 0.0, 0.0]
+			samples.append(seconds)
+			totals = self._totals[stage]
+			totals[0] += 1
+			totals[1] += seconds
+			totals[2] = max(totals[2], seconds)
+		if self.parent is not None:
+			self.parent.record(stage, seconds)
+
+	def add(self, name: str, value: float = 1) -> None:
+		"""累加计数器"""
+		with self._lock:
+			self._counters[name] = self._counters.get(name, 0) + value
+		if self.parent is not None:
+			self.parent.add(name, value)
+
+	def counters(self) -> Dict[str, float]:
+		with self._lock:
+			counters = dict(self._counters)
+		order = [c for c in COUNTERS if c in counters] + sorted(c for c in counters if c not in COUNTERS)
+		return {name: counters[name] for name in order}
+
+	def record_memory(self, stage: str, rss: int, traced: int) -> None:
+		"""记录阶段进行中的一次内存采样（字节），只保留峰值"""
+		with self._lock:
+			peaks = self._memory.setdefault(stage, [0, 0])
+			peaks[0] = max(peaks[0], rss)
+			peaks[1] = max(peaks[1], traced)
+		if self.parent is not None:
+			self.parent.record_memory(stage, rss, traced)
+
+	def memory_peak(self) -> Dict[str, int]:
+		"""各阶段内存峰值中的最大值；未启用内存跟踪时为空"""
+		with self._lock:
+			peaks = list(self._memory.values())
+		if not peaks:
+			return {}
+		return {"peak_rss": max(p[0] for p in peaks), "peak_traced": max(p[1] for p in peaks)}
+
+	def summary(self) -> Dict[str, Dict[str, float]]:
+		"""每个阶段的次数、总耗时、平均值、p50/p95/p99 与最大值；启用内存跟踪时另有 RSS 与 tracemalloc 峰值"""
+		with self._lock:
+			samples = {stage: sorted(values) for stage, values in self._samples.items()}
+			totals = {stage: list(values) for stage, values in self._totals.items()}
+			memory = {stage: list(values) for stage, values in self._memory.items()}
+		order = [s for s in STAGES if s in samples] + sorted(s for s in samples if s not in STAGES)
+		result = {}
+		for stage in order:
+			count, total, longest = totals[stage]
+			result[stage] = {
+				"count": count,
+				"total": round(total, 6),
+				"mean": round(total / count, 6),
+				**{f"p{int(q * 100)}": round(percentile(samples[stage], q), 6) for q in QUANTILES},
+				"max": round(longest, 6),
+			}
+			if stage in memory:
+				result[stage]["peak_rss"], result[stage]["peak_traced"] = memory[stage]
+		return result
+
+
+@contextlib.contextmanager
+def timed(stage: str) -> Iterator[None]:
+	"""
+	把代码块的墙钟耗时记入当前上下文的 StageMetrics；没有启用统计时几乎没有开销。
+
+	也可用作同步函数的装饰器。当前统计保存在 contextvar 中，asyncio 任务、call_soon 回调
+	与 asyncio.to_thread 会继承创建时的上下文，因此并发处理的多个文件各自记入自己的统计。
+	"""
+	metrics = _current.get()
+	if metrics is None:
+		yield
+		return
+	tracer = metrics.tracer
+	if tracer is not None:
+		tracer.enter(metrics, stage)
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		metrics.record(stage, time.perf_counter() - start)
+		if tracer is not None:
+			tracer.exit(metrics, stage)
+
+
+def count(name: str, value: float = 1) -> None:
+	"""累加当前上下文 StageMetrics 的计数器；没有启用统计时不做任何事"""
+	metrics = _current.get()
+	if metrics is not None:
+		metrics.add(name, value)
+
+
+def activate(metrics: Optional[StageMetrics]) -> contextvars.Token:
+	"""在当前上下文启用统计，返回用于 deactivate 的 token"""
+	return _current.set(metrics)
+
+
+def deactivate(token: contextvars.Token) -> None:
+	_current.reset(token)
+
+
+@contextlib.contextmanager
+def use_metrics(metrics: Optional[StageMetrics]) -> Iterator[Optional[StageMetrics]]:
+	token = activate(metrics)
+	try:
+		yield metrics
+	finally:
+		deactivate(token)
+
+
+class RunReport:
+	"""
+	一次批量处理的阶段耗时：整批汇总与逐文件明细，可导出 JSON 与 Prometheus 文本格式。
+
+	Args:
+		tracer: 内存跟踪；传入时各阶段与各文件另记内存峰值（调用方负责 start/stop）
+		budget: 本次运行的内存预算，其降级统计写入报告
+	"""
+
+	def __init__(self, max_samples: Optional[int] = None, tracer: Optional[MemoryTracer] = None,
+				budget: Optional[MemoryBudget] = None) -> None:
+		self.batch = StageMetrics(max_samples=max_samples, tracer=tracer)
+		self.tracer = tracer
+		self.budget = budget
+		self.files: Dict[str, StageMetrics] = {}
+		self.started_at = time.time()
+		self._start = time.perf_counter()
+		self.elapsed = 0.0
+
+	def file(self, name: str) -> StageMetrics:
+		"""某个文件的统计（同时记入整批）"""
+		if name not in self.files:
+			self.files[name] = StageMetrics(parent=self.batch)
+		return self.files[name]
+
+	def finish(self) -> RunReport:
+		self.elapsed = time.perf_counter() - self._start
+		return self
+
+	def to_dict(self) -> Dict:
+		result = {
+			"started_at": self.started_at,
+			"elapsed": round(self.elapsed or time.perf_counter() - self._start, 3),
+			"stages": self.batch.summary(),
+			"files": {name: metrics.summary() for name, metrics in self.files.items()},
+		}
+		counters = self.batch.counters()
+		if counters:
+			result["counters"] = counters
+			result["file_counters"] = {name: metrics.counters() for name, metrics in self.files.items()}
+			ratios = {name: dedup_ratio(values) for name, values in result["file_counters"].items()}
+			if any(ratio is not None for ratio in ratios.values()):
+				result["dedup_ratio"] = {"total": dedup_ratio(counters), "files": ratios}
+			if counters.get("explained_pages"):
+				result["continuation_rate"] = continuation_rate(counters)
+				result["output_tokens_per_page"] = output_tokens_per_page(counters)
+		if self.tracer is not None or self.budget is not None:
+			result["memory"] = self.memory()
+		return result
+
+	def memory(self) -> Dict:
+		"""内存峰值（整体与逐文件）、分配最多的代码位置与预算降级统计"""
+		result: Dict = {}
+		if self.tracer is not None:
+			result.update(self.tracer.to_dict())
+			result["files"] = {name: metrics.memory_peak() for name, metrics in self.files.items()}
+		if self.budget is not None:
+			result["budget"] = self.budget.to_dict()
+		return result
+
+	def to_json(self) -> str:
+		return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+	def to_prometheus(self, prefix: str = "smartlecturer") -> str:
+		"""
+		Prometheus 文本格式：每阶段一个 summary（分位数、_sum、_count）。
+
+		整批序列带 scope="batch"，逐文件序列带 scope="file" 与 file 标签；整批已包含各文件，
+		聚合时需按 scope 筛选（如 sum by (stage) (...{scope="file"})），否则每个文件会被计入两次。
+		"""
+		name = f"{prefix}_stage_seconds"
+		lines = [
+			f"# HELP {name} Wall time per pipeline stage in seconds.",
+			f"# TYPE {name} summary",
+		]
+		scopes = [({"scope": "batch"}, self.batch.summary())] + \
+			[({"scope": "file", "file": f}, m.summary()) for f, m in self.files.items()]
+		for labels, summary in scopes:
+			for stage, stats in summary.items():
+				base = {**labels, "stage": stage}
+				for q in QUANTILES:
+					lines.append(f"{name}{_labels({**base, 'quantile': str(q)})} {stats[f'p{int(q * 100)}']}")
+				lines.append(f"{name}_sum{_labels(base)} {stats['total']}")
+				lines.append(f"{name}_count{_labels(base)} {stats['count']}")
+		if self.tracer is not None:
+			mem = f"{prefix}_stage_peak_rss_bytes"
+			lines.append(f"# HELP {mem} Peak resident memory observed while a stage was running.")
+			lines.append(f"# TYPE {mem} gauge")
+			for labels, summary in scopes:
+				for stage, stats in summary.items():
+					if "peak_rss" in stats:
+						lines.append(f"{mem}{_labels({**labels, 'stage': stage})} {stats['peak_rss']}")
+		counters = [(labels, metrics.counters()) for labels, metrics in
+					[({"scope": "batch"}, self.batch)] + [({"scope": "file", "file": f}, m) for f, m in self.files.items()]]
+		for counter in dict.fromkeys(c for _, values in counters for c in values):
+			total = f"{prefix}_{counter}_total"
+			lines.append(f"# HELP {total} {COUNTERS.get(counter, counter)}")
+			lines.append(f"# TYPE {total} counter")
+			for labels, values in counters:
+				if counter in values:
+					lines.append(f"{total}{_labels(labels)} {values[counter]}")
+		lines.append(f"# HELP {prefix}_run_seconds Wall time of the whole run in seconds.")
+		lines.append(f"# TYPE {prefix}_run_seconds gauge")
+		lines.append(f"{prefix}_run_seconds {self.to_dict()['elapsed']}")
+		return "\n".join(lines) + "\n"
+
+
+def dedup_ratio(counters: Dict[str, float]) -> Optional[float]:
+	"""重复页占参与去重检查页数的比例；未做去重检查时为 None"""
+	checked = counters.get("dedup_checked_pages")
+	if not checked:
+		return None
+	return round(counters.get("duplicate_pages", 0) / checked, 4)
+
+
+def continuation_rate(counters: Dict[str, float]) -> Optional[float]:
+	"""平均每个绘制讲解的页生成的续页数；没有合成时为 None"""
+	explained = counters.get("explained_pages")
+	if not explained:
+		return None
+	return round(counters.get("continuation_pages", 0) / explained, 4)
+
+
+def output_tokens_per_page(counters: Dict[str, float]) -> Optional[float]:
+	"""平均每个绘制讲解的页的 LLM 输出 token；没有合成时为 None"""
+	explained = counters.get("explained_pages")
+	if not explained:
+		return None
+	return round(counters.get("output_tokens", 0) / explained, 1)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+	def escape(value: str) -> str:
+		return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+	return "{" + ",".join(f'{k}="{escape(str(v))}"' for k, v in labels.items()) + "}"
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+
+_SPACE_RE = re.compile(r"\s+")
+
+# 过渡页在本地生成的讲解：空白页不写讲解，有少量文字的页只注明标题
+BLANK_NOTE = ""
+TRIVIAL_NOTE = "（过渡页：{text}）"
+
+
+def pixel_std(page: fitz.Page, size: int = 48) -> float:
+	"""把页面缩小到长边 size 像素的灰度图，返回像素值的标准差（0~255）；纯色页接近 0"""
+	zoom = size / max(page.rect.width, page.rect.height, 1)
+	pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+	samples = pix.samples
+	if not samples:
+		return 0.0
+	n = len(samples)
+	mean = sum(samples) / n
+	return (sum((v - mean) ** 2 for v in samples) / n) ** 0.5
+
+
+def classify_page(page: fitz.Page, max_chars: int = 40, max_drawings: int = 4,
+				max_pixel_std: float = 40.0) -> Optional[str]:
+	"""
+	本地判定无需完整讲解的页面：
+
+	- "blank"：没有文字和图片，矢量图形不超过 max_drawings（如只有边框），缩略图近乎纯色；
+	- "trivial"：文字不超过 max_chars 个（章节分隔页、“Questions?”），没有图片，矢量图形与缩略图变化都很少；
+	- None：正常内容页。
+
+	先检查最便宜的文本层，文字较多的页不再提取矢量图形或渲染缩略图。
+	"""
+	chars = len(_SPACE_RE.sub("", page.get_text("text")))
+	if chars > max_chars or page.get_images(full=False):
+		return None
+	if len(page.get_drawings()) > max_drawings:
+		return None
+	std = pixel_std(page)
+	if chars == 0 and std < 2.0:
+		return "blank"
+	return "trivial" if std <= max_pixel_std else None
+
+
+def trivial_note(page: fitz.Page) -> str:
+	"""过渡页的本地讲解"""
+	text = _SPACE_RE.sub(" ", page.get_text("text")).strip()
+	return TRIVIAL_NOTE.format(text=text) if text else BLANK_NOTE
+
+
+def contact_sheet(doc: fitz.Document, pages: Sequence[int], width: int = 320, columns: int = 3) -> bytes:
+	"""把多页渲染为长边 width 像素的缩略图，按页序拼成一张 PNG（供一次请求讲解多页）"""
+	thumbs = []
+	for pno in pages:
+		page = doc.load_page(pno)
+		zoom = width / max(page.rect.width, page.rect.height, 1)
+		pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+		thumbs.append(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+	cell_w = max(t.width for t in thumbs)
+	cell_h = max(t.height for t in thumbs)
+	rows = (len(thumbs) + columns - 1) // columns
+	sheet = Image.new("RGB", (cell_w * min(columns, len(thumbs)), cell_h * rows), "white")
+	for k, thumb in enumerate(thumbs):
+		sheet.paste(thumb, ((k % columns) * cell_w, (k // columns) * cell_h))
+	bio = io.BytesIO()
+	sheet.save(bio, format="PNG")
+	return bio.getvalue()
+
+
+def batch_prompt(user_prompt: str, pages: Sequence[int]) -> str:
+	"""合并讲解多张过渡页的提示词；图片中按从左到右、从上到下的顺序排列"""
+	numbers = "、".join(str(p + 1) for p in pages)
+	return (f"{user_prompt}\n\n图片按从左到右、从上到下依次为第 {numbers} 页，都是标题页或过渡页。"
+			"请为每页写一两句简短讲解，只输出一个 JSON 对象，键为页码（数字字符串），值为该页讲解。")
+
+
+def parse_batch_response(text: str, pages: Sequence[int]) -> Dict[int, str]:
+	"""解析合并请求的 JSON 响应，返回 {页号(0 起): 讲解}；无法解析的页不出现在结果中"""
+	match = re.search(r"\{.*\}", text or "", flags=re.S)
+	if not match:
+		return {}
+	try:
+		data = json.loads(match.group(0))
+	except ValueError:
+		return {}
+	if not isinstance(data, dict):
+		return {}
+	wanted = set(pages)
+	result: Dict[int, str] = {}
+	for key, value in data.items():
+		try:
+			pno = int(str(key).strip().lstrip("第").rstrip("页")) - 1
+		except ValueError:
+			continue
+		if pno in wanted and isinstance(value, str) and value.strip():
+			result[pno] = value.strip()
+	return result
+
+
+def chunks(items: List[int], size: int) -> List[List[int]]:
+	return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+@dataclass
+class DuplicatePages:
+	"""
+	重复页分组结果。
+
+	shared: 页 -> 代表页；两页文字相同、缩略图的差异哈希相近（重复的目录页、同一页的副本），直接共用代表页的讲解
+	buildup: 页 -> (上一页, 新增文字)；本页在上一页的全部文字之上逐条增加内容（动画逐步展开），只需讲解新增部分
+	"""
+	shared: Dict[int, int] = field(default_factory=dict)
+	buildup: Dict[int, Tuple[int, str]] = field(default_factory=dict)
+
+
+def dhash(page: fitz.Page, size: int = 16) -> int:
+	"""
+	差异哈希（dHash）：渲染长边 64 像素的灰度缩略图，缩放到 (size+1)×size 后逐行比较相邻像素，
+	得到 size×size 位的整数；版式与明暗分布相近的页面汉明距离小
+	"""
+	zoom = 64 / max(page.rect.width, page.rect.height, 1)
+	pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+	img = Image.frombytes("L", (pix.width, pix.height), pix.samples).resize((size + 1, size), Image.BILINEAR)
+	px = img.tobytes()
+	bits = 0
+	for y in range(size):
+		row = px[y * (size + 1):(y + 1) * (size + 1)]
+		for x in range(size):
+			bits = (bits << 1) | (row[x] > row[x + 1])
+	return bits
+
+
+def text_lines(page: fitz.Page) -> List[str]:
+	"""文本层按行切分，合并行内空白，去掉空行"""
+	return [line for line in (_SPACE_RE.sub(" ", s).strip() for s in page.get_text("text").splitlines()) if line]
+
+
+def find_duplicates(doc: fitz.Document, pages: Sequence[int], max_distance: int = 10,
+					buildup: bool = False, min_buildup_chars: int = 20) -> DuplicatePages:
+	"""
+	在 pages 中查找重复页与逐步展开的页。
+
+	重复页：文字（含图片数）与之前某个代表页相同，且 dHash 汉明距离不超过 max_distance（256 位中）；
+	代表页取该组中页号最小的页。buildup 为 True 时，若某页包含上一页（须为已处理页，且至少 min_buildup_chars 字）
+	的全部文字行并有新增行，则记为展开页。
+	"""
+	result = DuplicatePages()
+	representatives: Dict[str, List[Tuple[int, int]]] = {}  # 文字指纹 -> [(dHash, 代表页)]
+	prev: Optional[Tuple[int, List[str]]] = None
+	for pno in pages:
+		page = doc.load_page(pno)
+		lines = text_lines(page)
+		key = hashlib.md5(("\n".join(lines) + f"|{len(page.get_images(full=False))}").encode("utf-8")).hexdigest()
+		h = dhash(page)
+		match = next((rep for rh, rep in representatives.get(key, []) if (rh ^ h).bit_count() <= max_distance), None)
+		if match is not None:
+			result.shared[pno] = match
+		else:
+			representatives.setdefault(key, []).append((h, pno))
+			if buildup and prev is not None and prev[0] == pno - 1:
+				prev_lines = prev[1]
+				remaining = list(lines)
+				if sum(len(s) for s in prev_lines) >= min_buildup_chars and all(_take(remaining, s) for s in prev_lines) and remaining:
+					result.buildup[pno] = (pno - 1, "\n".join(remaining))
+		prev = (pno, lines)
+	return result
+
+
+def _take(lines: List[str], line: str) -> bool:
+	"""从 lines 中移除一个 line，返回是否存在"""
+	try:
+		lines.remove(line)
+	except ValueError:
+		return False
+	return True
+
+
+def buildup_prompt(user_prompt: str, prev_pno: int, new_text: str) -> str:
+	"""逐步展开页的提示词：只讲解相对上一页新增的内容"""
+	return (f"{user_prompt}\n\n本页是第 {prev_pno + 1} 页逐步展开后的版本，第 {prev_pno + 1} 页已单独讲解。"
+			f"请只讲解本页新增的以下内容，简明扼要，不要重复已讲过的部分：\n{new_text}")
+
+
+@dataclass
+class RenderPlan:
+	"""发给 LLM 的页面图片的渲染方式：裁剪区域与 DPI"""
+	clip: fitz.Rect
+	dpi: int
+	min_font: Optional[float] = None
+	small_figures: bool = False
+
+
+def content_bbox(page: fitz.Page, margin: float = 12.0) -> fitz.Rect:
+	"""
+	页面内容的外接矩形（文字、图片与矢量图形），四周留 margin 后与页面求交；没有内容时返回整页。
+
+	覆盖页面 90% 以上面积的填充（整页背景色）不计入，否则背景会让裁剪失效。
+	"""
+	area = abs(page.rect)
+	bbox: Optional[fitz.Rect] = None
+	for kind, rect in page.get_bboxlog():
+		rect = fitz.Rect(rect) & page.rect
+		if rect.is_empty or (kind.startswith("fill") and abs(rect) > 0.9 * area):
+			continue
+		bbox = rect if bbox is None else bbox | rect
+	if bbox is None:
+		return fitz.Rect(page.rect)
+	return (bbox + (-margin, -margin, margin, margin)) & page.rect
+
+
+def min_font_size(page: fitz.Page) -> Optional[float]:
+	"""文本层中最小的字号（pt），忽略空白；没有文字时为 None"""
+	sizes = [span["size"] for block in page.get_text("dict")["blocks"] for line in block.get("lines", [])
+			for span in line["spans"] if span["text"].strip()]
+	return min(sizes) if sizes else None
+
+
+def render_plan(page: fitz.Page, dpi: int, min_dpi: int = 96, max_dpi: int = 220, crop: bool = True,
+				target_px: float = 20.0, small_figure_ratio: float = 0.25, figure_dpi: int = 150) -> RenderPlan:
+	"""
+	按页面内容选择渲染区域与 DPI：
+
+	- crop 为 True 时裁去内容外接矩形之外的空白边距；
+	- 有文字时按最小字号选 DPI，使最小的字渲染后约 target_px 像素高（字号 s pt 在 d DPI 下为 s×d/72 像素）；
+	- 有显示尺寸小于页宽 small_figure_ratio 的图片（小图、公式截图）时 DPI 至少为 figure_dpi；
+	- 没有文字（如扫描页）时沿用全局 dpi；结果限制在 [min_dpi, max_dpi] 内。
+	"""
+	clip = content_bbox(page) if crop else fitz.Rect(page.rect)
+	smallest = min_font_size(page)
+	small_figures = any(fitz.Rect(info["bbox"]).width < page.rect.width * small_figure_ratio
+						for info in page.get_image_info())
+	chosen = dpi if smallest is None else 72.0 * target_px / smallest
+	if small_figures:
+		chosen = max(chosen, figure_dpi)
+	return RenderPlan(clip=clip, dpi=int(round(min(max(chosen, min_dpi), max_dpi))), min_font=smallest,
+					small_figures=small_figures)
+
+
+def text_layer(page: fitz.Page, min_chars: int = 200, max_image_ratio: float = 0.15, max_drawings: int = 60,
+			max_chars: int = 6000) -> Optional[str]:
+	"""
+	文字主导的页返回其文本层（逐行合并空白，超过 max_chars 截断），否则返回 None。
+
+	文字主导：去掉空白后至少 min_chars 个字，图片显示面积不超过页面的 max_image_ratio，
+	矢量图形不超过 max_drawings 个（图表、示意图多的页仍需要清晰的图片）。
+	"""
+	lines = text_lines(page)
+	if sum(len(_SPACE_RE.sub("", s)) for s in lines) < min_chars:
+		return None
+	area = abs(page.rect) or 1
+	if sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info()) > max_image_ratio * area:
+		return None
+	if len(page.get_drawings()) > max_drawings:
+		return None
+	return "\n".join(lines)[:max_chars]
+
+
+def hybrid_prompt(user_prompt: str, text: str) -> str:
+	"""文字主导页的提示词：附上文本层，图片只是低分辨率的版式参考"""
+	return (f"{user_prompt}\n\n本页文字已从 PDF 文本层提取如下；所附图片为低分辨率缩略图，仅用于参考版式与图示，"
+			f"文字以下文为准：\n{text}")
+
+
+# 公式常见字符与数学字体（Computer Modern、STIX、Cambria Math 等）
+_MATH_CHARS = set("∑∏∫∮√∞∂∇≤≥≠≈≡∝∈∉⊂⊆∪∩∀∃→⇒⇔±×÷·αβγδεζηθλμνξπρστφχψωΓΔΘΛΞΠΣΦΨΩ")
+_MATH_FONT_RE = re.compile(r"CMMI|CMSY|CMEX|MSBM|Math|STIX|Symbol", re.I)
+
+ROUTES = ("fast", "strong")
+
+
+@dataclass
+class PageComplexity:
+	"""页面复杂度的本地估计，用于在快速模型与强模型之间路由"""
+	chars: int = 0
+	formulas: int = 0  # 公式字符与数学字体的文字片段数
+	figures: int = 0  # 显示的图片数；矢量图形很多（图表、示意图）时另计 1
+	table_lines: int = 0  # 水平/竖直线段数（表格线）
+
+	@property
+	def score(self) -> float:
+		"""文字密度、公式、图片与表格各自封顶后求和；标题页与简单列表页通常低于 1"""
+		table = 1.5 if self.table_lines >= 8 else 0.0
+		return round(min(self.chars / 600, 2.0) + min(self.formulas / 4, 3.0) + min(self.figures, 3) + table, 3)
+
+
+def page_complexity(page: fitz.Page, max_drawings: int = 40) -> PageComplexity:
+	result = PageComplexity()
+	for block in page.get_text("dict")["blocks"]:
+		for line in block.get("lines", []):
+			for span in line["spans"]:
+				text = span["text"]
+				result.chars += len(_SPACE_RE.sub("", text))
+				if _MATH_FONT_RE.search(span["font"]) or any(c in _MATH_CHARS for c in text):
+					result.formulas += 1
+	result.figures = len(page.get_image_info())
+	drawings = page.get_drawings()
+	if len(drawings) > max_drawings:
+		result.figures += 1
+	for path in drawings:
+		for item in path["items"]:
+			if item[0] == "l" and (abs(item[1].x - item[2].x) < 0.5 or abs(item[1].y - item[2].y) < 0.5):
+				result.table_lines += 1
+			elif item[0] == "re" and min(item[1].width, item[1].height) < 1.5:
+				result.table_lines += 1
+	return result
+
+
+def parse_route_overrides(spec: Optional[str]) -> Dict[int, str]:
+	"""
+	解析逐页指定的路由，如 "1-3=fast, 7=strong"（页码从 1 起），返回 {页号(0 起): 路由}。
+
+	格式错误时抛出 ValueError。
+	"""
+	overrides: Dict[int, str] = {}
+	for item in (spec or "").split(","):
+		item = item.strip()
+		if not item:
+			continue
+		pages, sep, route = item.partition("=")
+		route = route.strip()
+		if not sep or route not in ROUTES:
+			raise ValueError(f"无法解析的路由指定: {item}（应为 页码=fast 或 页码=strong）")
+		first, _, last = pages.strip().partition("-")
+		try:
+			start, end = int(first), int(last or first)
+		except ValueError:
+			raise ValueError(f"无法解析的页码: {pages.strip()}") from None
+		if start < 1 or end < start:
+			raise ValueError(f"无效的页码范围: {pages.strip()}")
+		for pno in range(start - 1, end):
+			overrides[pno] = route
+	return overrides
+
+
+def length_prompt(user_prompt: str, max_chars: int) -> str:
+	"""附加篇幅上限：讲解排在原页右侧的三栏内，超出的部分会挤到续页"""
+	return (f"{user_prompt}\n\n篇幅要求：本页讲解的排版区域约能容纳 {max_chars} 字，请控制在 {max_chars} 字以内，"
+			"优先保留关键概念与英文关键词，不要写开场白和总结套话。")
+
+
+def condense_prompt(text: str, max_chars: int) -> str:
+	"""把超出篇幅的讲解压缩到 max_chars 字以内"""
+	return (f"下面是对所附页面的讲解，篇幅超出了排版区域。请在不遗漏关键概念与英文关键词的前提下，"
+			f"把它压缩到 {max_chars} 字以内，只输出压缩后的讲解：\n\n{text}")
+
+
+def retry_prompt(user_prompt: str) -> str:
+	"""空白/过短讲解的重试：提醒模型上一次没有给出有效讲解"""
+	return (f"{user_prompt}\n\n注意：上一次对本页的讲解为空或过短。即使本页内容很少，"
+			"也请说明本页的作用与其中的文字、图表，直接输出讲解正文。")
@@ -2,16 +2,32 @@ from __future__ import annotations
 
 import io
 import asyncio
+import hashlib
 import json
 import os
-from typing import Dict, List, Tuple, Optional, Callable
+import time
+import uuid
+import warnings
+from typing import BinaryIO, Dict, List, Tuple, Optional, Callable, Union
 import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields, replace
 
 import fitz  # PyMuPDF
 from PIL import Image
-from markdown import markdown
 
-from .gemini_client import GeminiClient
+from .gemini_client import GeminiClient, estimate_image_tokens, estimate_text_tokens, estimate_tokens
+from .markdown_renderer import build_css, get_renderer
+from .memory import MemoryBudget
+from .page_analysis import (batch_prompt, buildup_prompt, chunks, classify_page, contact_sheet, find_duplicates,
+							condense_prompt, hybrid_prompt, length_prompt, page_complexity, parse_batch_response,
+							parse_route_overrides, render_plan, retry_prompt, text_layer, trivial_note)
+from .metrics import count, timed
+from .pdf_session import PdfSession, check_document, source_digest
+from .progress import ProgressAggregator
+
+# 源 PDF：字节，或已打开的 PdfSession（复用其文档，不再重复解析）
+PdfSource = Union[bytes, PdfSession]
 
 
 # 判空：去除空白与标点等装饰字符后长度是否小于阈值
@@ -24,40 +40,35 @@ def is_blank_explanation(text: Optional[str], min_chars: int = 10) -> bool:
 	return len(s.strip()) < min_chars
 
 
-def validate_pdf_file(pdf_bytes: bytes) -> Tuple[bool, str]:
+def validate_pdf_file(pdf_bytes: PdfSource) -> Tuple[bool, str]:
 	"""
 	验证PDF文件是否有效
 
 	Args:
-		pdf_bytes: PDF文件字节数据
+		pdf_bytes: PDF文件字节数据，或 PdfSession（直接返回打开时的校验结果）
 
 	Returns:
 		(bool, str): (是否有效, 错误信息)
 	"""
+	if isinstance(pdf_bytes, PdfSession):
+		return pdf_bytes.validation
 	try:
 		# 尝试打开PDF文件
 		doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-		# 检查页数
-		if doc.page_count == 0:
-			doc.close()
-			return False, "PDF文件没有页面"
-
-		# 检查第一页是否可以正常访问
-		try:
-			page = doc.load_page(0)
-			if page.rect.width <= 0 or page.rect.height <= 0:
-				doc.close()
-				return False, "PDF页面尺寸无效"
-		except Exception as e:
-			doc.close()
-			return False, f"无法读取PDF页面: {str(e)}"
-
-		doc.close()
-		return True, ""
-
 	except Exception as e:
 		return False, f"PDF文件无效或已损坏: {str(e)}"
+	try:
+		# 检查页数与第一页是否可以正常访问
+		return check_document(doc)
+	finally:
+		doc.close()
+
+
+def _open_source(src: PdfSource) -> Tuple[fitz.Document, bool]:
+	"""打开源 PDF，返回 (文档, 是否需由调用方关闭)；PdfSession 直接复用其文档"""
+	if isinstance(src, PdfSession):
+		return src.require_doc(), False
+	return fitz.open(stream=src, filetype="pdf"), True
 
 def pages_with_blank_explanations(explanations: Dict[int, str], min_chars: int = 10) -> List[int]:
 	return [p for p, t in explanations.items() if is_blank_explanation(t, min_chars)]
@@ -130,82 +141,91 @@ def _smart_text_layout(text: str, column_rects: List[fitz.Rect], font_size: int,
 
 	return text_parts
 
-def _page_png_bytes(doc: fitz.Document, pno: int, dpi: int) -> bytes:
+@timed("render")
+def _page_png_bytes(doc: fitz.Document, pno: int, dpi: int, clip: Optional[fitz.Rect] = None) -> bytes:
 	page = doc.load_page(pno)
 	mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
-	pix = page.get_pixmap(matrix=mat, alpha=False)
+	pix = page.get_pixmap(matrix=mat, clip=clip, alpha=False)
 	return pix.tobytes("png")
 
 
-def _compose_vector(dst_doc: fitz.Document, src_doc: fitz.Document, pno: int,
-    right_ratio: float, font_size: int, explanation: str,
-    font_path: Optional[str] = None,
-    render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10) -> None:
-    spage = src_doc.load_page(pno)
-    w, h = spage.rect.width, spage.rect.height
-
-    # Normalize rotation so layout calculation always works in page coordinates
-    rotation = spage.rotation
-    if rotation != 0:
-        original_rotation = rotation
-        spage.set_rotation(0)
-        w, h = spage.rect.width, spage.rect.height
-
-    new_w, new_h = int(w * 3), h
-    dpage = dst_doc.new_page(width=new_w, height=new_h)
-    dpage.show_pdf_page(fitz.Rect(0, 0, w, h), src_doc, pno)
-
-    if rotation != 0:
-        spage.set_rotation(original_rotation)
-
-    if render_mode == "empty_right":
-        return
-
-    margin_x, margin_y = 25, 40
-    right_start = w + margin_x
-    right_end = new_w - margin_x
-    available_width = max(right_end - right_start, 1)
-    column_spacing = 20
-    max_columns = 3
-
-    fontname = "china"
-    fontfile = None
-    font_available = False
-
+def _llm_image(doc: fitz.Document, pno: int, dpi: int, image_mode: str = "full", min_dpi: int = 96,
+			max_dpi: int = 220, on_log: Optional[Callable[[str], None]] = None) -> bytes:
+	"""
+	渲染发给 LLM 的页面图片。"full" 按全局 dpi 渲染整页；"adaptive" 裁去空白边距并按最小字号、
+	小图选择本页 DPI（见 render_plan）。图片数、字节数与像素数记入计数器，便于比较两种模式的负载。
+	"""
+	clip = None
+	if image_mode == "adaptive":
+		with timed("render_plan"):
+			plan = render_plan(doc.load_page(pno), dpi, min_dpi=min_dpi, max_dpi=max_dpi)
+		dpi, clip = plan.dpi, plan.clip
+	img_bytes = _page_png_bytes(doc, pno, dpi, clip=clip)
+	# PNG 的 IHDR 块：第 16~24 字节为宽、高
+	width, height = int.from_bytes(img_bytes[16:20], "big"), int.from_bytes(img_bytes[20:24], "big")
+	count("image_pages")
+	count("image_bytes", len(img_bytes))
+	count("image_pixels", width * height)
+	if on_log and image_mode == "adaptive":
+		on_log(f"第 {pno + 1} 页图片：DPI {dpi}，{width}×{height} 像素，{len(img_bytes) / 1024:.0f} KB")
+	return img_bytes
+
+
+def _resolve_font(font_path: Optional[str]) -> Tuple[str, Optional[str]]:
+    """校验字体文件，返回 (fontname, fontfile)；不可用时回退到内置 helv。"""
     if font_path:
         try:
             if os.path.exists(font_path) and os.access(font_path, os.R_OK):
-                fontfile = font_path
-                font_available = True
+                return "china", font_path
             else:
                 print(f"警告: 字体文件不存在或不可读: {font_path}，将使用默认字体")
         except Exception as e:
             print(f"警告: 字体文件验证失败: {e}，将使用默认字体")
     else:
         print("信息: 未指定字体文件，将使用默认字体")
+    return "helv", None
+
+
+_MARGIN_X, _MARGIN_Y = 25, 40
+_COLUMN_SPACING = 20
+_MAX_COLUMNS = 3
+# 单个源页最多生成的续页数，防止栏位过小导致无限续页
+_MAX_CONTINUATION_PAGES = 10
+_SPLIT_SEPARATORS = ['，', '。', '；', '：', ',', '.', ';', ':', '\n\n', '\n', ' ']
 
-    if not font_available:
-        fontname = "helv"
-        fontfile = None
+
+def _column_layout(w: float, new_w: float, new_h: float, font_size: int, explanation: str,
+    render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10):
+    """
+    测量与分栏阶段：计算栏位矩形、使用的栏数，并把讲解文本分配到各栏。
+
+    Returns:
+        (column_rects, text_parts, build_rects, capacity):
+        build_rects(count, top_offset) 用于生成续页栏位；capacity 为所用栏位的估算字符容量
+    """
+    right_start = w + _MARGIN_X
+    right_end = new_w - _MARGIN_X
+    available_width = max(right_end - right_start, 1)
+    max_columns = _MAX_COLUMNS
 
     initial_text = explanation or ""
     line_height = font_size * max(1.0, line_spacing)
     bottom_core = int(line_height * 1.25)
     bottom_safe = (min(max(16, bottom_core), 36) if render_mode == "markdown" else 0)
     column_internal_margin = max(column_padding, int(font_size * 1.05))
-    total_spacing = column_spacing * (max_columns - 1)
+    total_spacing = _COLUMN_SPACING * (max_columns - 1)
     column_width = max(1.0, (available_width - total_spacing) / max(max_columns, 1))
 
     def build_rects(count: int, top_offset: float = 0.0):
         if count <= 0:
             return []
-        top = margin_y + top_offset
-        bottom = new_h - margin_y - bottom_safe - 2
+        top = _MARGIN_Y + top_offset
+        bottom = new_h - _MARGIN_Y - bottom_safe - 2
         if bottom <= top:
             bottom = top + max(line_height, font_size)
         rects = []
         for idx in range(count):
-            x_left = right_start + idx * (column_width + column_spacing)
+            x_left = right_start + idx * (column_width + _COLUMN_SPACING)
             x_right = x_left + column_width
             x0 = x_left + column_internal_margin
             x1 = min(x_right, right_end) - column_internal_margin
@@ -235,10 +255,193 @@ def _compose_vector(dst_doc: fitz.Document, src_doc: fitz.Document, pno: int,
             break
 
     column_rects = all_rects[:column_count]
-
-    text_parts = _smart_text_layout(initial_text, column_rects, font_size, fontfile, fontname, render_mode, line_spacing)
+    text_parts = _smart_text_layout(initial_text, column_rects, font_size, None, "", render_mode, line_spacing)
+    return column_rects, text_parts, build_rects, estimated_capacity(column_rects)
+
+
+def layout_char_budget(w: float, h: float, font_size: int, render_mode: str = "text",
+    line_spacing: float = 1.4, column_padding: int = 10, fill: float = 0.85) -> int:
+    """
+    一页讲解在右侧三栏内（不续页）大约能容纳的字数，供生成时限制篇幅。
+
+    栏位与 _column_layout 相同；按中文全角字宽（约等于字号）计算每行字数，
+    乘以 fill 扣除段落末行与标点换行的空白；markdown 模式另按 0.85 折算（标题、列表缩进）。
+    """
+    _rects, _parts, build_rects, _capacity = _column_layout(
+        w, w * 3, h, font_size, "", render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
+    line_height = font_size * max(1.2, line_spacing)
+    total = sum(int(rect.width / font_size) * int(rect.height / line_height) for rect in build_rects(_MAX_COLUMNS))
+    if render_mode == "markdown":
+        total *= 0.85
+    return max(int(total * fill), 0)
+
+
+def _textbox_fits(page: fitz.Page, rect: fitz.Rect, text: str, font_size: int,
+    fontname: str, fontfile: Optional[str]) -> bool:
+    # Shape 未 commit 时不写入页面内容，仅用于测量
+    return page.new_shape().insert_textbox(rect, text, fontsize=font_size, fontname=fontname, fontfile=fontfile, align=0) >= 0
+
+
+def _textbox_fit_length(page: fitz.Page, rect: fitz.Rect, text: str, font_size: int,
+    fontname: str, fontfile: Optional[str]) -> Optional[int]:
+    """
+    按 insert_textbox 的贪心折行规则一次遍历，返回能放进 rect 的最长前缀长度（在行首处截断）。
+    无法模拟（含制表符或字体信息不可用）时返回 None。
+    """
+    if "\t" in text:
+        return None
+    try:
+        xref = page.insert_font(fontname=fontname, fontfile=fontfile)
+        fontdict = fitz.CheckFontInfo(page.parent, xref)[1]
+    except Exception:
+        return None
+    ordering, simple = fontdict["ordering"], fontdict["simple"]
+    ascender, descender = fontdict["ascender"], fontdict["descender"]
+    lheight = font_size * (1.2 if ascender - descender <= 1 else ascender - descender)
+    max_lines = int((rect.height + descender * font_size + fitz.EPSILON) // lheight)
+    if max_lines <= 0:
+        return 0
+
+    if ordering < 0:
+        maxcode = max(ord(c) for c in text) if text else 32
+        glyphs = page.parent.get_char_widths(xref, max(255 if simple else maxcode, 32) + 1)
+        widths = [g[1] for g in glyphs]
+
+        def width(c: str) -> float:
+            code = ord(c)
+            if simple and code > 255:
+                code = 63  # '?'
+            return widths[code] if code < len(widths) else 0.0
+
+        blen = widths[32] * font_size
+    else:
+        width = lambda c: 1.0
+        blen = font_size
+    maxwidth = rect.width
+
+    lines = 0
+    pos = 0
+    text_lines = text.splitlines(keepends=True)
+    for idx, line in enumerate(text_lines):
+        body = line.rstrip("\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+        if idx == len(text_lines) - 1 and not body.strip(" "):
+            # insert_textbox 会丢弃末尾仅含空格的行
+            break
+        lines += 1
+        if lines > max_lines:
+            return pos
+        rest = maxwidth
+        has_content = False
+        word_start = pos
+        for word in body.split(" "):
+            pl_w = sum(width(c) for c in word) * font_size
+            if rest >= pl_w:
+                has_content = True
+                rest -= pl_w + blen
+                word_start += len(word) + 1
+                continue
+            if has_content:
+                lines += 1
+                if lines > max_lines:
+                    return word_start
+            rest = maxwidth
+            if pl_w <= maxwidth:
+                has_content = True
+                rest = maxwidth - pl_w - blen
+                word_start += len(word) + 1
+                continue
+            # 超长单词（如中文整句）逐字折行
+            cur = 0.0
+            for k, c in enumerate(word):
+                wc = width(c)
+                if cur * font_size <= maxwidth - wc * font_size:
+                    cur += wc
+                else:
+                    lines += 1
+                    if lines > max_lines:
+                        return word_start + k
+                    cur = wc
+            has_content = True
+            rest = maxwidth - (cur * font_size + blen)
+            word_start += len(word) + 1
+        pos += len(line)
+    return len(text)
+
+
+def _place_text(page: fitz.Page, rect: fitz.Rect, text: str, font_size: int,
+    fontname: str, fontfile: Optional[str], commit: bool = True) -> str:
+    """
+    写入栏位能容纳的最长前缀（尽量在标点/换行处断开），返回放不下的剩余文本。
+    insert_textbox 在溢出时不会写入任何内容，因此先计算能容纳的长度再写入。
+    """
+    fit_len = _textbox_fit_length(page, rect, text, font_size, fontname, fontfile)
+    if fit_len is None or (fit_len < len(text) and not _textbox_fits(page, rect, text[:fit_len], font_size, fontname, fontfile)):
+        # 无法模拟或模拟与实际不符时，退回二分查找
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _textbox_fits(page, rect, text[:mid], font_size, fontname, fontfile):
+                lo = mid
+            else:
+                hi = mid - 1
+        fit_len = lo
+
+    if fit_len >= len(text):
+        if commit:
+            page.insert_textbox(rect, text, fontsize=font_size, fontname=fontname, fontfile=fontfile, align=0)
+        return ""
+
+    split_pos = fit_len
+    head = text[:fit_len]
+    for sep in _SPLIT_SEPARATORS:
+        pos = head.rfind(sep)
+        if pos > fit_len * 0.7:
+            split_pos = pos + 1
+            break
+    if split_pos > 0 and commit:
+        page.insert_textbox(rect, text[:split_pos], fontsize=font_size, fontname=fontname, fontfile=fontfile, align=0)
+    return text[split_pos:]
+
+
+def _place_html(page: fitz.Page, rect: fitz.Rect, text: str, font_size: int,
+    line_spacing: float, commit: bool = True) -> float:
+    """以 HTML 写入 markdown 栏位（放不下时整体缩小），返回缩放比例（1.0 表示无需缩小）。"""
+    html = get_renderer().to_html(text)
+    css = build_css(font_size, line_spacing)
+    if commit:
+        _, scale = page.insert_htmlbox(rect, html, css=css)
+        return scale
+    # 与 insert_htmlbox 相同的排版，但只测量不绘制
+    story = fitz.Story(html=html, user_css="body {margin:1px;}" + css)
+    more, _ = story.place(fitz.Rect(0, 0, rect.width, rect.height))
+    if not more:
+        return 1.0
+    fit = fitz.Story(html=html, user_css="body {margin:1px;}" + css).fit_scale(fitz.Rect(0, 0, rect.width, rect.height), scale_min=1)
+    return 1 / fit.parameter if fit.big_enough else 0.0
+
+
+def _draw_explanation(dst_doc: fitz.Document, dpage: fitz.Page, pno: int, w: float,
+    new_w: float, new_h: float, font_size: int, explanation: str,
+    fontname: str, fontfile: Optional[str],
+    render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+    insert_at: int = -1, commit: bool = True, stats: Optional[Dict] = None) -> int:
+    """
+    在 dpage 右侧 (x >= w) 的三栏区域写入讲解，放不下的部分依次写入 insert_at 处的续页。
+
+    Args:
+        commit: False 时只测量不绘制，也不新建续页（供 plan_layout 使用）
+        stats: 若提供，写入 columns/capacity/overflow_chars/min_scale 等测量结果
+
+    Returns:
+        新建（或 commit=False 时所需）的续页数量
+    """
+    column_rects, text_parts, build_rects, capacity = _column_layout(
+        w, new_w, new_h, font_size, explanation, render_mode=render_mode,
+        line_spacing=line_spacing, column_padding=column_padding)
+    column_count = len(column_rects)
 
     leftovers = []
+    min_scale = 1.0
     for rect, text_part in zip(column_rects, text_parts):
         if not text_part.strip():
             leftovers.append("")
@@ -246,210 +449,1227 @@ def _compose_vector(dst_doc: fitz.Document, src_doc: fitz.Document, pno: int,
 
         if render_mode == "markdown":
             try:
-                import re as _re
-
-                def protect_latex(s: str) -> str:
-                    s = _re.sub(r"\$\$(.+?)\$\$", r"\n```\n\\1\n```\n", s, flags=_re.S)
-                    s = _re.sub(r"\$(.+?)\$", r"`\\1`", s, flags=_re.S)
-                    return s
-
-                md_text = protect_latex(text_part)
-                html = markdown(md_text, extensions=["fenced_code", "tables", "toc", "codehilite"])
-                css = f"""
-                /* base reset */
-                body {{ font-size: {font_size}pt; line-height: {line_spacing}; font-family: 'SimHei','Noto Sans SC','Microsoft YaHei',sans-serif; color: #000000; word-wrap: break-word; overflow-wrap: break-word; word-break: break-word; white-space: normal; }}
-                pre, code {{ font-family: 'Consolas','Fira Code',monospace; font-size: {max(8, font_size-1)}pt; color: #000000; }}
-                table {{ border-collapse: collapse; width: 100%; }}
-                th, td {{ border: 1px solid #ccc; padding: 2pt 4pt; color: #000000; }}
-                body, p, h1, h2, h3, h4, h5, h6, ul, ol, pre, table {{ margin: 0; padding: 0; color: #000000; }}
-                ul, ol {{ padding-left: 18pt; list-style-position: inside; }}
-                p {{ margin-bottom: 1pt; }}
-                """
-                dpage.insert_htmlbox(rect, html, css=css)
+                min_scale = min(min_scale, _place_html(dpage, rect, text_part, font_size, line_spacing, commit=commit))
                 leftovers.append("")
             except Exception:
-                leftover_len = dpage.insert_textbox(rect, text_part, fontsize=font_size, fontname=fontname, fontfile=fontfile, align=0)
-                if isinstance(leftover_len, (int, float)) and leftover_len > 0:
-                    remaining_chars = int(leftover_len / (font_size * 0.6))
-                    leftovers.append(text_part[-remaining_chars:] if remaining_chars < len(text_part) else "")
-                else:
-                    leftovers.append("")
+                leftovers.append(_place_text(dpage, rect, text_part, font_size, fontname, fontfile, commit=commit))
         else:
-            leftover_len = dpage.insert_textbox(rect, text_part, fontsize=font_size, fontname=fontname, fontfile=fontfile, align=0)
-            if isinstance(leftover_len, (int, float)) and leftover_len > 0:
-                remaining_chars = int(leftover_len / (font_size * 0.6))
-                leftovers.append(text_part[-remaining_chars:] if remaining_chars < len(text_part) else "")
-            else:
-                leftovers.append("")
+            leftovers.append(_place_text(dpage, rect, text_part, font_size, fontname, fontfile, commit=commit))
+
+    if stats is not None:
+        stats.update({
+            "columns": column_count,
+            "chars": len(explanation or ""),
+            "capacity": capacity,
+            "overflow_chars": sum(len(t) for t in leftovers),
+            "min_scale": min_scale,
+        })
+
+    header_h = int(font_size * 1.4)
+    continue_rects = build_rects(column_count, top_offset=header_h)
+    n_continuation = 0
+    while any(leftovers) and n_continuation < _MAX_CONTINUATION_PAGES:
+        if commit:
+            cpage = dst_doc.new_page(pno=insert_at, width=new_w, height=new_h)
+            if insert_at >= 0:
+                insert_at += 1
+            header = f"第 {pno + 1} 页讲解 - 续"
+            cpage.insert_text(fitz.Point(w + _MARGIN_X, _MARGIN_Y), header, fontsize=font_size, fontname=fontname, fontfile=fontfile)
+        else:
+            cpage = dpage
+        n_continuation += 1
+        remaining = [
+            _place_text(cpage, rect, leftover_text, font_size, fontname, fontfile, commit=commit) if leftover_text else ""
+            for rect, leftover_text in zip(continue_rects, leftovers)
+        ]
+        if remaining == leftovers:
+            # 栏位连一行都放不下，继续续页没有意义
+            break
+        leftovers = remaining
+    if stats is not None:
+        stats["dropped_chars"] = sum(len(t) for t in leftovers)
+    if commit:
+        count("explained_pages")
+        count("continuation_pages", n_continuation)
+    return n_continuation
 
-    has_overflow = any(len(leftover) > 0 for leftover in leftovers)
-    if has_overflow:
-        cpage = dst_doc.new_page(width=new_w, height=new_h)
-        header = f"第 {pno + 1} 页讲解 - 续"
-        cpage.insert_text(fitz.Point(w + margin_x, margin_y), header, fontsize=font_size, fontname=fontname, fontfile=fontfile)
 
-        header_h = int(font_size * 1.4)
-        continue_rects = build_rects(column_count, top_offset=header_h)
-        for rect, leftover_text in zip(continue_rects, leftovers):
-            if leftover_text:
-                cpage.insert_textbox(rect, leftover_text, fontsize=font_size, fontname=fontname, fontfile=fontfile, align=0)
+@timed("compose_page")
+def _compose_vector(dst_doc: fitz.Document, src_doc: fitz.Document, pno: int,
+    right_ratio: float, font_size: int, explanation: str,
+    font_path: Optional[str] = None,
+    render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10) -> int:
+    """逐页引擎：新建 3 倍宽页面并以 show_pdf_page 嵌入原页。返回写入的页数（含续页）。"""
+    spage = src_doc.load_page(pno)
+    w, h = spage.rect.width, spage.rect.height
 
+    # Normalize rotation so layout calculation always works in page coordinates
+    rotation = spage.rotation
+    if rotation != 0:
+        original_rotation = rotation
+        spage.set_rotation(0)
+        w, h = spage.rect.width, spage.rect.height
+
+    new_w, new_h = int(w * 3), h
+    dpage = dst_doc.new_page(width=new_w, height=new_h)
+    dpage.show_pdf_page(fitz.Rect(0, 0, w, h), src_doc, pno)
+
+    if rotation != 0:
+        spage.set_rotation(original_rotation)
+
+    if render_mode == "empty_right":
+        return 1
+
+    fontname, fontfile = _resolve_font(font_path)
+    return 1 + _draw_explanation(dst_doc, dpage, pno, w, new_w, new_h, font_size, explanation,
+        fontname, fontfile, render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
+
+
+_BOX_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)")
+
+
+def _add_contents(doc: fitz.Document, page: fitz.Page, prefix: bytes, suffix: bytes) -> None:
+    """在页面内容流数组的首尾各加一个新内容流（只用公开的 xref 接口，不读取、不重写原内容流）"""
+    xrefs = []
+    for data in (prefix, suffix):
+        xref = doc.get_new_xref()
+        doc.update_object(xref, "<<>>")
+        doc.update_stream(xref, data)
+        xrefs.append(xref)
+    refs = [xrefs[0], *page.get_contents(), xrefs[1]]
+    doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{x} 0 R" for x in refs) + "]")
+
+
+def _widen_page(doc: fitz.Document, page: fitz.Page, factor: int = 3) -> Tuple[float, float]:
+    """
+    将已复制的页面原地加宽：取消旋转，MediaBox/CropBox 向右扩展为 factor 倍，
+    并以裁剪路径限定原内容，避免 CropBox 外的内容露出到新区域。
+
+    Returns:
+        (w, h): 原页面（未旋转）的宽高
+    """
+    if page.rotation != 0:
+        page.set_rotation(0)
+    kind, value = doc.xref_get_key(page.xref, "CropBox")
+    if kind != "array":
+        kind, value = doc.xref_get_key(page.xref, "MediaBox")
+    nums = [float(v) for v in _BOX_RE.findall(value)]
+    if len(nums) != 4:
+        r = page.rect
+        nums = [0.0, 0.0, r.width, r.height]
+    x0, x1 = min(nums[0], nums[2]), max(nums[0], nums[2])
+    y0, y1 = min(nums[1], nums[3]), max(nums[1], nums[3])
+    w, h = x1 - x0, y1 - y0
+    # 与逐页引擎一致：新宽度取整
+    new_x1 = x0 + int(w * factor)
+
+    page.wrap_contents()
+    _add_contents(doc, page, f"q {x0:g} {y0:g} {w:g} {h:g} re W n\n".encode(), b"\nQ\n")
+
+    box = f"[{x0:g} {y0:g} {new_x1:g} {y1:g}]"
+    doc.xref_set_key(page.xref, "MediaBox", box)
+    doc.xref_set_key(page.xref, "CropBox", box)
+    for key in ("TrimBox", "BleedBox", "ArtBox"):
+        doc.xref_set_key(page.xref, key, "null")
+    return w, h
+
+
+def _compose_widen(src_doc: fitz.Document, explanations: Dict[int, str], font_size: int,
+    font_path: Optional[str] = None,
+    render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+    from_page: int = 0, to_page: int = -1) -> Tuple[fitz.Document, List[int]]:
+    """
+    加宽引擎：一次 insert_pdf 复制全部原页，再把每页 MediaBox 加宽到 3 倍并在新区域写入讲解。
+    原页内容与资源不再被包装成逐页 Form XObject，保存时也无需大量去重。
+
+    Returns:
+        (dst_doc, counts): 合成文档，以及每个源页对应的输出页数（含续页）
+    """
+    if to_page < 0:
+        to_page = src_doc.page_count - 1
+    dst_doc = fitz.open()
+    dst_doc.insert_pdf(src_doc, from_page=from_page, to_page=to_page)
+    fontname, fontfile = (None, None)
+    if render_mode != "empty_right":
+        fontname, fontfile = _resolve_font(font_path)
+
+    counts: List[int] = []
+    index = 0
+    for pno in range(from_page, to_page + 1):
+        n = _widen_and_draw(dst_doc, index, pno, explanations.get(pno, ""), font_size, fontname, fontfile,
+            render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
+        index += n
+        counts.append(n)
+    return dst_doc, counts
+
+
+@timed("compose_page")
+def _widen_and_draw(dst_doc: fitz.Document, index: int, pno: int, explanation: str, font_size: int,
+    fontname: Optional[str], fontfile: Optional[str],
+    render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10) -> int:
+    """加宽 dst_doc 第 index 页（源页 pno 的副本）并写入讲解，返回该源页占用的输出页数（含续页）。"""
+    dpage = dst_doc.load_page(index)
+    w, h = _widen_page(dst_doc, dpage)
+    extra = 0
+    if render_mode != "empty_right":
+        new_w, new_h = int(w * 3), h
+        extra = _draw_explanation(dst_doc, dpage, pno, w, new_w, new_h, font_size,
+            explanation, fontname, fontfile, render_mode=render_mode,
+            line_spacing=line_spacing, column_padding=column_padding, insert_at=index + 1)
+    return 1 + extra
+
+
+def _preview_png(doc: fitz.Document, pno: int, size: int = 1024) -> bytes:
+	"""直接按长边 size 像素渲染预览（不经 LLM 输入图），用于本地处理、不渲染高 DPI 图片的页"""
+	page = doc.load_page(pno)
+	zoom = size / max(page.rect.width, page.rect.height, 1)
+	return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes("png")
 
 
 async def _process_one(pno: int, src_doc: fitz.Document, dpi: int, client: GeminiClient,
-					system_prompt: str, right_ratio: float, font_size: int) -> Tuple[int, Optional[str], bytes, Optional[Exception]]:
-	img_bytes = _page_png_bytes(src_doc, pno, dpi)
-	# 生成预览缩略图（无论是否成功都可展示原页缩略图）
-	preview = Image.open(io.BytesIO(img_bytes))
-	preview.thumbnail((1024, 1024))
-	bio = io.BytesIO()
-	preview.save(bio, format="PNG")
+					system_prompt: str, right_ratio: float, font_size: int,
+					memory_budget: Optional[MemoryBudget] = None, image_mode: str = "full", min_dpi: int = 96,
+					max_dpi: int = 220, on_log: Optional[Callable[[str], None]] = None,
+					max_chars: Optional[int] = None, condense: bool = False,
+					blank_retries: int = 0, blank_min_chars: int = 10, retry_hint: bool = False,
+					retry_temperature: Optional[float] = None,
+					) -> Tuple[int, Optional[str], Union[bytes, str], Optional[Exception]]:
+	img_bytes = _llm_image(src_doc, pno, dpi, image_mode, min_dpi, max_dpi, on_log=on_log)
+	# 生成预览缩略图（无论是否成功都可展示原页缩略图）；裁剪后的图片不是整页，预览单独渲染
+	if image_mode == "full":
+		preview = Image.open(io.BytesIO(img_bytes))
+		preview.thumbnail((1024, 1024))
+		bio = io.BytesIO()
+		preview.save(bio, format="PNG")
+		preview_out: Union[bytes, str] = bio.getvalue()
+	else:
+		preview_out = _preview_png(src_doc, pno)
+	# 接近内存预算时预览不留在内存中，落盘后只保留路径
+	if memory_budget is not None and memory_budget.under_pressure():
+		preview_out = memory_budget.spill(f"preview_{pno + 1}.png", preview_out)
 	try:
-		expl = await client.explain_page(img_bytes, system_prompt)
-		return pno, expl, bio.getvalue(), None
+		options = {"max_chars": max_chars} if max_chars else {}
+		expl = await client.explain_page(img_bytes, system_prompt, **options)
+		if blank_retries > 0:
+			expl = await _retry_blank(pno, client, img_bytes, system_prompt, expl, options, blank_retries,
+									blank_min_chars, retry_hint, retry_temperature, on_log)
+		if not max_chars:
+			return pno, expl, preview_out, None
+		if condense and expl and len(expl) > max_chars * _CONDENSE_TOLERANCE:
+			expl = await _condense(pno, client, img_bytes, expl, max_chars, on_log)
+		count("budget_chars", max_chars)
+		count("explanation_chars", len(expl or ""))
+		if len(expl or "") > max_chars:
+			count("over_budget_pages")
+		return pno, expl, preview_out, None
 	except Exception as e:
-		return pno, None, bio.getvalue(), e
+		return pno, None, preview_out, e
+
+
+async def _retry_blank(pno: int, client: GeminiClient, img_bytes: bytes, system_prompt: str, text: str,
+					options: Dict[str, int], times: int, min_chars: int = 10, hint: bool = False,
+					temperature: Optional[float] = None, on_log: Optional[Callable[[str], None]] = None) -> str:
+	"""
+	在本页的任务内立即重试空白/过短的讲解，其他页的请求照常进行。
+	hint 为 True 时在提示词后附加提醒（见 retry_prompt），temperature 为重试时的采样温度；
+	重试请求失败时保留已有讲解。
+	"""
+	if not is_blank_explanation(text, min_chars):
+		return text
+	prompt = retry_prompt(system_prompt) if hint else system_prompt
+	kwargs = dict(options, temperature=temperature) if temperature is not None else options
+	for attempt in range(times):
+		count("blank_retries")
+		if on_log:
+			on_log(f"第 {pno + 1} 页讲解为空，立即重试（第 {attempt + 1} 次）")
+		try:
+			text = await client.explain_page(img_bytes, prompt, **kwargs)
+		except Exception as e:
+			if on_log:
+				on_log(f"第 {pno + 1} 页重试失败：{e}")
+			return text
+		if not is_blank_explanation(text, min_chars):
+			count("blank_recovered")
+			return text
+	return text
 
 
-def generate_explanations(src_bytes: bytes, api_key: str, model_name: str, user_prompt: str,
+# 讲解超出字数上限的比例达到该值时才重新压缩
+_CONDENSE_TOLERANCE = 1.1
+
+
+async def _condense(pno: int, client: GeminiClient, img_bytes: bytes, text: str, max_chars: int,
+					on_log: Optional[Callable[[str], None]] = None) -> str:
+	"""请模型把超出篇幅的讲解压缩到 max_chars 字以内；失败或没有变短时保留原讲解"""
+	count("condense_requests")
+	try:
+		short = await client.explain_page(img_bytes, condense_prompt(text, max_chars), max_chars=max_chars)
+	except Exception as e:
+		if on_log:
+			on_log(f"第 {pno + 1} 页压缩失败，保留原讲解：{e}")
+		return text
+	if is_blank_explanation(short) or len(short) >= len(text):
+		return text
+	count("condensed_pages")
+	if on_log:
+		on_log(f"第 {pno + 1} 页讲解 {len(text)} 字超出上限 {max_chars} 字，压缩为 {len(short)} 字")
+	return short
+
+
+@dataclass
+class ExplainOptions:
+	"""
+	逐页生成讲解时的可选处理，界面/任务参数、命令行参数或 HTTP 查询参数经 from_params 构建一次后
+	传给 generate_explanations(_async)。默认值全部关闭，与不传时相同。
+
+	trivial_pages: 空白/过渡页（文字不超过 trivial_max_chars 个、无图片、缩略图变化很少，见 classify_page）的处理方式。
+		"off" 与其他页相同；"skip" 不请求 LLM，直接使用本地讲解（空白页为空，过渡页注明其文字）；
+		"batch" 空白页同 skip，过渡页拼成缩略图每 trivial_batch_size 页合并为一次请求。
+		跳过的页数与节省的请求数、token 记入当前运行报告的计数器
+	duplicate_pages: 重复页处理方式（见 find_duplicates）。"off" 不检测；"share" 文字相同、缩略图相近的页
+		只请求代表页，讲解复制给其余页；"diff" 另外对逐步展开的页只请求讲解新增内容。
+		去重页数与检查页数记入计数器（dedup_ratio 见运行报告）
+	image_mode: 发给 LLM 的页面图片。"full" 按 dpi 渲染整页；"adaptive" 裁去空白边距，
+		按本页最小字号与小图在 [min_dpi, max_dpi] 内选择 DPI（没有文字层的页沿用 dpi，见 render_plan）。
+		图片数、字节数与像素数记入计数器，on_log 逐页输出所选 DPI 与图片大小
+	input_mode: 发给 LLM 的输入。"image" 只发图片；"hybrid" 对文字主导的页（见 text_layer）在提示词中附上
+		文本层，图片改按 hybrid_dpi 渲染整页，图表多的页仍按 image_mode 发送清晰图片。
+		两类页数与估算节省的输入 token 记入计数器，on_log 输出走文本层的页
+	routing: 模型路由。"off" 所有页使用 model_name；"auto" 按本地估计的页面复杂度（文字密度、公式、图片、
+		表格，见 page_complexity）低于 route_threshold 的页使用快速模型 fast_model_name，其余使用强模型。
+		route_overrides 为逐页指定的路由 {页号(0 起): "fast"/"strong"}，优先于自动判定（routing 为 "off" 时也生效），
+		from_params 从 route_pages（如 "1-3=fast"，见 parse_route_overrides）解析。
+		两个模型各有独立的限流器，fast_*_limit 为空时沿用强模型的限额；各路由页数记入计数器，
+		各模型的调用耗时记入 "explain_page:fast" / "explain_page:strong" 阶段
+	length_budget: 篇幅控制。"off" 不限制；"prompt" 按合成参数（font_size / line_spacing / column_padding /
+		render_mode，默认值与 compose_pdf 相同；合成时改了排版参数须同样传入这里，否则按另一种排版估算篇幅）
+		估算每页右侧三栏能容纳的字数（见 layout_char_budget），
+		写入提示词并据此设置该次调用的 max_output_tokens 与限流估算；"condense" 另外把超出上限 10% 以上的讲解
+		再请求一次压缩。上限、实际字数、超限页数与压缩次数记入计数器（合成时的续页数见 continuation_pages）
+	retry_blank: 讲解为空或少于 blank_min_chars 个字时，在该页的任务内立即重试（最多 blank_retry_times 次），
+		不等待其他页完成，整个文件只有一轮请求。blank_retry_hint 为 True 时重试的提示词附加提醒（见 retry_prompt），
+		blank_retry_temperature 为重试时的采样温度（None 沿用 temperature）。空白/过渡页不重试，重复页共用代表页重试后的讲解；
+		重试次数与重试后恢复的页数记入计数器
+	request_timeout / hedge: generate_explanations 新建客户端时的单次调用期限（秒）与对冲慢请求（见 GeminiClient），
+		传入已有客户端时以客户端自身的设置为准；超时与对冲次数记入计数器，对冲前后的单页耗时见 "explain_page" 阶段的 p99
+	"""
+	trivial_pages: str = "off"
+	trivial_max_chars: int = 40
+	trivial_batch_size: int = 9
+	duplicate_pages: str = "off"
+	image_mode: str = "full"
+	min_dpi: int = 96
+	max_dpi: int = 220
+	input_mode: str = "image"
+	hybrid_dpi: int = 72
+	routing: str = "off"
+	route_threshold: float = 1.0
+	route_overrides: Optional[Dict[int, str]] = None
+	fast_model_name: Optional[str] = None
+	fast_rpm_limit: Optional[int] = None
+	fast_tpm_budget: Optional[int] = None
+	fast_rpd_limit: Optional[int] = None
+	length_budget: str = "off"
+	font_size: int = 20
+	line_spacing: float = 1.4
+	column_padding: int = 10
+	render_mode: str = "text"
+	retry_blank: bool = False
+	blank_min_chars: int = 10
+	blank_retry_times: int = 1
+	blank_retry_hint: bool = False
+	blank_retry_temperature: Optional[float] = None
+	request_timeout: Optional[float] = None
+	hedge: bool = False
+
+	def __post_init__(self) -> None:
+		if self.trivial_pages not in ("off", "skip", "batch"):
+			raise ValueError(f"未知的过渡页处理方式: {self.trivial_pages}")
+		if self.duplicate_pages not in ("off", "share", "diff"):
+			raise ValueError(f"未知的重复页处理方式: {self.duplicate_pages}")
+		if self.image_mode not in ("full", "adaptive"):
+			raise ValueError(f"未知的图片渲染方式: {self.image_mode}")
+		if not 0 < self.min_dpi <= self.max_dpi:
+			raise ValueError(f"DPI 范围无效: {self.min_dpi}~{self.max_dpi}")
+		if self.input_mode not in ("image", "hybrid"):
+			raise ValueError(f"未知的输入方式: {self.input_mode}")
+		if self.routing not in ("off", "auto"):
+			raise ValueError(f"未知的模型路由方式: {self.routing}")
+		if self.route_overrides and any(r not in ("fast", "strong") for r in self.route_overrides.values()):
+			raise ValueError(f"未知的路由: {sorted(set(self.route_overrides.values()))}")
+		if self.length_budget not in ("off", "prompt", "condense"):
+			raise ValueError(f"未知的篇幅控制方式: {self.length_budget}")
+
+	@property
+	def routed(self) -> bool:
+		return self.routing != "off" or bool(self.route_overrides)
+
+	@classmethod
+	def from_params(cls, params: Dict) -> "ExplainOptions":
+		"""从参数字典（键名与字段相同，如界面参数、任务参数或 vars(args)）构建，缺少或为空的键取默认值"""
+		kwargs = {f.name: params[f.name] for f in fields(cls) if params.get(f.name) not in (None, "")}
+		if params.get("route_pages"):
+			kwargs["route_overrides"] = parse_route_overrides(params["route_pages"])
+		# 界面与命令行以 0 表示不限
+		if not kwargs.get("request_timeout"):
+			kwargs.pop("request_timeout", None)
+		return cls(**kwargs)
+
+
+def generate_explanations(src_bytes: PdfSource, api_key: str, model_name: str, user_prompt: str,
 				temperature: float, max_tokens: int, dpi: int,
 				concurrency: int, rpm_limit: int, tpm_budget: int, rpd_limit: int,
 				pages: Optional[List[int]] = None,
 				on_progress: Optional[Callable[[int, int], None]] = None,
 				on_log: Optional[Callable[[str], None]] = None,
-				retry_blank: bool = False,
-				blank_min_chars: int = 10,
-				blank_retry_times: int = 1) -> Tuple[Dict[int, str], List[bytes], List[int]]:
-	# 打开源 PDF
-	src_doc = fitz.open(stream=src_bytes, filetype="pdf")
-	n_pages = src_doc.page_count
-
-	client = GeminiClient(
-		api_key=api_key,
-		model_name=model_name,
-		temperature=temperature,
-		max_output_tokens=max_tokens,
-		rpm_limit=rpm_limit,
-		tpm_budget=tpm_budget,
-		rpd_limit=rpd_limit,
-		logger=on_log,
-	)
-
-	to_process = pages if pages is not None else list(range(n_pages))
-
-	async def run_all():
-		sem = asyncio.Semaphore(concurrency)
-		results: List[Tuple[int, Optional[str], bytes, Optional[Exception]]] = []
-		total = len(to_process)
-		done = 0
-
-		async def worker(i: int):
-			nonlocal done
-			async with sem:
-				return await _process_one(i, src_doc, dpi, client, user_prompt, 0.0, 0)
-
-		pending = [worker(i) for i in to_process]
-		for coro in asyncio.as_completed(pending):
-			r = await coro
-			results.append(r)
-			done += 1
-			if on_progress:
-				on_progress(done, total)
-			if on_log:
-				ok = (r[1] is not None) and (r[3] is None)
-				on_log(f"第 {r[0]+1} 页处理完成：{'成功' if ok else '失败'}")
-		return results
+				retry_blank: Optional[bool] = None,
+				blank_min_chars: Optional[int] = None,
+				blank_retry_times: Optional[int] = None,
+				on_page_done: Optional[Callable[[int, Optional[str]], None]] = None,
+				client: Optional[GeminiClient] = None,
+				progress: Optional[ProgressAggregator] = None,
+				memory_budget: Optional[MemoryBudget] = None,
+				options: Optional[ExplainOptions] = None,
+				fast_client: Optional[GeminiClient] = None) -> Tuple[Dict[int, str], List[Union[bytes, str]], List[int]]:
+	"""
+	逐页渲染并并发生成讲解。
 
-	async def run_all_retry(to_retry: List[int]):
-		sem = asyncio.Semaphore(concurrency)
-		results2: List[Tuple[int, Optional[str], bytes, Optional[Exception]]] = []
+	Args:
+		src_bytes: 源 PDF 字节或 PdfSession
+		retry_blank / blank_min_chars / blank_retry_times: 已弃用，请改用 ExplainOptions 的同名字段；
+			给出时覆盖 options 中的对应字段
+		on_page_done: 每页完成时回调 (pno, 讲解或 None)，讲解为空白重试后的结果，在事件循环线程中调用，
+			可直接传入 StreamingComposer.add_page 实现边生成边合成
+		client: 复用已有客户端（共享限流器与用量统计）；为 None 时按参数新建
+		progress: 汇总逐页进度并限频刷新界面（同时读取客户端的进行中请求数与限流等待）
+		memory_budget: 内存预算；接近预算时减少同时渲染的页数，预览落盘（对应项为文件路径而非 PNG 字节）
+		options: 空白/过渡页、重复页、图片渲染、文本层输入、模型路由、篇幅控制、空白重试与调用期限/对冲等
+			逐页处理选项（见 ExplainOptions）；为 None 时全部关闭
+		fast_client: 复用已有的快速模型客户端；为 None 时按 options.fast_model_name 新建
+
+	Returns:
+		(讲解, 预览 PNG 字节或落盘路径, 失败页)
+	"""
+	options = options or ExplainOptions()
+	legacy = {name: value for name, value in (("retry_blank", retry_blank), ("blank_min_chars", blank_min_chars),
+											("blank_retry_times", blank_retry_times)) if value is not None}
+	if legacy:
+		warnings.warn(f"generate_explanations 的 {'/'.join(legacy)} 参数已弃用，请通过 options=ExplainOptions(...) 传入",
+					DeprecationWarning, stacklevel=2)
+		options = replace(options, **legacy)
+	routed = options.routed
+	if client is None:
+		client = GeminiClient(
+			api_key=api_key,
+			model_name=model_name,
+			temperature=temperature,
+			max_output_tokens=max_tokens,
+			rpm_limit=rpm_limit,
+			tpm_budget=tpm_budget,
+			rpd_limit=rpd_limit,
+			logger=on_log,
+			label="strong" if routed else None,
+			request_timeout=options.request_timeout,
+			hedge=options.hedge,
+		)
+	if fast_client is None and routed and options.fast_model_name:
+		fast_client = GeminiClient(
+			api_key=api_key,
+			model_name=options.fast_model_name,
+			temperature=temperature,
+			max_output_tokens=max_tokens,
+			rpm_limit=options.fast_rpm_limit or rpm_limit,
+			tpm_budget=options.fast_tpm_budget or tpm_budget,
+			rpd_limit=options.fast_rpd_limit or rpd_limit,
+			logger=on_log,
+			label="fast",
+			request_timeout=options.request_timeout,
+			hedge=options.hedge,
+		)
+	return asyncio.run(generate_explanations_async(
+		src_bytes, client, user_prompt, dpi, concurrency, pages=pages, on_progress=on_progress, on_log=on_log,
+		on_page_done=on_page_done, progress=progress, memory_budget=memory_budget, options=options,
+		fast_client=fast_client,
+	))
+
+
+async def generate_explanations_async(src_bytes: PdfSource, client: GeminiClient, user_prompt: str, dpi: int,
+				concurrency: int,
+				pages: Optional[List[int]] = None,
+				on_progress: Optional[Callable[[int, int], None]] = None,
+				on_log: Optional[Callable[[str], None]] = None,
+				on_page_done: Optional[Callable[[int, Optional[str]], None]] = None,
+				semaphore: Optional[asyncio.Semaphore] = None,
+				progress: Optional[ProgressAggregator] = None,
+				memory_budget: Optional[MemoryBudget] = None,
+				options: Optional[ExplainOptions] = None,
+				fast_client: Optional[GeminiClient] = None) -> Tuple[Dict[int, str], List[Union[bytes, str]], List[int]]:
+	"""
+	generate_explanations 的协程版本，可在同一事件循环中并发处理多个文件。
 
-		async def worker2(i: int):
+	Args:
+		semaphore: 跨文件共享的并发槽位；为 None 时每个文件使用自己的 concurrency 上限
+		progress: 同 generate_explanations；多个文件可共用一个，总页数逐文件累加
+		memory_budget: 同 generate_explanations；多个文件可共用一个
+		options: 同 generate_explanations
+		fast_client: 快速模型客户端，路由到 "fast" 的页与合并的过渡页使用它；启用路由时必须提供
+	"""
+	options = options or ExplainOptions()
+	routed = options.routed
+	if routed and fast_client is None:
+		raise ValueError("模型路由需要快速模型（fast_model_name 或 fast_client）")
+	# 打开源 PDF（PdfSession 复用已打开的文档）
+	src_doc, owns_doc = _open_source(src_bytes)
+	try:
+		n_pages = src_doc.page_count
+		sem = semaphore or asyncio.Semaphore(concurrency)
+
+		to_process = pages if pages is not None else list(range(n_pages))
+
+		# 本地判定空白/过渡页：不渲染高 DPI 图片，不单独请求 LLM
+		trivial: Dict[int, str] = {}
+		if options.trivial_pages != "off":
+			with timed("classify"):
+				for pno in to_process:
+					kind = classify_page(src_doc.load_page(pno), max_chars=options.trivial_max_chars)
+					if kind:
+						trivial[pno] = kind
+		batched = [p for p in to_process if trivial.get(p) == "trivial"] if options.trivial_pages == "batch" else []
+		batches = chunks(batched, options.trivial_batch_size)
+		local = [p for p in to_process if p in trivial and p not in batched]
+		if trivial:
+			saved = len(trivial) - len(batches)
+			count("trivial_pages", len(trivial))
+			count("trivial_batched", len(batched))
+			count("saved_requests", saved)
+			count("saved_tokens", saved * estimate_tokens(1200))
+			if on_log:
+				on_log(f"空白/过渡页 {len(trivial)} 页：{[p + 1 for p in sorted(trivial)]}，节省 {saved} 次请求")
+
+		# 重复页只请求代表页，完成后复制给其余页；逐步展开的页改用只讲新增内容的提示词
+		followers: Dict[int, List[int]] = {}
+		prompts: Dict[int, str] = {}
+		if options.duplicate_pages != "off":
+			candidates = [p for p in to_process if p not in trivial]
+			with timed("dedup"):
+				duplicates = find_duplicates(src_doc, candidates, buildup=options.duplicate_pages == "diff")
+			for pno, rep in duplicates.shared.items():
+				followers.setdefault(rep, []).append(pno)
+			for pno, (prev, new_text) in duplicates.buildup.items():
+				prompts[pno] = buildup_prompt(user_prompt, prev, new_text)
+			count("dedup_checked_pages", len(candidates))
+			count("duplicate_pages", len(duplicates.shared))
+			count("buildup_pages", len(duplicates.buildup))
+			if duplicates.shared:
+				count("saved_requests", len(duplicates.shared))
+				count("saved_tokens", len(duplicates.shared) * estimate_tokens(1200))
+			if on_log and candidates:
+				on_log(f"重复页 {len(duplicates.shared)} 页、逐步展开页 {len(duplicates.buildup)} 页，"
+					f"去重率 {len(duplicates.shared) / len(candidates):.0%}")
+		shared = {pno for dups in followers.values() for pno in dups}
+
+		# 文字主导的页附上文本层，图片改用低分辨率；节省量按 dpi 整页图片估算（文本较长时可能为负）
+		hybrid: Dict[int, str] = {}
+		if options.input_mode == "hybrid":
+			candidates = [p for p in to_process if p not in trivial and p not in shared]
+			saved_tokens = 0
+			with timed("text_layer"):
+				for pno in candidates:
+					page = src_doc.load_page(pno)
+					text = text_layer(page)
+					if text is None:
+						continue
+					hybrid[pno] = text
+					prompts[pno] = hybrid_prompt(prompts.get(pno, user_prompt), text)
+					w, h = page.rect.width / 72.0, page.rect.height / 72.0
+					saved_tokens += (estimate_image_tokens(int(w * dpi), int(h * dpi))
+									- estimate_image_tokens(int(w * options.hybrid_dpi), int(h * options.hybrid_dpi))
+									- estimate_text_tokens(text))
+			count("hybrid_pages", len(hybrid))
+			count("image_input_pages", len(candidates) - len(hybrid))
+			count("hybrid_saved_tokens", saved_tokens)
+			if on_log and candidates:
+				on_log(f"文本层辅助 {len(hybrid)} 页：{[p + 1 for p in sorted(hybrid)]}，其余 {len(candidates) - len(hybrid)} 页发送图片，"
+					f"估算节省输入 token {saved_tokens}")
+
+		# 模型路由：简单的页交给快速模型，复杂的页交给强模型，逐页指定的优先
+		routes: Dict[int, str] = {}
+		if routed:
+			candidates = [p for p in to_process if p not in trivial and p not in shared]
+			overrides = {p: r for p, r in (options.route_overrides or {}).items() if p in candidates}
+			with timed("route"):
+				for pno in candidates:
+					if pno in overrides:
+						routes[pno] = overrides[pno]
+					elif options.routing == "auto" and page_complexity(src_doc.load_page(pno)).score < options.route_threshold:
+						routes[pno] = "fast"
+					else:
+						routes[pno] = "strong"
+			fast = sorted(p for p, r in routes.items() if r == "fast")
+			count("routed_fast", len(fast))
+			count("routed_strong", len(routes) - len(fast))
+			count("route_overrides", len(overrides))
+			if on_log and candidates:
+				on_log(f"模型路由：快速模型 {len(fast)} 页 {[p + 1 for p in fast]}，强模型 {len(routes) - len(fast)} 页")
+
+		# 篇幅上限：按合成排版估算每页右侧三栏能容纳的字数，写入提示词
+		budgets: Dict[int, int] = {}
+		if options.length_budget != "off":
+			for pno in to_process:
+				if pno in trivial or pno in shared:
+					continue
+				w, h = _unrotated_size(src_doc.load_page(pno))
+				budgets[pno] = max(layout_char_budget(w, h, options.font_size, render_mode=options.render_mode,
+													line_spacing=options.line_spacing, column_padding=options.column_padding), 50)
+				prompts[pno] = length_prompt(prompts.get(pno, user_prompt), budgets[pno])
+			if on_log and budgets:
+				on_log(f"篇幅上限：每页 {min(budgets.values())}~{max(budgets.values())} 字")
+
+		def client_for(i: int) -> GeminiClient:
+			return fast_client if routes.get(i) == "fast" else client
+
+		async def process(i: int):
+			prompt = prompts.get(i, user_prompt)
+			page_client = client_for(i)
+			if i in hybrid:
+				page_dpi, page_kwargs = options.hybrid_dpi, dict(on_log=on_log)
+			else:
+				page_dpi, page_kwargs = dpi, dict(image_mode=options.image_mode, min_dpi=options.min_dpi,
+												max_dpi=options.max_dpi, on_log=on_log)
+			if i in budgets:
+				page_kwargs.update(max_chars=budgets[i], condense=options.length_budget == "condense")
+			if options.retry_blank and options.blank_retry_times > 0:
+				page_kwargs.update(blank_retries=options.blank_retry_times, blank_min_chars=options.blank_min_chars,
+								retry_hint=options.blank_retry_hint, retry_temperature=options.blank_retry_temperature)
 			async with sem:
-				return await _process_one(i, src_doc, dpi, client, user_prompt, 0.0, 0)
-
-		pending2 = [worker2(i) for i in to_retry]
-		for coro in asyncio.as_completed(pending2):
-			r = await coro
-			results2.append(r)
-		return results2
-
-	results = asyncio.run(run_all())
-	results.sort(key=lambda x: x[0])
-
-	# 汇总
-	explanations: Dict[int, str] = {}
-	previews: List[bytes] = []
-	failed_pages: List[int] = []
-	for pno, expl, preview_png, err in results:
-		previews.append(preview_png)
-		if err is None and expl is not None:
-			explanations[pno] = expl
-		else:
-			failed_pages.append(pno)
-
-	# 第二阶段：若启用，对空白解释页进行重试（基于当前 explanations 判定）
-	if retry_blank and blank_retry_times > 0:
-		blank_pages = pages_with_blank_explanations(explanations, min_chars=blank_min_chars)
-		if on_log and blank_pages:
-			on_log(f"检测到空白解释页，准备重试：{[i+1 for i in blank_pages]}")
-		for _ in range(blank_retry_times):
-			if not blank_pages:
-				break
-			retry_results = asyncio.run(run_all_retry(blank_pages))
-			# 合并成功项
-			for pno, expl, _prev, err in retry_results:
-				if err is None and expl:
-					explanations[pno] = expl
-			# 重新计算仍空白的页
-			blank_pages = [pno for (pno, expl, _prev, err) in retry_results
-						  if (err is not None) or is_blank_explanation(expl, blank_min_chars)]
-			if on_log and blank_pages:
-				on_log(f"仍有空白/失败页：{[i+1 for i in blank_pages]}")
-
-	src_doc.close()
-	return explanations, previews, failed_pages
-
-
-def compose_pdf(src_bytes: bytes, explanations: Dict[int, str], right_ratio: float, font_size: int,
-                font_path: Optional[str] = None,
-                render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10) -> bytes:
-	src_doc = fitz.open(stream=src_bytes, filetype="pdf")
+				if memory_budget is None:
+					return await _process_one(i, src_doc, page_dpi, page_client, prompt, 0.0, 0, **page_kwargs)
+				# 渲染图片在请求返回前一直留在内存中，接近预算时限制同时持有的页数
+				async with memory_budget.render_slot():
+					return await _process_one(i, src_doc, page_dpi, page_client, prompt, 0.0, 0,
+											memory_budget=memory_budget, **page_kwargs)
+
+		async def process_batch(chunk: List[int]):
+			"""一次请求讲解多张过渡页；请求失败或响应缺页时使用本地讲解"""
+			async with sem:
+				notes: Dict[int, str] = {}
+				try:
+					text = await (fast_client if routed else client).explain_page(contact_sheet(src_doc, chunk),
+																				batch_prompt(user_prompt, chunk))
+					notes = parse_batch_response(text, chunk)
+				except Exception as e:
+					if on_log:
+						on_log(f"过渡页合并请求失败，使用本地讲解：{e}")
+				return [(pno, notes.get(pno) or trivial_note(src_doc.load_page(pno)), _preview_png(src_doc, pno), None)
+						for pno in chunk]
+
+		async def process_list(i: int):
+			return [await process(i)]
+
+		async def run_all():
+			results: List[Tuple[int, Optional[str], Union[bytes, str], Optional[Exception]]] = []
+			total = len(to_process)
+			done = 0
+
+			def page_finished(r) -> None:
+				nonlocal done
+				results.append(r)
+				done += 1
+				if on_progress:
+					on_progress(done, total)
+				if on_log:
+					ok = (r[1] is not None) and (r[3] is None)
+					on_log(f"第 {r[0]+1} 页处理完成：{'成功' if ok else '失败'}")
+				if on_page_done:
+					on_page_done(r[0], r[1] if r[3] is None else None)
+				if progress:
+					progress.page_done(r[0], ok=(r[1] is not None) and (r[3] is None))
+				# 重复页与代表页同时完成，共用其讲解与预览
+				for dup in followers.get(r[0], []):
+					page_finished((dup, *r[1:]))
+
+			# 本地处理的页立即完成，不占用并发槽位
+			for pno in local:
+				page_finished((pno, trivial_note(src_doc.load_page(pno)), _preview_png(src_doc, pno), None))
+
+			# 按页序创建任务，使请求按页序获取并发槽位（as_completed 内部用 set 包装协程，顺序不确定），
+			# 流式合成可尽早拿到连续的前缀页
+			pending = [asyncio.ensure_future(process_list(i)) for i in to_process if i not in trivial and i not in shared]
+			pending += [asyncio.ensure_future(process_batch(chunk)) for chunk in batches]
+			for coro in asyncio.as_completed(pending):
+				for r in await coro:
+					page_finished(r)
+			return results
+
+		ticker = None
+		if progress:
+			progress.track(client, fast_client)
+			progress.add_total(len(to_process))
+			ticker = asyncio.ensure_future(progress.run())
+		try:
+			results = await run_all()
+		finally:
+			if ticker:
+				ticker.cancel()
+		results.sort(key=lambda x: x[0])
+
+		# 汇总
+		explanations: Dict[int, str] = {}
+		previews: List[Union[bytes, str]] = []
+		failed_pages: List[int] = []
+		for pno, expl, preview_png, err in results:
+			previews.append(preview_png)
+			if err is None and expl is not None:
+				explanations[pno] = expl
+			else:
+				failed_pages.append(pno)
+
+		# 空白重试已在各页任务内完成，这里只报告仍为空白的页（含与代表页共用讲解的重复页）
+		if options.retry_blank and on_log:
+			blank_pages = [p for p in pages_with_blank_explanations(explanations, min_chars=options.blank_min_chars)
+						if p not in trivial]
+			if blank_pages:
+				on_log(f"重试后仍为空白的页：{[i + 1 for i in blank_pages]}")
+		return explanations, previews, failed_pages
+	finally:
+		if owns_doc:
+			src_doc.close()
+
+
+# 合成映射：记录每个源页绘制的讲解哈希与对应输出页数，写入输出 PDF 的 Catalog，供增量重合成使用
+_COMPOSE_MAP_KEY = "SmartLecturerMap"
+
+
+def _explanation_hash(text: Optional[str]) -> str:
+	return hashlib.md5((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _layout_key(font_size: int, font_path: Optional[str], render_mode: str,
+				line_spacing: float, column_padding: int, engine: str) -> str:
+	params = [font_size, font_path or "", render_mode, float(line_spacing), column_padding, engine]
+	return hashlib.md5(json.dumps(params).encode("utf-8")).hexdigest()
+
+
+def _write_compose_map(doc: fitz.Document, layout_key: str, source_key: str,
+					explanations: Dict[int, str], counts: List[int], base_size: Optional[int] = None) -> None:
+	"""base_size：上次完整保存时的文件大小，增量保存时用于计算累计追加的字节数"""
+	data = {
+		"v": 1,
+		"layout": layout_key,
+		"source": source_key,
+		"pages": [[_explanation_hash(explanations.get(pno, "")), n] for pno, n in enumerate(counts)],
+	}
+	if base_size:
+		data["base"] = base_size
+	doc.xref_set_key(doc.pdf_catalog(), _COMPOSE_MAP_KEY, fitz.get_pdf_str(json.dumps(data, separators=(",", ":"))))
+
+
+def read_compose_map(doc: fitz.Document) -> Optional[Dict]:
+	"""读取 compose_pdf 写入的合成映射；不存在或无法解析时返回 None。"""
+	kind, value = doc.xref_get_key(doc.pdf_catalog(), _COMPOSE_MAP_KEY)
+	if kind != "string":
+		return None
+	try:
+		data = json.loads(value)
+	except ValueError:
+		return None
+	return data if isinstance(data, dict) and data.get("v") == 1 else None
+
+
+def _compose_pages(src_doc: fitz.Document, explanations: Dict[int, str], right_ratio: float, font_size: int,
+				font_path: Optional[str], render_mode: str, line_spacing: float, column_padding: int,
+				engine: str, from_page: int = 0, to_page: int = -1) -> Tuple[fitz.Document, List[int]]:
+	if to_page < 0:
+		to_page = src_doc.page_count - 1
+	if engine == "widen":
+		return _compose_widen(src_doc, explanations, font_size, font_path=font_path, render_mode=render_mode,
+							line_spacing=line_spacing, column_padding=column_padding, from_page=from_page, to_page=to_page)
 	dst_doc = fitz.open()
-	for pno in range(src_doc.page_count):
+	counts = []
+	for pno in range(from_page, to_page + 1):
 		expl = explanations.get(pno, "")
-		_compose_vector(dst_doc, src_doc, pno, right_ratio, font_size, expl, font_path=font_path, render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
-	bout = io.BytesIO()
-	# 优化PDF保存参数，减小文件大小
-	dst_doc.save(bout, deflate=True, clean=True, garbage=4, deflate_images=True, deflate_fonts=True)
-	dst_doc.close()
-	src_doc.close()
-	return bout.getvalue()
+		counts.append(_compose_vector(dst_doc, src_doc, pno, right_ratio, font_size, expl, font_path=font_path, render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding))
+	return dst_doc, counts
+
+
+# 优化PDF保存参数，减小文件大小（garbage=4 合并重复对象，如各页重复嵌入的字体）
+_SAVE_KWARGS = dict(deflate=True, clean=True, garbage=4, deflate_images=True, deflate_fonts=True)
+
+
+def _temp_output_path(path: str) -> str:
+	"""与 path 同目录的临时文件名；同一进程中的多个会话线程可能同时写同一目标，名称需逐次唯一"""
+	return f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+
+
+def _save_output(doc: fitz.Document, output: Union[str, BinaryIO]) -> int:
+	"""
+	将合成结果直接写入文件路径或可写文件对象，返回写入的字节数。
+
+	路径输出先写临时文件再原子替换，避免读取方看到写了一半的 PDF。
+	"""
+	if isinstance(output, (str, os.PathLike)):
+		path = os.fspath(output)
+		tmp_path = _temp_output_path(path)
+		try:
+			doc.save(tmp_path, **_SAVE_KWARGS)
+			os.replace(tmp_path, path)
+		finally:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+		return os.path.getsize(path)
+	start = output.tell() if output.seekable() else None
+	doc.save(output, **_SAVE_KWARGS)
+	return output.tell() - start if start is not None else -1
+
+
+def compose_pdf(src_bytes: PdfSource, explanations: Dict[int, str], right_ratio: float, font_size: int,
+                font_path: Optional[str] = None,
+                render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+                engine: str = "vector", output: Optional[Union[str, BinaryIO]] = None,
+                source_key: Optional[str] = None) -> Union[bytes, Dict]:
+	"""
+	合成讲解版 PDF。
+
+	Args:
+		engine: 合成引擎。"vector" 为逐页 show_pdf_page 嵌入；
+			"widen" 为一次复制全部原页后加宽 MediaBox，合成与保存更快、输出更小。
+		output: 输出位置（文件路径或可写文件对象）。为 None 时返回 PDF 字节；
+			否则直接写入该位置，不在内存中保留整份输出，只返回元数据。
+		source_key: 预先计算的 source_digest(src_bytes)，为 None 时在此计算（PdfSession 使用其摘要）
+
+	Returns:
+		output 为 None 时返回 PDF 字节；否则返回
+		{"path": 文件路径或 None, "size": 写入字节数（不可 seek 的流为 -1）,
+		 "page_count": 输出页数, "source_pages": 源页数, "continuation_pages": 续页数}
+	"""
+	if engine not in ("vector", "widen"):
+		raise ValueError(f"未知的合成引擎: {engine}")
+	src_doc, owns_doc = _open_source(src_bytes)
+	try:
+		dst_doc, counts = _compose_pages(src_doc, explanations, right_ratio, font_size, font_path, render_mode, line_spacing, column_padding, engine)
+		_write_compose_map(dst_doc, _layout_key(font_size, font_path, render_mode, line_spacing, column_padding, engine),
+						source_key or source_digest(src_bytes), explanations, counts)
+		return _finish_output(dst_doc, counts, output)
+	finally:
+		if owns_doc:
+			src_doc.close()
+
 
+def _finish_output(dst_doc: fitz.Document, counts: List[int], output: Optional[Union[str, BinaryIO]]) -> Union[bytes, Dict]:
+	"""保存并关闭合成文档；返回值约定同 compose_pdf。"""
+	try:
+		if output is None:
+			with timed("save"):
+				return dst_doc.tobytes(**_SAVE_KWARGS)
+		with timed("save"):
+			size = _save_output(dst_doc, output)
+		return {
+			"path": os.fspath(output) if isinstance(output, (str, os.PathLike)) else None,
+			"size": size,
+			"page_count": dst_doc.page_count,
+			"source_pages": len(counts),
+			"continuation_pages": sum(counts) - len(counts),
+		}
+	finally:
+		dst_doc.close()
+
+
+class StreamingComposer:
+	"""
+	流式合成：讲解逐页到达时，只要之前的页都已就绪，就立即把该页排入输出文档。
+
+	与 generate_explanations(on_page_done=composer.add_page) 配合使用，合成与等待 LLM 响应交替进行，
+	最后一页讲解返回时输出已基本完成，端到端耗时接近 max(生成, 合成) 而非两者之和。
+	PyMuPDF 非线程安全，合成只在生成讲解的事件循环线程中进行：每次回调只登记讲解，
+	再通过 call_soon 每轮合成一页，避免一次性合成一批页而推迟后续请求的发出。
+	传入 PdfSession 时与生成讲解共用同一个源文档，合成结束后不关闭它（由会话的持有者关闭）。
+	"""
+
+	def __init__(self, src_bytes: PdfSource, right_ratio: float, font_size: int,
+				font_path: Optional[str] = None,
+				render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+				engine: str = "vector", source_key: Optional[str] = None) -> None:
+		if engine not in ("vector", "widen"):
+			raise ValueError(f"未知的合成引擎: {engine}")
+		self._source_key = source_key or source_digest(src_bytes)
+		self._src_doc, self._owns_src = _open_source(src_bytes)
+		self._dst_doc = fitz.open()
+		self._params = (right_ratio, font_size, font_path, render_mode, line_spacing, column_padding, engine)
+		self._font = _resolve_font(font_path) if engine == "widen" and render_mode != "empty_right" else (None, None)
+		if engine == "widen":
+			# 与 compose_pdf 相同，一次复制全部原页，讲解到达后原地加宽
+			self._dst_doc.insert_pdf(self._src_doc)
+		self._ready: Dict[int, str] = {}
+		self._drawn: Dict[int, str] = {}
+		self._scheduled = False
+		self.counts: List[int] = []
+		self.compose_seconds = 0.0
+
+	@property
+	def page_count(self) -> int:
+		return self._src_doc.page_count
+
+	@property
+	def next_page(self) -> int:
+		"""下一个待合成的源页号"""
+		return len(self.counts)
+
+	def add_page(self, pno: int, explanation: Optional[str]) -> None:
+		"""
+		登记第 pno 页的讲解（失败为 None），从 next_page 起已连续就绪的页随后依次合成。
+
+		在事件循环中调用时逐页让出循环；无运行中的事件循环时立即合成。
+		"""
+		self._ready[pno] = explanation or ""
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			while self.next_page in self._ready:
+				self._step()
+			return
+		if not self._scheduled and self.next_page in self._ready:
+			self._scheduled = True
+			loop.call_soon(self._step_soon, loop)
+
+	def _step_soon(self, loop: asyncio.AbstractEventLoop) -> None:
+		self._scheduled = False
+		if self._dst_doc.is_closed:
+			return
+		self._step()
+		if self.next_page in self._ready:
+			self._scheduled = True
+			loop.call_soon(self._step_soon, loop)
+
+	def _step(self) -> None:
+		start = time.perf_counter()
+		self._compose_next(self._ready.pop(self.next_page))
+		self.compose_seconds += time.perf_counter() - start
+
+	def _compose_next(self, explanation: str) -> None:
+		pno = self.next_page
+		right_ratio, font_size, font_path, render_mode, line_spacing, column_padding, engine = self._params
+		if engine == "widen":
+			# 之前的源页连同续页占据输出的前 sum(counts) 页，本页的副本紧随其后
+			index = sum(self.counts)
+			n_pages = _widen_and_draw(self._dst_doc, index, pno, explanation, font_size, *self._font,
+										render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
+		else:
+			n_pages = _compose_vector(self._dst_doc, self._src_doc, pno, right_ratio, font_size, explanation, font_path=font_path,
+										render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
+		self._drawn[pno] = explanation
+		self.counts.append(n_pages)
+
+	def finish(self, explanations: Optional[Dict[int, str]] = None,
+			output: Optional[Union[str, BinaryIO]] = None) -> Union[bytes, Dict]:
+		"""
+		合成剩余页并输出，之后不可再使用。
+
+		Args:
+			explanations: 最终讲解。与流式阶段已绘制内容不同的页（如空白重试后成功）会被原位替换；
+				为 None 时以已登记的讲解为准
+			output: 同 compose_pdf
+
+		Returns:
+			同 compose_pdf
+		"""
+		start = time.perf_counter()
+		try:
+			while self.next_page < self.page_count:
+				pno = self.next_page
+				self._compose_next(explanations.get(pno, "") if explanations is not None else self._ready.pop(pno, ""))
+			final = explanations if explanations is not None else self._drawn
+			changed = [pno for pno, text in self._drawn.items() if text != final.get(pno, "")]
+			if changed:
+				drawn = [self.counts[pno] for pno in changed]
+				_replace_pages(self._dst_doc, self._src_doc, final, self.counts, changed, *self._params)
+				# 流式阶段绘制这些页时已计数，重绘不重复计入
+				if self._params[3] != "empty_right":
+					count("explained_pages", -len(changed))
+					count("continuation_pages", -sum(n - 1 for n in drawn))
+			right_ratio, font_size, font_path, render_mode, line_spacing, column_padding, engine = self._params
+			_write_compose_map(self._dst_doc, _layout_key(font_size, font_path, render_mode, line_spacing, column_padding, engine),
+							self._source_key, final, self.counts)
+			return _finish_output(self._dst_doc, self.counts, output)
+		finally:
+			self.compose_seconds += time.perf_counter() - start
+			if self._owns_src:
+				self._src_doc.close()
+
+	def close(self) -> None:
+		"""放弃合成并释放文档（finish 之后无需调用）"""
+		if not self._dst_doc.is_closed:
+			self._dst_doc.close()
+		if self._owns_src and not self._src_doc.is_closed:
+			self._src_doc.close()
+
+
+@dataclass
+class PageLayoutPlan:
+	"""plan_layout 对单个源页的排版测量结果。"""
+	page: int
+	columns: int
+	chars: int
+	capacity: int
+	overflow_chars: int
+	continuation_pages: int
+	min_scale: float = 1.0
+	dropped_chars: int = 0
+
+	@property
+	def fits(self) -> bool:
+		# 无续页且 markdown 无需缩小
+		return self.continuation_pages == 0 and self.min_scale >= 0.999
+
+
+def _unrotated_size(page: fitz.Page) -> Tuple[float, float]:
+	w, h = page.rect.width, page.rect.height
+	return (h, w) if page.rotation in (90, 270) else (w, h)
+
+
+def plan_layout(src_bytes: PdfSource, explanations: Dict[int, str], font_size: int,
+				font_path: Optional[str] = None,
+				render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+				pages: Optional[List[int]] = None) -> List[PageLayoutPlan]:
+	"""
+	仅运行测量与分栏阶段（与 compose_pdf 共用同一套逻辑），不嵌入原页、不绘制、不保存 PDF。
+
+	Returns:
+		每个源页的 PageLayoutPlan：使用栏数、溢出字符数、所需续页数等
+	"""
+	src_doc, owns_doc = _open_source(src_bytes)
+	scratch = fitz.open()
+	scratch_pages: Dict[Tuple[float, float], fitz.Page] = {}
+	fontname, fontfile = ("helv", None)
+	if render_mode != "empty_right":
+		fontname, fontfile = _resolve_font(font_path)
+
+	plans: List[PageLayoutPlan] = []
+	for pno in (pages if pages is not None else range(src_doc.page_count)):
+		w, h = _unrotated_size(src_doc.load_page(pno))
+		new_w, new_h = int(w * 3), h
+		text = explanations.get(pno, "")
+		if render_mode == "empty_right" or not text:
+			plans.append(PageLayoutPlan(page=pno, columns=0, chars=len(text), capacity=0, overflow_chars=0, continuation_pages=0))
+			continue
+		page = scratch_pages.get((new_w, new_h))
+		if page is None:
+			page = scratch_pages[(new_w, new_h)] = scratch.new_page(width=new_w, height=new_h)
+		stats: Dict = {}
+		n_cont = _draw_explanation(scratch, page, pno, w, new_w, new_h, font_size, text, fontname, fontfile,
+								render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding,
+								commit=False, stats=stats)
+		plans.append(PageLayoutPlan(page=pno, continuation_pages=n_cont, **stats))
+	scratch.close()
+	if owns_doc:
+		src_doc.close()
+	return plans
+
+
+def _plan_summary(args: Tuple) -> Dict:
+	src_bytes, explanations, font_size, line_spacing, column_padding, font_path, render_mode = args
+	plans = plan_layout(src_bytes, explanations, font_size, font_path=font_path, render_mode=render_mode,
+						line_spacing=line_spacing, column_padding=column_padding)
+	return {
+		"font_size": font_size,
+		"line_spacing": line_spacing,
+		"column_padding": column_padding,
+		"continuation_pages": sum(p.continuation_pages for p in plans),
+		"overflow_pages": [p.page for p in plans if not p.fits],
+		"min_scale": min((p.min_scale for p in plans), default=1.0),
+	}
+
+
+def sweep_layout(src_bytes: bytes, explanations: Dict[int, str], font_sizes: List[int],
+				line_spacings: List[float], column_paddings: List[int],
+				font_path: Optional[str] = None, render_mode: str = "text",
+				max_workers: Optional[int] = None) -> Dict:
+	"""
+	并行遍历排版参数网格（PyMuPDF 非线程安全，使用进程池），找出无需续页/缩小时的最大字号。
+
+	Returns:
+		{"results": [每组参数的汇总], "best": 最大可容纳字号对应的汇总（没有则为 None）}
+	"""
+	grid = [(src_bytes, explanations, fs, ls, cp, font_path, render_mode)
+			for fs in font_sizes for ls in line_spacings for cp in column_paddings]
+	if max_workers == 1 or len(grid) <= 1:
+		results = [_plan_summary(args) for args in grid]
+	else:
+		with ProcessPoolExecutor(max_workers=max_workers) as pool:
+			results = list(pool.map(_plan_summary, grid))
+	fitting = [r for r in results if not r["overflow_pages"]]
+	best = max(fitting, key=lambda r: (r["font_size"], r["line_spacing"], -r["column_padding"]), default=None)
+	return {"results": results, "best": best}
+
+
+def output_is_current(output_path: str, src_bytes: PdfSource, font_size: int,
+					font_path: Optional[str] = None,
+					render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+					engine: str = "vector", explanations: Optional[Dict[int, str]] = None,
+					source_key: Optional[str] = None) -> bool:
+	"""
+	根据输出 PDF 中的合成映射判断其是否与源 PDF、排版参数（以及给定讲解）一致，一致时无需重新合成。
+	"""
+	if not os.path.exists(output_path):
+		return False
+	try:
+		doc = fitz.open(output_path)
+	except Exception:
+		return False
+	try:
+		compose_map = read_compose_map(doc)
+	finally:
+		doc.close()
+	if (compose_map is None
+			or compose_map.get("layout") != _layout_key(font_size, font_path, render_mode, line_spacing, column_padding, engine)
+			or compose_map.get("source") != (source_key or source_digest(src_bytes))):
+		return False
+	if explanations is None:
+		return True
+	return [h for h, _ in compose_map.get("pages", [])] == [
+		_explanation_hash(explanations.get(pno, "")) for pno in range(len(compose_map.get("pages", [])))]
 
-def process_pdf(src_bytes: bytes, api_key: str, model_name: str, user_prompt: str,
+
+# 增量保存累计追加的字节超过上次完整保存大小的该比例时，改为完整重写
+_INCREMENTAL_GROWTH_LIMIT = 0.25
+
+
+def _replace_pages(doc: fitz.Document, src_doc: fitz.Document, explanations: Dict[int, str], counts: List[int],
+				changed: List[int], right_ratio: float, font_size: int, font_path: Optional[str], render_mode: str,
+				line_spacing: float, column_padding: int, engine: str) -> None:
+	"""删除 changed 中各源页对应的输出页并插入重新合成的页，原地更新 counts。"""
+	# 从后往前替换，保证前面页的输出起点不受影响
+	for pno in sorted(changed, reverse=True):
+		start = sum(counts[:pno])
+		doc.delete_pages(start, start + counts[pno] - 1)
+		tmp_doc, new_counts = _compose_pages(src_doc, explanations, right_ratio, font_size, font_path, render_mode,
+											line_spacing, column_padding, engine, from_page=pno, to_page=pno)
+		doc.insert_pdf(tmp_doc, start_at=start)
+		tmp_doc.close()
+		counts[pno] = new_counts[0]
+
+
+def recompose_pdf(prev_pdf: Union[bytes, str], src_bytes: PdfSource, explanations: Dict[int, str],
+				right_ratio: float, font_size: int,
+				font_path: Optional[str] = None,
+				render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+				engine: str = "vector", source_key: Optional[str] = None) -> Tuple[Optional[bytes], List[int]]:
+	"""
+	增量重新合成：仅重新生成讲解发生变化的源页，其余输出页原样保留。
+
+	通过 compose_pdf 写入的合成映射定位每个源页对应的输出页区间，删除变化页并插入新合成的页。
+	若映射缺失、排版参数或源 PDF 不一致，则退回完整合成。
+
+	Args:
+		prev_pdf: 之前的输出（bytes 或文件路径；为路径时以增量方式写回该文件，累计追加的字节超过上次完整保存的
+			_INCREMENTAL_GROWTH_LIMIT 时完整重写一次，避免每次修改都重复嵌入字体使文件不断变大）
+		source_key: 预先计算的 source_digest(src_bytes)
+
+	Returns:
+		(pdf_bytes, changed_pages): 新的 PDF 字节（prev_pdf 为路径时为 None），以及重新合成的源页号
+	"""
+	layout_key = _layout_key(font_size, font_path, render_mode, line_spacing, column_padding, engine)
+	source_key = source_key or source_digest(src_bytes)
+	is_path = isinstance(prev_pdf, str)
+	doc = fitz.open(prev_pdf) if is_path else fitz.open(stream=prev_pdf, filetype="pdf")
+	compose_map = read_compose_map(doc)
+	src_doc, owns_doc = _open_source(src_bytes)
+
+	if (compose_map is None or compose_map.get("layout") != layout_key or compose_map.get("source") != source_key
+			or len(compose_map.get("pages", [])) != src_doc.page_count):
+		n_pages = src_doc.page_count
+		doc.close()
+		if owns_doc:
+			src_doc.close()
+		result = compose_pdf(src_bytes, explanations, right_ratio, font_size, font_path=font_path, render_mode=render_mode,
+							line_spacing=line_spacing, column_padding=column_padding, engine=engine,
+							output=prev_pdf if is_path else None, source_key=source_key)
+		return (None if is_path else result), list(range(n_pages))
+
+	counts = [n for _, n in compose_map["pages"]]
+	changed = [pno for pno, (h, _) in enumerate(compose_map["pages"]) if h != _explanation_hash(explanations.get(pno, ""))]
+	# 增量保存只追加对象，替换页各自嵌入的字体不会去重；记录上次完整保存的大小以计算累计追加量
+	base_size = (compose_map.get("base") or os.path.getsize(prev_pdf)) if is_path else None
+	if changed:
+		_replace_pages(doc, src_doc, explanations, counts, changed, right_ratio, font_size, font_path, render_mode,
+					line_spacing, column_padding, engine)
+		_write_compose_map(doc, layout_key, source_key, explanations, counts, base_size=base_size)
+	if owns_doc:
+		src_doc.close()
+
+	if is_path:
+		if changed:
+			with timed("save"):
+				doc.saveIncr()
+				if os.path.getsize(prev_pdf) - base_size > base_size * _INCREMENTAL_GROWTH_LIMIT:
+					# 累计追加过多：完整重写一次（合并重复对象），之后重新计算基准大小
+					_write_compose_map(doc, layout_key, source_key, explanations, counts)
+					tmp_path = _temp_output_path(prev_pdf)
+					try:
+						doc.save(tmp_path, **_SAVE_KWARGS)
+						doc.close()
+						os.replace(tmp_path, prev_pdf)
+					finally:
+						if os.path.exists(tmp_path):
+							os.remove(tmp_path)
+		if not doc.is_closed:
+			doc.close()
+		return None, changed
+	if not changed:
+		doc.close()
+		return prev_pdf, changed
+	out = doc.tobytes(**_SAVE_KWARGS)
+	doc.close()
+	return out, changed
+
+
+def process_pdf(src_bytes: PdfSource, api_key: str, model_name: str, user_prompt: str,
 				temperature: float, max_tokens: int, dpi: int,
 				right_ratio: float, font_size: int,
 				concurrency: int, rpm_limit: int, tpm_budget: int, rpd_limit: int,
                 font_path: Optional[str] = None,
-				render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10) -> Tuple[bytes, Dict[int, str], List[bytes], List[int]]:
-	# 先生成讲解
-	expl_dict, previews, failed = generate_explanations(
-		src_bytes=src_bytes,
-		api_key=api_key,
-		model_name=model_name,
-		user_prompt=user_prompt,
-		temperature=temperature,
-		max_tokens=max_tokens,
-		dpi=dpi,
-		concurrency=concurrency,
-		rpm_limit=rpm_limit,
-		tpm_budget=tpm_budget,
-		rpd_limit=rpd_limit,
-	)
-	# 再合成PDF
-	result_pdf = compose_pdf(src_bytes, expl_dict, right_ratio, font_size, font_path=font_path, render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding)
-	return result_pdf, expl_dict, previews, failed
+				render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+				engine: str = "vector", streaming: bool = True) -> Tuple[bytes, Dict[int, str], List[bytes], List[int]]:
+	"""
+	生成讲解并合成 PDF。
+
+	Args:
+		streaming: 为 True 时边生成边合成（StreamingComposer），否则等全部讲解生成后再合成
+	"""
+	# 源 PDF 只打开一次，生成与合成共用
+	session = src_bytes if isinstance(src_bytes, PdfSession) else PdfSession(src_bytes)
+	composer = None
+	try:
+		if streaming:
+			composer = StreamingComposer(session, right_ratio, font_size, font_path=font_path, render_mode=render_mode,
+										line_spacing=line_spacing, column_padding=column_padding, engine=engine)
+		try:
+			# 生成讲解（流式模式下每页完成即合成）
+			expl_dict, previews, failed = generate_explanations(
+				src_bytes=session,
+				api_key=api_key,
+				model_name=model_name,
+				user_prompt=user_prompt,
+				temperature=temperature,
+				max_tokens=max_tokens,
+				dpi=dpi,
+				concurrency=concurrency,
+				rpm_limit=rpm_limit,
+				tpm_budget=tpm_budget,
+				rpd_limit=rpd_limit,
+				on_page_done=composer.add_page if composer else None,
+			)
+		except Exception:
+			if composer:
+				composer.close()
+			raise
+		if composer:
+			return composer.finish(expl_dict), expl_dict, previews, failed
+		# 再合成PDF
+		result_pdf = compose_pdf(session, expl_dict, right_ratio, font_size, font_path=font_path, render_mode=render_mode, line_spacing=line_spacing, column_padding=column_padding, engine=engine)
+		return result_pdf, expl_dict, previews, failed
+	finally:
+		if session is not src_bytes:
+			session.close()
 
 
 def match_pdf_json_files(pdf_files: List[str], json_files: List[str]) -> Dict[str, Optional[str]]:
@@ -492,21 +1712,26 @@ def match_pdf_json_files(pdf_files: List[str], json_files: List[str]) -> Dict[st
 	return matches
 
 
-def batch_recompose_from_json(pdf_files: List[Tuple[str, bytes]], json_files: List[Tuple[str, bytes]],
+def batch_recompose_from_json(pdf_files: List[Tuple[str, PdfSource]], json_files: List[Tuple[str, bytes]],
 							right_ratio: float, font_size: int,
 							font_path: Optional[str] = None,
-							render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10) -> Dict[str, Dict]:
+							render_mode: str = "text", line_spacing: float = 1.4, column_padding: int = 10,
+							engine: str = "vector", output_dir: Optional[str] = None) -> Dict[str, Dict]:
 	"""
 	批量根据JSON文件重新合成PDF
 
 	Args:
-		pdf_files: [(filename, bytes), ...] PDF文件列表
+		pdf_files: [(filename, bytes 或 PdfSession), ...] PDF文件列表；传入 PdfSession（如按上传摘要落盘的会话）时
+			直接复用其文档与摘要，不复制源 PDF 字节、不重新计算 source_digest
 		json_files: [(filename, bytes), ...] JSON文件列表
 		right_ratio: 右侧留白比例
 		font_size: 字体大小
 		font_path: 字体文件路径
 		render_mode: 渲染模式
 		line_spacing: 行间距
+		engine: 合成引擎（"vector" / "widen"）
+		output_dir: 输出目录。指定时每个结果直接写入 "<原文件名>讲解版.pdf"，
+			结果中 "pdf_path" 为文件路径、"pdf_bytes" 为 None
 
 	Returns:
 		处理结果字典
@@ -523,17 +1748,20 @@ def batch_recompose_from_json(pdf_files: List[Tuple[str, bytes]], json_files: Li
 	json_content_map = {name: content for name, content in json_files}
 
 	results = {}
+	if output_dir:
+		os.makedirs(output_dir, exist_ok=True)
 
 	for pdf_filename, matched_json in matches.items():
 		result = {
 			"status": "pending",
 			"pdf_bytes": None,
+			"pdf_path": None,
 			"explanations": {},
 			"error": None
 		}
 
 		try:
-			pdf_bytes = pdf_content_map[pdf_filename]
+			pdf_source = pdf_content_map[pdf_filename]
 
 			if matched_json is None:
 				result["status"] = "failed"
@@ -549,18 +1777,23 @@ def batch_recompose_from_json(pdf_files: List[Tuple[str, bytes]], json_files: Li
 
 					# 重新合成PDF
 					result_pdf = compose_pdf(
-						pdf_bytes,
+						pdf_source,
 						explanations,
 						right_ratio,
 						font_size,
 						font_path=font_path,
 						render_mode=render_mode,
 						line_spacing=line_spacing,
-						column_padding=column_padding
+						column_padding=column_padding,
+						engine=engine,
+						output=(os.path.join(output_dir, f"{os.path.splitext(pdf_filename)[0]}讲解版.pdf") if output_dir else None)
 					)
 
 					result["status"] = "completed"
-					result["pdf_bytes"] = result_pdf
+					if output_dir:
+						result["pdf_path"] = result_pdf["path"]
+					else:
+						result["pdf_bytes"] = result_pdf
 					result["explanations"] = explanations
 
 				except json.JSONDecodeError as e:
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import tempfile
+from typing import BinaryIO, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+
+def source_digest(source: Union[bytes, BinaryIO, "PdfSession"], chunk_size: int = 1 << 20) -> str:
+	"""
+	源 PDF 内容的 MD5，即合成映射中记录的 source。
+
+	文件对象按块增量计算；BytesIO（如 Streamlit 的上传文件）直接在其缓冲区上计算，不复制内容；
+	PdfSession 返回其已记录的摘要。
+	调用方可计算一次后通过 source_key 参数传给 compose_pdf 等函数，避免重复哈希。
+	"""
+	if isinstance(source, PdfSession):
+		return source.digest
+	h = hashlib.md5()
+	if isinstance(source, (bytes, bytearray, memoryview)):
+		h.update(source)
+	elif isinstance(source, io.BytesIO):
+		with source.getbuffer() as view:
+			for start in range(0, len(view), chunk_size):
+				h.update(view[start:start + chunk_size])
+	else:
+		pos = source.tell()
+		source.seek(0)
+		try:
+			for chunk in iter(lambda: source.read(chunk_size), b""):
+				h.update(chunk)
+		finally:
+			source.seek(pos)
+	return h.hexdigest()
+
+
+def check_document(doc: fitz.Document) -> Tuple[bool, str]:
+	"""检查已打开的文档：至少一页，且第一页可读取、尺寸有效"""
+	if doc.page_count == 0:
+		return False, "PDF文件没有页面"
+	try:
+		page = doc.load_page(0)
+		if page.rect.width <= 0 or page.rect.height <= 0:
+			return False, "PDF页面尺寸无效"
+	except Exception as e:
+		return False, f"无法读取PDF页面: {str(e)}"
+	return True, ""
+
+
+class PdfSession:
+	"""
+	一次处理中共享的源 PDF：只打开、解析一次，校验结果、页数与内容摘要随之携带。
+
+	可直接传给 validate_pdf_file、generate_explanations、compose_pdf、StreamingComposer、recompose_pdf 等
+	（代替源 PDF 字节），各环节复用同一个 fitz.Document，不再各自重新解析 xref 与对象树。
+	从文件路径打开时 MuPDF 按需从文件读取对象，内存中不保留整份 PDF 的字节副本。
+
+	fitz.Document 非线程安全，同一会话只应在一个线程（如生成讲解的事件循环线程）中使用。
+	无法打开的文件不会抛出异常，而是 is_valid 为 False、error 给出原因。
+	"""
+
+	def __init__(self, source: Union[str, os.PathLike, bytes], digest: Optional[str] = None) -> None:
+		self.path: Optional[str] = None
+		self._data: Optional[bytes] = None
+		if isinstance(source, (str, os.PathLike)):
+			self.path = os.fspath(source)
+		else:
+			self._data = bytes(source)
+		self._digest = digest
+		self.doc: Optional[fitz.Document] = None
+		try:
+			if self.path is not None:
+				self.doc = fitz.open(self.path, filetype="pdf")
+			else:
+				self.doc = fitz.open(stream=self._data, filetype="pdf")
+		except Exception as e:
+			self.is_valid, self.error = False, f"PDF文件无效或已损坏: {str(e)}"
+		else:
+			self.is_valid, self.error = check_document(self.doc)
+
+	@classmethod
+	def spool(cls, source: Union[bytes, BinaryIO], directory: str, digest: Optional[str] = None) -> PdfSession:
+		"""
+		把内存中的 PDF（字节或上传文件）按内容摘要写入 directory 后从文件打开。
+
+		同一内容只写一次（文件名即摘要），后续处理、重试与重新合成直接复用。
+		"""
+		digest = digest or source_digest(source)
+		os.makedirs(directory, exist_ok=True)
+		path = os.path.join(directory, f"{digest}.pdf")
+		if not os.path.exists(path):
+			# 同一进程的多个会话线程可能同时写入同一摘要，临时文件名需各自唯一
+			fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{digest}.", suffix=".tmp")
+			try:
+				with os.fdopen(fd, "wb") as f:
+					if isinstance(source, io.BytesIO):
+						with source.getbuffer() as view:
+							f.write(view)
+					elif isinstance(source, (bytes, bytearray, memoryview)):
+						f.write(source)
+					else:
+						pos = source.tell()
+						source.seek(0)
+						try:
+							for chunk in iter(lambda: source.read(1 << 20), b""):
+								f.write(chunk)
+						finally:
+							source.seek(pos)
+				os.replace(tmp_path, path)
+			finally:
+				if os.path.exists(tmp_path):
+					os.remove(tmp_path)
+		return cls(path, digest=digest)
+
+	@property
+	def page_count(self) -> int:
+		return self.doc.page_count if self.doc is not None else 0
+
+	@property
+	def validation(self) -> Tuple[bool, str]:
+		"""与 validate_pdf_file 相同的 (是否有效, 错误信息)"""
+		return self.is_valid, self.error
+
+	@property
+	def digest(self) -> str:
+		"""源文件内容的 MD5（与 source_digest 一致），首次访问时计算"""
+		if self._digest is None:
+			if self._data is not None:
+				self._digest = source_digest(self._data)
+			else:
+				with open(self.path, "rb") as f:
+					self._digest = source_digest(f)
+		return self._digest
+
+	def require_doc(self) -> fitz.Document:
+		"""返回已打开的文档；文件无效时抛出 ValueError"""
+		if self.doc is None or self.doc.is_closed:
+			raise ValueError(self.error or "PDF 会话已关闭")
+		return self.doc
+
+	def close(self) -> None:
+		if self.doc is not None and not self.doc.is_closed:
+			self.doc.close()
+
+	def __enter__(self) -> PdfSession:
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.close()
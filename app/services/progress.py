@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+
+@dataclass
+class ProgressSnapshot:
+	"""某一时刻的汇总进度"""
+	done: int
+	failed: int
+	total: int
+	cached: int
+	elapsed: float
+	pages_per_minute: float
+	eta_seconds: Optional[float]
+	in_flight: int
+	rate_limit_wait: float
+	message: str = ""
+	label: str = ""
+
+	@property
+	def fraction(self) -> float:
+		return min(1.0, self.done / self.total) if self.total else 0.0
+
+	def describe(self) -> str:
+		parts = [f"{self.done}/{self.total} 页"]
+		if self.failed:
+			parts.append(f"失败 {self.failed}")
+		if self.cached:
+			parts.append(f"缓存 {self.cached}")
+		parts.append(f"{self.pages_per_minute:.1f} 页/分钟")
+		if self.eta_seconds is not None and self.done < self.total:
+			minutes, seconds = divmod(int(self.eta_seconds + 0.5), 60)
+			parts.append(f"预计剩余 {minutes}分{seconds:02d}秒" if minutes else f"预计剩余 {seconds}秒")
+		parts.append(f"进行中请求 {self.in_flight}")
+		parts.append(f"限流等待 {self.rate_limit_wait:.1f}s")
+		text = " · ".join(parts)
+		if self.label:
+			text = f"{self.label}：{text}"
+		return f"{text}\n{self.message}" if self.message else text
+
+
+class ProgressAggregator:
+	"""
+	逐页进度的汇总与限频输出。
+
+	page_done / log 等事件可从任意线程或事件循环中调用，只在锁内累加计数；
+	距上次输出超过 interval 秒时才把合并后的快照交给 sink，因此上千页的批量处理
+	每秒最多刷新 1/interval 次界面，而不是每页一次。sink 在触发输出的线程中调用
+	（Streamlit 中生成讲解的事件循环运行在脚本线程内，可直接更新页面元素）。
+
+	Args:
+		sink: 接收 ProgressSnapshot 的回调
+		interval: 两次输出的最小间隔（秒）
+		total: 初始总页数，之后可用 add_total 追加（批量处理逐个文件开始时）
+	"""
+
+	def __init__(self, sink: Callable[[ProgressSnapshot], None], interval: float = 0.5, total: int = 0,
+				clock: Callable[[], float] = time.monotonic) -> None:
+		self.sink = sink
+		self.interval = interval
+		self.clock = clock
+		self.flushes = 0
+		self._lock = threading.Lock()
+		self._total = total
+		self._done = 0
+		self._failed = 0
+		self._cached = 0
+		self._message = ""
+		self._label = ""
+		self._clients: List = []
+		self._start = clock()
+		self._last_flush: Optional[float] = None
+
+	def track(self, *clients) -> None:
+		"""
+		从这些 GeminiClient 读取进行中的请求数与限流/重试等待时间，多个客户端（如模型路由的
+		快速模型客户端、批量处理中各文件的客户端）的值相加；None 与已跟踪的客户端忽略
+		"""
+		with self._lock:
+			for client in clients:
+				if client is not None and all(client is not c for c in self._clients):
+					self._clients.append(client)
+
+	def add_total(self, n: int) -> None:
+		with self._lock:
+			self._total += n
+
+	def set_label(self, label: str) -> None:
+		with self._lock:
+			self._label = label
+		self.maybe_flush()
+
+	def page_done(self, pno: int, ok: bool = True) -> None:
+		with self._lock:
+			self._done += 1
+			if not ok:
+				self._failed += 1
+		self.maybe_flush()
+
+	def skip(self, n: int) -> None:
+		"""n 页来自缓存：计入总数与完成数，但不计入吞吐"""
+		with self._lock:
+			self._total += n
+			self._done += n
+			self._cached += n
+		self.maybe_flush()
+
+	def log(self, message: str) -> None:
+		with self._lock:
+			self._message = message
+		self.maybe_flush()
+
+	def snapshot(self) -> ProgressSnapshot:
+		with self._lock:
+			done, failed, total, cached = self._done, self._failed, self._total, self._cached
+			message, label = self._message, self._label
+			clients = list(self._clients)
+		elapsed = self.clock() - self._start
+		processed = done - cached
+		rate = processed / elapsed * 60 if elapsed > 0 else 0.0
+		eta = (total - done) / rate * 60 if rate > 0 else None
+		in_flight = sum(client.in_flight for client in clients)
+		wait = sum(client.ratelimiter.wait_seconds + client.retry_wait_seconds for client in clients)
+		return ProgressSnapshot(done=done, failed=failed, total=total, cached=cached, elapsed=elapsed,
+								pages_per_minute=rate, eta_seconds=eta, in_flight=in_flight, rate_limit_wait=wait,
+								message=message, label=label)
+
+	def maybe_flush(self) -> bool:
+		"""距上次输出已超过 interval 时输出快照，返回是否输出"""
+		now = self.clock()
+		with self._lock:
+			if self._last_flush is not None and now - self._last_flush < self.interval:
+				return False
+			self._last_flush = now
+		self._emit()
+		return True
+
+	def flush(self) -> None:
+		"""立即输出（如批量结束时）"""
+		with self._lock:
+			self._last_flush = self.clock()
+		self._emit()
+
+	def _emit(self) -> None:
+		self.flushes += 1
+		self.sink(self.snapshot())
+
+	async def run(self) -> None:
+		"""
+		按固定间隔刷新，直到被取消：等待 LLM 响应或限流期间没有新完成的页时，
+		速度、预计剩余时间、进行中请求与限流等待仍持续更新。
+		"""
+		while True:
+			await asyncio.sleep(self.interval)
+			self.maybe_flush()
@@ -1,11 +1,11 @@
 import os
-import io
 import time
 import json
+import shutil
 import zipfile
 import hashlib
 import tempfile
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import streamlit as st
 from dotenv import load_dotenv
@@ -16,25 +16,226 @@ load_dotenv()
 # 创建临时目录用于存储处理结果
 TEMP_DIR = os.path.join(tempfile.gettempdir(), "pdf_processor_cache")
 os.makedirs(TEMP_DIR, exist_ok=True)
+# 合成结果直接写入磁盘，session_state 只保存路径
+OUTPUT_DIR = os.path.join(TEMP_DIR, "outputs")
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 上传的源 PDF 按内容摘要落盘一次，处理时从文件路径打开
+SOURCE_DIR = os.path.join(TEMP_DIR, "sources")
 
 
-def get_file_hash(file_bytes: bytes, params: dict) -> str:
-	"""生成基于文件内容和参数的哈希值"""
-	content = file_bytes + json.dumps(params, sort_keys=True).encode('utf-8')
-	return hashlib.md5(content).hexdigest()
+def upload_digest(uploaded_file) -> str:
+	"""
+	上传文件内容的 MD5（与输出 PDF 合成映射中的 source 相同），每个上传只计算一次。
+
+	在上传文件的缓冲区上增量计算，不复制内容；结果按 file_id 记在 session_state 中，
+	同一上传在各处理流程和重跑之间复用。
+	"""
+	from app.services.pdf_processor import source_digest
+
+	digests = st.session_state.setdefault("upload_digests", {})
+	key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+	if key not in digests:
+		digests[key] = source_digest(uploaded_file)
+	return digests[key]
+
+
+def upload_session(uploaded_file):
+	"""
+	为上传文件打开 PdfSession：按内容摘要写入 SOURCE_DIR（同一内容只写一次）后从路径打开，
+	校验、渲染讲解与合成共用这一个文档。调用方负责 close()。
+	"""
+	from app.services.pdf_session import PdfSession
+
+	return PdfSession.spool(uploaded_file, SOURCE_DIR, digest=upload_digest(uploaded_file))
+
+
+# 不影响输出的参数不参与缓存键：更换 API Key、调整调用期限或对冲不会使已缓存的结果失效，API Key 也不进入缓存文件名
+CACHE_KEY_EXCLUDED = ("api_key", "request_timeout", "hedge")
+
+
+def get_file_hash(content_digest: str, params: dict) -> str:
+	"""生成基于文件内容摘要（upload_digest）和参数的哈希值（不含 CACHE_KEY_EXCLUDED 中的参数）"""
+	key_params = {k: v for k, v in params.items() if k not in CACHE_KEY_EXCLUDED}
+	content = content_digest + json.dumps(key_params, sort_keys=True)
+	return hashlib.md5(content.encode('utf-8')).hexdigest()
 
 
 def save_result_to_file(file_hash: str, result: dict) -> str:
 	"""将处理结果保存到临时文件"""
 	filepath = os.path.join(TEMP_DIR, f"{file_hash}.json")
 	with open(filepath, 'w', encoding='utf-8') as f:
-		# 不保存pdf_bytes到文件，只保存其他信息
+		# 不保存PDF到JSON，输出文件路径由哈希确定
 		result_copy = result.copy()
 		result_copy.pop('pdf_bytes', None)
+		result_copy.pop('pdf_path', None)
 		json.dump(result_copy, f, ensure_ascii=False, indent=2)
 	return filepath
 
 
+def cached_output_path(file_hash: str) -> str:
+	"""按文件内容与参数哈希确定的输出路径，相同输入复用同一份 PDF"""
+	return os.path.join(OUTPUT_DIR, f"{file_hash}.pdf")
+
+
+def session_output_path(name: str) -> str:
+	"""当前会话专属的输出文件路径（重新合成、ZIP 等会被原地更新的文件）"""
+	session_dir = st.session_state.get("output_dir")
+	if not session_dir or not os.path.isdir(session_dir):
+		session_dir = tempfile.mkdtemp(dir=OUTPUT_DIR)
+		st.session_state["output_dir"] = session_dir
+	return os.path.join(session_dir, name)
+
+
+def has_output(result: dict) -> bool:
+	return bool(result.get("pdf_path")) and os.path.exists(result["pdf_path"])
+
+
+# 已压缩格式再次 deflate 几乎不减小体积，只消耗 CPU，直接存储
+STORED_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".zip")
+
+
+def zip_compress_type(arcname: str) -> int:
+	return zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+
+def write_zip_file(zip_path: str, entries: List[Tuple[str, object]]) -> str:
+	"""
+	将 (归档名, 文件路径或字节) 写入磁盘上的 ZIP 文件。
+	文件路径按块读入，不会把整份 PDF 载入内存；PDF（compose_pdf 已 deflate）以 STORED 写入，JSON 等文本仍 DEFLATED。
+	"""
+	with zipfile.ZipFile(zip_path, 'w') as zip_file:
+		for arcname, content in entries:
+			if isinstance(content, bytes):
+				zip_file.writestr(arcname, content, compress_type=zip_compress_type(arcname))
+			else:
+				zip_file.write(content, arcname, compress_type=zip_compress_type(arcname))
+	return zip_path
+
+
+def zip_signature(entries: List[Tuple[str, object]]) -> str:
+	"""ZIP 内容签名：文件按路径/大小/修改时间，字节按哈希；内容未变化时复用已打包的 ZIP"""
+	h = hashlib.md5()
+	for arcname, content in entries:
+		if isinstance(content, bytes):
+			h.update(f"{arcname}|{hashlib.md5(content).hexdigest()}\n".encode("utf-8"))
+		else:
+			stat = os.stat(content)
+			h.update(f"{arcname}|{content}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+	return h.hexdigest()
+
+
+def lazy_zip_download(label: str, entries: List[Tuple[str, object]], zip_name: str, key: str, **kwargs) -> None:
+	"""
+	按需打包下载：点击“打包”后才把 entries 写入会话目录下的 ZIP 文件，随后显示下载按钮。
+	内容未变化时直接复用上次打包结果，没人下载时不做任何打包。
+	"""
+	built = st.session_state.get(f"{key}_built")
+	signature = zip_signature(entries) if entries else None
+	if not (built and built["signature"] == signature and os.path.exists(built["path"])):
+		if not st.button(f"🗜️ 打包 {len(entries)} 个文件为 ZIP", key=f"{key}_build", use_container_width=True,
+						disabled=kwargs.get("disabled", False) or not entries):
+			return
+		with st.spinner("正在打包..."):
+			built = {"path": write_zip_file(session_output_path(zip_name), entries), "signature": signature}
+		st.session_state[f"{key}_built"] = built
+	file_download_button(label, built["path"], mime="application/zip", key=key, **kwargs)
+
+
+def stage_breakdown(run_report) -> None:
+	"""各阶段耗时明细（次数、总耗时、p50/p95/p99），并提供 JSON 与 Prometheus 格式下载"""
+	from app.services.metrics import COUNTERS, STAGES, continuation_rate, dedup_ratio, output_tokens_per_page
+
+	stages = run_report.batch.summary()
+	if not stages:
+		return
+	counters = run_report.batch.counters()
+	if counters:
+		st.caption("；".join(f"{COUNTERS.get(name, name)}：{value:g}" for name, value in counters.items()))
+		ratios = {name: dedup_ratio(metrics.counters()) for name, metrics in run_report.files.items()}
+		ratios = {name: ratio for name, ratio in ratios.items() if ratio is not None}
+		if ratios:
+			st.caption("去重率：" + "；".join(f"{name} {ratio:.0%}" for name, ratio in ratios.items()))
+		if counters.get("explained_pages"):
+			st.caption(f"续页率：{continuation_rate(counters):.2f} 页/页；每页输出 token：{output_tokens_per_page(counters):g}")
+	with st.expander("⏱️ 阶段耗时", expanded=False):
+		rows = ["| 阶段 | 次数 | 总耗时(s) | p50(ms) | p95(ms) | p99(ms) |", "|---|---:|---:|---:|---:|---:|"]
+		for stage, stats in stages.items():
+			rows.append(f"| {STAGES.get(stage, stage)} | {stats['count']} | {stats['total']:.2f} | "
+						f"{stats['p50'] * 1000:.1f} | {stats['p95'] * 1000:.1f} | {stats['p99'] * 1000:.1f} |")
+		st.markdown("\n".join(rows))
+		st.caption("并发请求的阶段耗时相互重叠，各阶段总耗时之和可能大于总耗时。")
+		memory = run_report.memory()
+		if "peak_rss" in memory:
+			mb = 1024 * 1024
+			rows = ["| 阶段 | RSS 峰值(MB) | Python 分配峰值(MB) |", "|---|---:|---:|"]
+			for stage, stats in stages.items():
+				if "peak_rss" in stats:
+					rows.append(f"| {STAGES.get(stage, stage)} | {stats['peak_rss'] / mb:.1f} | {stats['peak_traced'] / mb:.1f} |")
+			for name, peak in memory["files"].items():
+				if peak:
+					rows.append(f"| 文件：{name} | {peak['peak_rss'] / mb:.1f} | {peak['peak_traced'] / mb:.1f} |")
+			st.markdown("\n".join(rows))
+			st.caption(f"整体峰值：RSS {memory['peak_rss'] / mb:.1f} MB，Python 分配 {memory['peak_traced'] / mb:.1f} MB")
+		budget = memory.get("budget")
+		if budget and budget["pressure_events"]:
+			st.caption(f"接近内存预算 {budget['pressure_events']} 次：限制渲染 {budget['throttled']} 次，"
+					f"预览落盘 {budget['spilled']} 个")
+		col_json, col_prom = st.columns(2)
+		with col_json:
+			st.download_button("下载运行报告 (JSON)", data=run_report.to_json().encode("utf-8"),
+							file_name="run_report.json", mime="application/json", use_container_width=True)
+		with col_prom:
+			st.download_button("下载指标 (Prometheus)", data=run_report.to_prometheus().encode("utf-8"),
+							file_name="run_report.prom", mime="text/plain", use_container_width=True)
+
+
+def progress_panel(interval: float = 0.5):
+	"""
+	页级进度条与状态文字，返回以固定频率刷新它们的 ProgressAggregator：
+	逐页事件只在内存中累加，每 interval 秒最多向浏览器发送一次更新。
+	"""
+	from app.services.progress import ProgressAggregator
+
+	bar = st.progress(0)
+	text = st.empty()
+
+	def sink(snapshot) -> None:
+		bar.progress(int(snapshot.fraction * 100))
+		text.caption(snapshot.describe().replace("\n", "  \n"))
+
+	return ProgressAggregator(sink, interval=interval)
+
+
+def start_memory_controls():
+	"""
+	按侧边栏设置创建本次运行的内存跟踪（已启动）与内存预算；两者都可能为 None。
+	这两项只影响资源使用、不影响结果，保存在 session_state 中而不进入缓存键（params）。
+	"""
+	from app.services.memory import MemoryBudget, MemoryTracer
+
+	tracer = MemoryTracer().start() if st.session_state.get("memory_trace") else None
+	budget = MemoryBudget.from_mb(st.session_state.get("memory_budget_mb"))
+	return tracer, budget
+
+
+def stop_memory_controls(tracer, budget) -> None:
+	"""停止内存跟踪；界面不展示预览，落盘的预览随之删除"""
+	if tracer is not None:
+		tracer.stop()
+	if budget is not None:
+		budget.cleanup()
+
+
+def file_download_button(label: str, path: Optional[str], **kwargs) -> None:
+	"""从磁盘文件提供下载；文件仅在渲染按钮时读取一次"""
+	if not path or not os.path.exists(path):
+		kwargs["disabled"] = True
+		st.download_button(label=label, data=b"", **kwargs)
+		return
+	with open(path, "rb") as f:
+		st.download_button(label=label, data=f, **kwargs)
+
+
 def load_result_from_file(file_hash: str) -> Optional[dict]:
 	"""从临时文件加载处理结果"""
 	filepath = os.path.join(TEMP_DIR, f"{file_hash}.json")
@@ -47,45 +248,69 @@ def load_result_from_file(file_hash: str) -> Optional[dict]:
 	return None
 
 
-@st.cache_data
-def cached_process_pdf(src_bytes: bytes, params: dict) -> dict:
-	"""缓存的PDF处理函数"""
+def process_uploaded_pdf(session, content_digest: str, params: dict, progress=None, memory_budget=None) -> dict:
+	"""
+	处理单个上传文件（session 为已打开的 PdfSession），结果按 content_digest 与 params 缓存到临时文件。
+
+	Args:
+		progress: 页级进度汇总（ProgressAggregator），逐页事件由它限频刷新到页面
+		memory_budget: 内存预算（MemoryBudget），接近预算时生成讲解自动降级
+	"""
 	from app.services import pdf_processor
 
-	file_hash = get_file_hash(src_bytes, params)
+	file_hash = get_file_hash(content_digest, params)
 	column_padding = params.get("column_padding", 10)
+	options = pdf_processor.ExplainOptions.from_params(params)
+	pdf_path = cached_output_path(file_hash)
 
 	# 尝试从缓存文件加载
 	cached_result = load_result_from_file(file_hash)
 	if cached_result and cached_result.get("status") == "completed":
-		# 如果有缓存，需要重新生成PDF bytes（因为bytes不能序列化到JSON）
+		cached_result["pdf_path"] = pdf_path
+		if os.path.exists(pdf_path):
+			return cached_result
+		# 输出文件已被清理，使用缓存的讲解重新合成
 		try:
-			result_bytes = pdf_processor.compose_pdf(
-				src_bytes,
+			pdf_processor.compose_pdf(
+				session,
 				cached_result["explanations"],
 				params["right_ratio"],
 				params["font_size"],
 				font_path=(params.get("cjk_font_path") or None),
 				render_mode=params.get("render_mode", "markdown"),
 				line_spacing=params["line_spacing"],
-				column_padding=column_padding
+				column_padding=column_padding,
+				engine=params.get("compose_engine", "vector"),
+				output=pdf_path,
+				source_key=content_digest
 			)
-			cached_result["pdf_bytes"] = result_bytes
 			return cached_result
 		except Exception as e:
 			# 从缓存重新合成PDF失败，返回错误结果
 			return {
 				"status": "failed",
-				"pdf_bytes": None,
+				"pdf_path": None,
 				"explanations": {},
 				"failed_pages": [],
 				"error": f"从缓存重新合成PDF失败: {str(e)}"
 			}
 
-	# 没有缓存或缓存无效，重新处理
+	# 没有缓存或缓存无效，重新处理：每页讲解返回后立即合成，与生成重叠
+	composer = None
 	try:
+		composer = pdf_processor.StreamingComposer(
+			session,
+			params["right_ratio"],
+			params["font_size"],
+			font_path=(params.get("cjk_font_path") or None),
+			render_mode=params.get("render_mode", "markdown"),
+			line_spacing=params["line_spacing"],
+			column_padding=column_padding,
+			engine=params.get("compose_engine", "vector"),
+			source_key=content_digest
+		)
 		explanations, preview_images, failed_pages = pdf_processor.generate_explanations(
-			src_bytes=src_bytes,
+			src_bytes=session,
 			api_key=params["api_key"],
 			model_name=params["model_name"],
 			user_prompt=params["user_prompt"],
@@ -96,22 +321,16 @@ def cached_process_pdf(src_bytes: bytes, params: dict) -> dict:
 			rpm_limit=params["rpm_limit"],
 			tpm_budget=params["tpm_budget"],
 			rpd_limit=params["rpd_limit"],
+			on_page_done=composer.add_page,
+			progress=progress,
+			memory_budget=memory_budget,
+			options=options,
 		)
-
-		result_bytes = pdf_processor.compose_pdf(
-			src_bytes,
-			explanations,
-			params["right_ratio"],
-			params["font_size"],
-			font_path=(params.get("cjk_font_path") or None),
-			render_mode=params.get("render_mode", "markdown"),
-			line_spacing=params["line_spacing"],
-			column_padding=column_padding
-		)
+		composer.finish(explanations, output=pdf_path)
 
 		result = {
 			"status": "completed",
-			"pdf_bytes": result_bytes,
+			"pdf_path": pdf_path,
 			"explanations": explanations,
 			"failed_pages": failed_pages
 		}
@@ -122,9 +341,11 @@ def cached_process_pdf(src_bytes: bytes, params: dict) -> dict:
 		return result
 
 	except Exception as e:
+		if composer:
+			composer.close()
 		result = {
 			"status": "failed",
-			"pdf_bytes": None,
+			"pdf_path": None,
 			"explanations": {},
 			"failed_pages": [],
 			"error": str(e)
@@ -132,6 +353,88 @@ def cached_process_pdf(src_bytes: bytes, params: dict) -> dict:
 		return result
 
 
+@st.cache_resource
+def get_job_queue():
+	from app.services.job_queue import JobQueue
+	return JobQueue()
+
+
+def tracked_job_ids() -> List[str]:
+	"""当前页面跟踪的任务 ID，保存在 URL 查询参数中，浏览器刷新后仍然有效"""
+	return [j for j in st.query_params.get("jobs", "").split(",") if j]
+
+
+def submit_jobs(uploaded_files, params: dict) -> List[str]:
+	from app.services.job_worker import ensure_worker
+
+	queue = get_job_queue()
+	# 先确认 worker 使用当前填写的 API Key，Key 不一致时不提交任务
+	try:
+		ensure_worker(queue, int(st.session_state.get("job_concurrency", 2)), api_key=params.get("api_key"))
+	except ValueError as e:
+		st.error(str(e))
+		st.stop()
+	job_ids = [queue.submit(f.getvalue(), f.name, params) for f in uploaded_files]
+	st.query_params["jobs"] = ",".join(tracked_job_ids() + job_ids)
+	return job_ids
+
+
+@st.fragment(run_every=2)
+def job_progress_panel():
+	"""每 2 秒轮询一次运行中任务的进度；全部结束后整页刷新以显示下载"""
+	from app.services.job_queue import QUEUED, RUNNING
+
+	queue = get_job_queue()
+	active = [j for j in queue.list_jobs(tracked_job_ids()) if j["status"] in (QUEUED, RUNNING)]
+	if not active:
+		if st.session_state.pop("jobs_active", False):
+			st.rerun()
+		return
+	st.session_state["jobs_active"] = True
+	for job in active:
+		if job["status"] == QUEUED:
+			st.progress(0, text=f"⏳ {job['filename']}：排队中")
+		else:
+			pct = job["done"] / job["total"] if job["total"] else 0.0
+			st.progress(pct, text=f"🔄 {job['filename']}：{job['done']}/{job['total']} {job['message'] or ''}")
+	if not queue.live_workers():
+		st.warning("未检测到运行中的 worker，请执行 `python -m app.services.job_worker` 或重新提交任务。")
+
+
+def render_jobs():
+	from app.services.job_queue import COMPLETED, FAILED, CANCELLED, QUEUED
+
+	job_ids = tracked_job_ids()
+	if not job_ids:
+		return
+	queue = get_job_queue()
+	jobs = queue.list_jobs(job_ids)
+	st.subheader("🗂️ 后台任务")
+	job_progress_panel()
+	for job in jobs:
+		base_name = os.path.splitext(job["filename"])[0]
+		if job["status"] == COMPLETED:
+			st.success(f"✅ {job['filename']} 处理完成" + (f"（{len(job['failed_pages'])} 页讲解失败）" if job["failed_pages"] else ""))
+			col_dl1, col_dl2 = st.columns(2)
+			with col_dl1:
+				file_download_button(f"📄 {base_name}讲解版.pdf", job["pdf_path"], file_name=f"{base_name}讲解版.pdf",
+									mime="application/pdf", use_container_width=True, key=f"job_pdf_{job['id']}")
+			with col_dl2:
+				file_download_button(f"📝 {base_name}.json", job["json_path"], file_name=f"{base_name}.json",
+									mime="application/json", use_container_width=True, key=f"job_json_{job['id']}")
+		elif job["status"] == FAILED:
+			st.error(f"❌ {job['filename']} 处理失败: {job['error']}")
+		elif job["status"] == CANCELLED:
+			st.info(f"🚫 {job['filename']} 已取消")
+		elif job["status"] == QUEUED:
+			if st.button(f"取消 {job['filename']}", key=f"job_cancel_{job['id']}"):
+				queue.cancel(job["id"])
+				st.rerun()
+	if st.button("清除任务列表", key="job_clear"):
+		del st.query_params["jobs"]
+		st.rerun()
+
+
 def setup_page():
 	st.set_page_config(page_title="PDF 讲解流 · Gemini 2.5 Pro", layout="wide")
 	st.title("PDF 讲解流 · Gemini 2.5 Pro")
@@ -139,13 +442,30 @@ def setup_page():
 
 
 def sidebar_form():
+	from app.services.page_analysis import parse_route_overrides
+
 	with st.sidebar:
 		st.header("参数配置")
 		api_key = st.text_input("GEMINI_API_KEY", value=os.getenv('GEMINI_API_KEY'),type="password")
 		model_name = st.text_input("模型名", value="gemini-2.5-pro")
+		fast_model_name = st.text_input("快速模型名(可选)", value="", placeholder="gemini-2.5-flash",
+										help="填写后可启用模型路由：简单的页交给快速模型，复杂的页交给上面的模型，两者独立限流")
+		routing = st.selectbox("模型路由", ["off", "auto"], index=0, disabled=not fast_model_name.strip(),
+							help="auto：按页面复杂度（文字密度、公式、图片、表格）自动选择模型")
+		route_threshold = st.number_input("复杂度阈值", min_value=0.0, max_value=10.0, value=1.0, step=0.25,
+										disabled=routing != "auto", help="复杂度低于该值的页使用快速模型")
+		route_pages = st.text_input("逐页指定模型", value="", placeholder="1-3=fast,7=strong",
+									disabled=not fast_model_name.strip(), help="页码从 1 起，优先于自动判定")
+		fast_rpm_limit = st.number_input("快速模型 RPM 上限", min_value=10, max_value=10000, value=1000, step=10,
+										disabled=not fast_model_name.strip())
 		temperature = st.slider("温度", 0.0, 1.0, 0.4, 0.1)
 		max_tokens = st.number_input("最大输出 tokens", min_value=256, max_value=8192, value=4096, step=256)
 		dpi = st.number_input("渲染DPI(仅供LLM)", min_value=96, max_value=300, value=180, step=12)
+		image_mode = st.selectbox("LLM 图片", ["full", "adaptive"], index=0,
+								help="full：按渲染DPI发送整页；adaptive：裁去空白边距，按最小字号与小图逐页选择 DPI")
+		min_dpi, max_dpi = st.slider("自适应 DPI 范围", 72, 300, (96, 220), 12, disabled=image_mode != "adaptive")
+		input_mode = st.selectbox("LLM 输入", ["image", "hybrid"], index=0,
+								help="image：只发送页面图片；hybrid：文字为主的页附上 PDF 文本层并改发 72 DPI 低分辨率图片，减少输入 token")
 		right_ratio = st.slider("右侧留白比例", 0.2, 0.6, 0.48, 0.01)
 		font_size = st.number_input("右栏字体大小", min_value=8, max_value=20, value=20, step=1)
 		line_spacing = st.slider("讲解文本行距", 0.6, 2.0, 1.2, 0.1)
@@ -154,15 +474,47 @@ def sidebar_form():
 		rpm_limit = st.number_input("RPM 上限(请求/分钟)", min_value=10, max_value=5000, value=150, step=10)
 		tpm_budget = st.number_input("TPM 预算(令牌/分钟)", min_value=100000, max_value=20000000, value=2000000, step=100000)
 		rpd_limit = st.number_input("RPD 上限(请求/天)", min_value=100, max_value=100000, value=10000, step=100)
+		request_timeout = st.number_input("单次调用期限(秒，0 为不限)", min_value=0, max_value=3600, value=300, step=30,
+										help="单次 LLM 调用超过该时间仍未返回时放弃并重试，避免一次卡住的调用拖住整个文件")
+		hedge = st.checkbox("对冲慢请求", value=False,
+							help="调用超过最近耗时的 p90 仍未返回时，在 RPM/TPM 额度允许且 RPD 留有余量时再发一个相同请求，先返回的为准")
 		user_prompt = st.text_area("讲解风格/要求(系统提示)", value="请用中文讲解本页pdf，关键词给出英文，讲解详尽，语言简洁易懂。讲解让人一看就懂，便于快速学习。请避免不必要的换行，使页面保持紧凑。")
 		cjk_font_path = st.text_input("CJK 字体文件路径(可选)", value="assets/fonts/SIMHEI.TTF")
 		render_mode = st.selectbox("右栏渲染方式", ["text", "markdown"], index=1)
+		length_budget = st.selectbox("篇幅控制", ["off", "prompt", "condense"], index=0,
+									help="prompt：按右栏字号/行距估算每页能容纳的字数，写入提示词并限制输出 token，减少续页；"
+										"condense：另外把超出上限的讲解再请求一次压缩")
+		compose_engine = st.selectbox("合成引擎", ["vector", "widen"], index=0, help="vector：逐页嵌入原页；widen：一次复制原页并加宽页面，合成更快、文件更小")
+		trivial_pages = st.selectbox("空白/过渡页", ["off", "skip", "batch"], index=0,
+									help="本地识别空白页、章节分隔页等：skip 不调用 LLM，直接注明；batch 将过渡页拼图后合并为一次请求")
+		duplicate_pages = st.selectbox("重复页", ["off", "share", "diff"], index=0,
+									help="share：内容相同的页（重复的目录页等）只讲解一次并共用；diff：另外对动画逐步展开的页只讲解新增内容")
+		st.checkbox("后台任务队列", key="use_job_queue", help="提交到本地任务队列，由后台 worker 进程处理；刷新页面不会中断任务")
+		st.number_input("同时运行任务数", min_value=1, max_value=8, value=int(os.getenv("JOB_WORKER_CONCURRENCY", "2")), step=1,
+						key="job_concurrency", help="后台 worker 同时处理的文件数（首次启动 worker 时生效），API 限额在任务间均分")
+		st.number_input("内存预算(MB，0 为不限)", min_value=0, max_value=65536, value=0, step=256, key="memory_budget_mb",
+						help="接近预算时减少同时渲染的页数、预览落盘并释放缓存，避免大批量处理时内存耗尽")
+		st.checkbox("内存跟踪", key="memory_trace", help="记录各阶段与各文件的内存峰值（tracemalloc 与 RSS 采样），显示在阶段耗时中")
+		try:
+			parse_route_overrides(route_pages)
+		except ValueError as e:
+			st.error(f"逐页指定模型无效，已忽略：{e}")
+			route_pages = ""
 		return {
 			"api_key": api_key,
 			"model_name": model_name,
 			"temperature": float(temperature),
 			"max_tokens": int(max_tokens),
 			"dpi": int(dpi),
+			"image_mode": image_mode,
+			"min_dpi": int(min_dpi),
+			"max_dpi": int(max_dpi),
+			"input_mode": input_mode,
+			"fast_model_name": fast_model_name.strip(),
+			"routing": routing if fast_model_name.strip() else "off",
+			"route_threshold": float(route_threshold),
+			"route_pages": route_pages.strip() if fast_model_name.strip() else "",
+			"fast_rpm_limit": int(fast_rpm_limit),
 			"right_ratio": float(right_ratio),
 			"font_size": int(font_size),
 			"line_spacing": float(line_spacing),
@@ -171,9 +523,15 @@ def sidebar_form():
 			"rpm_limit": int(rpm_limit),
 			"tpm_budget": int(tpm_budget),
 			"rpd_limit": int(rpd_limit),
+			"request_timeout": int(request_timeout),
+			"hedge": bool(hedge),
 			"user_prompt": user_prompt.strip(),
 			"cjk_font_path": cjk_font_path.strip(),
 			"render_mode": render_mode,
+			"compose_engine": compose_engine,
+			"length_budget": length_budget,
+			"trivial_pages": trivial_pages,
+			"duplicate_pages": duplicate_pages,
 		}
 
 
@@ -219,17 +577,13 @@ def main():
 
 	# 初始化session_state
 	if "batch_results" not in st.session_state:
-		st.session_state["batch_results"] = {}  # {filename: {"pdf_bytes": bytes, "explanations": dict, "status": str, "failed_pages": list}}
+		st.session_state["batch_results"] = {}  # {filename: {"pdf_path": str, "explanations": dict, "status": str, "failed_pages": list}}
 	if "batch_processing" not in st.session_state:
 		st.session_state["batch_processing"] = False
-	if "batch_zip_bytes" not in st.session_state:
-		st.session_state["batch_zip_bytes"] = None
 	if "batch_json_results" not in st.session_state:
 		st.session_state["batch_json_results"] = {}
 	if "batch_json_processing" not in st.session_state:
 		st.session_state["batch_json_processing"] = False
-	if "batch_json_zip_bytes" not in st.session_state:
-		st.session_state["batch_json_zip_bytes"] = None
 
 	with col_run:
 		if st.button("批量生成讲解与合成", type="primary", use_container_width=True, disabled=st.session_state.get("batch_processing", False)):
@@ -239,42 +593,55 @@ def main():
 			if not params["api_key"]:
 				st.error("请在侧边栏填写 GEMINI_API_KEY")
 				st.stop()
+			if st.session_state.get("use_job_queue"):
+				# 后台任务模式：提交后立即返回，由 worker 进程执行
+				submit_jobs(uploaded_files, params)
+				st.rerun()
 
 			st.session_state["batch_processing"] = True
 			st.session_state["batch_results"] = {}
-			st.session_state["batch_zip_bytes"] = None
 
 			total_files = len(uploaded_files)
 			st.info(f"开始批量处理 {total_files} 个文件：逐页渲染→生成讲解→合成新PDF（保持向量）")
 
 			# 延后导入以加快首屏
 			from app.services import pdf_processor
+			from app.services.metrics import RunReport, activate, deactivate
 
-			# 整体进度
+			# 各阶段耗时（渲染、限流等待、生成讲解、合成、保存），逐文件与整批汇总；可选内存峰值与预算
+			tracer, memory_budget = start_memory_controls()
+			run_report = RunReport(tracer=tracer, budget=memory_budget)
+
+			# 整体进度（按文件）与页级进度（限频刷新）
 			overall_progress = st.progress(0)
 			overall_status = st.empty()
+			page_progress = progress_panel()
 
 			# 限制同时处理的PDF数量，避免API过载
 			max_concurrent_pdfs = min(5, total_files)  # 最多同时处理5个PDF
 
 			for i, uploaded_file in enumerate(uploaded_files):
 				filename = uploaded_file.name
-				st.session_state["batch_results"][filename] = {"status": "processing", "pdf_bytes": None, "explanations": {}, "failed_pages": [], "json_bytes": None}
+				st.session_state["batch_results"][filename] = {"status": "processing", "pdf_path": None, "explanations": {}, "failed_pages": [], "json_bytes": None}
 
 				# 更新整体进度
 				overall_progress.progress(int((i / total_files) * 100))
 				overall_status.write(f"正在处理文件 {i+1}/{total_files}: {filename}")
 
+				session = None
+				metrics_token = activate(run_report.file(filename))
 				try:
-					# 读取源PDF bytes
-					src_bytes = uploaded_file.read()
+					# 内容摘要每个上传只计算一次，缓存键与合成映射都复用它；
+					# 源 PDF 只打开一次，校验、生成与合成共用同一个会话
+					content_digest = upload_digest(uploaded_file)
+					session = upload_session(uploaded_file)
 
 					# 验证PDF文件有效性
-					is_valid, validation_error = pdf_processor.validate_pdf_file(src_bytes)
+					is_valid, validation_error = pdf_processor.validate_pdf_file(session)
 					if not is_valid:
 						st.session_state["batch_results"][filename] = {
 							"status": "failed",
-							"pdf_bytes": None,
+							"pdf_path": None,
 							"explanations": {},
 							"failed_pages": [],
 							"error": f"PDF文件验证失败: {validation_error}"
@@ -283,26 +650,33 @@ def main():
 						continue
 
 					# 检查是否有缓存
-					file_hash = get_file_hash(src_bytes, params)
+					file_hash = get_file_hash(content_digest, params)
 					cached_result = load_result_from_file(file_hash)
 
+					page_progress.set_label(filename)
 					if cached_result and cached_result.get("status") == "completed":
 						st.info(f"📋 {filename} 使用缓存结果")
-						# 从缓存加载，需要重新合成PDF
+						page_progress.skip(session.page_count)
+						# 从缓存加载；输出文件仍在时直接复用，否则重新合成到该文件
 						try:
-							result_bytes = pdf_processor.compose_pdf(
-								src_bytes,
-								cached_result["explanations"],
-								params["right_ratio"],
-								params["font_size"],
-								font_path=(params.get("cjk_font_path") or None),
-								render_mode=params.get("render_mode", "markdown"),
-								line_spacing=params["line_spacing"],
-								column_padding=column_padding_value
-							)
+							pdf_path = cached_output_path(file_hash)
+							if not os.path.exists(pdf_path):
+								pdf_processor.compose_pdf(
+									session,
+									cached_result["explanations"],
+									params["right_ratio"],
+									params["font_size"],
+									font_path=(params.get("cjk_font_path") or None),
+									render_mode=params.get("render_mode", "markdown"),
+									line_spacing=params["line_spacing"],
+									column_padding=column_padding_value,
+									engine=params.get("compose_engine", "vector"),
+									output=pdf_path,
+									source_key=content_digest
+								)
 							st.session_state["batch_results"][filename] = {
 								"status": "completed",
-								"pdf_bytes": result_bytes,
+								"pdf_path": pdf_path,
 								"explanations": cached_result["explanations"],
 								"failed_pages": cached_result["failed_pages"],
 								"json_bytes": None
@@ -310,13 +684,14 @@ def main():
 						except Exception as e:
 							# 缓存重新合成失败，标记为失败并尝试重新处理
 							st.warning(f"缓存重新合成失败，尝试重新处理: {str(e)}")
-							st.session_state["batch_results"][filename] = {"status": "processing", "pdf_bytes": None, "explanations": {}, "failed_pages": []}
+							st.session_state["batch_results"][filename] = {"status": "processing", "pdf_path": None, "explanations": {}, "failed_pages": []}
 							# 继续到下面的重新处理逻辑
 							cached_result = None
 					else:
 						# 需要重新处理
 						with st.spinner(f"处理 {filename} 中..."):
-							result = cached_process_pdf(src_bytes, params)
+							result = process_uploaded_pdf(session, content_digest, params, progress=page_progress,
+														memory_budget=memory_budget)
 							st.session_state["batch_results"][filename] = result
 
 					result = st.session_state["batch_results"][filename]
@@ -330,14 +705,21 @@ def main():
 				except Exception as e:
 					st.session_state["batch_results"][filename] = {
 						"status": "failed",
-						"pdf_bytes": None,
+						"pdf_path": None,
 						"explanations": {},
 						"failed_pages": [],
 						"error": str(e)
 					}
 					st.error(f"❌ {filename} 处理失败: {str(e)}")
+				finally:
+					deactivate(metrics_token)
+					if session is not None:
+						session.close()
 
 			# 完成处理
+			stop_memory_controls(tracer, memory_budget)
+			st.session_state["run_report"] = run_report.finish()
+			page_progress.flush()
 			overall_progress.progress(100)
 			overall_status.write("批量处理完成！")
 
@@ -350,34 +732,19 @@ def main():
 			else:
 				st.error("❌ 所有文件处理失败")
 
-			# 预生成每个文件的 json_bytes，并构建ZIP缓存
+			# 预生成每个文件的 json_bytes（ZIP 在点击下载时才打包）
 			for fname, res in st.session_state["batch_results"].items():
 				if res.get("status") == "completed" and res.get("explanations"):
 					try:
 						res["json_bytes"] = json.dumps(res["explanations"], ensure_ascii=False, indent=2).encode("utf-8")
 					except Exception:
 						res["json_bytes"] = None
-			# 仅当存在成功项时构建ZIP
-			completed_any = any(r.get("status") == "completed" and r.get("pdf_bytes") for r in st.session_state["batch_results"].values())
-			if completed_any:
-				zip_buffer = io.BytesIO()
-				with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-					for fname, res in st.session_state["batch_results"].items():
-						if res.get("status") == "completed" and res.get("pdf_bytes"):
-							base_name = os.path.splitext(fname)[0]
-							new_filename = f"{base_name}讲解版.pdf"
-							zip_file.writestr(new_filename, res["pdf_bytes"])
-							if res.get("json_bytes"):
-								json_filename = f"{base_name}.json"
-								zip_file.writestr(json_filename, res["json_bytes"])
-				zip_buffer.seek(0)
-				st.session_state["batch_zip_bytes"] = zip_buffer.getvalue()
-			else:
-				st.session_state["batch_zip_bytes"] = None
 
 			st.session_state["batch_processing"] = False
 
 	with col_save:
+		render_jobs()
+
 		# 显示批量处理结果
 		batch_results = st.session_state.get("batch_results", {})
 		if batch_results:
@@ -388,13 +755,18 @@ def main():
 			completed_files = sum(1 for r in batch_results.values() if r["status"] == "completed")
 			failed_files = sum(1 for r in batch_results.values() if r["status"] == "failed")
 
-			col_stat1, col_stat2, col_stat3 = st.columns(3)
+			run_report = st.session_state.get("run_report")
+			col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
 			with col_stat1:
 				st.metric("总文件数", total_files)
 			with col_stat2:
 				st.metric("成功处理", completed_files)
 			with col_stat3:
 				st.metric("处理失败", failed_files)
+			with col_stat4:
+				st.metric("总耗时", f"{run_report.elapsed:.1f}s" if run_report else "-")
+			if run_report:
+				stage_breakdown(run_report)
 
 			# 详细结果列表
 			with st.expander("查看详细结果", expanded=False):
@@ -423,74 +795,89 @@ def main():
 
 					if retry_files:
 						from app.services import pdf_processor
+						from app.services.metrics import RunReport, activate, deactivate
 
+						tracer, memory_budget = start_memory_controls()
+						run_report = RunReport(tracer=tracer, budget=memory_budget)
+						options = pdf_processor.ExplainOptions.from_params(params)
 						retry_progress = st.progress(0)
 						retry_status = st.empty()
+						page_progress = progress_panel()
 
 						for i, uploaded_file in enumerate(retry_files):
 							filename = uploaded_file.name
 							retry_progress.progress(int((i / len(retry_files)) * 100))
 							retry_status.write(f"重试文件 {i+1}/{len(retry_files)}: {filename}")
 
+							session = None
+							metrics_token = activate(run_report.file(filename))
 							try:
-								src_bytes = uploaded_file.read()
-
-								file_progress = st.progress(0)
-								file_status = st.empty()
-
-								def on_file_progress(done: int, total: int):
-									pct = int(done * 100 / max(1, total))
-									file_progress.progress(pct)
-									file_status.write(f"{filename}: 正在生成讲解 {done}/{total}")
-
-								def on_file_log(msg: str):
-									file_status.write(f"{filename}: {msg}")
+								content_digest = upload_digest(uploaded_file)
+								session = upload_session(uploaded_file)
+								page_progress.set_label(filename)
 
 								with st.spinner(f"重试 {filename} 中..."):
-									explanations, preview_images, failed_pages = pdf_processor.generate_explanations(
-										src_bytes=src_bytes,
-										api_key=params["api_key"],
-										model_name=params["model_name"],
-										user_prompt=params["user_prompt"],
-										temperature=params["temperature"],
-										max_tokens=params["max_tokens"],
-										dpi=params["dpi"],
-										concurrency=min(params["concurrency"], 10),
-										rpm_limit=params["rpm_limit"],
-										tpm_budget=params["tpm_budget"],
-										rpd_limit=params["rpd_limit"],
-										on_progress=on_file_progress,
-										on_log=on_file_log,
-									)
-
-									result_bytes = pdf_processor.compose_pdf(
-										src_bytes,
-										explanations,
+									file_hash = get_file_hash(content_digest, params)
+									pdf_path = cached_output_path(file_hash)
+									composer = pdf_processor.StreamingComposer(
+										session,
 										params["right_ratio"],
 										params["font_size"],
 										font_path=(params.get("cjk_font_path") or None),
 										render_mode=params.get("render_mode", "markdown"),
 										line_spacing=params["line_spacing"],
-										column_padding=column_padding_value
+										column_padding=column_padding_value,
+										engine=params.get("compose_engine", "vector"),
+										source_key=content_digest
 									)
-
-								st.session_state["batch_results"][filename] = {
+									try:
+										explanations, preview_images, failed_pages = pdf_processor.generate_explanations(
+											src_bytes=session,
+											api_key=params["api_key"],
+											model_name=params["model_name"],
+											user_prompt=params["user_prompt"],
+											temperature=params["temperature"],
+											max_tokens=params["max_tokens"],
+											dpi=params["dpi"],
+											concurrency=min(params["concurrency"], 10),
+											rpm_limit=params["rpm_limit"],
+											tpm_budget=params["tpm_budget"],
+											rpd_limit=params["rpd_limit"],
+											on_log=page_progress.log,
+											on_page_done=composer.add_page,
+											progress=page_progress,
+											memory_budget=memory_budget,
+											options=options,
+										)
+									except Exception:
+										composer.close()
+										raise
+									composer.finish(explanations, output=pdf_path)
+
+								result = {
 									"status": "completed",
-									"pdf_bytes": result_bytes,
+									"pdf_path": pdf_path,
 									"explanations": explanations,
 									"failed_pages": failed_pages
 								}
+								# 与首次处理相同，讲解与输出 PDF 一起缓存，下次运行直接复用
+								save_result_to_file(file_hash, result)
+								st.session_state["batch_results"][filename] = result
 
 								st.success(f"✅ {filename} 重试成功！")
 								if failed_pages:
 									st.warning(f"⚠️ {filename} 中仍有 {len(failed_pages)} 页生成讲解失败")
 
-								file_progress.empty()
-								file_status.empty()
-
 							except Exception as e:
 								st.error(f"❌ {filename} 重试仍然失败: {str(e)}")
-
+							finally:
+								deactivate(metrics_token)
+								if session is not None:
+									session.close()
+
+						stop_memory_controls(tracer, memory_budget)
+						st.session_state["run_report"] = run_report.finish()
+						page_progress.flush()
 						retry_progress.progress(100)
 						retry_status.write("重试完成！")
 
@@ -507,30 +894,36 @@ def main():
 			st.subheader("📥 下载结果")
 
 			if download_mode == "打包下载":
-				zip_bytes = st.session_state.get("batch_zip_bytes")
-				st.download_button(
-					label="📦 下载所有PDF和讲解JSON (ZIP)",
-					data=zip_bytes,
+				zip_entries = []
+				for fname, res in batch_results.items():
+					if res.get("status") == "completed" and has_output(res):
+						base_name = os.path.splitext(fname)[0]
+						zip_entries.append((f"{base_name}讲解版.pdf", res["pdf_path"]))
+						if res.get("json_bytes"):
+							zip_entries.append((f"{base_name}.json", res["json_bytes"]))
+				lazy_zip_download(
+					"📦 下载所有PDF和讲解JSON (ZIP)",
+					zip_entries,
+					"batch.zip",
 					file_name=zip_filename,
-					mime="application/zip",
 					use_container_width=True,
-					disabled=st.session_state.get("batch_processing", False) or not bool(zip_bytes),
+					disabled=st.session_state.get("batch_processing", False),
 					key="download_all_zip"
 				)
 
 			else:  # 分别下载
 				st.write("**分别下载每个文件：**")
 				for filename, result in batch_results.items():
-					if result["status"] == "completed" and result["pdf_bytes"]:
+					if result["status"] == "completed" and has_output(result):
 						base_name = os.path.splitext(filename)[0]
 						pdf_filename = f"{base_name}讲解版.pdf"
 						json_filename = f"{base_name}.json"
 
 						col_dl1, col_dl2 = st.columns(2)
 						with col_dl1:
-							st.download_button(
-								label=f"📄 {pdf_filename}",
-								data=result["pdf_bytes"],
+							file_download_button(
+								f"📄 {pdf_filename}",
+								result["pdf_path"],
 								file_name=pdf_filename,
 								mime="application/pdf",
 								use_container_width=True,
@@ -585,22 +978,44 @@ def main():
 					recompose_progress.progress(int((i / len(uploaded_files)) * 100))
 					recompose_status.write(f"重新合成 {i+1}/{len(uploaded_files)}: {filename}")
 
+					session = None
 					try:
-						src_bytes = uploaded_file.read()
-						result_bytes = pdf_processor.compose_pdf(
-							src_bytes,
-							st.session_state["explanations"],
-							params["right_ratio"],
-							params["font_size"],
+						session = upload_session(uploaded_file)
+						compose_kwargs = dict(
 							font_path=(params.get("cjk_font_path") or None),
 							render_mode=params.get("render_mode", "markdown"),
 							line_spacing=params["line_spacing"],
-							column_padding=column_padding_value
+							column_padding=column_padding_value,
+							engine=params.get("compose_engine", "vector")
 						)
+						pdf_path = session_output_path(f"recompose_{hashlib.md5(filename.encode('utf-8')).hexdigest()}.pdf")
+						prev_result = st.session_state["batch_results"].get(filename) or {}
+						if prev_result.get("status") == "completed" and has_output(prev_result):
+							# 已有输出：复制到会话文件后增量写回，仅重新合成讲解发生变化的页
+							if os.path.abspath(prev_result["pdf_path"]) != os.path.abspath(pdf_path):
+								shutil.copyfile(prev_result["pdf_path"], pdf_path)
+							_, changed_pages = pdf_processor.recompose_pdf(
+								pdf_path,
+								session,
+								st.session_state["explanations"],
+								params["right_ratio"],
+								params["font_size"],
+								**compose_kwargs
+							)
+							st.caption(f"{filename}: 重新合成 {len(changed_pages)} 页")
+						else:
+							pdf_processor.compose_pdf(
+								session,
+								st.session_state["explanations"],
+								params["right_ratio"],
+								params["font_size"],
+								output=pdf_path,
+								**compose_kwargs
+							)
 
 						recompose_results[filename] = {
 							"status": "completed",
-							"pdf_bytes": result_bytes,
+							"pdf_path": pdf_path,
 							"explanations": st.session_state["explanations"].copy(),
 							"failed_pages": []
 						}
@@ -610,12 +1025,15 @@ def main():
 					except Exception as e:
 						recompose_results[filename] = {
 							"status": "failed",
-							"pdf_bytes": None,
+							"pdf_path": None,
 							"explanations": {},
 							"failed_pages": [],
 							"error": str(e)
 						}
 						st.error(f"❌ {filename} 重新合成失败: {str(e)}")
+					finally:
+						if session is not None:
+							session.close()
 
 				# 保存重新合成的结果
 				st.session_state["batch_results"] = recompose_results
@@ -657,39 +1075,32 @@ def main():
 			st.info("开始批量根据JSON重新生成PDF...")
 			st.session_state["batch_json_processing"] = True
 			st.session_state["batch_json_results"] = {}
-			st.session_state["batch_json_zip_bytes"] = None
-			# 将确认配对转为现有批处理入口的两个列表，并让 JSON 名与 PDF 同名匹配
+			# 将确认配对转为现有批处理入口的两个列表，并让 JSON 名与 PDF 同名匹配；
+			# PDF 按上传摘要落盘后以会话传入，不复制上传内容，合成映射直接使用已计算的摘要
 			pdf_data, json_data = [], []
-			for pdf_obj, json_obj in pairs:
-				pdf_name = pdf_obj.name
-				json_alias = os.path.splitext(pdf_name)[0] + ".json"
-				pdf_data.append((pdf_name, pdf_obj.read()))
-				json_data.append((json_alias, json_obj.read()))
-			batch_results = pdf_processor.batch_recompose_from_json(
-				pdf_data,
-				json_data,
-				params["right_ratio"],
-				params["font_size"],
-				font_path=(params.get("cjk_font_path") or None),
-				render_mode=params.get("render_mode", "markdown"),
-				line_spacing=params["line_spacing"],
-				column_padding=column_padding_value
-			)
+			try:
+				for pdf_obj, json_obj in pairs:
+					pdf_name = pdf_obj.name
+					json_alias = os.path.splitext(pdf_name)[0] + ".json"
+					pdf_data.append((pdf_name, upload_session(pdf_obj)))
+					json_data.append((json_alias, json_obj.read()))
+				batch_results = pdf_processor.batch_recompose_from_json(
+					pdf_data,
+					json_data,
+					params["right_ratio"],
+					params["font_size"],
+					font_path=(params.get("cjk_font_path") or None),
+					render_mode=params.get("render_mode", "markdown"),
+					line_spacing=params["line_spacing"],
+					column_padding=column_padding_value,
+					engine=params.get("compose_engine", "vector"),
+					output_dir=session_output_path("json_batch")
+				)
+			finally:
+				for _name, session in pdf_data:
+					session.close()
+			del pdf_data, json_data
 			st.session_state["batch_json_results"] = batch_results
-			# 构建ZIP缓存
-			completed_count = sum(1 for r in batch_results.values() if r["status"] == "completed" and r.get("pdf_bytes"))
-			if completed_count > 0:
-				zip_buffer = io.BytesIO()
-				with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-					for filename, result in batch_results.items():
-						if result["status"] == "completed" and result.get("pdf_bytes"):
-							base_name = os.path.splitext(filename)[0]
-							new_filename = f"{base_name}讲解版.pdf"
-							zip_file.writestr(new_filename, result["pdf_bytes"])
-				zip_buffer.seek(0)
-				st.session_state["batch_json_zip_bytes"] = zip_buffer.getvalue()
-			else:
-				st.session_state["batch_json_zip_bytes"] = None
 			st.session_state["batch_json_processing"] = False
 
 		if pdf_files and json_files and len(pdf_files) == 1 and len(json_files) == 1:
@@ -793,28 +1204,32 @@ def main():
 				st.metric("处理失败", failed_files)
 			if completed_files > 0:
 				zip_filename = f"批量JSON重新生成PDF_{time.strftime('%Y%m%d_%H%M%S')}.zip"
-				zip_bytes = st.session_state.get("batch_json_zip_bytes")
-				st.download_button(
-					label="📦 下载所有成功处理的PDF (ZIP)",
-					data=zip_bytes,
+				zip_entries = [
+					(os.path.basename(result["pdf_path"]), result["pdf_path"])
+					for result in batch_json_results.values()
+					if result["status"] == "completed" and has_output(result)
+				]
+				lazy_zip_download(
+					"📦 下载所有成功处理的PDF (ZIP)",
+					zip_entries,
+					"json_batch.zip",
 					file_name=zip_filename,
-					mime="application/zip",
 					use_container_width=True,
 					key="batch_json_zip_download",
-					disabled=st.session_state.get("batch_json_processing", False) or not bool(zip_bytes)
+					disabled=st.session_state.get("batch_json_processing", False)
 				)
 			st.write("**分别下载每个成功处理的文件：**")
 			for filename, result in batch_json_results.items():
-				if result["status"] == "completed" and result["pdf_bytes"]:
+				if result["status"] == "completed" and has_output(result):
 					base_name = os.path.splitext(filename)[0]
 					pdf_filename = f"{base_name}讲解版.pdf"
 					col_dl1, col_dl2 = st.columns([3, 1])
 					with col_dl1:
 						st.write(f"📄 {pdf_filename}")
 					with col_dl2:
-						st.download_button(
-							label="下载",
-							data=result["pdf_bytes"],
+						file_download_button(
+							"下载",
+							result["pdf_path"],
 							file_name=pdf_filename,
 							mime="application/pdf",
 							key=f"batch_json_pdf_{filename}",
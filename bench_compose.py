@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+合成/排版/渲染基准：在生成的语料（1~1000 页，短/长讲解，text/markdown 模式）上测量
+_smart_text_layout、_compose_vector、compose_pdf（含保存）、_page_png_bytes 与 batch_recompose_from_json，
+记录耗时、峰值内存与输出大小，并可保存为 JSON 基线、与基线对比标记性能回退：
+
+	python bench_compose.py --save benchmarks/baseline.json
+	python bench_compose.py --compare benchmarks/baseline.json
+	python bench_compose.py --pages 1 10 --lengths short --modes text --compare benchmarks/baseline.json
+
+对比时耗时超过基线 --time-threshold（默认 25%）、峰值内存超过 --memory-threshold、输出大小超过
+--size-threshold 的用例记为回退，有回退时退出码为 1。基线中记录了 Python/PyMuPDF 版本与平台，
+与当前环境不一致时只给出提示（耗时在不同机器之间不可比）。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fitz
+
+from app.services import pdf_processor
+
+
+CASES = ("smart_text_layout", "page_png_bytes", "compose_vector", "compose_pdf", "batch_recompose_from_json")
+
+# 大语料只计时一次
+MAX_REPEAT_PAGES = 100
+
+# 低于此值的差异视为噪声（秒 / 字节）
+MIN_TIME_DELTA = 0.005
+MIN_MEMORY_DELTA = 256 * 1024
+
+
+def create_corpus(n_pages: int) -> bytes:
+	"""标题、正文、矢量图形与一张小位图，接近常见的课件页"""
+	doc = fitz.open()
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+	pix.set_rect(pix.irect, (40, 90, 200))
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+		page.insert_text((50, 110), f"Topic {i % 7} - bullet {i}", fontsize=14, fontname="helv")
+		page.draw_rect(fitz.Rect(50, 140, 400, 360), color=(0.2, 0.3, 0.8), width=2)
+		page.insert_image(fitz.Rect(450, 140, 650, 340), pixmap=pix)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def make_explanation(pno: int, length: str, mode: str) -> str:
+	"""short 约 150 字、一栏；long 约 1800 字、占满三栏"""
+	sentence = f"第 {pno + 1} 页讲解：本页介绍核心概念及其应用场景，并结合示例说明推导过程。"
+	if length == "short":
+		body = sentence * 4
+		return f"## 要点\n\n- **概念**：{body}" if mode == "markdown" else body
+	paragraphs = [sentence * 8 for _ in range(6)]
+	if mode == "markdown":
+		return "\n\n".join(f"### 第 {k + 1} 部分\n\n- **重点**：{p}" for k, p in enumerate(paragraphs))
+	return "\n\n".join(paragraphs)
+
+
+def bench_smart_text_layout(src: bytes, explanations: Dict[int, str], args: argparse.Namespace, mode: str) -> Optional[int]:
+	rects, _parts, _build, _cap = pdf_processor._column_layout(720, 2160, 405, args.font_size, "x" * 5000,
+															render_mode=mode, line_spacing=args.line_spacing)
+	for text in explanations.values():
+		pdf_processor._smart_text_layout(text, rects, args.font_size, None, "", mode, args.line_spacing)
+	return None
+
+
+def bench_page_png_bytes(src: bytes, explanations: Dict[int, str], args: argparse.Namespace, mode: str) -> Optional[int]:
+	doc = fitz.open(stream=src, filetype="pdf")
+	try:
+		return sum(len(pdf_processor._page_png_bytes(doc, pno, args.dpi)) for pno in range(doc.page_count))
+	finally:
+		doc.close()
+
+
+def bench_compose_vector(src: bytes, explanations: Dict[int, str], args: argparse.Namespace, mode: str) -> Optional[int]:
+	src_doc = fitz.open(stream=src, filetype="pdf")
+	dst_doc = fitz.open()
+	try:
+		for pno in range(src_doc.page_count):
+			pdf_processor._compose_vector(dst_doc, src_doc, pno, 0.48, args.font_size, explanations[pno],
+										font_path=args.font_path, render_mode=mode, line_spacing=args.line_spacing)
+		return None
+	finally:
+		dst_doc.close()
+		src_doc.close()
+
+
+def bench_compose_pdf(src: bytes, explanations: Dict[int, str], args: argparse.Namespace, mode: str) -> Optional[int]:
+	return len(pdf_processor.compose_pdf(src, explanations, 0.48, args.font_size, font_path=args.font_path,
+										render_mode=mode, line_spacing=args.line_spacing))
+
+
+def bench_batch_recompose_from_json(src: bytes, explanations: Dict[int, str], args: argparse.Namespace, mode: str) -> Optional[int]:
+	data = json.dumps({str(k): v for k, v in explanations.items()}, ensure_ascii=False).encode("utf-8")
+	with tempfile.TemporaryDirectory() as out_dir:
+		results = pdf_processor.batch_recompose_from_json(
+			[("deck.pdf", src)], [("deck.json", data)], 0.48, args.font_size, font_path=args.font_path,
+			render_mode=mode, line_spacing=args.line_spacing, output_dir=out_dir)
+		result = results["deck.pdf"]
+		if result["status"] != "completed":
+			raise RuntimeError(result.get("error"))
+		return os.path.getsize(result["pdf_path"])
+
+
+BENCHMARKS: Dict[str, Callable] = {
+	"smart_text_layout": bench_smart_text_layout,
+	"page_png_bytes": bench_page_png_bytes,
+	"compose_vector": bench_compose_vector,
+	"compose_pdf": bench_compose_pdf,
+	"batch_recompose_from_json": bench_batch_recompose_from_json,
+}
+
+
+def case_key(case: str, pages: int, length: str, mode: str) -> str:
+	return f"{case}/{pages}p/{length}/{mode}"
+
+
+def measure(fn: Callable, repeat: int, memory: bool) -> Dict:
+	"""
+	先预热一次（字体加载等一次性开销），再取 repeat 次中最短的耗时；
+	峰值内存单独运行一次（tracemalloc 会拖慢计时），只统计 Python 侧分配（含输出字节），不含 MuPDF 内部内存
+	"""
+	if repeat > 1:
+		fn()
+	times = []
+	size = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		size = fn()
+		times.append(time.perf_counter() - start)
+	result = {"seconds": round(min(times), 6), "output_bytes": size}
+	if memory:
+		tracemalloc.start()
+		try:
+			fn()
+			result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+	return result
+
+
+def run_suite(args: argparse.Namespace) -> Dict[str, Dict]:
+	results: Dict[str, Dict] = {}
+	for pages in args.pages:
+		src = create_corpus(pages)
+		repeat = args.repeat if pages <= MAX_REPEAT_PAGES else 1
+		for case in args.cases:
+			# 渲染与讲解内容无关，只测一次
+			variants = [("-", "-")] if case == "page_png_bytes" else [(l, m) for l in args.lengths for m in args.modes]
+			for length, mode in variants:
+				explanations = {pno: make_explanation(pno, length, mode) for pno in range(pages)} if length != "-" else {}
+				fn = lambda: BENCHMARKS[case](src, explanations, args, mode)  # noqa: E731
+				# 未指定字体时 _resolve_font 每页打印提示，不计入结果
+				with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+					result = measure(fn, repeat, not args.no_memory)
+				result["pages"] = pages
+				result["ms_per_page"] = round(result["seconds"] / pages * 1000, 3)
+				key = case_key(case, pages, length, mode)
+				results[key] = result
+				print(f"  {key:<48} {result['seconds']:9.3f}s  {result['ms_per_page']:8.2f} ms/页"
+					+ (f"  峰值 {result['peak_bytes'] / 1024 / 1024:7.1f} MB" if "peak_bytes" in result else "")
+					+ (f"  输出 {result['output_bytes'] / 1024:9.1f} KB" if result["output_bytes"] else ""))
+	return results
+
+
+def environment() -> Dict:
+	return {"python": platform.python_version(), "pymupdf": fitz.VersionBind, "platform": platform.platform()}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], time_threshold: float,
+			memory_threshold: float, size_threshold: float) -> Tuple[List[str], List[str]]:
+	"""返回 (回退, 改进) 的说明列表；只比较两边都有的用例"""
+	regressions, improvements = [], []
+	checks = (
+		("seconds", time_threshold, MIN_TIME_DELTA, "耗时", lambda v: f"{v:.3f}s"),
+		("peak_bytes", memory_threshold, MIN_MEMORY_DELTA, "峰值内存", lambda v: f"{v / 1024 / 1024:.1f}MB"),
+		("output_bytes", size_threshold, 0, "输出大小", lambda v: f"{v / 1024:.1f}KB"),
+	)
+	for key, result in results.items():
+		base = baseline.get(key)
+		if base is None:
+			continue
+		for field, threshold, min_delta, label, fmt in checks:
+			old, new = base.get(field), result.get(field)
+			if not old or new is None:
+				continue
+			change = (new - old) / old
+			text = f"{key} {label} {fmt(old)} → {fmt(new)} ({change:+.0%})"
+			if change > threshold and new - old > min_delta:
+				regressions.append(text)
+			elif change < -threshold and old - new > min_delta:
+				improvements.append(text)
+	return regressions, improvements
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="合成/排版/渲染基准与回退检查")
+	parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000])
+	parser.add_argument("--lengths", nargs="+", choices=["short", "long"], default=["short", "long"])
+	parser.add_argument("--modes", nargs="+", choices=["text", "markdown"], default=["text", "markdown"])
+	parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+	parser.add_argument("--repeat", type=int, default=3, help=f"每个用例计时次数，取最短（超过 {MAX_REPEAT_PAGES} 页的语料只计一次）")
+	parser.add_argument("--no-memory", action="store_true", help="不测峰值内存")
+	parser.add_argument("--dpi", type=int, default=180)
+	parser.add_argument("--font-size", type=int, default=14)
+	parser.add_argument("--line-spacing", type=float, default=1.2)
+	parser.add_argument("--font-path", default=None)
+	parser.add_argument("--save", default=None, help="把结果保存为 JSON 基线")
+	parser.add_argument("--compare", default=None, help="与 JSON 基线对比，有回退时退出码为 1")
+	parser.add_argument("--time-threshold", type=float, default=0.25)
+	parser.add_argument("--memory-threshold", type=float, default=0.25)
+	parser.add_argument("--size-threshold", type=float, default=0.05)
+	args = parser.parse_args(argv)
+
+	print(f"📊 语料 {args.pages} 页，讲解 {args.lengths}，模式 {args.modes}，DPI {args.dpi}，字号 {args.font_size}")
+	results = run_suite(args)
+
+	if args.save:
+		os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+		with open(args.save, "w", encoding="utf-8") as f:
+			json.dump({"environment": environment(), "args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+		print(f"💾 基线已保存：{args.save}")
+
+	if args.compare:
+		with open(args.compare, encoding="utf-8") as f:
+			baseline = json.load(f)
+		if baseline.get("environment") != environment():
+			print(f"⚠️ 基线环境 {baseline.get('environment')} 与当前 {environment()} 不同，耗时仅供参考")
+		regressions, improvements = compare(results, baseline["results"], args.time_threshold,
+											args.memory_threshold, args.size_threshold)
+		for text in improvements:
+			print(f"  ✅ {text}")
+		for text in regressions:
+			print(f"  ❌ {text}")
+		print(f"对比 {args.compare}：回退 {len(regressions)} 项，改进 {len(improvements)} 项")
+		if regressions:
+			return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
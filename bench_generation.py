@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+离线基准：用确定性的 FakeBackend 代替 Gemini，测量调度（并发槽位）、限流器、重试与流式合成的端到端吞吐。
+
+延迟与 429 只由 seed 与页内容决定，同样的参数多次运行结果可复现，不联网、不消耗配额：
+
+	python bench_generation.py --pages 200 --latency 0.5 --rate-limit-rate 0.02 --concurrency 10 20 40
+	python bench_generation.py --pages 100 --rpm 300 --json bench.json
+	python bench_generation.py --pages 200 --latency-sigma 1.3 --hedge   # 对比对冲前后的单页耗时 p99
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Dict, List
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+from app.services.metrics import RunReport, use_metrics
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+		page.insert_text((50, 120), f"Topic {i % 7} - bullet {i}", fontsize=14, fontname="helv")
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def run_once(src_bytes: bytes, args: argparse.Namespace, concurrency: int, hedge: bool = False) -> Dict:
+	random.seed(args.seed)
+	backend = FakeBackend(latency=args.latency, latency_sigma=args.latency_sigma, rate_limit_rate=args.rate_limit_rate,
+						output_chars=args.output_chars, seed=args.seed)
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=args.rpm, tpm_budget=args.tpm, rpd_limit=10**9, backend=backend,
+						request_timeout=args.request_timeout or None, hedge=hedge)
+	client.retry_delay = args.retry_delay
+	# 模拟延迟远小于真实调用，阈值下限按延迟中位数缩放
+	client.hedge_min_delay = args.latency
+	composer = pdf_processor.StreamingComposer(src_bytes, 0.48, args.font_size, render_mode=args.render_mode)
+	report = RunReport()
+	start = time.perf_counter()
+	with use_metrics(report.batch):
+		explanations, _previews, failed = pdf_processor.generate_explanations(
+			src_bytes, None, "fake", "请讲解本页", 0.0, 0, args.dpi, concurrency, args.rpm, args.tpm, 10**9,
+			on_page_done=composer.add_page, client=client,
+		)
+	generated = time.perf_counter()
+	explain = report.batch.summary().get("explain_page", {})
+	counters = report.batch.counters()
+	meta = composer.finish(explanations, output=args.output) if args.output else composer.finish(explanations)
+	elapsed = time.perf_counter() - start
+	size = meta["size"] if isinstance(meta, dict) else len(meta)
+	return {
+		"concurrency": concurrency,
+		"hedge": hedge,
+		"pages": len(explanations),
+		"failed_pages": len(failed),
+		"elapsed": round(elapsed, 3),
+		"generate_seconds": round(generated - start, 3),
+		"compose_seconds": round(composer.compose_seconds, 3),
+		"pages_per_minute": round(len(explanations) / elapsed * 60, 1),
+		"rate_limited": backend.rate_limited,
+		"page_p50": explain.get("p50", 0.0),
+		"page_p99": explain.get("p99", 0.0),
+		"hedged_requests": counters.get("hedged_requests", 0),
+		"hedge_wins": counters.get("hedge_wins", 0),
+		"request_timeouts": counters.get("request_timeouts", 0),
+		"usage": dict(client.usage),
+		"output_bytes": size,
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="离线生成+合成基准（FakeBackend）")
+	parser.add_argument("--pages", type=int, default=100)
+	parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 20, 40])
+	parser.add_argument("--latency", type=float, default=0.5, help="模拟延迟中位数（秒）")
+	parser.add_argument("--latency-sigma", type=float, default=0.5)
+	parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟 429 的概率")
+	parser.add_argument("--retry-delay", type=float, default=1.0, help="首次重试等待（秒）")
+	parser.add_argument("--output-chars", type=int, default=800)
+	parser.add_argument("--rpm", type=int, default=100000)
+	parser.add_argument("--tpm", type=int, default=10**12)
+	parser.add_argument("--dpi", type=int, default=72)
+	parser.add_argument("--font-size", type=int, default=14)
+	parser.add_argument("--render-mode", choices=["text", "markdown"], default="text")
+	parser.add_argument("--output", default=None, help="讲解版 PDF 写入路径（默认只在内存中生成）")
+	parser.add_argument("--request-timeout", type=float, default=0.0, help="单次调用期限（秒），0 为不限")
+	parser.add_argument("--hedge", action="store_true", help="每个并发度另跑一次对冲慢请求，对比单页耗时 p99")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", default=None, help="把结果写入 JSON 文件")
+	args = parser.parse_args()
+
+	src_bytes = create_test_pdf(args.pages)
+	results: List[Dict] = []
+	print(f"📊 {args.pages} 页，延迟中位数 {args.latency}s (sigma {args.latency_sigma})，429 概率 {args.rate_limit_rate}，RPM {args.rpm}")
+	for concurrency in args.concurrency:
+		r = run_once(src_bytes, args, concurrency)
+		results.append(r)
+		print(f"  并发 {concurrency:>3}: {r['elapsed']:.2f}s，{r['pages_per_minute']:.0f} 页/分钟，"
+			f"合成 {r['compose_seconds']:.2f}s，429 {r['rate_limited']} 次，失败页 {r['failed_pages']}，"
+			f"单页 p99 {r['page_p99']:.2f}s")
+		if args.hedge:
+			h = run_once(src_bytes, args, concurrency, hedge=True)
+			results.append(h)
+			print(f"    对冲: {h['elapsed']:.2f}s，单页 p99 {r['page_p99']:.2f}s → {h['page_p99']:.2f}s，"
+				f"对冲 {h['hedged_requests']} 次（先返回 {h['hedge_wins']} 次），"
+				f"请求数 {r['usage']['requests']} → {h['usage']['requests'] + h['hedged_requests']}")
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as f:
+			json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+	main()
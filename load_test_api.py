@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+HTTP API 压测脚本：多个客户端线程并发提交 PDF、订阅 SSE 逐页进度并下载讲解版 PDF，
+统计提交延迟、首个进度事件延迟与端到端耗时的分位数，以及整体吞吐（页/分钟）。
+
+默认在进程内启动服务并使用模拟后端 FakeBackend（对数正态延迟、可注入 429，不联网、不消耗配额），
+请求仍经过 GeminiClient 的限流与重试：
+
+	python load_test_api.py --clients 8 --jobs 16 --pages 20 --latency 0.5 --rate-limit-rate 0.05
+
+也可对已启动的服务压测（此时后端由服务端决定，如 python -m app.server --backend fake）：
+
+	python load_test_api.py --url http://127.0.0.1:8765 --clients 4 --jobs 8
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+import fitz
+
+from app.server import ApiService, create_server
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+		page.draw_rect(fitz.Rect(50, 100, 670, 360), color=(0.2, 0.3, 0.8), width=2)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def iter_sse(response) -> Iterator[Tuple[str, Dict]]:
+	"""解析 text/event-stream，逐个产出 (event, data)"""
+	event, data = "message", []
+	for raw in response:
+		line = raw.decode("utf-8").rstrip("\r\n")
+		if not line:
+			if data:
+				yield event, json.loads("\n".join(data))
+			event, data = "message", []
+		elif line.startswith("event:"):
+			event = line[6:].strip()
+		elif line.startswith("data:"):
+			data.append(line[5:].strip())
+
+
+def run_one(base_url: str, src_bytes: bytes, index: int, options: str) -> Dict[str, float]:
+	"""提交一个 PDF 并跟随进度直到完成，返回各阶段耗时（秒）"""
+	start = time.perf_counter()
+	req = urllib.request.Request(f"{base_url}/jobs?filename=load{index}.pdf&{options}", data=src_bytes,
+								headers={"Content-Type": "application/pdf"}, method="POST")
+	with urllib.request.urlopen(req) as resp:
+		job = json.load(resp)
+	submitted = time.perf_counter()
+	first_page = None
+	final = None
+	with urllib.request.urlopen(f"{base_url}/jobs/{job['id']}/events") as resp:
+		for event, data in iter_sse(resp):
+			if event == "page" and first_page is None:
+				first_page = time.perf_counter()
+			if event in ("done", "error"):
+				final = (event, data)
+	if final is None or final[0] != "done":
+		raise RuntimeError(f"任务 {job['id']} 失败: {final}")
+	size = 0
+	with urllib.request.urlopen(f"{base_url}/jobs/{job['id']}/pdf") as resp:
+		while True:
+			chunk = resp.read(64 * 1024)
+			if not chunk:
+				break
+			size += len(chunk)
+	end = time.perf_counter()
+	return {
+		"submit": submitted - start,
+		"first_page": (first_page or end) - start,
+		"total": end - start,
+		"pages": job["total"] - len(final[1]["failed_pages"]),
+		"bytes": size,
+	}
+
+
+def percentile(values: List[float], q: float) -> float:
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="SmartLecturer HTTP API 压测")
+	parser.add_argument("--url", default=None, help="已启动服务的地址；不指定则在进程内启动服务并使用模拟 LLM")
+	parser.add_argument("--clients", type=int, default=8, help="并发客户端数")
+	parser.add_argument("--jobs", type=int, default=16, help="提交的 PDF 总数")
+	parser.add_argument("--pages", type=int, default=20, help="每个 PDF 的页数")
+	parser.add_argument("--latency", type=float, default=0.5, help="模拟 LLM 延迟中位数（秒）")
+	parser.add_argument("--latency-sigma", type=float, default=0.5, help="模拟延迟的对数正态 sigma")
+	parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟 429 的概率")
+	parser.add_argument("--output-chars", type=int, default=600, help="模拟讲解字数")
+	parser.add_argument("--rpm", type=int, default=100000, help="进程内服务的 RPM 上限")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--concurrency", type=int, default=32, help="进程内服务的并发页数")
+	parser.add_argument("--server-jobs", type=int, default=4, help="进程内服务同时处理的任务数")
+	parser.add_argument("--options", default="render_mode=text&font_size=14&dpi=72", help="附加的处理参数（查询字符串）")
+	args = parser.parse_args()
+
+	service = server = None
+	base_url = args.url
+	if base_url is None:
+		backend = FakeBackend(latency=args.latency, latency_sigma=args.latency_sigma, rate_limit_rate=args.rate_limit_rate,
+							output_chars=args.output_chars, seed=args.seed)
+		client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=args.rpm, tpm_budget=10**12, rpd_limit=10**9, backend=backend)
+		service = ApiService(client, concurrency=args.concurrency, max_jobs=args.server_jobs,
+							output_dir=tempfile.mkdtemp(prefix="load_test_api_"))
+		server = create_server(service, port=0)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+	src_bytes = create_test_pdf(args.pages)
+	print(f"🚀 {args.clients} 个客户端提交 {args.jobs} 个 {args.pages} 页 PDF → {base_url}")
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=args.clients) as pool:
+		results = list(pool.map(lambda i: run_one(base_url, src_bytes, i, args.options), range(args.jobs)))
+	elapsed = time.perf_counter() - start
+
+	pages = sum(r["pages"] for r in results)
+	print(f"完成 {len(results)} 个任务，共 {pages} 页，耗时 {elapsed:.2f}s，吞吐 {pages / elapsed * 60:.0f} 页/分钟")
+	for key, label in (("submit", "提交"), ("first_page", "首个进度事件"), ("total", "端到端")):
+		values = [r[key] for r in results]
+		print(f"  {label}: p50 {percentile(values, 50):.3f}s  p95 {percentile(values, 95):.3f}s  "
+			f"max {max(values):.3f}s  mean {statistics.mean(values):.3f}s")
+	print(f"  输出 PDF 平均 {statistics.mean(r['bytes'] for r in results) / 1024:.0f} KB")
+
+	if server is not None:
+		with urllib.request.urlopen(f"{base_url}/health") as resp:
+			print(f"  LLM 用量: {json.load(resp)['usage']}")
+		server.shutdown()
+		server.server_close()
+		service.close()
+
+
+if __name__ == "__main__":
+	main()
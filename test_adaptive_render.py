@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试裁剪与自适应 DPI：按内容外接矩形裁去空白边距，按最小字号与小图选择 DPI，图片负载记入运行报告
+"""
+
+import asyncio
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.metrics import RunReport, use_metrics
+from app.services.page_analysis import content_bbox, render_plan
+
+
+def create_deck() -> bytes:
+	"""第 1 页内容集中在左上角、大字号；第 2 页有 8pt 小字；第 3 页只有一张小图（无文字层）"""
+	doc = fitz.open()
+	page = doc.new_page(width=720, height=540)
+	page.insert_text((60, 80), "Big title", fontsize=36)
+	page.insert_text((60, 140), "Short bullet", fontsize=24)
+	page = doc.new_page(width=720, height=540)
+	page.insert_text((60, 80), "Dense slide", fontsize=24)
+	page.insert_text((60, 480), "Source: footnote in tiny print", fontsize=8)
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 16, 16), False)
+	pix.set_rect(pix.irect, (30, 120, 200))
+	doc.new_page(width=720, height=540).insert_image(fitz.Rect(300, 220, 400, 320), pixmap=pix)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class SizeClient:
+	"""记录每次请求的图片大小"""
+
+	def __init__(self) -> None:
+		self.sizes = []
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		self.sizes.append(len(image_bytes))
+		await asyncio.sleep(0.005)
+		return "本页讲解：介绍标题与要点（key points）。"
+
+
+def test_render_plan():
+	print("🧪 测试裁剪与自适应 DPI\n")
+	doc = fitz.open(stream=create_deck(), filetype="pdf")
+	title, dense, figure = (doc.load_page(pno) for pno in range(3))
+
+	bbox = content_bbox(title)
+	assert bbox.x0 < 60 and bbox.x1 < 360 and bbox.y1 < 170, bbox
+	plan = render_plan(title, 180)
+	assert plan.min_font == 24 and plan.dpi == 96 and plan.clip == bbox
+	print("  ✅ 大字号页：裁去右侧与下方空白，DPI 降到下限")
+
+	plan = render_plan(dense, 180)
+	assert plan.dpi == 180 and plan.clip.y1 > 480
+	assert render_plan(dense, 180, max_dpi=150).dpi == 150
+	print("  ✅ 小字页：按最小字号选 DPI，受上限约束，裁剪保留页脚")
+
+	plan = render_plan(figure, 120)
+	assert plan.min_font is None and plan.small_figures and plan.dpi == 150
+	assert render_plan(figure, 120, crop=False).clip == figure.rect
+	print("  ✅ 只有小图的页：DPI 至少为 figure_dpi；crop=False 时渲染整页")
+	doc.close()
+
+
+def test_adaptive_payload():
+	src = create_deck()
+	payloads = {}
+	for mode in ("full", "adaptive"):
+		client = SizeClient()
+		report = RunReport()
+		logs = []
+		with use_metrics(report.batch):
+			explanations, previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+				src, client, "讲解", 180, 3, options=pdf_processor.ExplainOptions(image_mode=mode), on_log=logs.append))
+		assert len(explanations) == 3 and not failed and len(previews) == 3
+		counters = report.batch.counters()
+		assert counters["image_pages"] == 3 and counters["image_bytes"] == sum(client.sizes)
+		payloads[mode] = counters
+		if mode == "adaptive":
+			assert sum("DPI" in line for line in logs) == 3
+			assert "render_plan" in report.batch.summary()
+	assert payloads["adaptive"]["image_pixels"] < payloads["full"]["image_pixels"] / 2
+	assert payloads["adaptive"]["image_bytes"] < payloads["full"]["image_bytes"]
+	print(f"  ✅ adaptive：像素 {payloads['adaptive']['image_pixels']} / {payloads['full']['image_pixels']}，"
+		f"字节 {payloads['adaptive']['image_bytes']} / {payloads['full']['image_bytes']}，逐页记录 DPI")
+
+	try:
+		pdf_processor.ExplainOptions(image_mode="crop")
+	except ValueError:
+		print("  ✅ 未知的图片渲染方式报错")
+	else:
+		raise AssertionError("应当报错")
+
+
+if __name__ == "__main__":
+	test_render_plan()
+	test_adaptive_payload()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+测试本地 HTTP 服务：提交 PDF、SSE 逐页进度、讲解 JSON 与 PDF 下载、错误处理，以及多个请求共享同一客户端
+"""
+
+import asyncio
+import json
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+import fitz
+
+from app.server import ApiService, create_server, parse_options
+from load_test_api import iter_sse
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class FakeClient:
+	"""模拟 GeminiClient：可通过事件阻塞，记录并发峰值"""
+
+	def __init__(self):
+		self.usage = {"requests": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0}
+		self.release = threading.Event()
+		self.release.set()
+		self.active = 0
+		self.peak = 0
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		self.active += 1
+		self.peak = max(self.peak, self.active)
+		while not self.release.is_set():
+			await asyncio.sleep(0.01)
+		await asyncio.sleep(0.02)
+		self.active -= 1
+		self.usage["requests"] += 1
+		if "fail page" in system_prompt and self.usage["requests"] == 1:
+			raise RuntimeError("rate limited")
+		return f"note {self.usage['requests']}"
+
+
+def request(url: str, data: bytes = None, method: str = None):
+	req = urllib.request.Request(url, data=data, method=method)
+	try:
+		with urllib.request.urlopen(req) as resp:
+			return resp.status, resp.headers, resp.read()
+	except urllib.error.HTTPError as e:
+		return e.code, e.headers, e.read()
+
+
+def test_api_server():
+	print("🧪 测试 HTTP 服务\n")
+	client = FakeClient()
+	service = ApiService(client, concurrency=3, output_dir=tempfile.mkdtemp())
+	server = create_server(service, port=0)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	base = f"http://127.0.0.1:{server.server_address[1]}"
+	try:
+		# 提交并订阅进度
+		client.release.clear()
+		status, _, body = request(f"{base}/jobs?filename=%E8%AF%BE%E4%BB%B6.pdf&render_mode=text&font_size=10&dpi=30", create_test_pdf(5))
+		assert status == 202
+		job = json.loads(body)
+		assert job["total"] == 5 and job["options"]["font_size"] == 10
+		status, _, body = request(f"{base}/jobs/{job['id']}/pdf")
+		assert status == 409
+		client.release.set()
+		with urllib.request.urlopen(f"{base}/jobs/{job['id']}/events") as resp:
+			assert resp.headers["Content-Type"].startswith("text/event-stream")
+			events = list(iter_sse(resp))
+		assert [e for e, _ in events] == ["status"] + ["page"] * 5 + ["done"]
+		assert [d["done"] for e, d in events if e == "page"] == [1, 2, 3, 4, 5]
+		assert client.peak == 3
+		print("  ✅ SSE 推送逐页进度，并发不超过服务共享槽位")
+
+		status, _, body = request(f"{base}/jobs/{job['id']}/explanations")
+		assert status == 200 and sorted(json.loads(body)) == ["0", "1", "2", "3", "4"]
+		status, headers, body = request(f"{base}/jobs/{job['id']}/pdf")
+		assert status == 200 and int(headers["Content-Length"]) == len(body)
+		assert "%E8%AE%B2%E8%A7%A3%E7%89%88.pdf" in headers["Content-Disposition"]
+		with fitz.open(stream=body, filetype="pdf") as doc:
+			assert doc.page_count == 5 and "note" in doc[0].get_text()
+		print("  ✅ 下载讲解 JSON 与讲解版 PDF")
+
+		# 断线重连：从 Last-Event-ID 之后继续
+		req = urllib.request.Request(f"{base}/jobs/{job['id']}/events", headers={"Last-Event-ID": "4"})
+		with urllib.request.urlopen(req) as resp:
+			assert [e for e, _ in iter_sse(resp)] == ["page", "done"]
+		print("  ✅ 按 Last-Event-ID 续传事件")
+
+		# 失败页记录在结果中
+		client.usage["requests"] = 0
+		status, _, body = request(f"{base}/jobs?render_mode=text&dpi=30&prompt=fail+page", create_test_pdf(2))
+		job2 = json.loads(body)
+		with urllib.request.urlopen(f"{base}/jobs/{job2['id']}/events") as resp:
+			done = [d for e, d in iter_sse(resp) if e == "done"][0]
+		assert len(done["failed_pages"]) == 1
+		print("  ✅ 失败页在 done 事件中返回")
+
+		# 错误处理
+		assert request(f"{base}/jobs", b"not a pdf")[0] == 400
+		assert request(f"{base}/jobs?font_size=abc", create_test_pdf(1))[0] == 400
+		assert request(f"{base}/jobs?engine=fast", create_test_pdf(1))[0] == 400
+		assert request(f"{base}/jobs?min_dpi=300&max_dpi=100", create_test_pdf(1))[0] == 400
+		assert request(f"{base}/jobs/missing")[0] == 404
+		assert request(f"{base}/other")[0] == 404
+		status, _, body = request(f"{base}/health")
+		assert status == 200 and json.loads(body)["jobs"]["completed"] == 2
+		assert request(f"{base}/jobs/{job['id']}", method="DELETE")[0] == 200
+		assert request(f"{base}/jobs/{job['id']}")[0] == 404
+		print("  ✅ 非法 PDF/参数返回 400，未知任务 404，删除已完成任务")
+	finally:
+		server.shutdown()
+		server.server_close()
+		service.close()
+
+
+def test_parse_options():
+	options = parse_options({"font_size": ["16"], "line_spacing": ["1.5"]})
+	assert options["font_size"] == 16 and options["line_spacing"] == 1.5 and options["render_mode"] == "markdown"
+	print("  ✅ 查询参数解析与默认值")
+
+
+if __name__ == "__main__":
+	test_api_server()
+	test_parse_options()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+测试合成基准：小语料跑通全部用例，保存基线后与自身对比无回退，基线被改快后报告回退
+"""
+
+import json
+import os
+import tempfile
+
+from bench_compose import CASES, compare, main
+
+
+def test_bench_compose_baseline():
+	print("🧪 测试合成基准\n")
+	with tempfile.TemporaryDirectory() as root:
+		path = os.path.join(root, "baselines", "baseline.json")
+		assert main(["--pages", "1", "3", "--repeat", "1", "--dpi", "36", "--save", path]) == 0
+		with open(path, encoding="utf-8") as f:
+			baseline = json.load(f)
+		results = baseline["results"]
+		assert {key.split("/")[0] for key in results} == set(CASES)
+		assert "compose_pdf/3p/long/markdown" in results and "page_png_bytes/3p/-/-" in results
+		assert all(r["peak_bytes"] >= 0 for r in results.values())
+		assert results["compose_pdf/3p/long/text"]["output_bytes"] > results["compose_pdf/1p/long/text"]["output_bytes"]
+		print(f"  ✅ {len(results)} 个用例，记录耗时、峰值内存与输出大小")
+
+		regressions, _ = compare(results, results, 0.25, 0.25, 0.05)
+		assert not regressions
+		faster = {key: {**r, "seconds": r["seconds"] / 10, "output_bytes": r["output_bytes"] and r["output_bytes"] // 2}
+				for key, r in results.items()}
+		regressions, improvements = compare(results, faster, 0.25, 0.25, 0.05)
+		assert any(text.startswith("compose_pdf/3p/long/markdown 耗时") for text in regressions)
+		assert any("输出大小" in text for text in regressions) and not improvements
+		with open(path, "w", encoding="utf-8") as f:
+			json.dump({**baseline, "results": faster}, f)
+		assert main(["--pages", "3", "--lengths", "long", "--modes", "markdown", "--cases", "compose_pdf",
+					"--repeat", "1", "--no-memory", "--compare", path]) == 1
+	print("  ✅ 与基线对比：超过阈值的耗时与输出大小记为回退，退出码为 1")
+
+
+if __name__ == "__main__":
+	test_bench_compose_baseline()
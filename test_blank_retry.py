@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试空白讲解的即时重试：空白/过短的讲解在该页的任务内立即重试，其他页仍在进行中，
+不再等全部页完成后另起一轮；重试可附加提醒、改用其他采样温度，重复页共用重试后的讲解
+"""
+
+import asyncio
+import io
+import time
+import warnings
+
+import fitz
+from PIL import Image
+
+from app.services import pdf_processor
+from app.services.llm_backends import RecordReplayBackend
+from app.services.metrics import RunReport, use_metrics
+
+
+def create_deck() -> bytes:
+	"""第 1 页与第 3 页相同（重复页）；第 2 页较窄，模拟慢请求"""
+	doc = fitz.open()
+	doc.new_page(width=720, height=405).insert_text((50, 60), "Gradient descent", fontsize=28)
+	doc.new_page(width=360, height=405).insert_text((50, 60), "Momentum", fontsize=28)
+	doc.new_page(width=720, height=405).insert_text((50, 60), "Gradient descent", fontsize=28)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class FlakyClient:
+	"""宽页第一次返回空白、很快返回；窄页很慢；always_blank 时宽页总是返回空白"""
+
+	def __init__(self, always_blank: bool = False, fail_retry: bool = False) -> None:
+		self.always_blank = always_blank
+		self.fail_retry = fail_retry
+		self.calls = []
+		self.events = []
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str, temperature=None) -> str:
+		wide = Image.open(io.BytesIO(image_bytes)).width > 300
+		first = not any(w for w, _prompt, _t in self.calls if w == wide)
+		self.calls.append((wide, system_prompt, temperature))
+		self.events.append(("start", wide, time.perf_counter()))
+		await asyncio.sleep(0.02 if wide else 0.3)
+		self.events.append(("end", wide, time.perf_counter()))
+		if wide and not first and self.fail_retry:
+			raise RuntimeError("503 UNAVAILABLE")
+		if wide and (first or self.always_blank):
+			return "  \n"
+		return "本页讲解梯度下降（gradient descent）与动量（momentum）。"
+
+
+def run(client: FlakyClient, **kwargs):
+	report = RunReport()
+	done = {}
+	logs = []
+	with use_metrics(report.batch):
+		explanations, _previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+			create_deck(), client, "讲解", 36, 3,
+			options=pdf_processor.ExplainOptions(duplicate_pages="share", retry_blank=True, **kwargs),
+			on_page_done=done.__setitem__, on_log=logs.append))
+	return explanations, failed, done, logs, report.batch.counters()
+
+
+def test_inline_retry():
+	print("🧪 测试空白讲解的即时重试\n")
+	client = FlakyClient()
+	explanations, failed, done, _logs, counters = run(client, blank_retry_hint=True, blank_retry_temperature=0.9)
+	assert not failed and not any(pdf_processor.is_blank_explanation(t) for t in explanations.values())
+	assert explanations[0] == explanations[2] == done[0] == done[2]
+	assert counters["blank_retries"] == 1 and counters["blank_recovered"] == 1
+	print("  ✅ 空白讲解重试后恢复，重复页与 on_page_done 拿到的是重试后的讲解")
+
+	retry_start = [t for kind, wide, t in client.events if kind == "start" and wide][1]
+	slow_end = [t for kind, wide, t in client.events if kind == "end" and not wide][0]
+	assert retry_start < slow_end
+	print("  ✅ 重试在慢页仍在请求时就已发出，没有第二轮等待")
+
+	retries = [(prompt, t) for wide, prompt, t in client.calls if wide][1:]
+	assert len(retries) == 1 and "上一次" in retries[0][0] and retries[0][1] == 0.9
+	assert all(t is None for _w, _prompt, t in client.calls[:2])
+	print("  ✅ 重试附加提醒并使用指定的采样温度，首次请求不受影响")
+
+
+def test_still_blank():
+	client = FlakyClient(always_blank=True)
+	explanations, failed, _done, logs, counters = run(client, blank_retry_times=2)
+	assert not failed and pdf_processor.is_blank_explanation(explanations[0])
+	assert counters["blank_retries"] == 2 and "blank_recovered" not in counters
+	assert sum(wide for wide, _prompt, _t in client.calls) == 3
+	assert all(prompt == "讲解" and t is None for _w, prompt, t in client.calls)
+	assert any("重试后仍为空白的页：[1, 3]" in line for line in logs)
+	print("  ✅ 达到重试次数后保留空白讲解并报告；默认沿用原提示词与温度")
+
+	client = FlakyClient(fail_retry=True)
+	explanations, failed, _done, _logs, counters = run(client)
+	assert not failed and pdf_processor.is_blank_explanation(explanations[0]) and counters["blank_retries"] == 1
+	print("  ✅ 重试请求失败时保留首次的讲解，页面不计为失败")
+
+
+def test_legacy_keywords():
+	client = FlakyClient()
+	with warnings.catch_warnings(record=True) as caught:
+		warnings.simplefilter("always")
+		explanations, _previews, failed = pdf_processor.generate_explanations(
+			create_deck(), None, "fake", "讲解", 0.0, 0, 36, 3, 10000, 10**9, 10**6,
+			retry_blank=True, blank_min_chars=10, blank_retry_times=2, client=client)
+	assert any(issubclass(w.category, DeprecationWarning) for w in caught)
+	assert not failed and not any(pdf_processor.is_blank_explanation(t) for t in explanations.values())
+	assert sum(wide for wide, _prompt, _t in client.calls) == 3
+	print("  ✅ 旧版 retry_blank 等关键字参数仍可使用（提示已弃用），写入 ExplainOptions")
+
+
+def test_replay_key():
+	backend = RecordReplayBackend("/tmp/test_blank_retry_replay", mode="replay")
+	assert backend._path(b"img", "讲解") == backend._path(b"img", "讲解", temperature=None)
+	assert backend._path(b"img", "讲解") != backend._path(b"img", "讲解", temperature=0.9)
+	print("  ✅ 录制键只在设置采样温度时包含温度")
+
+
+if __name__ == "__main__":
+	test_inline_retry()
+	test_still_blank()
+	test_legacy_keywords()
+	test_replay_key()
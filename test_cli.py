@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+测试命令行批处理：输出写在输入旁、已是最新的文件跳过、讲解 JSON 修改后仅重新合成、失败页重跑时只补全
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import fitz
+
+from app import cli
+
+
+def create_test_pdf(path: str, n_pages: int) -> None:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+	doc.save(path)
+	doc.close()
+
+
+class FakeClient:
+	"""模拟 GeminiClient：记录调用页数，可指定首次失败的调用序号"""
+	fail_calls = set()
+	calls = 0
+
+	def __init__(self, **kwargs):
+		self.usage = {"requests": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0}
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		FakeClient.calls += 1
+		call = FakeClient.calls
+		await asyncio.sleep(0.01)
+		if call in FakeClient.fail_calls:
+			self.usage["errors"] += 1
+			raise RuntimeError("rate limited")
+		self.usage["requests"] += 1
+		self.usage["input_tokens"] += 100
+		self.usage["output_tokens"] += 20
+		return "note from llm"
+
+
+def run(inputs):
+	# fake 后端不创建真实的 Gemini 连接，GeminiClient 再替换为 FakeClient 以便计数与注入失败
+	return cli.main([*inputs, "--backend", "fake", "--dpi", "30", "--font-size", "10",
+					"--render-mode", "text", "--font-path", "", "--quiet"])
+
+
+def test_cli_batch():
+	print("🧪 测试命令行批处理\n")
+	original = cli.GeminiClient
+	cli.GeminiClient = FakeClient
+	try:
+		with tempfile.TemporaryDirectory() as root:
+			os.makedirs(os.path.join(root, "sub"))
+			a = os.path.join(root, "a.pdf")
+			b = os.path.join(root, "sub", "b.pdf")
+			create_test_pdf(a, 3)
+			create_test_pdf(b, 2)
+
+			# 首次运行：b 的一页失败
+			FakeClient.calls, FakeClient.fail_calls = 0, {2}
+			assert run([root]) == 1
+			assert FakeClient.calls == 5
+			a_pdf, a_json = cli.output_paths(a)
+			with fitz.open(a_pdf) as doc:
+				assert doc.page_count == 3 and "note from llm" in doc[0].get_text()
+			failed = [p for p in (a, b) if len(json.load(open(cli.output_paths(p)[1], encoding="utf-8"))) < fitz.open(p).page_count]
+			assert len(failed) == 1
+			print("  ✅ 首次运行：递归找到 2 个文件，输出写在输入旁，失败页不写入 JSON")
+
+			# 再次运行：只补全失败页，讲解版 PDF 本身不会被当作输入
+			FakeClient.calls, FakeClient.fail_calls = 0, set()
+			assert cli.collect_inputs([root]) == sorted([a, b])
+			assert run([root]) == 0
+			assert FakeClient.calls == 1
+			print("  ✅ 重新运行：仅重新生成失败的 1 页")
+
+			assert run([root]) == 0
+			assert FakeClient.calls == 1
+			print("  ✅ 已是最新的文件直接跳过")
+
+			# 手工修改讲解后只重新合成，不调用 LLM
+			with open(a_json, "r", encoding="utf-8") as f:
+				explanations = json.load(f)
+			explanations["1"] = "edited by hand"
+			time.sleep(0.01)
+			with open(a_json, "w", encoding="utf-8") as f:
+				json.dump(explanations, f)
+			assert run([a]) == 0
+			assert FakeClient.calls == 1
+			with fitz.open(a_pdf) as doc:
+				assert "edited by hand" in doc[1].get_text()
+			print("  ✅ 修改讲解 JSON 后仅重新合成")
+	finally:
+		cli.GeminiClient = original
+
+
+def test_format_summary():
+	stats = {"files": 2, "generated": 1, "composed": 0, "skipped": 1, "failed_files": 0,
+			"pages": 30, "failed_pages": 0, "elapsed": 60.0}
+	usage = {"requests": 30, "errors": 2, "input_tokens": 3000, "output_tokens": 600}
+	summary = cli.format_summary(stats, usage)
+	assert "30.0 页/分钟" in summary and "输入 3000" in summary
+	print("  ✅ 汇总信息包含吞吐与 token 用量")
+
+
+def test_invalid_options():
+	with tempfile.TemporaryDirectory() as root:
+		assert run([root, "--min-dpi", "300", "--max-dpi", "100"]) == 2
+	print("  ✅ 非法的处理参数打印错误并返回 2")
+
+
+if __name__ == "__main__":
+	test_cli_batch()
+	test_format_summary()
+	test_invalid_options()
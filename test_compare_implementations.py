@@ -33,7 +33,7 @@ def test_pymupdf_implementation(src_bytes, explanations):
             font_path="assets/fonts/SIMHEI.TTF"
         )
         end_time = time.time()
-        print(".2f")
+        print(f"✅ PyMuPDF实现完成，耗时 {end_time - start_time:.2f} 秒")
         return result
     except Exception as e:
         print(f"❌ PyMuPDF实现失败: {e}")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+测试合成结果直接写入文件：输出与返回字节一致，且 Python 堆上不再保留整份 PDF
+"""
+
+import io
+import os
+import tempfile
+import tracemalloc
+
+import fitz
+
+from app.services.pdf_processor import _temp_output_path, batch_recompose_from_json, compose_pdf, recompose_pdf
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+		# 加入不可压缩的图片，使输出体积明显
+		pix = fitz.Pixmap(fitz.csRGB, 200, 200, os.urandom(200 * 200 * 3), False)
+		page.insert_image(fitz.Rect(300, 100, 500, 300), pixmap=pix)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def page_texts(doc: fitz.Document):
+	return [page.get_text() for page in doc]
+
+
+def test_compose_to_path_and_stream():
+	print("🧪 测试合成结果写入文件\n")
+	src_bytes = create_test_pdf(20)
+	explanations = {i: f"第{i + 1}页讲解 explanation text. " * 30 for i in range(20)}
+	data = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text")
+	with fitz.open(stream=data, filetype="pdf") as doc:
+		expected = page_texts(doc)
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, "out.pdf")
+		meta = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text", output=path)
+		assert meta["path"] == path and meta["size"] == os.path.getsize(path)
+		assert meta["source_pages"] == 20 and meta["page_count"] == len(expected)
+		assert os.listdir(tmp) == ["out.pdf"]
+		with fitz.open(path) as doc:
+			assert page_texts(doc) == expected
+		# 同一进程的多个会话线程写同一路径时各用各的临时文件
+		tmp_paths = {_temp_output_path(path) for _ in range(100)}
+		assert len(tmp_paths) == 100 and all(os.path.dirname(p) == tmp for p in tmp_paths)
+
+	sink = io.BytesIO()
+	sink.write(b"header")
+	meta = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text", output=sink)
+	assert meta["path"] is None and meta["size"] == len(sink.getvalue()) - len(b"header")
+	print(f"  ✅ 写入路径/文件对象的结果与返回字节一致（{meta['size'] / 1024:.0f} KB，{meta['page_count']} 页）")
+
+
+def test_python_heap_peak():
+	"""写入路径时 Python 堆上不再出现输出 PDF 的副本"""
+	src_bytes = create_test_pdf(30)
+	explanations = {i: "讲解 explanation. " * 20 for i in range(30)}
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, "out.pdf")
+		tracemalloc.start()
+		data = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text")
+		bytes_peak = tracemalloc.get_traced_memory()[1]
+		del data
+		tracemalloc.reset_peak()
+		meta = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text", output=path)
+		path_peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	assert path_peak < bytes_peak - meta["size"] // 2
+	print(f"  ✅ 输出 {meta['size'] / 1024:.0f} KB：返回字节峰值 {bytes_peak / 1024:.0f} KB，"
+		  f"写入文件峰值 {path_peak / 1024:.0f} KB")
+
+
+def test_batch_and_recompose_with_files():
+	src_bytes = create_test_pdf(4)
+	explanations = {i: f"note {i}" for i in range(4)}
+	with tempfile.TemporaryDirectory() as tmp:
+		results = batch_recompose_from_json(
+			[("lecture.pdf", src_bytes)], [("lecture.json", b'{"0": "a", "1": "b", "2": "c", "3": "d"}')],
+			0.5, 10, render_mode="text", output_dir=os.path.join(tmp, "out"))
+		result = results["lecture.pdf"]
+		assert result["status"] == "completed" and result["pdf_bytes"] is None
+		assert os.path.basename(result["pdf_path"]) == "lecture讲解版.pdf"
+
+		# 路径输入且排版参数变化时，完整合成结果直接写回该文件
+		out, changed = recompose_pdf(result["pdf_path"], src_bytes, explanations, 0.5, 12, render_mode="text")
+		assert out is None and changed == [0, 1, 2, 3]
+		with fitz.open(result["pdf_path"]) as doc:
+			assert "note 2" in doc[2].get_text()
+	print("  ✅ 批量重新合成与增量合成直接读写文件")
+
+
+if __name__ == "__main__":
+	test_compose_to_path_and_stream()
+	test_python_heap_peak()
+	test_batch_and_recompose_with_files()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+加宽引擎 (engine="widen") 与逐页引擎 (engine="vector") 对比测试
+验证页面尺寸/文本一致，并对比合成耗时与输出大小（重点关注 empty_right 模式）
+"""
+
+import io
+import time
+
+import fitz
+
+from app.services.pdf_processor import compose_pdf
+
+
+def create_slides_pdf(n_pages: int = 50, rotations=(0,)) -> bytes:
+	"""创建带图片与文字的测试PDF，模拟课件"""
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 320, 200), False)
+	pix.clear_with(180)
+	img_bytes = pix.tobytes("png")
+
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}: lecture title", fontsize=24)
+		page.insert_image(fitz.Rect(360, 100, 700, 380), stream=img_bytes)
+		page.set_rotation(rotations[i % len(rotations)])
+	bio = io.BytesIO()
+	doc.save(bio, garbage=3, deflate=True)
+	doc.close()
+	return bio.getvalue()
+
+
+def test_widen_matches_vector():
+	"""两种引擎输出的页数、页面尺寸与文本内容应一致"""
+	print("🧪 对比 widen / vector 引擎输出\n")
+	src_bytes = create_slides_pdf(8, rotations=(0, 90, 180, 270))
+	explanations = {i: f"第{i + 1}页讲解：Key concept {i}。" * 5 for i in range(8)}
+
+	for mode in ("text", "empty_right"):
+		a = fitz.open(stream=compose_pdf(src_bytes, explanations, 0.5, 10, render_mode=mode, engine="vector"))
+		b = fitz.open(stream=compose_pdf(src_bytes, explanations, 0.5, 10, render_mode=mode, engine="widen"))
+		assert a.page_count == b.page_count, (mode, a.page_count, b.page_count)
+		for pa, pb in zip(a, b):
+			assert pa.rect == pb.rect, (mode, pa.number, pa.rect, pb.rect)
+			assert pb.rotation == 0
+			assert pa.get_text() == pb.get_text(), (mode, pa.number)
+		print(f"  ✅ {mode}: {a.page_count} 页，尺寸与文本一致")
+		a.close()
+		b.close()
+
+
+def test_widen_clips_outside_cropbox():
+	"""CropBox 之外的原内容不应露出到加宽后的讲解区域"""
+	doc = fitz.open()
+	page = doc.new_page(width=400, height=600)
+	page.draw_rect(fitz.Rect(380, 10, 400, 50), color=(1, 0, 0), fill=(1, 0, 0))
+	page.set_cropbox(fitz.Rect(20, 30, 370, 580))
+	src_bytes = doc.tobytes()
+	doc.close()
+
+	out = fitz.open(stream=compose_pdf(src_bytes, {}, 0.5, 10, render_mode="empty_right", engine="widen"))
+	opage = out.load_page(0)
+	assert opage.rect == fitz.Rect(0, 0, 1050, 550)
+	pix = opage.get_pixmap(clip=fitz.Rect(350, 0, 1050, 550))
+	assert set(pix.samples) == {255}, "讲解区域应为空白"
+	print("  ✅ CropBox 外内容已被裁剪")
+	out.close()
+
+
+def benchmark_engines(n_pages: int = 200):
+	"""对比两种引擎的合成耗时与输出大小"""
+	print(f"\n⏱️ 引擎基准（{n_pages} 页）")
+	src_bytes = create_slides_pdf(n_pages)
+	explanations = {i: "讲解 explanation text. " * 30 for i in range(n_pages)}
+	for mode in ("empty_right", "text"):
+		for engine in ("vector", "widen"):
+			start = time.perf_counter()
+			out = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode=mode, engine=engine)
+			elapsed = time.perf_counter() - start
+			print(f"  {mode:<12} {engine:<7} {elapsed:6.2f}s  {len(out) / 1024:8.1f} KB")
+
+
+if __name__ == "__main__":
+	test_widen_matches_vector()
+	test_widen_clips_outside_cropbox()
+	benchmark_engines()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试重复页去重：重复的目录页只讲解一次并共用讲解，逐步展开的页只请求新增内容，去重率按文档写入运行报告
+"""
+
+import asyncio
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.metrics import RunReport, use_metrics
+from app.services.page_analysis import find_duplicates
+
+
+AGENDA = ["Agenda", "1. Linear models", "2. Neural networks", "3. Optimization"]
+
+
+def add_slide(doc: fitz.Document, lines, color=(0.2, 0.3, 0.8)) -> None:
+	page = doc.new_page(width=720, height=405)
+	page.draw_rect(fitz.Rect(20, 20, 700, 385), color=color, width=3)
+	for k, line in enumerate(lines):
+		page.insert_text((60, 70 + 40 * k), line, fontsize=24 if k == 0 else 18)
+
+
+def create_deck() -> bytes:
+	"""第 1、4 页为相同目录页；第 2、3 页为逐步展开；第 5 页文字与第 1 页相同但版式不同"""
+	doc = fitz.open()
+	add_slide(doc, AGENDA)
+	add_slide(doc, ["Gradient descent", "- Compute the gradient of the loss"])
+	add_slide(doc, ["Gradient descent", "- Compute the gradient of the loss", "- Step against the gradient"])
+	add_slide(doc, AGENDA)
+	page = doc.new_page(width=720, height=405)
+	page.draw_rect(fitz.Rect(0, 0, 720, 405), color=(0, 0, 0), fill=(0.1, 0.1, 0.1))
+	for k, line in enumerate(AGENDA):
+		page.insert_text((400, 70 + 40 * k), line, fontsize=14, color=(1, 1, 1))
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class RecordingClient:
+	def __init__(self) -> None:
+		self.prompts = []
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		self.prompts.append(system_prompt)
+		# 序号在等待前取得：并发请求全部追加后才返回，等待后再取会得到相同的序号
+		n = len(self.prompts)
+		await asyncio.sleep(0.005)
+		return f"讲解 {n}：本页介绍课程内容与关键概念（key concepts）。"
+
+
+def test_find_duplicates():
+	print("🧪 测试重复页去重\n")
+	doc = fitz.open(stream=create_deck(), filetype="pdf")
+	result = find_duplicates(doc, range(doc.page_count), buildup=True)
+	doc.close()
+	assert result.shared == {3: 0}, result.shared
+	assert result.buildup == {2: (1, "- Step against the gradient")}, result.buildup
+	print("  ✅ 相同目录页归为一组，文字相同但版式不同的页不合并，逐步展开页只保留新增文字")
+
+
+def test_share_and_diff():
+	src = create_deck()
+	client = RecordingClient()
+	report = RunReport()
+	with use_metrics(report.file("deck.pdf")):
+		explanations, previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+			src, client, "讲解", 36, 4, options=pdf_processor.ExplainOptions(duplicate_pages="diff")))
+	assert len(client.prompts) == 4 and not failed and len(previews) == 5
+	assert explanations[3] == explanations[0] and explanations[4] != explanations[0]
+	assert sum("只讲解本页新增的以下内容" in p and "Step against the gradient" in p for p in client.prompts) == 1
+	data = report.to_dict()
+	assert data["counters"]["duplicate_pages"] == 1 and data["counters"]["buildup_pages"] == 1
+	assert data["dedup_ratio"]["files"]["deck.pdf"] == 0.2
+	print("  ✅ diff：重复页共用代表页讲解，展开页使用新增内容提示词，去重率 20% 写入报告")
+
+	client = RecordingClient()
+	done = []
+	asyncio.run(pdf_processor.generate_explanations_async(src, client, "讲解", 36, 4,
+														options=pdf_processor.ExplainOptions(duplicate_pages="share"),
+														on_page_done=lambda pno, text: done.append(pno)))
+	assert len(client.prompts) == 4 and sorted(done) == [0, 1, 2, 3, 4]
+	assert not any("新增" in p for p in client.prompts)
+	print("  ✅ share：只共用重复页，每页仍各回调一次 on_page_done（流式合成不缺页）")
+
+
+if __name__ == "__main__":
+	test_find_duplicates()
+	test_share_and_diff()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+测试单次调用期限与对冲慢请求：卡住的调用超时后重试；调用超过动态阈值仍未返回时再发一个相同请求，
+先返回的为准、另一个取消；RPD 余量不足时不对冲；对冲降低单页耗时 p99
+"""
+
+import asyncio
+import time
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend, LLMResponse
+from app.services.metrics import RunReport, use_metrics
+
+
+class ScriptedBackend:
+	"""按调用顺序返回预设的延迟；被取消的调用记入 cancelled"""
+
+	name = "scripted"
+
+	def __init__(self, delays) -> None:
+		self.delays = list(delays)
+		self.calls = 0
+		self.cancelled = 0
+
+	async def generate(self, image_bytes: bytes, prompt: str) -> LLMResponse:
+		delay = self.delays[self.calls] if self.calls < len(self.delays) else 0.005
+		self.calls += 1
+		try:
+			await asyncio.sleep(delay)
+		except asyncio.CancelledError:
+			self.cancelled += 1
+			raise
+		return LLMResponse(f"第 {self.calls} 次调用的讲解", 10, 10)
+
+
+def scripted_client(backend, rpd_limit: int = 10**6, **kwargs) -> GeminiClient:
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=rpd_limit,
+						backend=backend, **kwargs)
+	client.retry_delay = 0.01
+	client.hedge_min_delay = 0.0
+	return client
+
+
+async def warm_up(client: GeminiClient, n: int = 20) -> None:
+	for k in range(n):
+		await client.explain_page(f"warm-{k}".encode(), "讲解")
+
+
+def test_request_timeout():
+	print("🧪 测试单次调用期限与对冲慢请求\n")
+	backend = ScriptedBackend([30.0])
+	client = scripted_client(backend, request_timeout=0.1)
+	report = RunReport()
+	start = time.perf_counter()
+	with use_metrics(report.batch):
+		text = asyncio.run(client.explain_page(b"page", "讲解"))
+	assert time.perf_counter() - start < 1.0 and text == "第 2 次调用的讲解"
+	assert report.batch.counters()["request_timeouts"] == 1 and client.usage["errors"] == 1
+	assert backend.cancelled == 1 and client.in_flight == 0
+	print("  ✅ 卡住的调用超过期限后取消并重试，不再拖住整个文件")
+
+
+def test_hedge_wins():
+	backend = ScriptedBackend([0.005] * 20 + [30.0])
+	client = scripted_client(backend, hedge=True)
+	report = RunReport()
+
+	async def run():
+		await warm_up(client)
+		assert client.hedge_threshold() is not None
+		return await client.explain_page(b"slow", "讲解")
+
+	start = time.perf_counter()
+	with use_metrics(report.batch):
+		text = asyncio.run(run())
+	assert time.perf_counter() - start < 1.0 and text == "第 22 次调用的讲解"
+	counters = report.batch.counters()
+	assert counters["hedged_requests"] == 1 and counters["hedge_wins"] == 1
+	assert backend.cancelled == 1 and client.usage["requests"] == 21 and client.in_flight == 0
+	assert len(client.ratelimiter._daily_requests) == 22
+	print("  ✅ 超过阈值仍未返回时发出对冲请求，先返回的为准，慢请求被取消，对冲占用限流额度")
+
+	client = scripted_client(ScriptedBackend([0.005] * 20), hedge=True)
+	asyncio.run(warm_up(client, 10))
+	assert client.hedge_threshold() is None
+	print("  ✅ 耗时样本不足时不对冲")
+
+
+def test_hedge_respects_rpd():
+	backend = ScriptedBackend([0.005] * 20 + [0.3])
+	# 第 21 次请求后当日只剩 2 次，全部保留给首次请求（RPD 的 10%），不再对冲
+	client = scripted_client(backend, rpd_limit=23, hedge=True)
+	report = RunReport()
+
+	async def run():
+		await warm_up(client)
+		return await client.explain_page(b"slow", "讲解")
+
+	with use_metrics(report.batch):
+		text = asyncio.run(run())
+	counters = report.batch.counters()
+	assert text == "第 21 次调用的讲解" and backend.calls == 21
+	assert counters["hedges_skipped"] == 1 and "hedged_requests" not in counters
+	print("  ✅ 当日请求数接近 RPD 上限时不对冲，等待原请求返回")
+
+
+def explain_p99(hedge: bool):
+	backend = FakeBackend(latency=0.02, latency_sigma=1.3, output_chars=60, seed=3)
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10**6, tpm_budget=10**12, rpd_limit=10**9,
+						backend=backend, hedge=hedge)
+	client.hedge_min_delay = 0.0
+	report = RunReport()
+
+	async def run():
+		sem = asyncio.Semaphore(8)
+
+		async def one(k: int):
+			async with sem:
+				await client.explain_page(f"page-{k}".encode(), "讲解")
+
+		await asyncio.gather(*(one(k) for k in range(200)))
+
+	with use_metrics(report.batch):
+		asyncio.run(run())
+	return report.batch.summary()["explain_page"]["p99"], report.batch.counters()
+
+
+def test_hedge_cuts_p99():
+	p99_off, _ = explain_p99(False)
+	p99_on, counters = explain_p99(True)
+	assert p99_on < p99_off * 0.7, (p99_on, p99_off)
+	assert 0 < counters["hedged_requests"] < 200 * 0.25
+	print(f"  ✅ 重尾延迟下单页耗时 p99 {p99_off:.3f}s → {p99_on:.3f}s，"
+		f"对冲 {counters['hedged_requests']} 次（{counters.get('hedge_wins', 0)} 次先返回）")
+
+
+def test_options_from_params():
+	options = pdf_processor.ExplainOptions.from_params({"request_timeout": 0, "hedge": True})
+	assert options.request_timeout is None and options.hedge
+	options = pdf_processor.ExplainOptions.from_params({"request_timeout": 30.0})
+	assert options.request_timeout == 30.0 and not options.hedge
+	print("  ✅ 调用期限 0 表示不限，对冲选项由参数构造")
+
+
+if __name__ == "__main__":
+	test_request_timeout()
+	test_hedge_wins()
+	test_hedge_respects_rpd()
+	test_hedge_cuts_p99()
+	test_options_from_params()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+测试文本层辅助输入：文字主导的页附上文本层并发送低分辨率图片，图片为主的页仍发送清晰图片，路由与节省量记入运行报告
+"""
+
+import asyncio
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.gemini_client import estimate_image_tokens, estimate_text_tokens
+from app.services.metrics import RunReport, use_metrics
+from app.services.page_analysis import text_layer
+
+
+BULLETS = ["Gradient descent minimizes the loss by following the negative gradient.",
+		"The learning rate controls the step size of every update.",
+		"Momentum accumulates past gradients to smooth the trajectory.",
+		"Adam rescales each coordinate by a running estimate of its variance.",
+		"Learning rate schedules decay the step size as training converges."]
+
+
+def create_deck() -> bytes:
+	"""第 1 页为纯文字页；第 2 页文字相同但大半页是图片；第 3 页文字太少"""
+	doc = fitz.open()
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+	pix.set_rect(pix.irect, (40, 160, 90))
+	for with_image in (False, True):
+		page = doc.new_page(width=720, height=540)
+		page.insert_text((50, 60), "Optimization", fontsize=28)
+		for k, line in enumerate(BULLETS):
+			page.insert_text((50, 110 + 30 * k), line, fontsize=14)
+		if with_image:
+			page.insert_image(fitz.Rect(50, 270, 670, 520), pixmap=pix)
+	doc.new_page(width=720, height=540).insert_text((50, 60), "Summary", fontsize=28)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class RecordingClient:
+	def __init__(self) -> None:
+		self.calls = []
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		self.calls.append((len(image_bytes), system_prompt))
+		await asyncio.sleep(0.005)
+		return "本页讲解优化方法（optimization）与学习率（learning rate）。"
+
+
+def test_text_layer():
+	print("🧪 测试文本层辅助输入\n")
+	doc = fitz.open(stream=create_deck(), filetype="pdf")
+	text = text_layer(doc.load_page(0))
+	assert text is not None and text.splitlines()[0] == "Optimization" and BULLETS[-1] in text
+	assert text_layer(doc.load_page(1)) is None and text_layer(doc.load_page(2)) is None
+	assert text_layer(doc.load_page(0), max_chars=20) == text[:20]
+	doc.close()
+	print("  ✅ 只有文字主导的页返回文本层；图片面积大或文字太少的页返回 None")
+
+	assert estimate_image_tokens(300, 200) == 258 and estimate_image_tokens(1800, 1350) == 258 * 3 * 2
+	assert estimate_text_tokens("梯度下降 gradient") == 4 + len(" gradient") // 4
+	print("  ✅ 图片按 768 像素分块、文本按字符估算 token")
+
+
+def test_hybrid_routing():
+	src = create_deck()
+	results = {}
+	for mode in ("image", "hybrid"):
+		client = RecordingClient()
+		report = RunReport()
+		with use_metrics(report.batch):
+			explanations, previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+				src, client, "讲解", 180, 3, options=pdf_processor.ExplainOptions(input_mode=mode)))
+		assert len(explanations) == 3 and not failed and len(previews) == 3
+		results[mode] = (sorted(client.calls, key=lambda c: c[1]), report.batch.counters())
+
+	calls, counters = results["hybrid"]
+	with_text = [c for c in calls if "文本层" in c[1]]
+	assert len(with_text) == 1 and BULLETS[0] in with_text[0][1]
+	assert counters["hybrid_pages"] == 1 and counters["image_input_pages"] == 2
+	assert counters["hybrid_saved_tokens"] > 0
+	assert counters["image_bytes"] < results["image"][1]["image_bytes"]
+	assert "hybrid_pages" not in results["image"][1]
+	print(f"  ✅ hybrid：1 页附文本层并发送低分辨率图片，2 页仍发图片，"
+		f"图片字节 {counters['image_bytes']} / {results['image'][1]['image_bytes']}，"
+		f"估算节省输入 token {counters['hybrid_saved_tokens']}")
+
+
+if __name__ == "__main__":
+	test_text_layer()
+	test_hybrid_routing()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+测试增量重新合成：仅重建讲解变化的页，结果应与完整合成一致
+"""
+
+import os
+import tempfile
+import time
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.pdf_processor import compose_pdf, recompose_pdf, read_compose_map
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def same_text(a_bytes: bytes, b_bytes: bytes) -> bool:
+	a = fitz.open(stream=a_bytes, filetype="pdf")
+	b = fitz.open(stream=b_bytes, filetype="pdf")
+	try:
+		return a.page_count == b.page_count and all(x.get_text() == y.get_text() for x, y in zip(a, b))
+	finally:
+		a.close()
+		b.close()
+
+
+def test_incremental_recompose():
+	print("🧪 测试增量重新合成\n")
+	n_pages = 400
+	src_bytes = create_test_pdf(n_pages)
+	explanations = {i: f"第{i + 1}页讲解 explanation text. " * 20 for i in range(n_pages)}
+
+	for engine in ("vector", "widen"):
+		prev = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text", engine=engine)
+		doc = fitz.open(stream=prev, filetype="pdf")
+		compose_map = read_compose_map(doc)
+		doc.close()
+		assert compose_map is not None and len(compose_map["pages"]) == n_pages
+
+		edited = dict(explanations)
+		edited[5] = "修改后的讲解 " * 300
+		edited[300] = "短讲解"
+
+		start = time.perf_counter()
+		new_bytes, changed = recompose_pdf(prev, src_bytes, edited, 0.5, 10, render_mode="text", engine=engine)
+		elapsed = time.perf_counter() - start
+		assert changed == [5, 300], changed
+		assert same_text(new_bytes, compose_pdf(src_bytes, edited, 0.5, 10, render_mode="text", engine=engine))
+		print(f"  ✅ {engine}: 修改 2/{n_pages} 页，增量合成耗时 {elapsed:.3f}s")
+
+		# 文件路径：增量保存写回原文件
+		fd, path = tempfile.mkstemp(suffix=".pdf")
+		with os.fdopen(fd, "wb") as f:
+			f.write(prev)
+		try:
+			result, changed = recompose_pdf(path, src_bytes, edited, 0.5, 10, render_mode="text", engine=engine)
+			assert result is None and changed == [5, 300]
+			with open(path, "rb") as f:
+				assert same_text(f.read(), new_bytes)
+		finally:
+			os.remove(path)
+
+		# 未变化时直接返回原输出
+		unchanged, changed = recompose_pdf(new_bytes, src_bytes, edited, 0.5, 10, render_mode="text", engine=engine)
+		assert changed == [] and unchanged is new_bytes
+
+
+def test_repeated_edits_do_not_grow_file():
+	"""反复增量保存时文件大小受限：累计追加超过阈值后完整重写并合并重复对象"""
+	src_bytes = create_test_pdf(20)
+	explanations = {i: f"第{i + 1}页讲解 explanation text. " * 20 for i in range(20)}
+	fresh = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text")
+	fd, path = tempfile.mkstemp(suffix=".pdf")
+	with os.fdopen(fd, "wb") as f:
+		f.write(fresh)
+	try:
+		for k in range(12):
+			explanations[k % 20] = f"第 {k} 次修改的讲解 " * 40
+			recompose_pdf(path, src_bytes, explanations, 0.5, 10, render_mode="text")
+			assert os.path.getsize(path) <= len(fresh) * (1 + pdf_processor._INCREMENTAL_GROWTH_LIMIT) * 1.2
+		with open(path, "rb") as f:
+			assert same_text(f.read(), compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text"))
+	finally:
+		os.remove(path)
+	print("  ✅ 反复修改后文件大小受限，内容与完整合成一致")
+
+
+def test_recompose_falls_back_on_layout_change():
+	"""排版参数变化时退回完整合成"""
+	src_bytes = create_test_pdf(3)
+	explanations = {0: "讲解一", 1: "讲解二", 2: "讲解三"}
+	prev = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text")
+	new_bytes, changed = recompose_pdf(prev, src_bytes, explanations, 0.5, 12, render_mode="text")
+	assert changed == [0, 1, 2]
+	assert same_text(new_bytes, compose_pdf(src_bytes, explanations, 0.5, 12, render_mode="text"))
+	print("  ✅ 排版参数变化时退回完整合成")
+
+
+if __name__ == "__main__":
+	test_incremental_recompose()
+	test_repeated_edits_do_not_grow_file()
+	test_recompose_falls_back_on_layout_change()
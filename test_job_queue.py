@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+测试后台任务队列：提交/领取/进度/取消，worker 进程并行执行任务并把结果写入磁盘
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.job_queue import CANCELLED, COMPLETED, QUEUED, RUNNING, JobQueue, key_fingerprint
+from app.services.job_worker import _split_limits, ensure_worker, run_job, run_worker
+
+
+PARAMS = {
+	"api_key": "key", "model_name": "model", "temperature": 0.4, "max_tokens": 1024, "dpi": 30,
+	"right_ratio": 0.5, "font_size": 10, "line_spacing": 1.2, "column_padding": 10, "concurrency": 4,
+	"rpm_limit": 1000, "tpm_budget": 10**8, "rpd_limit": 10**5, "user_prompt": "prompt",
+	"cjk_font_path": "", "render_mode": "text", "compose_engine": "vector",
+}
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class FakeClient:
+	def __init__(self, **kwargs):
+		self.rpm_limit = kwargs["rpm_limit"]
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		await asyncio.sleep(0.01)
+		return f"explanation rpm={self.rpm_limit}"
+
+
+def test_queue_lifecycle():
+	print("🧪 测试任务队列\n")
+	with tempfile.TemporaryDirectory() as root:
+		queue = JobQueue(root)
+		a = queue.submit(create_test_pdf(2), "a.pdf", PARAMS)
+		b = queue.submit(create_test_pdf(2), "b.pdf", PARAMS)
+		c = queue.submit(create_test_pdf(2), "c.pdf", PARAMS)
+		assert [j["id"] for j in queue.list_jobs([c, a, b])] == [a, b, c]
+		assert "api_key" not in queue.get(a)["params"] and queue.get(a)["params"]["model_name"] == "model"
+		assert os.stat(queue.job_dir(a)).st_mode & 0o077 == 0
+		assert queue.cancel(c) and queue.get(c)["status"] == CANCELLED
+
+		job = queue.claim_next(worker_pid=1)
+		assert job["id"] == a and job["status"] == RUNNING
+		assert queue.claim_next(worker_pid=2)["id"] == b
+		assert queue.claim_next(worker_pid=3) is None
+		assert not queue.cancel(a)
+
+		queue.update_progress(a, 1, 2, "第 1 页处理完成")
+		job = queue.get(a)
+		assert (job["done"], job["total"], job["message"]) == (1, 2, "第 1 页处理完成")
+
+		# worker 异常退出后心跳超时，任务重新排队
+		assert queue.requeue_stale(stale_seconds=-1) == 2
+		assert queue.get(a)["status"] == QUEUED
+	print("  ✅ 提交/领取/取消/超时重排；API Key 不写入数据库，任务目录仅当前用户可访问")
+
+
+def test_worker_key_fingerprint():
+	with tempfile.TemporaryDirectory() as root:
+		queue = JobQueue(root)
+		queue.worker_heartbeat(1, 2, key_fingerprint("key-a"))
+		assert queue.live_workers()[0]["key_fingerprint"] == key_fingerprint("key-a") != "key-a"
+		# 已有 worker 使用相同的 Key（或 UI 未填写 Key）时沿用它
+		assert ensure_worker(queue, api_key="key-a") is False
+		assert ensure_worker(queue, api_key=None) is False
+		try:
+			ensure_worker(queue, api_key="key-b")
+		except ValueError:
+			pass
+		else:
+			raise AssertionError("Key 不同时应拒绝提交")
+		# 没有 Key 的 worker 同样拒绝
+		queue.remove_worker(1)
+		queue.worker_heartbeat(2, 2)
+		try:
+			ensure_worker(queue, api_key="key-a")
+		except ValueError:
+			pass
+		else:
+			raise AssertionError("worker 没有 Key 时应拒绝提交")
+	print("  ✅ worker 心跳记录 API Key 指纹，Key 不一致时拒绝提交")
+
+
+def test_split_limits():
+	params = _split_limits({**PARAMS, "concurrency": 50}, 4)
+	assert (params["rpm_limit"], params["rpd_limit"], params["concurrency"]) == (250, 25000, 2)
+	assert _split_limits(PARAMS, 8)["concurrency"] == 1
+	params = _split_limits({**PARAMS, "fast_rpm_limit": 1000, "fast_tpm_budget": 4000000, "fast_rpd_limit": None}, 4)
+	assert (params["fast_rpm_limit"], params["fast_tpm_budget"], params["fast_rpd_limit"]) == (250, 1000000, None)
+	print("  ✅ 并行任务均分限额（含快速模型的限额）与并发请求数（合计不超过 10 个）")
+
+
+def test_generate_job_in_process():
+	original = pdf_processor.GeminiClient
+	pdf_processor.GeminiClient = FakeClient
+	try:
+		with tempfile.TemporaryDirectory() as root:
+			queue = JobQueue(root)
+			job_id = queue.submit(create_test_pdf(3), "lecture.pdf", PARAMS)
+			job = queue.claim_next(os.getpid())
+			run_job(queue, job, max_jobs=4)
+			job = queue.get(job_id)
+			assert job["status"] == COMPLETED and (job["done"], job["total"]) == (3, 3)
+			with open(job["json_path"], encoding="utf-8") as f:
+				explanations = json.load(f)
+			# 4 个并行任务槽位均分 RPM 限额
+			assert explanations == {str(i): "explanation rpm=250" for i in range(3)}
+			with fitz.open(job["pdf_path"]) as doc:
+				assert doc.page_count == 3 and "explanation rpm=250" in doc[0].get_text()
+	finally:
+		pdf_processor.GeminiClient = original
+	print("  ✅ 生成任务：进度、讲解 JSON 与 PDF 写入任务目录")
+
+
+def test_worker_runs_jobs_in_parallel():
+	with tempfile.TemporaryDirectory() as root:
+		queue = JobQueue(root)
+		src_bytes = create_test_pdf(30)
+		explanations = {i: "Explanation text. " * 200 for i in range(30)}
+		job_ids = [queue.submit(src_bytes, f"f{i}.pdf", PARAMS, kind="compose", explanations=explanations) for i in range(4)]
+		start = time.perf_counter()
+		run_worker(root, max_jobs=2, poll_interval=0.05, exit_when_idle=True)
+		elapsed = time.perf_counter() - start
+		jobs = queue.list_jobs(job_ids)
+		assert all(j["status"] == COMPLETED for j in jobs), [j["error"] for j in jobs]
+		assert len({j["worker_pid"] for j in jobs}) == 1
+		for job in jobs:
+			with fitz.open(job["pdf_path"]) as doc:
+				assert doc.page_count >= 30
+		assert not queue.live_workers()
+	print(f"  ✅ worker 以 2 个并行槽位完成 4 个合成任务，耗时 {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+	test_queue_lifecycle()
+	test_worker_key_fingerprint()
+	test_split_limits()
+	test_generate_job_in_process()
+	test_worker_runs_jobs_in_parallel()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试篇幅控制：按合成排版估算每页右栏容量，写入提示词并限制输出 token，超长讲解可再压缩；
+输出 token 与续页率写入运行报告
+"""
+
+import asyncio
+import inspect
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+from app.services.metrics import RunReport, use_metrics
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def fake_client(output_chars: int) -> GeminiClient:
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6,
+						backend=FakeBackend(latency=0.005, latency_sigma=0, output_chars=output_chars, seed=5))
+	# 模拟后端没有思考过程，不需要预留
+	client.output_token_reserve = 0
+	return client
+
+
+class CondenseClient:
+	"""首次返回超长讲解，压缩请求返回短讲解"""
+
+	def __init__(self) -> None:
+		self.prompts = []
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str, max_chars=None) -> str:
+		self.prompts.append((system_prompt, max_chars))
+		await asyncio.sleep(0.005)
+		if system_prompt.startswith("下面是对所附页面的讲解"):
+			return "压缩后的讲解：梯度下降（gradient descent）沿负梯度方向更新参数。"
+		return "冗长的讲解。" * 400
+
+
+def test_char_budget():
+	print("🧪 测试篇幅控制\n")
+	text = pdf_processor.layout_char_budget(720, 405, 20, render_mode="text", line_spacing=1.2)
+	markdown = pdf_processor.layout_char_budget(720, 405, 20, render_mode="markdown", line_spacing=1.2)
+	small = pdf_processor.layout_char_budget(720, 405, 12, render_mode="text", line_spacing=1.2)
+	assert 300 < markdown < text < small, (text, markdown, small)
+	print(f"  ✅ 每页容量随字号与渲染方式变化：20pt text {text} 字，markdown {markdown} 字，12pt {small} 字")
+
+
+def test_token_reserve():
+	backend = FakeBackend(latency=0.005, latency_sigma=0, seed=5)
+	limits = dict(rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6, backend=backend)
+	assert GeminiClient(None, "gemini-2.0-flash", 0.0, 0, **limits).output_token_reserve == 1024
+	assert GeminiClient(None, "gemini-2.5-pro", 0.0, 0, **limits).output_token_reserve == GeminiClient.thinking_token_reserve
+	assert GeminiClient(None, "gemini-2.5-pro", 0.0, 0, output_token_reserve=2048, **limits).output_token_reserve == 2048
+	print("  ✅ 思考模型默认为思考过程预留更多输出 token，可在创建客户端时覆盖")
+
+
+def test_layout_defaults_match_compose():
+	defaults = pdf_processor.ExplainOptions()
+	for func in (pdf_processor.compose_pdf, pdf_processor.StreamingComposer, pdf_processor.plan_layout):
+		params = inspect.signature(func).parameters
+		for name in ("render_mode", "line_spacing", "column_padding"):
+			assert params[name].default == getattr(defaults, name), (func.__name__, name)
+	print("  ✅ 篇幅估算的排版默认值与合成函数相同")
+
+
+def run(mode: str):
+	src = create_test_pdf(4)
+	client = fake_client(4000)
+	report = RunReport()
+	with use_metrics(report.batch):
+		explanations, _previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+			src, client, "讲解", 36, 4,
+			options=pdf_processor.ExplainOptions(length_budget=mode, font_size=20, line_spacing=1.2, render_mode="text")))
+		assert not failed
+		pdf_processor.compose_pdf(src, explanations, 0.48, 20, render_mode="text", line_spacing=1.2)
+	return explanations, report.to_dict()
+
+
+def test_budget_reduces_output_and_continuations():
+	_explanations, off = run("off")
+	explanations, budgeted = run("prompt")
+	counters = budgeted["counters"]
+	assert counters["budget_chars"] >= sum(len(t) for t in explanations.values())
+	assert budgeted["output_tokens_per_page"] < off["output_tokens_per_page"]
+	assert budgeted["continuation_rate"] < off["continuation_rate"], (budgeted["continuation_rate"], off["continuation_rate"])
+	print(f"  ✅ prompt：每页输出 token {off['output_tokens_per_page']:g} → {budgeted['output_tokens_per_page']:g}，"
+		f"续页率 {off['continuation_rate']:.2f} → {budgeted['continuation_rate']:.2f}")
+
+
+def test_condense():
+	src = create_test_pdf(2)
+	client = CondenseClient()
+	report = RunReport()
+	with use_metrics(report.batch):
+		explanations, _previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+			src, client, "讲解", 36, 2,
+			options=pdf_processor.ExplainOptions(length_budget="condense", font_size=20, render_mode="text")))
+	assert not failed and all(text.startswith("压缩后的讲解") for text in explanations.values())
+	assert all(max_chars for _prompt, max_chars in client.prompts)
+	assert sum("篇幅要求" in prompt for prompt, _ in client.prompts) == 2
+	counters = report.batch.counters()
+	assert counters["condense_requests"] == 2 and counters["condensed_pages"] == 2
+	assert "over_budget_pages" not in counters
+	print("  ✅ condense：超出上限的讲解再请求一次压缩，压缩结果写入讲解")
+
+
+if __name__ == "__main__":
+	test_char_budget()
+	test_token_reserve()
+	test_layout_defaults_match_compose()
+	test_budget_reduces_output_and_continuations()
+	test_condense()
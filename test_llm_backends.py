@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+测试可替换的 LLM 后端：FakeBackend 的确定性与 429 注入、GeminiClient 的重试与用量统计、录制/回放、命令行离线运行
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import fitz
+
+from app import cli
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend, RateLimitError, RecordReplayBackend, create_backend
+
+
+def fake_client(backend) -> GeminiClient:
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6, backend=backend)
+	client.retry_delay = 0.01
+	return client
+
+
+def test_fake_backend_is_deterministic():
+	print("🧪 测试 LLM 后端\n")
+
+	async def run(order):
+		backend = FakeBackend(latency=0.01, latency_sigma=0.8, rate_limit_rate=0.3, output_chars=120, seed=7)
+		outcomes = {}
+
+		async def call(i):
+			try:
+				outcomes[i] = (await backend.generate(f"page {i}".encode(), "prompt")).text
+			except RateLimitError:
+				outcomes[i] = "429"
+
+		await asyncio.gather(*(call(i) for i in order))
+		return outcomes
+
+	forward = asyncio.run(run(list(range(40))))
+	backward = asyncio.run(run(list(reversed(range(40)))))
+	assert forward == backward
+	limited = sum(1 for v in forward.values() if v == "429")
+	assert 3 <= limited <= 25
+	assert all(len(v) == 120 for v in forward.values() if v != "429")
+	print(f"  ✅ 相同 seed 下结果与调用顺序无关（40 次中 {limited} 次 429）")
+
+
+def test_client_retries_through_rate_limits():
+	backend = FakeBackend(latency=0.005, latency_sigma=0, rate_limit_rate=0.5, output_chars=100, seed=1)
+	client = fake_client(backend)
+
+	async def run():
+		return await asyncio.gather(*(client.explain_page(f"p{i}".encode(), "prompt") for i in range(20)))
+
+	texts = asyncio.run(run())
+	assert len(texts) == 20 and all(texts)
+	assert client.usage["requests"] == 20 and client.usage["errors"] == backend.rate_limited > 0
+	assert client.usage["output_tokens"] == 20 * 50 and client.usage["input_tokens"] == 20 * (258 + 3)
+	print(f"  ✅ 429 经客户端重试后全部成功（重试 {client.usage['errors']} 次），用量来自后端响应")
+
+
+def test_record_and_replay():
+	with tempfile.TemporaryDirectory() as root:
+		inner = FakeBackend(latency=0.05, latency_sigma=0, output_chars=80, seed=3)
+		recorder = RecordReplayBackend(root, inner, mode="auto")
+		first = asyncio.run(recorder.generate(b"image", "prompt"))
+		again = asyncio.run(recorder.generate(b"image", "prompt"))
+		assert inner.calls == 1 and recorder.hits == 1 and again.text == first.text
+		assert len(os.listdir(root)) == 1
+
+		replay = RecordReplayBackend(root, mode="replay", replay_latency=False, backend_name=inner.name)
+		start = time.perf_counter()
+		resp = asyncio.run(replay.generate(b"image", "prompt"))
+		assert resp.text == first.text and resp.output_tokens == first.output_tokens
+		assert time.perf_counter() - start < 0.05
+		try:
+			asyncio.run(replay.generate(b"other", "prompt"))
+			assert False, "未录制的请求应报错"
+		except LookupError:
+			pass
+		replay_client = fake_client(RecordReplayBackend(root, mode="replay", backend_name=inner.name))
+		replay_client.max_attempts = 1
+		assert asyncio.run(replay_client.explain_page(b"image", "prompt")) == first.text.strip()
+
+		other = create_backend("replay", record_dir=root, model_name="gemini-2.5-flash")
+		assert other.name == "replay:gemini:gemini-2.5-flash"
+		try:
+			asyncio.run(other.generate(b"image", "prompt"))
+			assert False, "其他模型的请求不应命中录制"
+		except LookupError:
+			pass
+
+		# 键相同但录制来自其他后端（如旧录制）时拒绝回放
+		mismatched = RecordReplayBackend(root, mode="replay", backend_name="gemini:gemini-2.5-pro")
+		os.replace(recorder._path(b"image", "prompt"), mismatched._path(b"image", "prompt"))
+		try:
+			asyncio.run(mismatched.generate(b"image", "prompt"))
+			assert False, "后端不一致的录制不应回放"
+		except LookupError:
+			pass
+	print("  ✅ 录制后回放相同响应，未录制的请求报错")
+	print("  ✅ 录制按后端/模型区分，后端不一致的录制拒绝回放")
+
+
+def test_concurrent_recording():
+	"""同一进程的多个线程同时录制同一请求：各自写临时文件，最终只留下一份完整录制"""
+	with tempfile.TemporaryDirectory() as root:
+		errors = []
+
+		def record():
+			try:
+				recorder = RecordReplayBackend(root, FakeBackend(latency=0.02, latency_sigma=0, seed=3), mode="record")
+				asyncio.run(recorder.generate(b"image", "prompt"))
+			except Exception as e:
+				errors.append(e)
+
+		threads = [threading.Thread(target=record) for _ in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		assert not errors, errors
+		assert len(os.listdir(root)) == 1 and os.listdir(root)[0].endswith(".json")
+		replay = RecordReplayBackend(root, mode="replay", replay_latency=False, backend_name=FakeBackend().name)
+		assert asyncio.run(replay.generate(b"image", "prompt")).text
+	print("  ✅ 多线程同时录制同一请求不冲突，不留下临时文件")
+
+
+def test_cli_with_fake_backend():
+	with tempfile.TemporaryDirectory() as root:
+		path = os.path.join(root, "deck.pdf")
+		doc = fitz.open()
+		for i in range(4):
+			doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+		doc.save(path)
+		doc.close()
+		code = cli.main([root, "--backend", "fake", "--fake-latency", "0.01", "--dpi", "30", "--font-size", "10",
+						"--render-mode", "text", "--font-path", "", "--quiet"])
+		assert code == 0
+		with fitz.open(cli.output_paths(path)[0]) as out:
+			assert out.page_count >= 4
+		assert cli.main([root, "--backend", "replay"]) == 2
+	print("  ✅ 命令行 --backend fake 无需 API Key 离线运行")
+
+
+if __name__ == "__main__":
+	test_fake_backend_is_deterministic()
+	test_client_retries_through_rate_limits()
+	test_record_and_replay()
+	test_concurrent_recording()
+	test_cli_with_fake_backend()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试 Markdown 渲染缓存：输出与逐次 markdown() 调用一致，并统计合成时间中节省的占比
+"""
+
+import cProfile
+import pstats
+import time
+
+import fitz
+from markdown import markdown
+
+from app.services import pdf_processor
+from app.services.markdown_renderer import MarkdownRenderer, build_css, get_renderer, protect_latex
+
+
+SAMPLE = """## 梯度下降 Gradient Descent
+
+参数更新：$$\\theta_{t+1} = \\theta_t - \\eta \\nabla L$$，其中 $\\eta$ 为学习率 (learning rate)。
+
+| 方法 | 特点 |
+|------|------|
+| SGD | 简单 |
+| Adam | 自适应 |
+
+```python
+for x in data:
+    w -= lr * grad(w, x)
+```
+"""
+
+
+def legacy_html(text: str) -> str:
+	"""原实现：每次调用 markdown() 新建实例"""
+	return markdown(protect_latex(text), extensions=["fenced_code", "tables", "toc", "codehilite"])
+
+
+def test_renderer_matches_legacy():
+	renderer = MarkdownRenderer()
+	samples = [SAMPLE, "# 标题\n\n- 要点一\n- 要点二", SAMPLE + "\n\n## 小结 Summary\n\n完。"]
+	for text in samples * 2:
+		assert renderer.to_html(text) == legacy_html(text)
+	assert renderer.misses == 3 and renderer.hits == 3
+	assert protect_latex("$a$") == "`a`"
+	assert protect_latex("$$x^2$$") == "\n```\nx^2\n```\n"
+	assert build_css(12, 1.2) is build_css(12, 1.2)
+	print("  ✅ 缓存渲染结果与原实现一致")
+
+
+def profile_compose(n_pages: int = 60):
+	"""对比冷/热缓存下 markdown 模式的合成时间，并给出 Markdown 转换在合成中的占比"""
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	src_bytes = doc.tobytes()
+	doc.close()
+	explanations = {i: SAMPLE.replace("梯度下降", f"第{i + 1}页") for i in range(n_pages)}
+
+	renderer = get_renderer()
+	renderer.clear()
+	profiler = cProfile.Profile()
+	start = time.perf_counter()
+	profiler.enable()
+	pdf_processor.compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="markdown")
+	profiler.disable()
+	cold = time.perf_counter() - start
+
+	stats = pstats.Stats(profiler)
+	convert_time = sum(v[3] for k, v in stats.stats.items() if k[2] == "to_html")
+
+	start = time.perf_counter()
+	pdf_processor.compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="markdown")
+	warm = time.perf_counter() - start
+
+	print(f"\n⏱️ markdown 合成 {n_pages} 页：冷缓存 {cold:.2f}s（其中转换 {convert_time:.2f}s，"
+		  f"占 {convert_time / cold:.0%}，profiler 开销计入），热缓存 {warm:.2f}s，"
+		  f"命中 {renderer.hits} / 未命中 {renderer.misses}")
+
+
+if __name__ == "__main__":
+	test_renderer_matches_legacy()
+	profile_compose()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+测试内存跟踪与内存预算：阶段/文件峰值写入运行报告，接近预算时限制渲染页数、预览落盘，命令行输出内存摘要
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import fitz
+
+from app import cli
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+from app.services.memory import MemoryBudget, MemoryTracer
+from app.services.metrics import RunReport, timed, use_metrics
+
+
+MB = 1024 * 1024
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def fake_client(latency: float = 0.005) -> GeminiClient:
+	return GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6,
+						backend=FakeBackend(latency=latency, latency_sigma=0, output_chars=60, seed=3))
+
+
+def test_tracer_records_stage_and_file_peaks():
+	print("🧪 测试内存跟踪\n")
+	rss = iter(range(100 * MB, 10**12, MB))
+	tracer = MemoryTracer(interval=10, rss=lambda: next(rss))
+	report = RunReport(tracer=tracer)
+	with tracer:
+		with use_metrics(report.file("a.pdf")):
+			with timed("render"):
+				data = [bytearray(1024) for _ in range(2000)]
+		with use_metrics(report.file("b.pdf")):
+			with timed("save"):
+				pass
+		del data
+	stages = report.batch.summary()
+	assert stages["render"]["peak_traced"] >= 2000 * 1024
+	assert stages["render"]["peak_rss"] < stages["save"]["peak_rss"], "样本只记入当时进行中的阶段"
+	memory = report.to_dict()["memory"]
+	assert memory["peak_rss"] >= stages["save"]["peak_rss"] and memory["top_allocations"]
+	assert memory["files"]["a.pdf"]["peak_rss"] == stages["render"]["peak_rss"]
+	assert "save" not in report.files["a.pdf"].summary()
+	assert 'smartlecturer_stage_peak_rss_bytes{scope="file",file="b.pdf",stage="save"}' in report.to_prometheus()
+	print("  ✅ 各阶段与各文件的 RSS/Python 分配峰值写入报告与 Prometheus 文本")
+
+	plain = RunReport()
+	with use_metrics(plain.batch):
+		with timed("render"):
+			pass
+	assert "peak_rss" not in plain.batch.summary()["render"] and "memory" not in plain.to_dict()
+	print("  ✅ 未启用跟踪时报告格式不变")
+
+
+def test_budget_throttles_render_ahead():
+	usage = {"rss": 10 * MB}
+	budget = MemoryBudget(100 * MB, soft_ratio=0.8, min_render_ahead=2, rss=lambda: usage["rss"])
+	budget.check_interval = 0
+	budget.poll_interval = 0.005
+	assert not budget.under_pressure()
+	state = {"holding": 0, "max": 0}
+
+	async def page() -> None:
+		async with budget.render_slot():
+			state["holding"] += 1
+			state["max"] = max(state["max"], state["holding"])
+			await asyncio.sleep(0.01)
+			state["holding"] -= 1
+
+	async def run() -> None:
+		await asyncio.gather(*(page() for _ in range(6)))
+		state["unlimited"] = state["max"]
+		state["max"] = 0
+		usage["rss"] = 90 * MB
+		await asyncio.gather(*(page() for _ in range(6)))
+
+	asyncio.run(run())
+	assert state["unlimited"] == 6 and state["max"] == 2, state
+	assert budget.stats["pressure_events"] == 1 and budget.stats["throttled"] >= 4
+	print("  ✅ 接近预算时同时持有渲染图片的页数降到 min_render_ahead")
+
+
+def test_budget_spills_previews():
+	src = create_test_pdf(4)
+	budget = MemoryBudget(1, rss=lambda: 2)
+	try:
+		explanations, previews, failed = pdf_processor.generate_explanations(
+			src, None, "fake", "prompt", 0.0, 0, 36, 4, 10000, 10**9, 10**6,
+			client=fake_client(), memory_budget=budget)
+		assert len(explanations) == 4 and not failed
+		assert all(isinstance(p, str) and os.path.exists(p) for p in previews)
+		with open(previews[0], "rb") as f:
+			assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+		assert budget.stats["spilled"] == 4 and len(set(previews)) == 4
+		spill_dir = budget.spill_dir
+	finally:
+		budget.cleanup()
+	assert not os.path.exists(spill_dir)
+
+	_explanations, previews, _failed = pdf_processor.generate_explanations(
+		src, None, "fake", "prompt", 0.0, 0, 36, 4, 10000, 10**9, 10**6,
+		client=fake_client(), memory_budget=MemoryBudget(10**15, rss=lambda: 2))
+	assert all(isinstance(p, bytes) for p in previews)
+	print("  ✅ 接近预算时预览落盘只返回路径，预算充足时不受影响")
+
+
+def test_cli_memory_report():
+	with tempfile.TemporaryDirectory() as root:
+		with open(os.path.join(root, "deck.pdf"), "wb") as f:
+			f.write(create_test_pdf(3))
+		report_path = os.path.join(root, "report.json")
+		start = time.perf_counter()
+		code = cli.main([root, "--backend", "fake", "--fake-latency", "0.01", "--dpi", "30", "--font-size", "10",
+						"--render-mode", "text", "--quiet", "--report", report_path,
+						"--memory-trace", "--memory-budget", "100000"])
+		assert code == 0 and time.perf_counter() - start < 30
+		with open(report_path, encoding="utf-8") as f:
+			report = json.load(f)
+		memory = report["memory"]
+		assert memory["peak_rss"] > 0 and memory["budget"]["limit_bytes"] == 100000 * MB
+		assert report["stages"]["render"]["peak_traced"] > 0
+		assert list(memory["files"]) == [os.path.join(root, "deck.pdf")]
+	print("  ✅ 命令行 --memory-trace / --memory-budget 把内存峰值与预算统计写入运行报告")
+
+
+if __name__ == "__main__":
+	test_tracer_records_stage_and_file_peaks()
+	test_budget_throttles_render_ahead()
+	test_budget_spills_previews()
+	test_cli_memory_report()
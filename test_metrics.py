@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+测试阶段耗时统计：分位数、逐文件与整批汇总、并发任务互不串扰，以及命令行报告与服务 /metrics
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+import fitz
+
+from app import cli
+from app.server import ApiService, create_server
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+from app.services.metrics import RunReport, StageMetrics, timed, use_metrics
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def fake_client() -> GeminiClient:
+	return GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6,
+						backend=FakeBackend(latency=0.005, latency_sigma=0, output_chars=60, seed=3))
+
+
+def test_stage_summary():
+	print("🧪 测试阶段耗时统计\n")
+	report = RunReport()
+	a, b = report.file("a.pdf"), report.file("b.pdf")
+	for i in range(1, 101):
+		a.record("explain_page", i / 100)
+	b.record("render", 0.2)
+	summary = report.batch.summary()
+	assert list(summary) == ["render", "explain_page"], "按流水线顺序输出"
+	stats = summary["explain_page"]
+	assert stats["count"] == 100 and stats["p50"] == 0.51 and stats["p95"] == 0.95 and stats["p99"] == 0.99
+	assert stats["max"] == 1.0 and abs(stats["total"] - 50.5) < 1e-9
+	assert list(report.to_dict()["files"]["b.pdf"]) == ["render"]
+	print("  ✅ 分位数、总耗时与逐文件/整批汇总")
+
+	bounded = StageMetrics(max_samples=10)
+	for i in range(1000):
+		bounded.record("save", float(i))
+	stats = bounded.summary()["save"]
+	assert stats["count"] == 1000 and stats["max"] == 999.0 and stats["p50"] >= 990
+	print("  ✅ 限制样本数时次数、总耗时与最大值仍精确，分位数取最近样本")
+
+	text = report.to_prometheus()
+	assert "# TYPE smartlecturer_stage_seconds summary" in text
+	assert 'smartlecturer_stage_seconds{scope="batch",stage="explain_page",quantile="0.95"} 0.95' in text
+	assert 'smartlecturer_stage_seconds_count{scope="file",file="a.pdf",stage="explain_page"} 100' in text
+	assert "smartlecturer_run_seconds " in text
+	print("  ✅ Prometheus 文本格式")
+
+	# 整批与逐文件序列以 scope 区分：只对 scope="file" 求和时不含整批合计
+	report.file("a.pdf").add("saved_requests", 2)
+	report.file("b.pdf").add("saved_requests", 3)
+	text = report.to_prometheus()
+	series = [line for line in text.splitlines() if line.startswith("smartlecturer_stage_seconds_count{")]
+	assert all('scope="batch"' in line or 'scope="file"' in line for line in series)
+	file_total = sum(float(line.split()[-1]) for line in series if 'scope="file"' in line)
+	assert file_total == 101 and 'smartlecturer_stage_seconds_count{scope="batch",stage="explain_page"} 100' in text
+	counters = [line for line in text.splitlines() if line.startswith("smartlecturer_saved_requests_total")]
+	assert sum(float(line.split()[-1]) for line in counters if 'scope="file"' in line) == 5
+	assert 'smartlecturer_saved_requests_total{scope="batch"} 5' in text
+	print("  ✅ 整批与逐文件序列带 scope 标签，按 scope=\"file\" 求和不重复计入整批")
+
+
+def test_timed_without_recorder():
+	with timed("render"):
+		pass
+	metrics = StageMetrics()
+	with use_metrics(metrics):
+		with timed("render"):
+			time.sleep(0.01)
+	with timed("render"):
+		pass
+	assert metrics.summary()["render"]["count"] == 1 and metrics.summary()["render"]["total"] >= 0.009
+	print("  ✅ 未启用统计时 timed 不记录")
+
+
+def test_concurrent_files_are_isolated():
+	report = RunReport()
+	client = fake_client()
+	sources = {"a.pdf": create_test_pdf(3), "b.pdf": create_test_pdf(5)}
+
+	async def run_file(name: str) -> None:
+		with use_metrics(report.file(name)):
+			await pdf_processor.generate_explanations_async(sources[name], client, "prompt", 36, 4)
+
+	async def run_all():
+		await asyncio.gather(*(run_file(name) for name in sources))
+
+	asyncio.run(run_all())
+	for name, pages in (("a.pdf", 3), ("b.pdf", 5)):
+		summary = report.files[name].summary()
+		assert summary["render"]["count"] == summary["explain_page"]["count"] == pages, (name, summary)
+		assert summary["wait_for_slot"]["count"] >= pages
+	assert report.batch.summary()["explain_page"]["count"] == 8
+	print("  ✅ 并发处理的文件各自记入自己的统计，整批为其合计")
+
+
+def test_compose_stages():
+	src = create_test_pdf(4)
+	metrics = StageMetrics()
+	with use_metrics(metrics):
+		explanations, _previews, _failed = pdf_processor.generate_explanations(
+			src, None, "fake", "prompt", 0.0, 0, 36, 4, 10000, 10**9, 10**6, client=fake_client())
+		composer = pdf_processor.StreamingComposer(src, 0.5, 10, render_mode="text")
+		for pno, text in explanations.items():
+			composer.add_page(pno, text)
+		composer.finish(explanations)
+	summary = metrics.summary()
+	assert summary["compose_page"]["count"] == 4 and summary["save"]["count"] == 1
+	assert set(summary) == {"render", "wait_for_slot", "explain_page", "compose_page", "save"}
+	print("  ✅ 渲染、限流等待、讲解、逐页合成与保存均有记录")
+
+
+def test_cli_report():
+	with tempfile.TemporaryDirectory() as root:
+		with open(os.path.join(root, "deck.pdf"), "wb") as f:
+			f.write(create_test_pdf(3))
+		report_path = os.path.join(root, "report.json")
+		metrics_path = os.path.join(root, "metrics.prom")
+		code = cli.main([root, "--backend", "fake", "--fake-latency", "0.01", "--dpi", "30", "--font-size", "10",
+						"--render-mode", "text", "--quiet", "--report", report_path, "--metrics", metrics_path])
+		assert code == 0
+		with open(report_path, encoding="utf-8") as f:
+			report = json.load(f)
+		assert report["stages"]["explain_page"]["count"] == 3 and report["stages"]["save"]["count"] == 1
+		assert list(report["files"]) == [os.path.join(root, "deck.pdf")]
+		with open(metrics_path, encoding="utf-8") as f:
+			assert 'stage="compose_page"' in f.read()
+	print("  ✅ 命令行 --report / --metrics 输出运行报告")
+
+
+def test_server_metrics():
+	service = ApiService(fake_client(), concurrency=3, output_dir=tempfile.mkdtemp())
+	server = create_server(service, port=0)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	base = f"http://127.0.0.1:{server.server_address[1]}"
+	try:
+		req = urllib.request.Request(f"{base}/jobs?render_mode=text&font_size=10&dpi=30", data=create_test_pdf(2))
+		with urllib.request.urlopen(req) as resp:
+			job = json.loads(resp.read())
+		for _ in range(200):
+			if service.get(job["id"]).finished:
+				break
+			time.sleep(0.02)
+		with urllib.request.urlopen(f"{base}/metrics") as resp:
+			assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+			text = resp.read().decode("utf-8")
+		assert 'smartlecturer_stage_seconds_count{scope="batch",stage="explain_page"} 2' in text
+	finally:
+		server.shutdown()
+		service.close()
+	print("  ✅ 服务 GET /metrics 返回累计阶段耗时")
+
+
+if __name__ == "__main__":
+	test_stage_summary()
+	test_timed_without_recorder()
+	test_concurrent_files_are_isolated()
+	test_compose_stages()
+	test_cli_report()
+	test_server_metrics()
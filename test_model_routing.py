@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试模型路由：按本地估计的页面复杂度把简单的页交给快速模型、复杂的页交给强模型，支持逐页指定，
+两个模型各自限流，路由页数与各模型耗时写入运行报告
+"""
+
+import asyncio
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+from app.services.metrics import RunReport, use_metrics
+from app.services.page_analysis import page_complexity, parse_route_overrides
+
+
+def create_deck() -> bytes:
+	"""第 1 页标题页；第 2 页简单列表；第 3 页公式；第 4 页表格；第 5 页图片"""
+	doc = fitz.open()
+	doc.new_page(width=720, height=405).insert_text((200, 200), "Lecture 3: Optimization", fontsize=32)
+	page = doc.new_page(width=720, height=405)
+	for k, line in enumerate(["Outline", "- Motivation", "- Gradient descent", "- Momentum"]):
+		page.insert_text((60, 70 + 40 * k), line, fontsize=20)
+	page = doc.new_page(width=720, height=405)
+	page.insert_text((60, 50), "Update rule", fontsize=20)
+	# Symbol 字体：公式片段
+	for k, line in enumerate(["q = q - h D L(q)", "S a < 1", "d L / d w = S (y - x)", "l = 0"]):
+		page.insert_text((60, 100 + 50 * k), line, fontsize=20, fontname="symb")
+	page = doc.new_page(width=720, height=405)
+	for k in range(6):
+		page.draw_line((60, 60 + 50 * k), (660, 60 + 50 * k))
+	for k in range(4):
+		page.draw_line((60 + 200 * k, 60), (60 + 200 * k, 310))
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+	pix.set_rect(pix.irect, (90, 90, 200))
+	page = doc.new_page(width=720, height=405)
+	page.insert_image(fitz.Rect(100, 60, 300, 260), pixmap=pix)
+	page.insert_image(fitz.Rect(400, 60, 600, 260), pixmap=pix)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def fake_client(label: str, latency: float) -> GeminiClient:
+	return GeminiClient(None, label, 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6, label=label,
+						backend=FakeBackend(latency=latency, latency_sigma=0, output_chars=60, seed=1))
+
+
+def test_page_complexity():
+	print("🧪 测试模型路由\n")
+	doc = fitz.open(stream=create_deck(), filetype="pdf")
+	scores = [page_complexity(doc.load_page(pno)) for pno in range(doc.page_count)]
+	doc.close()
+	assert scores[0].score < 1 and scores[1].score < 1, scores
+	assert scores[2].formulas >= 4 and scores[2].score >= 1
+	assert scores[3].table_lines >= 8 and scores[3].score >= 1
+	assert scores[4].figures == 2 and scores[4].score >= 1
+	print("  ✅ 标题页与简单列表页复杂度低，公式、表格、图片页复杂度高")
+
+	assert parse_route_overrides("1-3=fast, 7=strong") == {0: "fast", 1: "fast", 2: "fast", 6: "strong"}
+	assert parse_route_overrides("") == {}
+	for bad in ("3=medium", "x=fast", "0=fast", "5-2=fast", "3"):
+		try:
+			parse_route_overrides(bad)
+		except ValueError:
+			continue
+		raise AssertionError(f"应当报错: {bad}")
+	print("  ✅ 逐页指定路由的解析与报错")
+
+
+def test_routing():
+	src = create_deck()
+	strong, fast = fake_client("strong", 0.05), fake_client("fast", 0.005)
+	report = RunReport()
+	logs = []
+	options = pdf_processor.ExplainOptions.from_params({"routing": "auto", "route_pages": "4=fast"})
+	assert options.route_overrides == {3: "fast"}
+	with use_metrics(report.batch):
+		explanations, _previews, failed = asyncio.run(pdf_processor.generate_explanations_async(
+			src, strong, "讲解", 36, 5, options=options, fast_client=fast, on_log=logs.append))
+	assert len(explanations) == 5 and not failed
+	assert fast.usage["requests"] == 3 and strong.usage["requests"] == 2
+	counters = report.batch.counters()
+	assert counters["routed_fast"] == 3 and counters["routed_strong"] == 2 and counters["route_overrides"] == 1
+	stages = report.batch.summary()
+	assert stages["explain_page:fast"]["count"] == 3 and stages["explain_page:strong"]["count"] == 2
+	assert stages["explain_page:fast"]["p50"] < stages["explain_page:strong"]["p50"]
+	assert fast.ratelimiter is not strong.ratelimiter
+	assert any("快速模型 3 页 [1, 2, 4]" in line for line in logs)
+	print("  ✅ auto：简单页与逐页指定的页走快速模型，其余走强模型，路由与各模型耗时写入报告")
+
+	try:
+		asyncio.run(pdf_processor.generate_explanations_async(src, strong, "讲解", 36, 5,
+															options=pdf_processor.ExplainOptions(routing="auto")))
+	except ValueError:
+		print("  ✅ 未提供快速模型时启用路由报错")
+	else:
+		raise AssertionError("应当报错")
+
+
+if __name__ == "__main__":
+	test_page_complexity()
+	test_routing()
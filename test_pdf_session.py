@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试 PdfSession：源 PDF 只打开一次，校验、页数与摘要随会话传给生成讲解与合成
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient
+from app.services.llm_backends import FakeBackend
+from app.services.pdf_session import PdfSession
+
+
+def create_test_pdf(path: str) -> bytes:
+	doc = fitz.open()
+	for i in range(4):
+		# 第 1、3 页内容相同
+		doc.new_page(width=720, height=405).insert_text((50, 60), "Agenda" if i in (1, 3) else f"Slide {i + 1}", fontsize=24)
+	doc.save(path)
+	doc.close()
+	with open(path, "rb") as f:
+		return f.read()
+
+
+class OpenCounter:
+	"""统计打开已有 PDF 的次数（不含 fitz.open() 新建空文档）"""
+
+	def __init__(self):
+		self.count = 0
+		self.docs = []
+		self._open = fitz.open
+
+	def __enter__(self):
+		def counting_open(*args, **kwargs):
+			doc = self._open(*args, **kwargs)
+			if args or kwargs.get("stream") is not None:
+				self.count += 1
+				self.docs.append(doc)
+			return doc
+		fitz.open = counting_open
+		return self
+
+	def __exit__(self, *exc):
+		fitz.open = self._open
+
+
+def test_session_metadata():
+	print("🧪 测试 PdfSession\n")
+	with tempfile.TemporaryDirectory() as root:
+		path = os.path.join(root, "deck.pdf")
+		data = create_test_pdf(path)
+		with PdfSession(path) as session:
+			assert session.validation == (True, "")
+			assert pdf_processor.validate_pdf_file(session) == (True, "")
+			assert session.page_count == 4
+			assert session.digest == hashlib.md5(data).hexdigest() == pdf_processor.source_digest(session)
+		with PdfSession(data) as in_memory:
+			assert in_memory.digest == session.digest
+		print("  ✅ 页数与内容摘要（从路径与字节打开一致）")
+
+		bad = os.path.join(root, "bad.pdf")
+		with open(bad, "wb") as f:
+			f.write(b"not a pdf")
+		with PdfSession(bad) as session:
+			is_valid, error = pdf_processor.validate_pdf_file(session)
+			assert not is_valid and error == session.error and session.page_count == 0
+			assert is_valid == pdf_processor.validate_pdf_file(b"not a pdf")[0]
+		print("  ✅ 无效文件不抛异常，校验结果与 validate_pdf_file 一致")
+
+
+def test_spool_upload():
+	with tempfile.TemporaryDirectory() as root:
+		data = create_test_pdf(os.path.join(root, "deck.pdf"))
+		upload = io.BytesIO(data)
+		upload.seek(5)
+		sources = os.path.join(root, "sources")
+		with PdfSession.spool(upload, sources) as session:
+			assert session.path == os.path.join(sources, f"{hashlib.md5(data).hexdigest()}.pdf")
+			assert upload.tell() == 5 and session.page_count == 4
+			assert os.listdir(sources) == [os.path.basename(session.path)]
+		mtime = os.stat(session.path).st_mtime_ns
+		with PdfSession.spool(upload, sources, digest=session.digest) as again:
+			assert again.path == session.path and os.stat(again.path).st_mtime_ns == mtime
+		print("  ✅ 上传内容按摘要落盘一次，之后从路径打开")
+
+
+def test_pipeline_opens_source_once():
+	with tempfile.TemporaryDirectory() as root:
+		path = os.path.join(root, "deck.pdf")
+		data = create_test_pdf(path)
+		client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6,
+							backend=FakeBackend(latency=0.001, latency_sigma=0, output_chars=60))
+		out = os.path.join(root, "out.pdf")
+		with OpenCounter() as counter:
+			with PdfSession(path) as session:
+				assert pdf_processor.validate_pdf_file(session)[0]
+				composer = pdf_processor.StreamingComposer(session, 0.5, 10, render_mode="text")
+				explanations, _previews, failed = pdf_processor.generate_explanations(
+					session, None, "fake", "prompt", 0.0, 0, 36, 4, 10000, 10**9, 10**6,
+					on_page_done=composer.add_page, client=client)
+				composer.finish(explanations, output=out)
+				assert not session.doc.is_closed, "合成结束后会话文档仍由持有者关闭"
+				pdf_processor.recompose_pdf(out, session, {**explanations, 0: "changed"}, 0.5, 10, render_mode="text")
+			assert session.doc.is_closed
+		# 会话 1 次 + 读取/增量写回输出 1 次
+		assert counter.count == 2 and not failed
+		assert pdf_processor.output_is_current(out, data, 10, render_mode="text", explanations={**explanations, 0: "changed"})
+
+		with OpenCounter() as counter:
+			pdf_processor.validate_pdf_file(data)
+			pdf_processor.generate_explanations(data, None, "fake", "prompt", 0.0, 0, 36, 4, 10000, 10**9, 10**6, client=client)
+			pdf_processor.compose_pdf(data, explanations, 0.5, 10, render_mode="text")
+		print(f"  ✅ 校验、生成、合成与增量重合成共用一次打开（传入字节时打开 {counter.count} 次）")
+
+
+def test_source_closed_on_error():
+	with tempfile.TemporaryDirectory() as root:
+		data = create_test_pdf(os.path.join(root, "deck.pdf"))
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6,
+						backend=FakeBackend(latency=0.001, latency_sigma=0, output_chars=60))
+
+	def on_page_done(pno, text):
+		raise RuntimeError("callback failed")
+
+	with OpenCounter() as counter:
+		try:
+			pdf_processor.generate_explanations(data, None, "fake", "prompt", 0.0, 0, 36, 4, 10000, 10**9, 10**6,
+											on_page_done=on_page_done, client=client)
+		except RuntimeError:
+			pass
+		else:
+			raise AssertionError("回调异常应向上抛出")
+	assert counter.count == 1 and counter.docs[0].is_closed
+	print("  ✅ 回调抛出异常时，生成讲解打开的源文档仍被关闭")
+
+
+if __name__ == "__main__":
+	test_session_metadata()
+	test_spool_upload()
+	test_pipeline_opens_source_once()
+	test_source_closed_on_error()
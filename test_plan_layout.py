@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试仅排版测量 (plan_layout)：与实际合成的续页数一致，且耗时远小于完整合成
+"""
+
+import time
+
+import fitz
+
+from app.services.pdf_processor import compose_pdf, plan_layout, read_compose_map, sweep_layout
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		# 使用非 helv 字体，避免与讲解字体资源同名
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def make_explanations(n_pages: int):
+	# 由短到长，覆盖 1~3 栏与续页
+	return {i: "讲解 explanation text, 第二句。" * (5 + i * 8) for i in range(n_pages)}
+
+
+def test_plan_matches_compose():
+	print("🧪 plan_layout 与 compose_pdf 对比\n")
+	n_pages = 40
+	src_bytes = create_test_pdf(n_pages)
+	explanations = make_explanations(n_pages)
+
+	start = time.perf_counter()
+	out = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text")
+	compose_time = time.perf_counter() - start
+	start = time.perf_counter()
+	plans = plan_layout(src_bytes, explanations, 10, render_mode="text")
+	plan_time = time.perf_counter() - start
+
+	doc = fitz.open(stream=out, filetype="pdf")
+	counts = [n for _, n in read_compose_map(doc)["pages"]]
+	doc.close()
+	assert [p.continuation_pages + 1 for p in plans] == counts
+	assert plans[0].columns == 1 and plans[-1].columns == 3
+	assert all(p.dropped_chars == 0 for p in plans)
+	print(f"  ✅ 续页数一致：共 {sum(p.continuation_pages for p in plans)} 页续页；"
+		  f"合成 {compose_time:.2f}s，仅测量 {plan_time:.2f}s")
+
+
+def test_overflow_text_is_continued_not_lost():
+	"""溢出的文本应完整写入续页，且不重复"""
+	src_bytes = create_test_pdf(1)
+	sentences = [f"S{i:04d}." for i in range(3000)]
+	out = compose_pdf(src_bytes, {0: " ".join(sentences)}, 0.5, 10, render_mode="text")
+	doc = fitz.open(stream=out, filetype="pdf")
+	assert doc.page_count > 1
+	text = " ".join(page.get_text() for page in doc)
+	doc.close()
+	words = text.split()
+	for s in sentences:
+		assert words.count(s) == 1, s
+	print("  ✅ 溢出文本写入续页，无丢失/重复")
+
+
+def test_sweep_finds_largest_fitting_font():
+	src_bytes = create_test_pdf(6)
+	explanations = {i: "讲解 explanation text, 第二句。" * 60 for i in range(6)}
+	result = sweep_layout(src_bytes, explanations, [8, 10, 12, 16, 20], [1.0, 1.4], [10], render_mode="text", max_workers=2)
+	assert len(result["results"]) == 10
+	best = result["best"]
+	assert best is not None and not best["overflow_pages"]
+	bigger = [r for r in result["results"] if r["font_size"] > best["font_size"]]
+	assert all(r["overflow_pages"] for r in bigger)
+	print(f"  ✅ 参数扫描：最大可容纳字号 {best['font_size']}pt，行距 {best['line_spacing']}")
+
+
+if __name__ == "__main__":
+	test_plan_matches_compose()
+	test_overflow_text_is_continued_not_lost()
+	test_sweep_finds_largest_fitting_font()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+测试进度汇总：逐页事件合并后限频输出，快照包含速度、预计剩余时间、进行中请求与限流等待
+"""
+
+import asyncio
+import threading
+import time
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.gemini_client import GeminiClient, RateLimiter
+from app.services.llm_backends import FakeBackend
+from app.services.progress import ProgressAggregator
+
+
+class FakeClock:
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+
+def test_flush_is_throttled():
+	print("🧪 测试进度汇总\n")
+	clock = FakeClock()
+	snapshots = []
+	progress = ProgressAggregator(snapshots.append, interval=0.5, total=1000, clock=clock)
+	for pno in range(1000):
+		clock.now += 0.006
+		progress.page_done(pno, ok=pno % 100 != 0)
+	progress.flush()
+	assert 12 <= progress.flushes <= 14, progress.flushes
+	last = snapshots[-1]
+	assert last.done == 1000 and last.failed == 10 and last.fraction == 1.0
+	assert abs(last.pages_per_minute - 10000) < 1
+	mid = snapshots[len(snapshots) // 2]
+	assert abs(mid.eta_seconds - (1000 - mid.done) / 10000 * 60) < 0.01
+	print(f"  ✅ 1000 次逐页事件只输出 {progress.flushes} 次界面更新")
+
+	clock = FakeClock()
+	progress = ProgressAggregator(snapshots.append, interval=0.5, clock=clock)
+	progress.skip(90)
+	progress.add_total(10)
+	clock.now = 60.0
+	progress.page_done(90)
+	snap = progress.snapshot()
+	assert snap.done == 91 and snap.total == 100 and snap.cached == 90
+	assert snap.pages_per_minute == 1.0 and snap.eta_seconds == 9 * 60
+	assert "缓存 90" in snap.describe() and "预计剩余 9分00秒" in snap.describe()
+	print("  ✅ 缓存命中的页计入完成数但不计入吞吐")
+
+
+def test_events_from_threads():
+	progress = ProgressAggregator(lambda s: None, interval=0.01)
+	progress.add_total(8 * 500)
+
+	def report():
+		for pno in range(500):
+			progress.page_done(pno)
+
+	threads = [threading.Thread(target=report) for _ in range(8)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert progress.snapshot().done == 4000
+	print("  ✅ 多线程上报事件计数准确")
+
+
+def test_tracks_several_clients():
+	clients = [GeminiClient(None, "fake", 0.0, 0, rpm_limit=10, tpm_budget=10**9, rpd_limit=100,
+							backend=FakeBackend(seed=k)) for k in range(2)]
+	for k, client in enumerate(clients):
+		client.in_flight = k + 1
+		client.retry_wait_seconds = 1.5
+		client.ratelimiter.wait_seconds = k * 2.0
+	progress = ProgressAggregator(lambda s: None)
+	progress.track(clients[0], None)
+	progress.track(*clients)
+	snap = progress.snapshot()
+	assert snap.in_flight == 3 and snap.rate_limit_wait == 5.0
+	print("  ✅ 跟踪多个客户端（如模型路由的快速模型）时进行中请求与等待时间相加")
+
+
+def test_rate_limiter_wait_is_recorded():
+	limiter = RateLimiter(max_rpm=1, max_tpm=10**9, max_rpd=100, window_seconds=1)
+
+	async def run():
+		await limiter.wait_for_slot(1)
+		await limiter.wait_for_slot(1)
+
+	start = time.perf_counter()
+	asyncio.run(run())
+	assert 0.7 < limiter.wait_seconds <= time.perf_counter() - start + 0.01
+	print(f"  ✅ 限流等待累计 {limiter.wait_seconds:.2f}s")
+
+
+def test_generate_reports_progress():
+	doc = fitz.open()
+	for i in range(30):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	src = doc.tobytes()
+	doc.close()
+	backend = FakeBackend(latency=0.02, latency_sigma=0, rate_limit_rate=0.2, output_chars=60, seed=5)
+	client = GeminiClient(None, "fake", 0.0, 0, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6, backend=backend)
+	client.retry_delay = 0.01
+	snapshots = []
+	progress = ProgressAggregator(snapshots.append, interval=0.02)
+	start = time.perf_counter()
+	explanations, _previews, failed = pdf_processor.generate_explanations(
+		src, None, "fake", "prompt", 0.0, 0, 30, 8, 10000, 10**9, 10**6, client=client, progress=progress)
+	elapsed = time.perf_counter() - start
+	progress.flush()
+	assert len(explanations) == 30 and not failed
+	assert progress.flushes <= elapsed / 0.02 + 2
+	assert max(s.in_flight for s in snapshots) > 0 and snapshots[-1].in_flight == 0
+	assert snapshots[-1].done == snapshots[-1].total == 30
+	assert snapshots[-1].rate_limit_wait == client.retry_wait_seconds > 0
+	print(f"  ✅ 生成 30 页共刷新 {progress.flushes} 次，观察到最多 {max(s.in_flight for s in snapshots)} 个进行中请求")
+
+
+if __name__ == "__main__":
+	test_flush_is_throttled()
+	test_events_from_threads()
+	test_tracks_several_clients()
+	test_rate_limiter_wait_is_recorded()
+	test_generate_reports_progress()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+测试流式合成：讲解逐页到达时立即合成，结果与完整合成一致，端到端耗时接近 max(生成, 合成)
+"""
+
+import asyncio
+import random
+import time
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.metrics import RunReport, use_metrics
+from app.services.pdf_processor import StreamingComposer, compose_pdf, read_compose_map
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def page_texts(data: bytes):
+	with fitz.open(stream=data, filetype="pdf") as doc:
+		return [page.get_text() for page in doc]
+
+
+class FakeClient:
+	"""模拟 GeminiClient：固定延迟后返回讲解"""
+	latency = 0.3
+
+	def __init__(self, **kwargs):
+		self.calls = 0
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		self.calls += 1
+		await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+		return "Explanation text for this slide. " * 40
+
+
+def test_out_of_order_pages():
+	print("🧪 测试流式合成\n")
+	n_pages = 12
+	src_bytes = create_test_pdf(n_pages)
+	explanations = {i: f"Page {i} explanation. " * (10 + 30 * (i % 3)) for i in range(n_pages)}
+	for engine in ("vector", "widen"):
+		streamed, full = RunReport(), RunReport()
+		with use_metrics(streamed.batch):
+			composer = StreamingComposer(src_bytes, 0.5, 10, render_mode="text", engine=engine)
+			order = list(range(n_pages))
+			random.Random(1).shuffle(order)
+			for pno in order:
+				if pno == 4:
+					composer.add_page(pno, None)  # 首轮失败
+				else:
+					composer.add_page(pno, explanations[pno])
+				assert all(p not in composer._ready for p in range(composer.next_page))
+			assert composer.next_page == n_pages
+			# 失败页在重试后成功：finish 时原位替换
+			out = composer.finish(explanations)
+		with use_metrics(full.batch):
+			expected = compose_pdf(src_bytes, explanations, 0.5, 10, render_mode="text", engine=engine)
+		assert page_texts(out) == page_texts(expected)
+		# 替换页不重复计数：绘制页数与续页数与完整合成相同
+		for name in ("explained_pages", "continuation_pages"):
+			assert streamed.batch.counters().get(name, 0) == full.batch.counters().get(name, 0), name
+		with fitz.open(stream=out, filetype="pdf") as doc:
+			assert read_compose_map(doc)["pages"][4][0] == pdf_processor._explanation_hash(explanations[4])
+		print(f"  ✅ {engine}: 乱序到达 + 失败页替换后与完整合成一致")
+
+
+def test_missing_pages_are_composed_on_finish():
+	src_bytes = create_test_pdf(5)
+	composer = StreamingComposer(src_bytes, 0.5, 10, render_mode="text")
+	composer.add_page(1, "later page")
+	assert composer.next_page == 0
+	out = composer.finish()
+	assert page_texts(out) == page_texts(compose_pdf(src_bytes, {1: "later page"}, 0.5, 10, render_mode="text"))
+	print("  ✅ 未到达的页在 finish 时补齐")
+
+
+def test_streaming_overlaps_generation():
+	n_pages = 80
+	src_bytes = create_test_pdf(n_pages)
+	original = pdf_processor.GeminiClient
+	pdf_processor.GeminiClient = FakeClient
+	try:
+		timings = {}
+		outputs = {}
+		for streaming in (False, True):
+			random.seed(0)
+			start = time.perf_counter()
+			outputs[streaming], expl, _, failed = pdf_processor.process_pdf(
+				src_bytes, "key", "model", "prompt", 0.2, 512, 30, 0.5, 10,
+				concurrency=20, rpm_limit=10000, tpm_budget=10**9, rpd_limit=10**6, render_mode="text", streaming=streaming)
+			timings[streaming] = time.perf_counter() - start
+			assert not failed and len(expl) == n_pages
+	finally:
+		pdf_processor.GeminiClient = original
+
+	start = time.perf_counter()
+	compose_pdf(src_bytes, expl, 0.5, 10, render_mode="text")
+	compose_time = time.perf_counter() - start
+	assert page_texts(outputs[True]) == page_texts(outputs[False])
+	assert timings[True] < timings[False]
+	print(f"  ✅ {n_pages} 页：先生成后合成 {timings[False]:.2f}s，流式 {timings[True]:.2f}s（其中单独合成 {compose_time:.2f}s）")
+
+
+if __name__ == "__main__":
+	test_out_of_order_pages()
+	test_missing_pages_are_composed_on_finish()
+	test_streaming_overlaps_generation()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+测试空白/过渡页预筛：本地判定空白页与过渡页，skip 模式不请求 LLM，batch 模式合并为一次请求，节省量记入运行报告
+"""
+
+import asyncio
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.metrics import RunReport, use_metrics
+from app.services.page_analysis import classify_page, parse_batch_response
+
+
+def create_deck() -> bytes:
+	"""第 1、5 页为内容页，第 2 页空白，第 3 页“Questions?”，第 4 页章节分隔页"""
+	doc = fitz.open()
+	pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+	pix.set_rect(pix.irect, (200, 40, 40))
+	for i in (1, 5):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Lecture slide {i}", fontsize=24)
+		page.insert_textbox(fitz.Rect(50, 90, 400, 380), "Gradient descent updates the weights step by step. " * 8, fontsize=12)
+		page.insert_image(fitz.Rect(450, 120, 650, 320), pixmap=pix)
+	doc.new_page(1, width=720, height=405)
+	doc.new_page(2, width=720, height=405).insert_text((300, 200), "Questions?", fontsize=28)
+	doc.new_page(3, width=720, height=405).insert_text((250, 200), "Part 2: Optimization", fontsize=28)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+class RecordingClient:
+	"""记录每次请求的提示词；合并请求返回 JSON"""
+
+	def __init__(self) -> None:
+		self.prompts = []
+
+	async def explain_page(self, image_bytes: bytes, system_prompt: str) -> str:
+		self.prompts.append(system_prompt)
+		await asyncio.sleep(0.005)
+		if "JSON" in system_prompt:
+			return '```json\n{"3": "提问环节。", "4": "第二部分：优化方法。"}\n```'
+		return "这是一页内容讲解，介绍梯度下降（gradient descent）。"
+
+
+def generate(src: bytes, client: RecordingClient, mode: str):
+	options = pdf_processor.ExplainOptions(trivial_pages=mode, retry_blank=True)
+	return asyncio.run(pdf_processor.generate_explanations_async(src, client, "讲解", 36, 4, options=options))
+
+
+def test_classify_pages():
+	print("🧪 测试空白/过渡页预筛\n")
+	doc = fitz.open(stream=create_deck(), filetype="pdf")
+	kinds = [classify_page(doc.load_page(pno)) for pno in range(doc.page_count)]
+	doc.close()
+	assert kinds == [None, "blank", "trivial", "trivial", None], kinds
+	print("  ✅ 内容页、空白页与过渡页判定正确")
+
+	assert parse_batch_response('{"3": "a", "第4页": "b", "9": "c", "x": "d"}', [2, 3]) == {2: "a", 3: "b"}
+	assert parse_batch_response("not json", [2]) == {}
+	print("  ✅ 合并请求的响应按页码解析，无关或无法解析的项忽略")
+
+
+def test_skip_mode():
+	src = create_deck()
+	client = RecordingClient()
+	report = RunReport()
+	with use_metrics(report.batch):
+		explanations, previews, failed = generate(src, client, "skip")
+	assert len(client.prompts) == 2 and not failed and len(previews) == 5
+	assert explanations[1] == "" and "Questions?" in explanations[2] and "Part 2" in explanations[3]
+	counters = report.to_dict()["counters"]
+	assert counters["trivial_pages"] == 3 and counters["saved_requests"] == 3 and counters["saved_tokens"] > 0
+	print("  ✅ skip：3 页不请求 LLM（也不做空白重试），节省量记入运行报告")
+
+	client = RecordingClient()
+	explanations, _previews, _failed = generate(src, client, "off")
+	assert len(client.prompts) == 5
+	print("  ✅ off：与原来一样逐页请求")
+
+
+def test_batch_mode():
+	src = create_deck()
+	client = RecordingClient()
+	report = RunReport()
+	with use_metrics(report.batch):
+		explanations, _previews, failed = generate(src, client, "batch")
+	assert len(client.prompts) == 3 and not failed
+	assert sum("第 3、4 页" in p for p in client.prompts) == 1
+	assert explanations[1] == "" and explanations[2] == "提问环节。" and explanations[3] == "第二部分：优化方法。"
+	counters = report.batch.counters()
+	assert counters["trivial_batched"] == 2 and counters["saved_requests"] == 2
+	print("  ✅ batch：两张过渡页合并为一次请求，空白页仍在本地处理")
+
+
+def test_options_from_params():
+	options = pdf_processor.ExplainOptions.from_params({"trivial_pages": "batch", "trivial_max_chars": None, "dpi": 180})
+	assert (options.trivial_pages, options.trivial_max_chars) == ("batch", 40)
+	try:
+		pdf_processor.ExplainOptions(trivial_pages="drop")
+	except ValueError:
+		print("  ✅ 选项从参数字典构建（忽略无关与空的键），未知的处理方式报错")
+	else:
+		raise AssertionError("应当报错")
+
+
+if __name__ == "__main__":
+	test_classify_pages()
+	test_skip_mode()
+	test_batch_mode()
+	test_options_from_params()
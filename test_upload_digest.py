@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试上传内容摘要：bytes / BytesIO / 文件对象得到相同的 MD5，摘要可通过 source_key 复用到合成映射
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+
+import fitz
+
+from app.services import pdf_processor
+from app.services.pdf_session import PdfSession
+from app.streamlit_app import get_file_hash
+
+
+def create_test_pdf(n_pages: int) -> bytes:
+	doc = fitz.open()
+	for i in range(n_pages):
+		doc.new_page(width=720, height=405).insert_text((50, 60), f"Slide {i + 1}", fontsize=24)
+	data = doc.tobytes()
+	doc.close()
+	return data
+
+
+def test_source_digest_inputs():
+	print("🧪 测试上传内容摘要\n")
+	data = os.urandom(3 * 1024 * 1024 + 17)
+	expected = hashlib.md5(data).hexdigest()
+	assert pdf_processor.source_digest(data) == expected
+
+	buf = io.BytesIO(data)
+	buf.seek(123)
+	assert pdf_processor.source_digest(buf, chunk_size=64 * 1024) == expected
+	assert buf.tell() == 123
+	buf.write(b"x")  # 计算结束后缓冲区视图已释放，仍可写入
+	print("  ✅ BytesIO 在缓冲区上分块计算，读写位置不变")
+
+	with tempfile.TemporaryFile() as f:
+		f.write(data)
+		f.seek(10)
+		assert pdf_processor.source_digest(f, chunk_size=1000) == expected
+		assert f.tell() == 10
+	print("  ✅ 文件对象分块计算结果与整体 MD5 一致")
+
+
+def test_source_key_is_reused():
+	src = create_test_pdf(3)
+	explanations = {i: f"讲解 {i}" for i in range(3)}
+	digest = pdf_processor.source_digest(io.BytesIO(src))
+	with tempfile.TemporaryDirectory() as root:
+		out = os.path.join(root, "out.pdf")
+		pdf_processor.compose_pdf(src, explanations, 0.5, 10, render_mode="text", output=out, source_key=digest)
+		with fitz.open(out) as doc:
+			assert pdf_processor.read_compose_map(doc)["source"] == hashlib.md5(src).hexdigest()
+		assert pdf_processor.output_is_current(out, src, 10, explanations=explanations, source_key=digest)
+		# 摘要与内容不符时视为过期
+		assert not pdf_processor.output_is_current(out, src, 10, source_key="0" * 32)
+
+		composer = pdf_processor.StreamingComposer(src, 0.5, 10, render_mode="text", source_key=digest)
+		for pno, text in explanations.items():
+			composer.add_page(pno, text)
+		streamed = os.path.join(root, "streamed.pdf")
+		composer.finish(explanations, output=streamed)
+		assert pdf_processor.output_is_current(streamed, src, 10, explanations=explanations)
+	print("  ✅ 预先计算的摘要写入合成映射，与按内容计算的结果一致")
+
+
+def test_json_recompose_reuses_upload_digest():
+	src = create_test_pdf(3)
+	# 用与内容不符的摘要标记，确认批量重新合成沿用上传时的摘要而不是重新哈希
+	digest = "a" * 32
+	with tempfile.TemporaryDirectory() as root:
+		with PdfSession.spool(io.BytesIO(src), os.path.join(root, "sources"), digest=digest) as session:
+			results = pdf_processor.batch_recompose_from_json(
+				[("deck.pdf", session)], [("deck.json", b'{"0": "a", "1": "b", "2": "c"}')],
+				0.5, 10, render_mode="text", output_dir=os.path.join(root, "out"))
+		result = results["deck.pdf"]
+		assert result["status"] == "completed", result["error"]
+		with fitz.open(result["pdf_path"]) as doc:
+			assert pdf_processor.read_compose_map(doc)["source"] == digest and "b" in doc[1].get_text()
+	print("  ✅ JSON 批量重新合成接收上传会话，合成映射使用上传时的摘要")
+
+
+def test_cache_key_ignores_call_settings():
+	params = {"api_key": "key-1", "request_timeout": 60, "hedge": False, "dpi": 180, "font_size": 20}
+	key = get_file_hash("digest", params)
+	assert get_file_hash("digest", {**params, "api_key": "key-2", "request_timeout": 0, "hedge": True}) == key
+	assert get_file_hash("digest", {**params, "dpi": 200}) != key
+	assert get_file_hash("other", params) != key
+	print("  ✅ 缓存键不含 API Key 与调用期限/对冲，随内容与排版参数变化")
+
+
+if __name__ == "__main__":
+	test_source_digest_inputs()
+	test_source_key_is_reused()
+	test_json_recompose_reuses_upload_digest()
+	test_cache_key_ignores_call_settings()
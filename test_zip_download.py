@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试打包下载：PDF 以 STORED、JSON 以 DEFLATED 写入 ZIP，内容签名随文件变化
+"""
+
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+import fitz
+
+from app.services.pdf_processor import compose_pdf
+from app.streamlit_app import write_zip_file, zip_signature
+
+
+def create_output_pdf(path: str, n_pages: int) -> None:
+	doc = fitz.open()
+	for i in range(n_pages):
+		page = doc.new_page(width=720, height=405)
+		page.insert_text((50, 60), f"Slide {i + 1}", fontsize=24, fontname="cour")
+		# 课件中的图片已压缩，用随机像素模拟
+		pix = fitz.Pixmap(fitz.csRGB, 120, 120, os.urandom(120 * 120 * 3), False)
+		page.insert_image(fitz.Rect(300, 100, 420, 220), pixmap=pix)
+	src = doc.tobytes()
+	doc.close()
+	compose_pdf(src, {i: "Explanation text. " * 80 for i in range(n_pages)}, 0.5, 10, render_mode="text", output=path)
+
+
+def test_zip_compress_types():
+	print("🧪 测试 ZIP 打包\n")
+	with tempfile.TemporaryDirectory() as root:
+		entries = []
+		for i in range(4):
+			pdf_path = os.path.join(root, f"f{i}.pdf")
+			create_output_pdf(pdf_path, 20)
+			entries.append((f"f{i}讲解版.pdf", pdf_path))
+			entries.append((f"f{i}.json", json.dumps({str(p): "讲解" * 200 for p in range(20)}, ensure_ascii=False).encode("utf-8")))
+
+		start = time.perf_counter()
+		zip_path = write_zip_file(os.path.join(root, "batch.zip"), entries)
+		stored_time = time.perf_counter() - start
+		with zipfile.ZipFile(zip_path) as zf:
+			infos = {info.filename: info for info in zf.infolist()}
+			assert infos["f0讲解版.pdf"].compress_type == zipfile.ZIP_STORED
+			assert infos["f0.json"].compress_type == zipfile.ZIP_DEFLATED
+			assert infos["f0.json"].compress_size < infos["f0.json"].file_size
+			with open(entries[0][1], "rb") as f:
+				assert zf.read("f0讲解版.pdf") == f.read()
+
+		# 对比：全部 DEFLATED（旧实现）
+		start = time.perf_counter()
+		with zipfile.ZipFile(os.path.join(root, "deflated.zip"), "w", zipfile.ZIP_DEFLATED) as zf:
+			for arcname, content in entries:
+				zf.writestr(arcname, content) if isinstance(content, bytes) else zf.write(content, arcname)
+		deflated_time = time.perf_counter() - start
+		sizes = (os.path.getsize(zip_path), os.path.getsize(os.path.join(root, "deflated.zip")))
+		print(f"  ✅ PDF STORED / JSON DEFLATED：{stored_time * 1000:.1f}ms {sizes[0] // 1024}KB，"
+			f"全部 DEFLATED：{deflated_time * 1000:.1f}ms {sizes[1] // 1024}KB")
+
+		signature = zip_signature(entries)
+		assert zip_signature(entries) == signature
+		time.sleep(0.01)
+		create_output_pdf(entries[0][1], 21)
+		assert zip_signature(entries) != signature
+		assert zip_signature(entries[:-1]) != zip_signature(entries)
+		print("  ✅ 文件内容变化后签名改变，需重新打包")
+
+
+if __name__ == "__main__":
+	test_zip_compress_types()